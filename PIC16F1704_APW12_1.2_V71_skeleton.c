@@ -15,63 +15,63 @@
 #pragma config CP = OFF
 
 
-// Function at 0x0674 (called 8 times)
-void func_0674(void) {
-    // 392 instructions
+// Function at 0x0E74 (called 8 times)
+void func_0E74(void) {
+    // 139 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x0193 (called 6 times)
-void func_0193(void) {
-    // 1003 instructions
+// Function at 0x0993 (called 6 times)
+void func_0993(void) {
+    // 15 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x0124 (called 5 times)
-void func_0124(void) {
-    // 2083 instructions
+// Function at 0x0924 (called 5 times)
+void func_0924(void) {
+    // 5 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x0380 (called 4 times)
-void func_0380(void) {
-    // 531 instructions
+// Function at 0x0B80 (called 4 times)
+void func_0B80(void) {
+    // 21 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x05EE (called 4 times)
-void func_05EE(void) {
-    // 31 instructions
+// Function at 0x0DEE (called 4 times)
+void func_0DEE(void) {
+    // 133 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x0264 (called 3 times)
-void func_0264(void) {
-    // 761 instructions
+// Function at 0x0951 (called 3 times)
+void func_0951(void) {
+    // 8 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x0151 (called 3 times)
-void func_0151(void) {
-    // 2148 instructions
+// Function at 0x0A64 (called 3 times)
+void func_0A64(void) {
+    // 28 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x01CA (called 2 times)
-void func_01CA(void) {
-    // 1992 instructions
+// Function at 0x060E (called 2 times)
+void func_060E(void) {
+    // 155 instructions
     // TODO: Reverse engineer function logic
 }
 
 // Function at 0x0746 (called 2 times)
 void func_0746(void) {
-    // 574 instructions
+    // 149 instructions
     // TODO: Reverse engineer function logic
 }
 
-// Function at 0x0118 (called 2 times)
-void func_0118(void) {
-    // 2087 instructions
+// Function at 0x0918 (called 2 times)
+void func_0918(void) {
+    // 5 instructions
     // TODO: Reverse engineer function logic
 }
 
@@ -1,56 +1,165 @@
 ; Burst Mode Control Patch for APW12
-; Generated for PIC16F1704
+; Generated by burst_mode_firmware_patch.py from _bins/PIC16F1704_APW12_1.2_V71.hex
 ; WARNING: This is experimental - use at your own risk!
 
-; Main control loop found at 0x01f1
-; Suggested insertion point for burst mode check
-
-; Burst Mode State Machine
-; States: 0=Normal, 1=BurstOff, 2=BurstOn
-
-BURST_STATE    EQU     0x70    ; Burst mode state variable
-BURST_THRESH_L EQU     0x71    ; Low threshold for burst mode
-BURST_THRESH_H EQU     0x72    ; High threshold for burst mode
-LOAD_CURRENT   EQU     0x73    ; Current load measurement
-
-CHECK_BURST_MODE:
-    ; Read current load via ADC
-    banksel ADCON0
-    bsf     ADCON0, GO      ; Start ADC conversion
-WAIT_ADC:
-    btfsc   ADCON0, GO
-    goto    WAIT_ADC
-    movf    ADRESH, W
-    movwf   LOAD_CURRENT
-
-    ; Compare with burst threshold
-    movf    BURST_THRESH_L, W
-    subwf   LOAD_CURRENT, W
-    btfss   STATUS, C       ; Skip if load >= threshold
-    goto    ENTER_BURST
-
-    ; Check if we should exit burst mode
-    movf    BURST_THRESH_H, W
-    subwf   LOAD_CURRENT, W
-    btfsc   STATUS, C       ; Skip if load < high threshold
-    goto    EXIT_BURST
-    return
-
-ENTER_BURST:
-    ; Enter burst mode - reduce switching frequency
-    movlw   0x01
-    movwf   BURST_STATE
-    ; Modify PWM period for burst operation
-    banksel PR2
-    movlw   0xFF            ; Maximum period = lowest frequency
-    movwf   PR2
-    return
-
-EXIT_BURST:
-    ; Exit burst mode - restore normal operation
-    clrf    BURST_STATE
-    ; Restore normal PWM period
-    banksel PR2
-    movlw   0x4F            ; Normal period
-    movwf   PR2
-    return
+BURST_STATE          EQU     0x2E0
+BURST_THRESH_L       EQU     0x2E1
+BURST_THRESH_H       EQU     0x2E2
+BURST_TIMER          EQU     0x2E3
+BURST_FLAGS          EQU     0x2E4
+LOAD_CURRENT         EQU     0x2E5
+BURST_FREQ_DIV       EQU     0x2E6
+SAFETY_STATUS        EQU     0x2E7
+W_SAVE_BURST         EQU     0x2E8
+STATUS_SAVE_BURST    EQU     0x2E9
+
+; reset_entry: Reset vector jump to the reset hook (2 words)
+0000:  318f  movlp   0x0f
+0001:  2ffc  goto    0x07fc
+
+; timer4_entry: ISR Timer4 test replaced by a jump to the Timer4 hook (2 words)
+000d:  318f  movlp   0x0f
+000e:  2fe9  goto    0x07e9
+
+; i2c_extensions: I2C command extensions for burst control (51 words)
+0f00:  0020  movlb   0x00
+0f01:  0822  movf    0x22, 0x0
+0f02:  3c50  sublw   0x50
+0f03:  1803  btfsc   0x03, 0x0
+0f04:  3218  bra     0x0f1d
+0f05:  0822  movf    0x22, 0x0
+0f06:  3c54  sublw   0x54
+0f07:  1c03  btfss   0x03, 0x0
+0f08:  3214  bra     0x0f1d
+0f09:  0822  movf    0x22, 0x0
+0f0a:  3c50  sublw   0x50
+0f0b:  1903  btfsc   0x03, 0x2
+0f0c:  3212  bra     0x0f1f
+0f0d:  0822  movf    0x22, 0x0
+0f0e:  3c51  sublw   0x51
+0f0f:  1903  btfsc   0x03, 0x2
+0f10:  3212  bra     0x0f23
+0f11:  0822  movf    0x22, 0x0
+0f12:  3c52  sublw   0x52
+0f13:  1903  btfsc   0x03, 0x2
+0f14:  3212  bra     0x0f27
+0f15:  0822  movf    0x22, 0x0
+0f16:  3c53  sublw   0x53
+0f17:  1903  btfsc   0x03, 0x2
+0f18:  3212  bra     0x0f2b
+0f19:  0822  movf    0x22, 0x0
+0f1a:  3c54  sublw   0x54
+0f1b:  1903  btfsc   0x03, 0x2
+0f1c:  3211  bra     0x0f2e
+ORIGINAL_I2C_HANDLER:
+0f1d:  3185  movlp   0x05
+0f1e:  2d4d  goto    0x054d
+HANDLE_BURST_ENABLE:
+0f1f:  0827  movf    0x27, 0x0
+0f20:  0025  movlb   0x05
+0f21:  00e0  movwf   0x60
+0f22:  320f  bra     0x0f32
+HANDLE_SET_THRESH_LOW:
+0f23:  0827  movf    0x27, 0x0
+0f24:  0025  movlb   0x05
+0f25:  00e1  movwf   0x61
+0f26:  320b  bra     0x0f32
+HANDLE_SET_THRESH_HIGH:
+0f27:  0827  movf    0x27, 0x0
+0f28:  0025  movlb   0x05
+0f29:  00e2  movwf   0x62
+0f2a:  3207  bra     0x0f32
+HANDLE_GET_STATUS:
+0f2b:  0025  movlb   0x05
+0f2c:  0860  movf    0x60, 0x0
+0f2d:  3202  bra     0x0f30
+HANDLE_GET_LOAD:
+0f2e:  0025  movlb   0x05
+0f2f:  0865  movf    0x65, 0x0
+I2C_RESPOND:
+0f30:  0020  movlb   0x00
+0f31:  00d3  movwf   0x53
+I2C_EXIT:
+0f32:  0008  return
+
+; burst_mode_logic: Main burst mode state machine (40 words)
+BURST_MODE_CHECK:
+0f33:  0025  movlb   0x05
+0f34:  00e8  movwf   0x68
+0f35:  0e03  swapf   0x03, 0x0
+0f36:  00e9  movwf   0x69
+0f37:  0020  movlb   0x00
+0f38:  0840  movf    0x40, 0x0
+0f39:  0025  movlb   0x05
+0f3a:  00e5  movwf   0x65
+0f3b:  0860  movf    0x60, 0x0
+0f3c:  3a00  xorlw   0x00
+0f3d:  1903  btfsc   0x03, 0x2
+0f3e:  3206  bra     0x0f45
+0f3f:  0862  movf    0x62, 0x0
+0f40:  0265  subwf   0x65, 0x0
+0f41:  1c03  btfss   0x03, 0x0
+0f42:  320b  bra     0x0f4e
+0f43:  01e0  clrf    0x60
+0f44:  3211  bra     0x0f56
+CHECK_ENTRY_CONDITION:
+0f45:  0861  movf    0x61, 0x0
+0f46:  0265  subwf   0x65, 0x0
+0f47:  1803  btfsc   0x03, 0x0
+0f48:  320d  bra     0x0f56
+0f49:  3001  movlw   0x01
+0f4a:  00e0  movwf   0x60
+0f4b:  3008  movlw   0x08
+0f4c:  00e6  movwf   0x66
+0f4d:  3208  bra     0x0f56
+CONTINUE_BURST:
+0f4e:  01e3  clrf    0x63
+0f4f:  0866  movf    0x66, 0x0
+0f50:  0263  subwf   0x63, 0x0
+0f51:  1c03  btfss   0x03, 0x0
+0f52:  3203  bra     0x0f56
+0f53:  0864  movf    0x64, 0x0
+0f54:  3a01  xorlw   0x01
+0f55:  00e4  movwf   0x64
+BURST_EXIT:
+0f56:  0e69  swapf   0x69, 0x0
+0f57:  0083  movwf   0x03
+0f58:  0ee8  swapf   0x68, 0x1
+0f59:  0e68  swapf   0x68, 0x0
+0f5a:  0008  return
+
+; initialization: Burst mode variable initialization (13 words)
+INITIALIZE:
+0fdc:  0025  movlb   0x05
+0fdd:  01e0  clrf    0x60
+INIT_THRESH_L:
+0fde:  3019  movlw   0x19
+0fdf:  00e1  movwf   0x61
+INIT_THRESH_H:
+0fe0:  301e  movlw   0x1e
+0fe1:  00e2  movwf   0x62
+0fe2:  01e3  clrf    0x63
+0fe3:  01e4  clrf    0x64
+0fe4:  01e5  clrf    0x65
+0fe5:  3008  movlw   0x08
+0fe6:  00e6  movwf   0x66
+0fe7:  01e7  clrf    0x67
+0fe8:  0008  return
+
+; timer4_isr_hook: Timer4 ISR hook for burst mode monitoring (9 words)
+0fe9:  1c92  btfss   0x12, 0x1
+0fea:  3205  bra     0x0ff0
+0feb:  318f  movlp   0x0f
+0fec:  2733  call    0x0733
+0fed:  0020  movlb   0x00
+0fee:  3180  movlp   0x00
+0fef:  280f  goto    0x000f
+TIMER4_TAKEN:
+0ff0:  3180  movlp   0x00
+0ff1:  28ab  goto    0x00ab
+
+; reset_hook: Burst mode initialization before the startup code (4 words)
+0ffc:  318f  movlp   0x0f
+0ffd:  27dc  call    0x07dc
+0ffe:  3180  movlp   0x00
+0fff:  28d8  goto    0x00d8
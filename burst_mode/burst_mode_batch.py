@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+APW12 Per-Unit Firmware Builds
+Bakes per-unit parameters (burst thresholds, voltage defaults) into patched
+firmware for a whole fleet. The base image is patched and rendered to Intel
+HEX once. Every parameter is the literal of a 'movlw k / movwf REG' pair,
+labelled in the patch's initialization section or found among the
+bank-resolved writes to the registers the original firmware defaults. The
+firmware sets the voltage defaults on two paths with different values
+(V71: 0xB4/0xC8 at 0x0069/0x006D, 0xB8/0xCA at 0x0092/0x0096), so each
+path has its own parameter (_A first in address order). A unit image
+differs from the base only in those literal bytes, so a unit is built by
+copying the rendered text, rewriting the two hex digits of each changed
+byte and adjusting its record's checksum by the change in byte sum. No
+record is re-encoded and no image is reloaded.
+"""
+
+import os
+import csv
+import time
+import argparse
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# Importing the injector puts the analysis modules (one directory up) on sys.path
+from burst_mode_injector import DATA_RECORD, LINEAR_RECORD, IntelHex
+from burst_mode_firmware_patch import APW12FirmwarePatcher
+from pic_disasm import disassemble
+from pic_xref import XrefIndex
+
+# Parameters the patch initializes -> label of their movlw in the initialization section
+PATCH_PARAMETERS = {
+    'BURST_THRESH_L': 'INIT_THRESH_L',
+    'BURST_THRESH_H': 'INIT_THRESH_H',
+}
+# Parameters the original firmware initializes -> (data register, which of
+# its 'movlw k / movwf' writes in address order)
+FIRMWARE_PARAMETERS = {
+    'VOLTAGE_BASE_A': (APW12FirmwarePatcher.FIRMWARE_VARIABLES['VOLTAGE_BASE'], 0),
+    'VOLTAGE_BASE_B': (APW12FirmwarePatcher.FIRMWARE_VARIABLES['VOLTAGE_BASE'], 1),
+    'VOLTAGE_ADJUST_A': (APW12FirmwarePatcher.FIRMWARE_VARIABLES['VOLTAGE_ADJUST'], 0),
+    'VOLTAGE_ADJUST_B': (APW12FirmwarePatcher.FIRMWARE_VARIABLES['VOLTAGE_ADJUST'], 1),
+}
+PARAMETERS = tuple(PATCH_PARAMETERS) + tuple(FIRMWARE_PARAMETERS)
+
+# The V71 image shipped with the repository, wherever the script is run from
+DEFAULT_BASE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             '..', '_bins', 'PIC16F1704_APW12_1.2_V71.hex'))
+
+# address: word address of the movlw; default: its literal in the base image
+ParameterSite = namedtuple('ParameterSite', 'name address default')
+# One rewritable byte of the rendered text: its two digits, its record's checksum digits
+_Slot = namedtuple('_Slot', 'digits checksum default')
+
+
+def literal_sites(image: IntelHex,
+                  parameters: Dict[str, Tuple[int, int]] = FIRMWARE_PARAMETERS) -> List[ParameterSite]:
+    """
+    The movlw of each parameter's 'movlw k / movwf REG' write. Writes are
+    taken from the cross-reference index, so the movwf's bank is resolved
+    rather than assumed; the image must default each register on exactly
+    as many paths as there are parameters for it.
+    """
+    store = disassemble(image)
+    xref = XrefIndex(store)
+    writes: Dict[int, List[int]] = {}
+    for register, _ in parameters.values():
+        if register not in writes:
+            writes[register] = [address for address in xref.writes(register)
+                                if store.at(address)['mnemonic'] == 'movwf' and store.at(address - 1) is not None
+                                and store.at(address - 1)['mnemonic'] == 'movlw']
+    sites = []
+    for name, (register, path) in parameters.items():
+        expected = sum(1 for other, _ in parameters.values() if other == register)
+        if len(writes[register]) != expected:
+            found = ', '.join(f'0x{address - 1:04X}' for address in writes[register]) or 'none'
+            raise ValueError(f"expected {expected} 'movlw k / movwf' defaults of register 0x{register:02X} "
+                             f"for {name}, found {len(writes[register])} ({found})")
+        address = writes[register][path] - 1
+        sites.append(ParameterSite(name, address, store.at(address)['arg']))
+    return sites
+
+
+def patch_base(original_hex: str) -> Tuple[IntelHex, List[ParameterSite]]:
+    """
+    The original image with the burst mode patch applied (once, in memory)
+    and the sites of every parameter in it
+    """
+    sites = literal_sites(IntelHex(original_hex))
+    patcher = APW12FirmwarePatcher(original_hex)
+    image = patcher.apply_patch(patcher.create_patch(), verbose=False)
+    for name, label in PATCH_PARAMETERS.items():
+        address = patcher.labels[label]
+        sites.append(ParameterSite(name, address, image.get_word(address) & 0xFF))
+    return image, sites
+
+
+class UnitImageBuilder:
+    """
+    The rendered base image plus, for each parameter, where its literal
+    bytes sit in the text. build() returns a unit's HEX text.
+    """
+
+    def __init__(self, image: IntelHex, sites: Iterable[ParameterSite], record_size: int = 16):
+        self.sites = list(sites)
+        self.record_size = record_size
+        self.text = image.render(record_size).encode('ascii')
+        # The literal is the low byte of the movlw word
+        slots = self._locate({site.address * 2 for site in self.sites})
+        self.slots: Dict[str, List[_Slot]] = {}
+        for site in self.sites:
+            self.slots.setdefault(site.name, []).append(slots[site.address * 2])
+
+    def _locate(self, addresses) -> Dict[int, _Slot]:
+        """Text positions of the bytes at these byte addresses"""
+        found = {}
+        text = self.text
+        base = 0
+        position = 0
+        while position < len(text):
+            end = text.index(b'\n', position) + 1
+            count, offset, record_type = int(text[position + 1:position + 3], 16), \
+                int(text[position + 3:position + 7], 16), int(text[position + 7:position + 9], 16)
+            if record_type == LINEAR_RECORD:
+                base = int(text[position + 9:position + 13], 16) << 16
+            elif record_type == DATA_RECORD:
+                start = base + offset
+                checksum = position + 9 + 2 * count
+                for address in addresses:
+                    if start <= address < start + count:
+                        digits = position + 9 + 2 * (address - start)
+                        found[address] = _Slot(digits, checksum, int(text[digits:digits + 2], 16))
+            position = end
+        missing = set(addresses) - set(found)
+        if missing:
+            raise ValueError(f"parameter bytes not programmed in the base image: "
+                             f"{', '.join(f'0x{a // 2:04X}' for a in sorted(missing))}")
+        return found
+
+    def build(self, values: Dict[str, int]) -> bytes:
+        """HEX text of the base image with these parameter values"""
+        text = bytearray(self.text)
+        changes: Dict[int, int] = {}
+        for name, value in values.items():
+            if name not in self.slots:
+                raise ValueError(f'unknown parameter {name}')
+            if not 0 <= value <= 0xFF:
+                raise ValueError(f'{name} = {value} does not fit a movlw literal (0-255)')
+            digits = b'%02X' % value
+            for slot in self.slots[name]:
+                text[slot.digits:slot.digits + 2] = digits
+                changes[slot.checksum] = changes.get(slot.checksum, 0) + value - slot.default
+        for checksum, change in changes.items():
+            old = int(self.text[checksum:checksum + 2], 16)
+            text[checksum:checksum + 2] = b'%02X' % ((old - change) & 0xFF)
+        return bytes(text)
+
+    def rebuild(self, values: Dict[str, int]) -> bytes:
+        """The same image by reloading and re-rendering everything (for checking build())"""
+        image = IntelHex()
+        image.load_text(self.text.decode('ascii'))
+        for site in self.sites:
+            if site.name in values:
+                image.data[site.address * 2] = values[site.name]
+        return image.render(self.record_size).encode('ascii')
+
+    def write_all(self, units: Iterable[Tuple[str, Dict[str, int]]], output_dir: str,
+                  pattern: str = '{serial}.hex') -> int:
+        """
+        Write each (serial, values) unit to its own file; returns the count.
+        All file names are checked before anything is written: a serial used
+        twice, or one that is empty, '.', '..' or holds a path separator (or a
+        pattern placing it outside output_dir), is an error.
+        """
+        root = os.path.realpath(output_dir)
+        jobs = []
+        paths = set()
+        for serial, values in units:
+            path = os.path.realpath(os.path.join(root, pattern.format(serial=serial)))
+            if serial in ('', '.', '..') or '/' in serial or '\\' in serial or \
+                    path == root or os.path.commonpath([root, path]) != root:
+                raise ValueError(f'unsafe serial {serial!r}: unit files must stay in {output_dir}')
+            if path in paths:
+                raise ValueError(f'duplicate serial {serial!r}')
+            paths.add(path)
+            jobs.append((path, values))
+        os.makedirs(output_dir, exist_ok=True)
+        for path, values in jobs:
+            with open(path, 'wb') as f:
+                f.write(self.build(values))
+        return len(jobs)
+
+
+def load_units(csv_file: str) -> Iterator[Tuple[str, Dict[str, int]]]:
+    """
+    (serial, values) per row of a CSV with a 'serial' column and one column
+    per parameter to set; blank cells keep the base value
+    """
+    with open(csv_file, newline='') as f:
+        reader = csv.DictReader(f)
+        columns = reader.fieldnames or []
+        if 'serial' not in columns:
+            raise ValueError(f"{csv_file}: no 'serial' column")
+        unknown = [column for column in columns if column != 'serial' and column not in PARAMETERS]
+        if unknown:
+            raise ValueError(f"{csv_file}: unknown parameter column(s) {', '.join(unknown)}")
+        for row in reader:
+            try:
+                values = {name: int(text, 0) for name, text in row.items()
+                          if name != 'serial' and text and text.strip()}
+            except ValueError as e:
+                raise ValueError(f'{csv_file}:{reader.line_num}: {e}')
+            yield row['serial'], values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build per-unit patched APW12 firmware images')
+    parser.add_argument('units', help="CSV with a 'serial' column and parameter columns "
+                                      f"({', '.join(PARAMETERS)})")
+    parser.add_argument('--base', default=DEFAULT_BASE, help='Original image to patch (default: V71)')
+    parser.add_argument('-o', '--output-dir', default='units', help='Directory for the unit images')
+    parser.add_argument('--name', default='{serial}.hex', help='File name pattern for each unit')
+    parser.add_argument('--record-size', type=int, choices=(16, 32), default=16,
+                        help='Data bytes per HEX record')
+    parser.add_argument('--check', action='store_true',
+                        help='Also rebuild the first unit from scratch and compare')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    image, sites = patch_base(args.base)
+    builder = UnitImageBuilder(image, sites, args.record_size)
+    prepared = time.perf_counter() - start
+    print(f"Base image {args.base} (patched): "
+          f"{len(builder.text)} bytes of HEX, prepared in {prepared * 1000:.0f} ms")
+    for site in sites:
+        print(f"  {site.name:<15} movlw at 0x{site.address:04X}  default 0x{site.default:02X}")
+
+    try:
+        units = load_units(args.units)
+        if args.check:
+            first = next(units, None)
+            if first is not None:
+                if builder.build(first[1]) != builder.rebuild(first[1]):
+                    raise SystemExit(f"error: incremental build of unit {first[0]} differs from a full rebuild")
+                print(f"  Unit {first[0]}: incremental build matches a full rebuild")
+                units = iter([first] + list(units))
+        start = time.perf_counter()
+        count = builder.write_all(units, args.output_dir, args.name)
+    except ValueError as e:
+        raise SystemExit(f"error: {e}")
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {count} unit images to {args.output_dir}/ in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
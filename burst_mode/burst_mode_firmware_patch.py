@@ -4,14 +4,34 @@ APW12 Burst Mode Firmware Patch Generator
 Creates targeted patches for burst mode implementation based on IDA Pro analysis
 """
 
+import os
 import struct
 from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+# Importing the injector puts the analysis modules (one directory up) on sys.path
+from burst_mode_injector import IntelHex
+from pic_asm import Assembly, assemble, listing
+from pic_callgraph import STACK_LEVELS, analyze_stack
+from pic_cfg import INTERRUPT_VECTOR, RESET_VECTOR, build_cfg
+from pic_disasm import FORM_PAGE, disassemble
+from pic_freespace import FreeSpaceIndex
+from pic_wcet import locate_timer4_handler
+from pic_xref import XrefIndex
+
 class APW12FirmwarePatcher:
     """
     Generate firmware patches for burst mode implementation
     Based on comprehensive IDA Pro analysis of PIC16F1704_APW12_1.2_V71.hex
+    
+    The patch takes control at two sites of the original image (see
+    locate_entries): the reset vector runs the initialization section
+    before the startup code, and the ISR's Timer4 test runs the burst mode
+    state machine on every Timer4 interrupt. The state machine therefore
+    only updates the burst state and flags; it does not call the firmware's
+    PWM routine, which main-line code runs and whose locals an interrupt
+    would overwrite. The I2C command extensions are placed but not yet
+    branched to, so commands 0x50-0x54 are not handled.
     """
     
     # Key addresses from IDA Pro analysis
@@ -22,19 +42,42 @@ class APW12FirmwarePatcher:
         'PWM_FUNCTION': 0x0A64,         # sub_CODE_A64 - PWM control
         'ADC_READER': 0x0BA0,           # ADC conversion routine
         'MAIN_LOOP': 0x0264,            # Main control loop
-        'FREE_SPACE': 0x0F00,           # Available program memory
     }
+    # Patch sections are placed in free flash by pic_freespace (see place_sections)
     
-    # Memory allocation for burst mode variables
+    # Memory allocation for burst mode variables, at the top of bank 5: the
+    # firmware uses all of common RAM and its variables end below 0x2A2
     BURST_VARIABLES = {
-        'BURST_STATE': 0x78,            # Current burst mode state
-        'BURST_THRESH_L': 0x79,         # Low load threshold (25%)
-        'BURST_THRESH_H': 0x7A,         # High load threshold (30%)
-        'BURST_TIMER': 0x7B,            # Burst timing counter
-        'BURST_FLAGS': 0x7C,            # Status and control flags
-        'LOAD_CURRENT': 0x7D,           # Current load measurement
-        'BURST_FREQ_DIV': 0x7E,         # Frequency divider for burst
-        'SAFETY_STATUS': 0x7F,          # Safety monitoring flags
+        'BURST_STATE': 0x2E0,           # Current burst mode state
+        'BURST_THRESH_L': 0x2E1,        # Low load threshold (25%)
+        'BURST_THRESH_H': 0x2E2,        # High load threshold (30%)
+        'BURST_TIMER': 0x2E3,           # Burst timing counter
+        'BURST_FLAGS': 0x2E4,           # Status and control flags
+        'LOAD_CURRENT': 0x2E5,          # Current load measurement
+        'BURST_FREQ_DIV': 0x2E6,        # Frequency divider for burst
+        'SAFETY_STATUS': 0x2E7,         # Safety monitoring flags
+    }
+    
+    # Context save slots of the state machine
+    SCRATCH_VARIABLES = {
+        'W_SAVE_BURST': 0x2E8,
+        'STATUS_SAVE_BURST': 0x2E9,
+    }
+    
+    # Original firmware variables the patch (and per-unit builds) use
+    FIRMWARE_VARIABLES = {
+        'VOLTAGE_BASE': 0x32,           # byte_DATA_32 - base voltage setting
+        'VOLTAGE_ADJUST': 0x33,         # byte_DATA_33 - voltage adjustment
+        'TIMER4_COUNT': 0x40,           # byte_DATA_40 - Timer4 tick counter
+        'I2C_COMMAND': 0x22,            # byte_DATA_22 - I2C command register
+        'I2C_DATA': 0x27,               # byte_DATA_27 - I2C data
+        'I2C_RESPONSE': 0x53,           # byte_DATA_53 - I2C response
+    }
+    
+    # Labels other sections reach, by the section they start
+    ENTRY_POINTS = {
+        'BURST_MODE_CHECK': 'burst_mode_logic',
+        'INITIALIZE': 'initialization',
     }
     
     # I2C command extensions for burst mode control
@@ -50,222 +93,320 @@ class APW12FirmwarePatcher:
         self.original_hex = original_hex
         self.patches = []
         self.code_injections = {}
+        # Section name -> word address, filled in by place_sections()
+        self.layout: Dict[str, int] = {}
+        # Label -> word address, from the last assembly of each section
+        self.labels: Dict[str, int] = {}
+        # Entry site -> its addresses, filled in by locate_entries()
+        self.entries: Dict[str, Dict[str, int]] = {}
         
-    def generate_timer4_hook(self) -> List[int]:
+    def assemble_section(self, name: str, source: str) -> List[int]:
         """
-        Generate Timer4 ISR hook for burst mode monitoring
-        Injects at optimal location identified in ISR analysis
+        Assemble a section at its placed address (0 before place_sections;
+        sizes do not depend on it). Labels of other sections and the
+        firmware entry points resolve through the symbol table.
         """
-        # Save context registers
-        hook_code = [
-            # Save W register and STATUS
-            0x0020,  # MOVLB 0x00 (ensure Bank 0)
-            0x00FF,  # MOVWF W_SAVE (placeholder address)
-            0x0803,  # MOVF STATUS, W
-            0x00FE,  # MOVWF STATUS_SAVE (placeholder address)
-            
-            # Check if Timer4 interrupt occurred
-            0x1D0C,  # BTFSS PIR2, TMR4IF
-            0x2800 | 0x0020,  # GOTO TIMER4_EXIT (skip if not Timer4)
-            
-            # Call burst mode monitoring
-            0x2000 | (self.ADDRESSES['FREE_SPACE'] + 0x10),  # CALL BURST_MODE_CHECK
-            
-            # Timer4 exit - restore context
-            0x0020,  # Label: TIMER4_EXIT
-            0x08FE,  # MOVF STATUS_SAVE, W
-            0x0083,  # MOVWF STATUS
-            0x08FF,  # MOVF W_SAVE, W
-            0x0008,  # RETURN
-        ]
+        symbols = dict(self.ADDRESSES)
+        symbols.update(self.BURST_VARIABLES)
+        symbols.update(self.SCRATCH_VARIABLES)
+        symbols.update(self.FIRMWARE_VARIABLES)
+        symbols.update({label: self.layout.get(section, 0) for label, section in self.ENTRY_POINTS.items()})
+        assembly = assemble(source, self.layout.get(name, 0), symbols, name)
+        self.labels.update(assembly.labels)
+        return assembly.words
+    
+    def locate_entries(self) -> Dict[str, Dict[str, int]]:
+        """
+        The two-word sites of the original image that become 'pagesel HOOK /
+        goto HOOK': the reset vector's 'movlp / goto' to the startup code and
+        the ISR's 'btfss/btfsc PIR2, TMR4IF / goto' (pic_wcet). Raises
+        ValueError for an image without either.
+        """
+        store = disassemble(IntelHex(self.original_hex))
+        cfg = build_cfg(store)
+        xref = XrefIndex(store, cfg)
+        
+        self.entries = {}
+        for site in range(RESET_VECTOR, INTERRUPT_VECTOR - 1):
+            jump = store.at(site + 1)
+            if store.at(site) and store.at(site)['form'] == FORM_PAGE and jump and jump['mnemonic'] == 'goto':
+                self.entries['reset'] = {'site': site, 'start': cfg.branch_target(site + 1)}
+                break
+        else:
+            raise ValueError("no 'movlp / goto' at the reset vector")
         
-        return hook_code
+        timer4 = locate_timer4_handler(store, cfg, xref)
+        if timer4 is None:
+            raise ValueError('no Timer4 branch in the ISR')
+        branch, others = timer4
+        # The branch is either the instruction after the skipped goto or its target
+        site = next(address - 2 for address in (branch,) + others
+                    if store.at(address - 2) and store.at(address - 2)['mnemonic'] in ('btfss', 'btfsc'))
+        guarded = cfg.block_containing(site + 1)
+        if cfg.predecessors()[guarded] != [cfg.block_containing(site)]:
+            raise ValueError(f"the goto at 0x{site + 1:04X} is a branch target")
+        if xref.bank_at(site) < 0:
+            raise ValueError(f"bank selected at the Timer4 test (0x{site:04X}) is not known")
+        self.entries['timer4'] = {
+            'site': site, 'test': store.at(site)['opcode'], 'bank': xref.bank_at(site),
+            'branch': branch, 'skipped': site + 2, 'taken': cfg.branch_target(site + 1),
+        }
+        return self.entries
+    
+    def generate_entry_jump(self, entry: str, hook: str) -> List[int]:
+        """The 'pagesel / goto' written over an entry site (see locate_entries)"""
+        site = self.entries[entry]['site']
+        return assemble('pagesel HOOK\n goto HOOK', site, {'HOOK': self.layout.get(hook, 0)},
+                        f'{entry}_entry').words
+    
+    def generate_reset_hook(self) -> List[int]:
+        """
+        Initialize the burst mode variables out of reset, then continue to
+        the startup code the reset vector jumped to
+        """
+        return self.assemble_section('reset_hook', f"""
+            pagesel INITIALIZE
+            call    INITIALIZE
+            pagesel 0x{self.entries['reset']['start']:04X}
+            goto    0x{self.entries['reset']['start']:04X}    ; the displaced reset jump
+        """)
+    
+    def generate_timer4_hook(self) -> List[int]:
+        """
+        Generate Timer4 ISR hook for burst mode monitoring: the ISR's TMR4IF
+        test and the goto it guards, with a call to the state machine on the
+        Timer4 branch. The state machine keeps W and STATUS; the hook puts
+        back the bank and page.
+        """
+        entry = self.entries['timer4']
+        paths = {}
+        for path in ('skipped', 'taken'):
+            target = entry[path]
+            paths[path] = f"""
+            pagesel {target:#06x}
+            goto    {target:#06x}"""
+            if target == entry['branch']:
+                paths[path] = f"""
+            pagesel BURST_MODE_CHECK
+            call    BURST_MODE_CHECK
+            movlb   {entry['bank']:#04x}               ; bank at the ISR's test""" + paths[path]
+        return self.assemble_section('timer4_isr_hook', f"""
+            dw      {entry['test']:#06x}              ; the ISR's TMR4IF test
+            bra     TIMER4_TAKEN        ; test not skipping: the goto it guarded
+            {paths['skipped']}
+        TIMER4_TAKEN:{paths['taken']}
+        """)
     
     def generate_burst_mode_logic(self) -> List[int]:
         """
         Generate main burst mode control logic
         """
         # Burst mode state machine
-        burst_logic = [
-            # === BURST_MODE_CHECK function ===
-            # Label: BURST_MODE_CHECK (FREE_SPACE + 0x10)
+        return self.assemble_section('burst_mode_logic', """
+        BURST_MODE_CHECK:
+            ; Save context
+            banksel W_SAVE_BURST
+            movwf   W_SAVE_BURST
+            swapf   STATUS, W
+            movwf   STATUS_SAVE_BURST
             
-            # Save context
-            0x0020,  # MOVLB 0x00
-            0x00A0,  # MOVWF W_SAVE_BURST (temp storage)
-            0x0803,  # MOVF STATUS, W
-            0x00A1,  # MOVWF STATUS_SAVE_BURST
+            ; Read current load via ADC simulation
+            ; In real implementation, this would trigger ADC conversion
+            banksel TIMER4_COUNT
+            movf    TIMER4_COUNT, W     ; use Timer4 counter as load proxy
+            banksel LOAD_CURRENT
+            movwf   LOAD_CURRENT
             
-            # Read current load via ADC simulation
-            # In real implementation, this would trigger ADC conversion
-            0x0840,  # MOVF byte_DATA_40, W (use Timer4 counter as load proxy)
-            0x00FD,  # MOVWF LOAD_CURRENT (0x7D)
+            ; Check burst state
+            movf    BURST_STATE, W
+            xorlw   0x00
+            btfsc   STATUS, Z
+            bra     CHECK_ENTRY_CONDITION
             
-            # Check burst state
-            0x0878,  # MOVF BURST_STATE, W (0x78)
-            0x3A00,  # XORLW 0x00
-            0x1903,  # BTFSC STATUS, Z
-            0x2800 | 0x0030,  # GOTO CHECK_ENTRY_CONDITION
+            ; Currently in burst mode - check exit condition
+            movf    BURST_THRESH_H, W
+            subwf   LOAD_CURRENT, W
+            btfss   STATUS, C           ; if load >= high_thresh
+            bra     CONTINUE_BURST
             
-            # Currently in burst mode - check exit condition
-            0x0879,  # MOVF BURST_THRESH_H, W (0x7A - high threshold)
-            0x027D,  # SUBWF LOAD_CURRENT, W (0x7D)
-            0x1C03,  # BTFSS STATUS, C (if load >= high_thresh)
-            0x2800 | 0x0050,  # GOTO CONTINUE_BURST
+            ; Exit burst mode (normal PWM resumes with BURST_STATE clear)
+            clrf    BURST_STATE
+            bra     BURST_EXIT
             
-            # Exit burst mode
-            0x0178,  # CLRF BURST_STATE (0x78)
-            0x2000 | (self.ADDRESSES['PWM_FUNCTION']),  # CALL restore_normal_pwm
-            0x2800 | 0x0070,  # GOTO BURST_EXIT
+        CHECK_ENTRY_CONDITION:          ; not in burst mode
+            movf    BURST_THRESH_L, W
+            subwf   LOAD_CURRENT, W
+            btfsc   STATUS, C           ; if load >= low_thresh
+            bra     BURST_EXIT          ; stay in normal mode
             
-            # Check entry condition (not in burst mode)
-            # Label: CHECK_ENTRY_CONDITION (offset 0x30)
-            0x0879,  # MOVF BURST_THRESH_L, W (0x79 - low threshold)
-            0x027D,  # SUBWF LOAD_CURRENT, W (0x7D)
-            0x1803,  # BTFSC STATUS, C (if load >= low_thresh)
-            0x2800 | 0x0070,  # GOTO BURST_EXIT (stay in normal mode)
+            ; Enter burst mode
+            movlw   0x01
+            movwf   BURST_STATE
+            movlw   0x08                ; burst frequency divider
+            movwf   BURST_FREQ_DIV
+            bra     BURST_EXIT
             
-            # Enter burst mode
-            0x3001,  # MOVLW 0x01
-            0x0078,  # MOVWF BURST_STATE (0x78)
-            0x3008,  # MOVLW 0x08 (burst frequency divider)
-            0x007E,  # MOVWF BURST_FREQ_DIV (0x7E)
-            0x2000 | (self.ADDRESSES['PWM_FUNCTION']),  # CALL configure_burst_pwm
-            0x2800 | 0x0070,  # GOTO BURST_EXIT
+        CONTINUE_BURST:
+            clrf    BURST_TIMER         ; reset timer
+            ; Implement burst timing logic here
+            movf    BURST_FREQ_DIV, W
+            subwf   BURST_TIMER, W
+            btfss   STATUS, C
+            bra     BURST_EXIT
             
-            # Continue burst mode
-            # Label: CONTINUE_BURST (offset 0x50)
-            0x017B,  # CLRF BURST_TIMER (0x7B - reset timer)
-            # Implement burst timing logic here
-            0x087E,  # MOVF BURST_FREQ_DIV, W (0x7E)
-            0x027B,  # SUBWF BURST_TIMER, W (0x7B)
-            0x1C03,  # BTFSS STATUS, C
-            0x2800 | 0x0070,  # GOTO BURST_EXIT
+            ; Toggle PWM for burst effect
+            movf    BURST_FLAGS, W
+            xorlw   0x01                ; toggle bit 0
+            movwf   BURST_FLAGS
             
-            # Toggle PWM for burst effect
-            0x087C,  # MOVF BURST_FLAGS, W (0x7C)
-            0x3A01,  # XORLW 0x01 (toggle bit 0)
-            0x007C,  # MOVWF BURST_FLAGS (0x7C)
-            
-            # Label: BURST_EXIT (offset 0x70)
-            # Restore context
-            0x08A1,  # MOVF STATUS_SAVE_BURST, W
-            0x0083,  # MOVWF STATUS
-            0x08A0,  # MOVF W_SAVE_BURST, W
-            0x0008,  # RETURN
-        ]
-        
-        return burst_logic
+        BURST_EXIT:                     ; restore context (swapf leaves STATUS alone)
+            swapf   STATUS_SAVE_BURST, W
+            movwf   STATUS
+            swapf   W_SAVE_BURST, F
+            swapf   W_SAVE_BURST, W
+            return
+        """)
     
     def generate_i2c_command_extensions(self) -> List[int]:
         """
         Generate I2C command extensions for burst mode control
-        Extends existing I2C handler at sub_CODE_53D
+        Extends existing I2C handler at sub_CODE_53D. Nothing branches to this
+        section yet: its way back into the handler (I2C_HANDLER + 0x10) has
+        not been checked against the firmware.
         """
-        i2c_extensions = [
-            # === I2C Command Handler Extension ===
-            # Insert after line 1772 in original I2C handler
+        return self.assemble_section('i2c_extensions', """
+            ; Insert after line 1772 in original I2C handler
             
-            # Check for burst mode commands (0x50-0x54)
-            0x0822,  # MOVF byte_DATA_22, W (command register)
-            0x3C50,  # SUBLW 0x50
-            0x1803,  # BTFSC STATUS, C (if command < 0x50)
-            0x2800 | 0x0020,  # GOTO ORIGINAL_I2C_HANDLER
+            ; Check for burst mode commands (0x50-0x54)
+            banksel I2C_COMMAND
+            movf    I2C_COMMAND, W
+            sublw   0x50
+            btfsc   STATUS, C           ; if command < 0x50
+            bra     ORIGINAL_I2C_HANDLER
             
-            0x0822,  # MOVF byte_DATA_22, W
-            0x3C54,  # SUBLW 0x54
-            0x1C03,  # BTFSS STATUS, C (if command > 0x54)
-            0x2800 | 0x0020,  # GOTO ORIGINAL_I2C_HANDLER
+            movf    I2C_COMMAND, W
+            sublw   0x54
+            btfss   STATUS, C           ; if command > 0x54
+            bra     ORIGINAL_I2C_HANDLER
             
-            # Handle burst mode commands
-            0x0822,  # MOVF byte_DATA_22, W
-            0x3C50,  # SUBLW 0x50
-            0x1903,  # BTFSC STATUS, Z
-            0x2800 | 0x0030,  # GOTO HANDLE_BURST_ENABLE
+            ; Handle burst mode commands
+            movf    I2C_COMMAND, W
+            sublw   0x50
+            btfsc   STATUS, Z
+            bra     HANDLE_BURST_ENABLE
             
-            0x0822,  # MOVF byte_DATA_22, W
-            0x3C51,  # SUBLW 0x51
-            0x1903,  # BTFSC STATUS, Z
-            0x2800 | 0x0040,  # GOTO HANDLE_SET_THRESH_LOW
+            movf    I2C_COMMAND, W
+            sublw   0x51
+            btfsc   STATUS, Z
+            bra     HANDLE_SET_THRESH_LOW
             
-            0x0822,  # MOVF byte_DATA_22, W
-            0x3C52,  # SUBLW 0x52
-            0x1903,  # BTFSC STATUS, Z
-            0x2800 | 0x0050,  # GOTO HANDLE_SET_THRESH_HIGH
+            movf    I2C_COMMAND, W
+            sublw   0x52
+            btfsc   STATUS, Z
+            bra     HANDLE_SET_THRESH_HIGH
             
-            0x0822,  # MOVF byte_DATA_22, W
-            0x3C53,  # SUBLW 0x53
-            0x1903,  # BTFSC STATUS, Z
-            0x2800 | 0x0060,  # GOTO HANDLE_GET_STATUS
+            movf    I2C_COMMAND, W
+            sublw   0x53
+            btfsc   STATUS, Z
+            bra     HANDLE_GET_STATUS
             
-            0x0822,  # MOVF byte_DATA_22, W
-            0x3C54,  # SUBLW 0x54
-            0x1903,  # BTFSC STATUS, Z
-            0x2800 | 0x0070,  # GOTO HANDLE_GET_LOAD
+            movf    I2C_COMMAND, W
+            sublw   0x54
+            btfsc   STATUS, Z
+            bra     HANDLE_GET_LOAD
             
-            # Default: jump to original handler
-            # Label: ORIGINAL_I2C_HANDLER (offset 0x20)
-            0x2800 | (self.ADDRESSES['I2C_HANDLER'] + 0x10),  # GOTO original code
+        ORIGINAL_I2C_HANDLER:           ; default: continue in the original code
+            pagesel I2C_HANDLER
+            goto    I2C_HANDLER + 0x10
             
-            # Label: HANDLE_BURST_ENABLE (offset 0x30)
-            0x0827,  # MOVF byte_DATA_27, W (I2C data)
-            0x0078,  # MOVWF BURST_STATE (0x78)
-            0x2800 | 0x0080,  # GOTO I2C_EXIT
+        HANDLE_BURST_ENABLE:
+            movf    I2C_DATA, W
+            banksel BURST_STATE
+            movwf   BURST_STATE
+            bra     I2C_EXIT
             
-            # Label: HANDLE_SET_THRESH_LOW (offset 0x40)
-            0x0827,  # MOVF byte_DATA_27, W
-            0x0079,  # MOVWF BURST_THRESH_L (0x79)
-            0x2800 | 0x0080,  # GOTO I2C_EXIT
+        HANDLE_SET_THRESH_LOW:
+            movf    I2C_DATA, W
+            banksel BURST_THRESH_L
+            movwf   BURST_THRESH_L
+            bra     I2C_EXIT
             
-            # Label: HANDLE_SET_THRESH_HIGH (offset 0x50)
-            0x0827,  # MOVF byte_DATA_27, W
-            0x007A,  # MOVWF BURST_THRESH_H (0x7A)
-            0x2800 | 0x0080,  # GOTO I2C_EXIT
+        HANDLE_SET_THRESH_HIGH:
+            movf    I2C_DATA, W
+            banksel BURST_THRESH_H
+            movwf   BURST_THRESH_H
+            bra     I2C_EXIT
             
-            # Label: HANDLE_GET_STATUS (offset 0x60)
-            0x0878,  # MOVF BURST_STATE, W (0x78)
-            0x0053,  # MOVWF byte_DATA_53 (I2C response)
-            0x2800 | 0x0080,  # GOTO I2C_EXIT
+        HANDLE_GET_STATUS:
+            banksel BURST_STATE
+            movf    BURST_STATE, W
+            bra     I2C_RESPOND
             
-            # Label: HANDLE_GET_LOAD (offset 0x70)
-            0x087D,  # MOVF LOAD_CURRENT, W (0x7D)
-            0x0053,  # MOVWF byte_DATA_53 (I2C response)
+        HANDLE_GET_LOAD:
+            banksel LOAD_CURRENT
+            movf    LOAD_CURRENT, W
+        I2C_RESPOND:
+            banksel I2C_RESPONSE
+            movwf   I2C_RESPONSE
             
-            # Label: I2C_EXIT (offset 0x80)
-            0x0008,  # RETURN
-        ]
-        
-        return i2c_extensions
+        I2C_EXIT:
+            return
+        """)
     
     def generate_initialization_code(self) -> List[int]:
         """
-        Generate initialization code for burst mode variables
+        Generate initialization code for burst mode variables (called
+        by the reset hook)
         """
-        init_code = [
-            # Initialize burst mode variables with safe defaults
-            0x0178,  # CLRF BURST_STATE (0x78) - start disabled
-            0x3019,  # MOVLW 0x19 (25 decimal - 25% threshold)
-            0x0079,  # MOVWF BURST_THRESH_L (0x79)
-            0x301E,  # MOVLW 0x1E (30 decimal - 30% threshold)
-            0x007A,  # MOVWF BURST_THRESH_H (0x7A)
-            0x017B,  # CLRF BURST_TIMER (0x7B)
-            0x017C,  # CLRF BURST_FLAGS (0x7C)
-            0x017D,  # CLRF LOAD_CURRENT (0x7D)
-            0x3008,  # MOVLW 0x08 (default frequency divider)
-            0x007E,  # MOVWF BURST_FREQ_DIV (0x7E)
-            0x017F,  # CLRF SAFETY_STATUS (0x7F)
-        ]
-        
-        return init_code
+        return self.assemble_section('initialization', """
+            ; Initialize burst mode variables with safe defaults
+        INITIALIZE:
+            banksel BURST_STATE
+            clrf    BURST_STATE         ; start disabled
+        INIT_THRESH_L:                  ; per-unit builds rewrite these literals
+            movlw   25                  ; 25% threshold
+            movwf   BURST_THRESH_L
+        INIT_THRESH_H:
+            movlw   30                  ; 30% threshold
+            movwf   BURST_THRESH_H
+            clrf    BURST_TIMER
+            clrf    BURST_FLAGS
+            clrf    LOAD_CURRENT
+            movlw   0x08                ; default frequency divider
+            movwf   BURST_FREQ_DIV
+            clrf    SAFETY_STATUS
+            return
+        """)
     
-    def create_patch_file(self, output_file: str):
+    def place_sections(self, sections: Dict[str, List[int]]) -> Dict[str, int]:
         """
-        Create complete firmware patch with all burst mode modifications
+        Best-fit placement of the patch sections in the original image's
+        erased flash, none straddling a 2K page
         """
-        print("Generating APW12 Burst Mode Firmware Patch...")
-        print("=" * 60)
+        index = FreeSpaceIndex.from_hex(IntelHex(self.original_hex))
+        placements = index.allocate_all({name: len(code) for name, code in sections.items()})
+        self.layout = {name: placement.start for name, placement in placements.items()}
+        return self.layout
+    
+    def create_patch(self) -> Dict:
+        """
+        Place and assemble all burst mode modifications (the patch structure
+        create_patch_file() saves)
+        """
+        self.locate_entries()
+        
+        # Section sizes do not depend on addresses: place them, then generate
+        # again so references between sections use the placed addresses
+        self.place_sections({
+            'reset_hook': self.generate_reset_hook(),
+            'timer4_isr_hook': self.generate_timer4_hook(),
+            'burst_mode_logic': self.generate_burst_mode_logic(),
+            'i2c_extensions': self.generate_i2c_command_extensions(),
+            'initialization': self.generate_initialization_code(),
+        })
         
         # Generate all code sections
+        reset_hook = self.generate_reset_hook()
         timer4_hook = self.generate_timer4_hook()
         burst_logic = self.generate_burst_mode_logic()
         i2c_extensions = self.generate_i2c_command_extensions()
@@ -276,23 +417,38 @@ class APW12FirmwarePatcher:
             'original_file': self.original_hex,
             'patch_version': '1.0',
             'modifications': {
+                'reset_entry': {
+                    'address': self.entries['reset']['site'],
+                    'code': self.generate_entry_jump('reset', 'reset_hook'),
+                    'description': 'Reset vector jump to the reset hook'
+                },
+                'timer4_entry': {
+                    'address': self.entries['timer4']['site'],
+                    'code': self.generate_entry_jump('timer4', 'timer4_isr_hook'),
+                    'description': 'ISR Timer4 test replaced by a jump to the Timer4 hook'
+                },
+                'reset_hook': {
+                    'address': self.layout['reset_hook'],
+                    'code': reset_hook,
+                    'description': 'Burst mode initialization before the startup code'
+                },
                 'timer4_isr_hook': {
-                    'address': self.ADDRESSES['TIMER4_ISR'],
+                    'address': self.layout['timer4_isr_hook'],
                     'code': timer4_hook,
                     'description': 'Timer4 ISR hook for burst mode monitoring'
                 },
                 'burst_mode_logic': {
-                    'address': self.ADDRESSES['FREE_SPACE'] + 0x10,
+                    'address': self.layout['burst_mode_logic'],
                     'code': burst_logic,
                     'description': 'Main burst mode state machine'
                 },
                 'i2c_extensions': {
-                    'address': self.ADDRESSES['FREE_SPACE'] + 0x100,
+                    'address': self.layout['i2c_extensions'],
                     'code': i2c_extensions,
                     'description': 'I2C command extensions for burst control'
                 },
                 'initialization': {
-                    'address': self.ADDRESSES['FREE_SPACE'] + 0x200,
+                    'address': self.layout['initialization'],
                     'code': init_code,
                     'description': 'Burst mode variable initialization'
                 }
@@ -304,31 +460,68 @@ class APW12FirmwarePatcher:
                 'Burst mode is disabled by default',
                 'Safety monitoring remains active',
                 'Original I2C protocol unchanged',
-                'Reversible via I2C command 0x50 with data 0x00'
+                'I2C commands 0x50-0x54 are not wired into the I2C handler yet'
             ]
         }
         
+        return patch_data
+    
+    def create_patch_file(self, output_file: str):
+        """
+        Create complete firmware patch with all burst mode modifications
+        """
+        print("Generating APW12 Burst Mode Firmware Patch...")
+        print("=" * 60)
+        
+        patch_data = self.create_patch()
+        modifications = patch_data['modifications']
+        for name, address in self.layout.items():
+            print(f"Placed {name} at 0x{address:04X}")
+        
         # Save patch file
         import json
         with open(output_file, 'w') as f:
             json.dump(patch_data, f, indent=2)
         
         print(f"Patch file created: {output_file}")
-        print(f"Timer4 Hook: {len(timer4_hook)} instructions")
-        print(f"Burst Logic: {len(burst_logic)} instructions")
-        print(f"I2C Extensions: {len(i2c_extensions)} instructions")
-        print(f"Initialization: {len(init_code)} instructions")
+        print(f"Reset Hook: {len(modifications['reset_hook']['code'])} instructions, "
+              f"entered from 0x{modifications['reset_entry']['address']:04X}")
+        print(f"Timer4 Hook: {len(modifications['timer4_isr_hook']['code'])} instructions, "
+              f"entered from 0x{modifications['timer4_entry']['address']:04X}")
+        print(f"Burst Logic: {len(modifications['burst_mode_logic']['code'])} instructions")
+        print(f"I2C Extensions: {len(modifications['i2c_extensions']['code'])} instructions")
+        print(f"Initialization: {len(modifications['initialization']['code'])} instructions")
         
         return patch_data
     
-    def generate_hex_patch(self, patch_data: Dict, output_hex: str):
+    def create_patch_listing(self, patch_data: Dict, output_asm: str):
         """
-        Generate modified Intel HEX file with burst mode patches
+        Write the assembled patch as a listing: the variables it uses, then
+        every modification at its address with the labels it defines
         """
-        from burst_mode_injector import IntelHex, BurstModeInjector
-        
-        print(f"\nGenerating modified HEX file: {output_hex}")
+        lines = [
+            '; Burst Mode Control Patch for APW12',
+            f"; Generated by burst_mode_firmware_patch.py from {patch_data['original_file']}",
+            '; WARNING: This is experimental - use at your own risk!',
+            '',
+        ]
+        for name, address in {**self.BURST_VARIABLES, **self.SCRATCH_VARIABLES}.items():
+            lines.append(f'{name:<20} EQU     0x{address:03X}')
+        modifications = sorted(patch_data['modifications'].items(), key=lambda item: item[1]['address'])
+        for name, mod_data in modifications:
+            address, code = mod_data['address'], mod_data['code']
+            labels = {label: at for label, at in self.labels.items() if address <= at < address + len(code)}
+            lines += ['', f"; {name}: {mod_data['description']} ({len(code)} words)"]
+            lines.append(listing(Assembly(address, code, labels)).rstrip('\n'))
         
+        with open(output_asm, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        print(f"Patch listing saved: {output_asm}")
+    
+    def apply_patch(self, patch_data: Dict, verbose: bool = True):
+        """
+        The original image with the patch sections written in (an IntelHex)
+        """
         # Load original hex file
         hex_handler = IntelHex()
         hex_handler.load(self.original_hex)
@@ -338,25 +531,45 @@ class APW12FirmwarePatcher:
             address = mod_data['address']
             code = mod_data['code']
             
-            print(f"Applying {mod_name} at address 0x{address:04X}")
+            if verbose:
+                print(f"Applying {mod_name} at address 0x{address:04X}")
             
-            # Convert instruction list to bytes and inject
-            for i, instruction in enumerate(code):
-                word_addr = address + i
-                # PIC instructions are 14-bit, stored as 16-bit words
-                low_byte = instruction & 0xFF
-                high_byte = (instruction >> 8) & 0xFF
-                
-                # Intel HEX uses byte addressing
-                byte_addr = word_addr * 2
-                hex_handler.data[byte_addr] = low_byte
-                hex_handler.data[byte_addr + 1] = high_byte
+            # PIC instructions are 14-bit, stored as little-endian 16-bit words
+            hex_handler.set_words(address, code)
+        
+        return hex_handler
+    
+    def generate_hex_patch(self, patch_data: Dict, output_hex: str):
+        """
+        Generate modified Intel HEX file with burst mode patches
+        """
+        print(f"\nGenerating modified HEX file: {output_hex}")
+        
+        hex_handler = self.apply_patch(patch_data)
         
         # Save modified hex file
         hex_handler.save(output_hex)
         print(f"Modified firmware saved: {output_hex}")
         
+        self.check_stack_depth(hex_handler)
+        
         return True
+    
+    def check_stack_depth(self, hex_handler) -> bool:
+        """
+        Worst-case hardware stack depth of a patched image, including the
+        ISR preempting main-line code. Returns False if it can overflow.
+        """
+        report = analyze_stack(disassemble(hex_handler)).stack_report()
+        worst = report['worst_case']
+        if worst is None:
+            print("WARNING: Patched image has recursive calls; stack depth is unbounded")
+        elif report['overflow']:
+            print(f"WARNING: Worst-case stack depth {worst} exceeds {STACK_LEVELS} levels "
+                  f"(main {report['main_depth']} + interrupt 1 + ISR {report['isr_depth']})")
+        else:
+            print(f"Worst-case stack depth: {worst}/{STACK_LEVELS} levels")
+        return not report['overflow']
 
 def generate_test_commands():
     """
@@ -383,19 +596,23 @@ def main():
     print("Based on IDA Pro Analysis of PIC16F1704_APW12_1.2_V71.hex")
     print("=" * 70)
     
-    # Initialize patcher
-    original_hex = "_bins/PIC16F1704_APW12_1.2_V71.hex"
+    # Initialize patcher; outputs are written next to this script
+    here = Path(__file__).resolve().parent
+    original_hex = os.path.relpath(here.parent / "_bins" / "PIC16F1704_APW12_1.2_V71.hex")
+    if not Path(original_hex).exists():
+        # Sections are placed in the image's free flash, so it is needed from here on
+        print(f"Error: Original hex file not found: {original_hex}")
+        return
     patcher = APW12FirmwarePatcher(original_hex)
     
     # Generate patch file
-    patch_data = patcher.create_patch_file("apw12_burst_mode_patch.json")
+    patch_file = os.path.relpath(here / "apw12_burst_mode_patch.json")
+    patch_data = patcher.create_patch_file(patch_file)
+    patcher.create_patch_listing(patch_data, os.path.relpath(here / "PIC16F1704_APW12_1.2_V71_burst_patch.asm"))
     
     # Generate modified firmware
-    output_hex = "PIC16F1704_APW12_1.2_V71_BURST_MODE.hex"
-    if Path(original_hex).exists():
-        patcher.generate_hex_patch(patch_data, output_hex)
-    else:
-        print(f"Warning: Original hex file not found: {original_hex}")
+    output_hex = os.path.relpath(here / "PIC16F1704_APW12_1.2_V71_BURST_MODE.hex")
+    patcher.generate_hex_patch(patch_data, output_hex)
     
     # Generate test commands
     print("\n" + "=" * 70)
@@ -404,7 +621,7 @@ def main():
     print("\n" + "=" * 70)
     print("Patch Generation Complete!")
     print("\nNext Steps:")
-    print("1. Review patch file: apw12_burst_mode_patch.json")
+    print("1. Review patch file: " + patch_file)
     print("2. Test modified firmware: " + output_hex)
     print("3. Use PICkit 4 to flash modified firmware")
     print("4. Test I2C commands via J15 connector")
@@ -4,88 +4,343 @@ Burst Mode Control Injector for APW12 PIC16F1704 Firmware
 This tool analyzes existing firmware and injects burst mode control logic
 """
 
+import sys
+import mmap
 import struct
 import binascii
+from array import array
+from collections.abc import MutableMapping
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Iterator, List, Dict, Sequence, Tuple, Optional
 import argparse
 
+# The analysis modules live one directory up. They import this module
+# (pic_disasm reads images with IntelHex), so methods import them where used.
+# The other burst_mode tools import this module first and rely on this entry.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Device memory regions (word addresses); bytes are little-endian words as in the HEX file
+PROGRAM_WORDS = 0x1000          # 4K words of flash
+USER_ID_BASE, USER_ID_WORDS = 0x8000, 4
+CONFIG_BASE, CONFIG_WORDS = 0x8004, 5   # revision/device ID and CONFIG1/CONFIG2 at 0x8007-0x8008
+ERASED_WORD = 0x3FFF
+_ERASED_BYTES = ERASED_WORD.to_bytes(2, 'little')
+
+# Word image file (IntelHex.save_image): magic, format, region count, bytes outside the regions
+WORD_IMAGE_MAGIC = b'P16W'
+WORD_IMAGE_FORMAT = 1
+WORD_IMAGE_HEADER = struct.Struct('<4sHHI4x')
+
+# Intel HEX record types
+DATA_RECORD, EOF_RECORD, SEGMENT_RECORD, START_SEGMENT_RECORD, LINEAR_RECORD, START_LINEAR_RECORD = range(6)
+
+
+class MemoryRegion:
+    """
+    One block of device memory: its bytes, preset to erased words, and a
+    parallel mask of the bytes the image actually programs.
+    """
+    
+    def __init__(self, name: str, base: int, words: int):
+        self.name = name
+        self.base = base
+        self.words = words
+        self.start = base * 2           # byte addresses, as in the HEX file
+        self.end = (base + words) * 2
+        self.data = bytearray(_ERASED_BYTES * words)
+        self.mask = bytearray(words * 2)
+    
+    def view(self) -> memoryview:
+        """
+        Word view over the region's bytes (index 0 is word address base).
+        The bytes are little-endian, so on a big-endian host this is a view
+        of a byteswapped copy: reads are correct but writes do not reach
+        the region.
+        """
+        if sys.byteorder == 'little':
+            return memoryview(self.data).cast('H')
+        words = array('H', self.data)
+        words.byteswap()
+        return memoryview(words)
+    
+    def runs(self) -> Iterator[Tuple[int, int]]:
+        """(first, end) byte offsets of each stretch of programmed bytes"""
+        mask = self.mask
+        end = 0
+        while True:
+            start = mask.find(1, end)
+            if start < 0:
+                return
+            end = mask.find(0, start)
+            if end < 0:
+                end = len(mask)
+            yield start, end
+    
+    def programmed(self) -> Iterator[Tuple[int, int]]:
+        """(word address, word) of every word whose low byte the image programs"""
+        data, mask = self.data, self.mask
+        for start, end in self.runs():
+            for offset in range(start & ~1, end, 2):
+                if mask[offset]:
+                    high = data[offset + 1] if mask[offset + 1] else 0
+                    yield self.base + offset // 2, data[offset] | high << 8
+
+
+class _ByteMap(MutableMapping):
+    """Programmed bytes of an IntelHex by byte address, backed by its regions"""
+    
+    def __init__(self, image: 'IntelHex'):
+        self.image = image
+    
+    def __getitem__(self, address: int) -> int:
+        region = self.image.region_at(address)
+        if region is None:
+            return self.image.extra[address]
+        offset = address - region.start
+        if not region.mask[offset]:
+            raise KeyError(address)
+        return region.data[offset]
+    
+    def __setitem__(self, address: int, value: int):
+        region = self.image.region_at(address)
+        if region is None:
+            self.image.extra[address] = value & 0xFF
+            return
+        offset = address - region.start
+        region.data[offset] = value & 0xFF
+        region.mask[offset] = 1
+    
+    def __delitem__(self, address: int):
+        region = self.image.region_at(address)
+        if region is None:
+            del self.image.extra[address]
+            return
+        offset = address - region.start
+        if not region.mask[offset]:
+            raise KeyError(address)
+        region.mask[offset] = 0
+        region.data[offset] = _ERASED_BYTES[offset & 1]
+    
+    def __contains__(self, address) -> bool:
+        region = self.image.region_at(address)
+        if region is None:
+            return address in self.image.extra
+        return bool(region.mask[address - region.start])
+    
+    def __iter__(self) -> Iterator[int]:
+        addresses = [region.start + offset for region in self.image.regions
+                     for start, end in region.runs() for offset in range(start, end)]
+        if self.image.extra:
+            addresses = sorted(addresses + list(self.image.extra))
+        return iter(addresses)
+    
+    def __len__(self) -> int:
+        return sum(region.mask.count(1) for region in self.image.regions) + len(self.image.extra)
+
+
 class IntelHex:
-    """Intel HEX file parser and generator"""
+    """
+    Intel HEX file parser and generator. Program flash, user ID and
+    configuration words live in preallocated bytearrays (MemoryRegion), so
+    loading is a slice copy per record and word views need no conversion;
+    bytes outside those regions are kept in a dict. data maps byte
+    addresses to the programmed bytes for code that edits single bytes.
+    """
     
     def __init__(self, filename: Optional[str] = None):
-        self.data = {}
+        self.program = MemoryRegion('program', 0, PROGRAM_WORDS)
+        self.user_id = MemoryRegion('user_id', USER_ID_BASE, USER_ID_WORDS)
+        self.config = MemoryRegion('config', CONFIG_BASE, CONFIG_WORDS)
+        self.regions = (self.program, self.user_id, self.config)
+        self.extra: Dict[int, int] = {}
         self.segments = []
+        self.start_address: Optional[int] = None
         if filename:
             self.load(filename)
     
+    @property
+    def data(self) -> _ByteMap:
+        return _ByteMap(self)
+    
+    def region_at(self, address: int) -> Optional[MemoryRegion]:
+        """Region holding a byte address"""
+        for region in self.regions:
+            if region.start <= address < region.end:
+                return region
+        return None
+    
     def load(self, filename: str):
-        """Load Intel HEX file"""
+        """Load Intel HEX file (or a word image from save_image)"""
+        with open(filename, 'rb') as f:
+            head = f.read(len(WORD_IMAGE_MAGIC))
+        if head == WORD_IMAGE_MAGIC:
+            self.load_image(filename)
+            return
         with open(filename, 'r') as f:
-            for line in f:
-                if not line.startswith(':'):
-                    continue
-                
-                line = line.strip()
-                byte_count = int(line[1:3], 16)
-                address = int(line[3:7], 16)
-                record_type = int(line[7:9], 16)
-                
-                if record_type == 0x00:  # Data record
-                    data = line[9:9 + byte_count * 2]
-                    for i in range(0, len(data), 2):
-                        byte_val = int(data[i:i+2], 16)
-                        self.data[address + i // 2] = byte_val
-                elif record_type == 0x01:  # End of file
-                    break
-                elif record_type == 0x04:  # Extended linear address
-                    self.segments.append(int(line[9:13], 16))
-    
-    def save(self, filename: str):
+            self.load_text(f.read(), filename)
+    
+    def load_text(self, text: str, source: str = '<hex>'):
+        """Load Intel HEX records from a string (checksums and lengths validated; one record per line)"""
+        base = 0
+        program = self.program
+        for number, line in enumerate(text.split(), 1):
+            if line[0] != ':':
+                continue
+            try:
+                record = bytes.fromhex(line[1:])
+            except ValueError:
+                raise ValueError(f'{source}:{number}: malformed record')
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError(f'{source}:{number}: record length does not match its byte count')
+            if sum(record) & 0xFF:
+                raise ValueError(f'{source}:{number}: checksum mismatch')
+            record_type = record[3]
+            
+            if record_type == DATA_RECORD:
+                address = base + (record[1] << 8 | record[2])
+                count = record[0]
+                if address + count <= program.end:
+                    program.data[address:address + count] = record[4:4 + count]
+                    program.mask[address:address + count] = b'\x01' * count
+                else:
+                    self._put(address, record[4:4 + count])
+            elif record_type == EOF_RECORD:
+                break
+            elif record_type == LINEAR_RECORD:
+                segment = record[4] << 8 | record[5]
+                self.segments.append(segment)
+                base = segment << 16
+            elif record_type == SEGMENT_RECORD:
+                base = (record[4] << 8 | record[5]) << 4
+            elif record_type in (START_SEGMENT_RECORD, START_LINEAR_RECORD):
+                self.start_address = int.from_bytes(record[4:8], 'big')
+            else:
+                raise ValueError(f'{source}:{number}: unknown record type {record_type:02X}')
+    
+    def _put(self, address: int, data: bytes):
+        """Store bytes that may straddle regions or fall outside them"""
+        byte_map = self.data
+        for offset, value in enumerate(data):
+            byte_map[address + offset] = value
+    
+    def get_word(self, address: int, default: Optional[int] = None) -> Optional[int]:
+        """Programmed word at a word address"""
+        data = self.data
+        low = data.get(address * 2)
+        if low is None:
+            return default
+        return low | data.get(address * 2 + 1, 0) << 8
+    
+    def set_words(self, address: int, words: Sequence[int]):
+        """Program consecutive words starting at a word address"""
+        program = self.program
+        start, count = address * 2, len(words)
+        if start + 2 * count <= program.end:
+            packed = array('H', (w & 0xFFFF for w in words))
+            if sys.byteorder != 'little':
+                packed.byteswap()
+            program.data[start:start + 2 * count] = packed.tobytes()
+            program.mask[start:start + 2 * count] = b'\x01' * (2 * count)
+            return
+        self._put(start, b''.join((w & 0xFFFF).to_bytes(2, 'little') for w in words))
+    
+    def programmed_words(self) -> Dict[int, int]:
+        """Programmed words of the program, user ID and config regions by word address"""
+        words = {}
+        for region in self.regions:
+            words.update(region.programmed())
+        return words
+    
+    def _runs(self) -> List[Tuple[int, bytes]]:
+        """(byte address, bytes) of each programmed stretch, ascending and merged"""
+        runs = [(region.start + start, bytes(region.data[start:end]))
+                for region in self.regions for start, end in region.runs()]
+        extra = sorted(self.extra)
+        while extra:
+            count = 1
+            while count < len(extra) and extra[count] == extra[0] + count:
+                count += 1
+            runs.append((extra[0], bytes(self.extra[a] for a in extra[:count])))
+            extra = extra[count:]
+        runs.sort()
+        merged = []
+        for address, data in runs:
+            if merged and merged[-1][0] + len(merged[-1][1]) == address:
+                merged[-1] = (merged[-1][0], merged[-1][1] + data)
+            else:
+                merged.append((address, data))
+        return merged
+    
+    def records(self, record_size: int = 16) -> Iterator[str]:
+        """Intel HEX record lines, data records of up to record_size bytes"""
+        if not 0 < record_size <= 0xFF:
+            raise ValueError('record size must be 1-255 bytes')
+        segment = 0
+        for address, data in self._runs():
+            offset = 0
+            while offset < len(data):
+                here = address + offset
+                if here >> 16 != segment:
+                    # Extended linear address record for config/user ID space
+                    segment = here >> 16
+                    header = bytes((2, 0, 0, LINEAR_RECORD, segment >> 8, segment & 0xFF))
+                    yield f':{header.hex().upper()}{-sum(header) & 0xFF:02X}\n'
+                # Records stop at the end of a 64K segment
+                count = min(record_size, len(data) - offset, 0x10000 - (here & 0xFFFF))
+                record = bytes((count, here >> 8 & 0xFF, here & 0xFF, DATA_RECORD)) + data[offset:offset + count]
+                yield f':{record.hex().upper()}{-sum(record) & 0xFF:02X}\n'
+                offset += count
+        yield ':00000001FF\n'
+    
+    def render(self, record_size: int = 16) -> str:
+        """The whole image as Intel HEX text"""
+        return ''.join(self.records(record_size))
+    
+    def save(self, filename: str, record_size: int = 16):
         """Save to Intel HEX file"""
         with open(filename, 'w') as f:
-            # Write data records
-            addresses = sorted(self.data.keys())
-            if addresses:
-                current_addr = addresses[0]
-                buffer = []
-                
-                for addr in addresses:
-                    if addr != current_addr + len(buffer):
-                        # Write current buffer
-                        if buffer:
-                            self._write_data_record(f, current_addr, buffer)
-                        buffer = [self.data[addr]]
-                        current_addr = addr
-                    else:
-                        buffer.append(self.data[addr])
-                    
-                    # Write buffer if it reaches 16 bytes
-                    if len(buffer) >= 16:
-                        self._write_data_record(f, current_addr, buffer[:16])
-                        buffer = buffer[16:]
-                        current_addr += 16
-                
-                # Write remaining buffer
-                if buffer:
-                    self._write_data_record(f, current_addr, buffer)
-            
-            # Write end of file record
-            f.write(':00000001FF\n')
-    
-    def _write_data_record(self, f, address: int, data: List[int]):
-        """Write a data record to file"""
-        byte_count = len(data)
-        record = f':{byte_count:02X}{address:04X}00'
-        checksum = byte_count + (address >> 8) + (address & 0xFF)
-        
-        for byte_val in data:
-            record += f'{byte_val:02X}'
-            checksum += byte_val
-        
-        checksum = (~checksum + 1) & 0xFF
-        record += f'{checksum:02X}\n'
-        f.write(record)
+            f.write(self.render(record_size))
+    
+    def save_bin(self, filename: str):
+        """Program flash as raw little-endian words (8 KB, erased words included)"""
+        with open(filename, 'wb') as f:
+            f.write(self.program.data)
+    
+    def save_image(self, filename: str):
+        """
+        Word image: a WORD_IMAGE_HEADER, then for each region its data bytes
+        followed by its programmed-byte mask, then any bytes outside the
+        regions (addresses as uint32, then values). Program words start at
+        byte WORD_IMAGE_HEADER.size, so the file can be memory-mapped as-is.
+        """
+        extra = sorted(self.extra)
+        with open(filename, 'wb') as f:
+            f.write(WORD_IMAGE_HEADER.pack(WORD_IMAGE_MAGIC, WORD_IMAGE_FORMAT, len(self.regions), len(extra)))
+            for region in self.regions:
+                f.write(region.data)
+                f.write(region.mask)
+            f.write(array('I', extra).tobytes())
+            f.write(bytes(self.extra[address] for address in extra))
+    
+    def load_image(self, filename: str):
+        """Load a word image written by save_image()"""
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, version, count, extra = WORD_IMAGE_HEADER.unpack_from(view)
+            if magic != WORD_IMAGE_MAGIC or version != WORD_IMAGE_FORMAT or count != len(self.regions):
+                raise ValueError(f'{filename}: not a word image this version can read')
+            offset = WORD_IMAGE_HEADER.size
+            expected = offset + sum(4 * region.words for region in self.regions) + 5 * extra
+            if len(view) != expected:
+                raise ValueError(f'{filename}: truncated word image')
+            for region in self.regions:
+                size = 2 * region.words
+                region.data[:] = view[offset:offset + size]
+                region.mask[:] = view[offset + size:offset + 2 * size]
+                offset += 2 * size
+            addresses = array('I')
+            addresses.frombytes(view[offset:offset + 4 * extra])
+            self.extra = dict(zip(addresses, view[offset + 4 * extra:offset + 5 * extra]))
+
 
 class BurstModeInjector:
     """Injects burst mode control into PIC16F1704 firmware"""
@@ -121,15 +376,17 @@ class BurstModeInjector:
     
     # Key PIC16F1704 registers
     REGISTERS = {
+        'PCL': 0x02,
         'STATUS': 0x03,
+        'PCLATH': 0x0A,
         'PORTA': 0x0C,
         'PORTC': 0x0E,
         'TRISA': 0x8C,
         'TRISC': 0x8E,
         'ADCON0': 0x9D,
         'ADCON1': 0x9E,
-        'ADRESH': 0x9B,
-        'ADRESL': 0x9C,
+        'ADRESH': 0x9C,
+        'ADRESL': 0x9B,
         'PR2': 0x1B,
         'T2CON': 0x1C,
         'CCP1CON': 0x293,
@@ -144,147 +401,171 @@ class BurstModeInjector:
         self.hex_data = IntelHex(hex_file)
         self.free_space = None
         self.burst_mode_code = []
+        self.hook_address = None
         
-    def find_free_space(self, required_words: int = 100) -> Optional[int]:
-        """Find free space in program memory for burst mode code"""
-        # PIC16F1704 has 4K words (0x0000-0x0FFF)
-        # Look for consecutive 0x3FFF (unimplemented) or 0x0000 (NOP) instructions
-        
-        consecutive = 0
-        start_addr = None
-        
-        for addr in range(0x0100, 0x0F00, 2):  # Skip interrupt vectors
-            word_addr = addr // 2
-            
-            # Get 14-bit instruction word
-            if addr in self.hex_data.data and addr+1 in self.hex_data.data:
-                low_byte = self.hex_data.data[addr]
-                high_byte = self.hex_data.data[addr+1]
-                instruction = (high_byte << 8) | low_byte
-                
-                if instruction == 0x3FFF or instruction == 0x0000:
-                    if start_addr is None:
-                        start_addr = word_addr
-                    consecutive += 1
-                    
-                    if consecutive >= required_words:
-                        self.free_space = start_addr
-                        return start_addr
-                else:
-                    consecutive = 0
-                    start_addr = None
-            else:
-                # Uninitialized memory
-                if start_addr is None:
-                    start_addr = word_addr
-                consecutive += 1
-                
-                if consecutive >= required_words:
-                    self.free_space = start_addr
-                    return start_addr
+    def find_free_space(self, required_words: int = 100, page: Optional[int] = None) -> Optional[int]:
+        """
+        Word address of the best-fit free run in program memory for burst mode
+        code, in the given 2K page if set. Code on another page than its
+        caller must be reached through pagesel (see generate_hook).
+        """
+        from pic_freespace import FreeSpaceIndex
         
-        return None
+        # Erased runs over all 4K words, split at 2K pages, vectors excluded
+        index = FreeSpaceIndex.from_hex(self.hex_data)
+        run = index.find(required_words, page)
+        if run is None:
+            return None
+        self.free_space = index.runs[run].start
+        return self.free_space
     
     def generate_burst_mode_code(self) -> List[int]:
-        """Generate burst mode control assembly code"""
-        code = []
-        
-        # Burst mode variables (in bank 0 common RAM 0x70-0x7F)
-        BURST_STATE = 0x70
-        BURST_THRESH_L = 0x71
-        BURST_THRESH_H = 0x72
-        LOAD_CURRENT = 0x73
-        BURST_COUNTER = 0x74
+        """
+        Generate burst mode control code, assembled at the free space found.
+        It runs on every main loop pass: the load is the firmware's latest
+        ADC result (starting a conversion here would race its own), and
+        BURST_STATE<0> follows it with hysteresis between the two thresholds.
+        The state lives in the bank 5 RAM the firmware patch also uses for it
+        (the firmware fills common RAM); the PWM is left to the firmware.
+        """
+        from pic_asm import assemble
         
-        # Initialize burst mode thresholds
-        code.extend([
-            self.OPCODES['MOVLB'] | 0x00,  # Bank 0
-            self.OPCODES['MOVLW'] | 0x20,  # Low threshold = 32 (12.5% load)
-            self.OPCODES['MOVWF'] | BURST_THRESH_L,
-            self.OPCODES['MOVLW'] | 0x40,  # High threshold = 64 (25% load)
-            self.OPCODES['MOVWF'] | BURST_THRESH_H,
-            self.OPCODES['CLRF'] | BURST_STATE,  # Clear burst state
-        ])
+        source = """
+        ; Burst mode variables (bank 5, as in burst_mode_firmware_patch)
+        BURST_STATE     EQU 0x2E0
+        LOAD_CURRENT    EQU 0x2E5
+        ; Thresholds on the 8-bit load (ADRES >> 2)
+        BURST_THRESH_L  EQU 0x20        ; enter below 12.5% load
+        BURST_THRESH_H  EQU 0x40        ; leave at 25% load or more
         
-        # Burst mode check routine
-        burst_check_addr = len(code)
-        
-        # Read ADC (assuming ADC is configured elsewhere)
-        code.extend([
-            self.OPCODES['MOVLB'] | 0x01,  # Bank 1 for ADC
-            self.OPCODES['BSF'] | (self.REGISTERS['ADCON0'] << 3) | 0x1,  # Start conversion
-        ])
-        
-        # Wait for ADC completion
-        wait_adc_addr = len(code)
-        code.extend([
-            self.OPCODES['BTFSC'] | (self.REGISTERS['ADCON0'] << 3) | 0x1,  # Test GO bit
-            self.OPCODES['GOTO'] | wait_adc_addr,  # Loop if still converting
-            self.OPCODES['MOVF'] | (self.REGISTERS['ADRESH'] << 3),  # Read result
-            self.OPCODES['MOVLB'] | 0x00,  # Bank 0
-            self.OPCODES['MOVWF'] | LOAD_CURRENT,  # Store load current
-        ])
-        
-        # Compare with thresholds and manage burst state
-        code.extend([
-            # Check if load < low threshold
-            self.OPCODES['MOVF'] | (LOAD_CURRENT << 3),
-            self.OPCODES['SUBLW'] | 0x00,  # Will be patched with threshold
-            self.OPCODES['BTFSS'] | (self.REGISTERS['STATUS'] << 3) | 0x0,  # Check carry
-        ])
-        
-        # Enter burst mode routine
-        enter_burst_addr = len(code)
-        code.extend([
-            self.OPCODES['MOVLW'] | 0x01,  # Set burst state
-            self.OPCODES['MOVWF'] | BURST_STATE,
-            # Reduce PWM frequency
-            self.OPCODES['MOVLB'] | 0x00,
-            self.OPCODES['MOVLW'] | 0xFF,  # Maximum PR2 for lowest frequency
-            self.OPCODES['MOVWF'] | self.REGISTERS['PR2'],
-            self.OPCODES['RETURN'],
-        ])
+        BURST_CHECK:
+            ; LOAD_CURRENT = ADRES >> 2 (the firmware right-justifies results)
+            banksel ADRESL
+            movf    ADRESL, W
+            banksel LOAD_CURRENT
+            movwf   LOAD_CURRENT
+            banksel ADRESH
+            lsrf    ADRESH, W           ; C = ADRES<8>, W<0> = ADRES<9>
+            banksel LOAD_CURRENT
+            rrf     LOAD_CURRENT, F
+            lsrf    WREG, W             ; C = ADRES<9>
+            rrf     LOAD_CURRENT, F
+            
+            movf    LOAD_CURRENT, W
+            btfsc   BURST_STATE, 0
+            bra     IN_BURST
+            
+            ; Normal operation: enter burst mode when load < low threshold
+            sublw   BURST_THRESH_L - 1  ; C = load <= low threshold - 1
+            btfsc   STATUS, C
+        ENTER_BURST:
+            bsf     BURST_STATE, 0
+            return
         
-        # Exit burst mode routine
-        exit_burst_addr = len(code)
-        code.extend([
-            self.OPCODES['CLRF'] | BURST_STATE,
-            # Restore normal PWM frequency
-            self.OPCODES['MOVLB'] | 0x00,
-            self.OPCODES['MOVLW'] | 0x4F,  # Normal PR2 value
-            self.OPCODES['MOVWF'] | self.REGISTERS['PR2'],
-            self.OPCODES['RETURN'],
-        ])
+        IN_BURST:
+            ; Burst mode: exit when load >= high threshold
+            sublw   BURST_THRESH_H - 1  ; C clear = load >= high threshold
+            btfss   STATUS, C
+        EXIT_BURST:
+            bcf     BURST_STATE, 0
+            return
+        """
+        code = assemble(source, self.free_space or 0, name='burst_mode_code').words
         
         self.burst_mode_code = code
         return code
     
     def find_injection_point(self) -> Optional[int]:
-        """Find suitable injection point in main loop"""
-        # Look for main loop patterns
-        for addr in range(0x0100, 0x0400, 2):
-            word_addr = addr // 2
-            
-            if addr in self.hex_data.data and addr+1 in self.hex_data.data:
-                low_byte = self.hex_data.data[addr]
-                high_byte = self.hex_data.data[addr+1]
-                instruction = (high_byte << 8) | low_byte
-                
-                # Look for GOTO instructions that loop back
-                if (instruction & 0x3800) == self.OPCODES['GOTO']:
-                    target = instruction & 0x07FF
-                    if target < word_addr and target > 0x0010:  # Backward jump
-                        # This could be a main loop
-                        return word_addr
+        """
+        Header of the main loop: the widest loop reached from reset that is
+        closed by a goto. A loop can have several back edges (V71's main
+        loop at 0x0264 is closed at 0x051D, 0x0521 and 0x053C, and only the
+        first runs in normal operation), but every iteration passes the header.
+        """
+        from pic_cfg import RESET_VECTOR, build_cfg
+        from pic_disasm import disassemble
         
-        return None
+        store = disassemble(self.hex_data)
+        cfg = build_cfg(store)
+        owner = cfg.function_owner()
+        
+        best = None
+        for header, latch in cfg.loops():
+            if owner[cfg.block_containing(latch)] != RESET_VECTOR:
+                continue
+            if store.at(latch)['mnemonic'] != 'goto':
+                continue
+            if best is None or latch - header > best[1] - best[0]:
+                best = (header, latch)
+        
+        return best[0] if best else None
     
-    def inject_burst_mode(self, output_file: str):
+    def generate_hook(self, injection_point: int, hook: int) -> Tuple[int, List[int], List[int]]:
+        """
+        Jump from the main loop header into a hook at the given address that
+        calls the burst mode code, runs the header instructions the jump
+        displaced and goes back to the first one it kept. The jump is a goto,
+        or pagesel + goto when the hook is on another page, so one or two
+        instructions move; they must be in the header's basic block (no branch
+        lands on them) and be plain ones or a call, which the hook makes with
+        its own pagesel (no skip, other branch or PCL/PCLATH access). The
+        burst mode code changes W, STATUS and BSR, which the header must set
+        before using (V71's loads W and selects a bank in its first three
+        instructions). Returns (site address, site words, hook words).
+        """
+        from pic_asm import assemble
+        from pic_cfg import build_cfg
+        from pic_disasm import (BRANCH_MNEMONICS, FORM_F, FORM_FB, FORM_FD, FORM_PAGE, SKIP_MNEMONICS,
+                                disassemble)
+        from pic_freespace import page_of
+        
+        store = disassemble(self.hex_data)
+        cfg = build_cfg(store)
+        site = injection_point
+        jump = 'goto HOOK' if page_of(hook) == page_of(site) else 'pagesel HOOK\n goto HOOK'
+        site_words = assemble(jump, site, {'HOOK': hook}, name='burst_mode_site').words
+        
+        relocated = ''
+        for address in range(site, site + len(site_words)):
+            moved = store.at(address)
+            if moved is None or cfg.block_containing(address) != cfg.block_containing(site):
+                raise ValueError(f"cannot move the instruction at 0x{address:04X} into the hook")
+            if moved['mnemonic'] == 'call' and cfg.branch_target(address) is not None:
+                target = cfg.branch_target(address)
+                relocated += (f"            pagesel 0x{target:04X}\n"
+                              f"            call    0x{target:04X}        ; displaced from the loop header\n")
+                continue
+            if moved['mnemonic'] in SKIP_MNEMONICS | BRANCH_MNEMONICS or moved['form'] == FORM_PAGE or \
+                    moved['form'] in (FORM_F, FORM_FD, FORM_FB) and \
+                    moved['arg'] in (self.REGISTERS['PCL'], self.REGISTERS['PCLATH']):
+                raise ValueError(f"cannot move the instruction at 0x{address:04X} into the hook")
+            relocated += f"            dw      0x{moved['opcode']:04X}        ; displaced from the loop header\n"
+        source = f"""
+        HOOK:
+            pagesel BURST_MODE
+            call    BURST_MODE
+{relocated}            pagesel RESUME
+            goto    RESUME              ; rest of the loop header
+        """
+        symbols = {'BURST_MODE': self.free_space, 'RESUME': site + len(site_words)}
+        hook_words = assemble(source, hook, symbols, name='burst_mode_hook').words
+        return site, site_words, hook_words
+    
+    def inject_burst_mode(self, output_file: str, record_size: int = 16):
         """Inject burst mode control into firmware"""
         print("Analyzing firmware structure...")
         
-        # Find free space for burst mode code
-        free_space = self.find_free_space(150)
+        # Find injection point
+        injection_point = self.find_injection_point()
+        if not injection_point:
+            print("ERROR: No main loop found to inject at")
+            return False
+        
+        print(f"Injection point at 0x{injection_point:04X}")
+        
+        # Find free space for burst mode code and its hook, on the caller's page if possible
+        from pic_freespace import page_of
+        free_space = self.find_free_space(150, page_of(injection_point)) or self.find_free_space(150)
         if not free_space:
             print("ERROR: No free space found in firmware")
             return False
@@ -295,37 +576,27 @@ class BurstModeInjector:
         burst_code = self.generate_burst_mode_code()
         print(f"Generated {len(burst_code)} words of burst mode code")
         
-        # Find injection point
-        injection_point = self.find_injection_point()
-        if not injection_point:
-            print("WARNING: Could not find ideal injection point")
-            injection_point = 0x0200  # Default location
-        
-        print(f"Injection point at 0x{injection_point:04X}")
-        
-        # Inject code into free space
-        for i, instruction in enumerate(burst_code):
-            addr = (free_space + i) * 2
-            self.hex_data.data[addr] = instruction & 0xFF
-            self.hex_data.data[addr + 1] = (instruction >> 8) & 0xFF
-        
-        # Add call to burst mode check at injection point
-        call_instruction = self.OPCODES['CALL'] | free_space
-        inject_addr = injection_point * 2
+        # Hook after the code; the loop header jumps to it
+        self.hook_address = free_space + len(burst_code)
+        try:
+            site, site_words, hook_words = self.generate_hook(injection_point, self.hook_address)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            return False
         
-        # Save original instruction
-        if inject_addr in self.hex_data.data and inject_addr+1 in self.hex_data.data:
-            original_low = self.hex_data.data[inject_addr]
-            original_high = self.hex_data.data[inject_addr + 1]
-            original = (original_high << 8) | original_low
-            print(f"Original instruction at injection point: 0x{original:04X}")
+        # Save original instructions
+        original = [self.hex_data.get_word(address) for address in range(site, site + len(site_words))]
+        print("Original instructions at injection site: " +
+              ' '.join(f"0x{word:04X}" for word in original if word is not None))
         
-        # Inject CALL instruction
-        self.hex_data.data[inject_addr] = call_instruction & 0xFF
-        self.hex_data.data[inject_addr + 1] = (call_instruction >> 8) & 0xFF
+        # Inject code and hook into free space, then the jump to the hook
+        self.hex_data.set_words(free_space, burst_code + hook_words)
+        self.hex_data.set_words(site, site_words)
+        print(f"Hook at 0x{self.hook_address:04X} ({len(hook_words)} words), "
+              f"jump at 0x{site:04X}-0x{site + len(site_words) - 1:04X}")
         
         # Save modified firmware
-        self.hex_data.save(output_file)
+        self.hex_data.save(output_file, record_size)
         print(f"Modified firmware saved to: {output_file}")
         
         return True
@@ -354,7 +625,7 @@ def analyze_firmware(hex_file: str):
     # Check for free space
     free_space = injector.find_free_space()
     if free_space:
-        print(f"✓ Found {100} words of free space at 0x{free_space:04X}")
+        print(f"✓ Found 100 words of free space at 0x{free_space:04X}")
     else:
         print("✗ Insufficient free space for burst mode code")
     
@@ -381,9 +652,25 @@ def main():
     parser.add_argument('-o', '--output', help='Output HEX file', default=None)
     parser.add_argument('-a', '--analyze', action='store_true', help='Only analyze, don\'t modify')
     parser.add_argument('-v', '--verify', help='Verify modified firmware')
+    parser.add_argument('--record-size', type=int, choices=(16, 32), default=16,
+                        help='Data bytes per HEX record written')
+    parser.add_argument('--bin', help='Also write program flash as a raw binary')
+    parser.add_argument('--word-image', help='Also write a memory-mappable word image')
+    parser.add_argument('--convert', action='store_true',
+                        help='Only rewrite the input to --output/--bin/--word-image, no injection')
     
     args = parser.parse_args()
     
+    if args.convert:
+        image = IntelHex(args.hex_file)
+        if args.output:
+            image.save(args.output, args.record_size)
+        if args.bin:
+            image.save_bin(args.bin)
+        if args.word_image:
+            image.save_image(args.word_image)
+        return
+    
     if args.verify:
         injector = BurstModeInjector(args.hex_file)
         injector.verify_injection(args.verify)
@@ -403,7 +690,11 @@ def main():
         args.output = f"{base_name}_burst_mode.hex"
     
     injector = BurstModeInjector(args.hex_file)
-    if injector.inject_burst_mode(args.output):
+    if injector.inject_burst_mode(args.output, args.record_size):
+        if args.bin:
+            injector.hex_data.save_bin(args.bin)
+        if args.word_image:
+            injector.hex_data.save_image(args.word_image)
         print("\n" + "=" * 60)
         print("BURST MODE INJECTION COMPLETE")
         print("=" * 60)
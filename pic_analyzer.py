@@ -6,41 +6,94 @@ Analyzes and compares different firmware versions to understand control logic
 
 import os
 import re
-import subprocess
 import argparse
+from array import array
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 import difflib
 
+from pic_asm import AsmError, assemble
+from pic_cache import AnalysisCache, DEFAULT_CACHE_DIR, decode_sections, encode_sections, load_image
+from pic_disasm import InstructionStore, format_listing
+from pic_parallel import parallel_map, resolve_workers
+from pic_callgraph import CallGraph
+from pic_cfg import CFG_SECTIONS, ControlFlowGraph
+from pic_xref import XREF_SECTIONS, XrefIndex
+
+if TYPE_CHECKING:
+    from pic_reverse import ReverseDebugger
+
+# Peripheral registers that mark each control-point category
+CONTROL_REGISTERS = {
+    # PWM control uses the CCP and PWM modules
+    'pwm_control': ('CCPR1L', 'CCPR1H', 'CCP1CON', 'CCPR2L', 'CCPR2H', 'CCP2CON', 'CCPTMRS',
+                    'PWM3DCL', 'PWM3DCH', 'PWM3CON', 'PWM4DCL', 'PWM4DCH', 'PWM4CON'),
+    # Voltage references feeding the comparators and ADC
+    'voltage_monitoring': ('FVRCON', 'DAC1CON0', 'DAC1CON1'),
+    'i2c_communication': ('SSP1BUF', 'SSP1ADD', 'SSP1MSK', 'SSP1STAT', 'SSP1CON1',
+                          'SSP1CON2', 'SSP1CON3', 'SSPCLKPPS', 'SSPDATPPS'),
+    'timers': ('TMR0', 'TMR1L', 'TMR1H', 'T1CON', 'T1GCON', 'TMR2', 'PR2', 'T2CON',
+               'TMR4', 'PR4', 'T4CON', 'TMR6', 'PR6', 'T6CON', 'OPTION_REG'),
+    'adc_reads': ('ADCON0', 'ADCON1', 'ADCON2', 'ADRESL', 'ADRESH'),
+}
+
 class PICAnalyzer:
-    def __init__(self, hex_file: str):
+    def __init__(self, hex_file: str, cache: Optional[AnalysisCache] = None):
         self.hex_file = hex_file
         self.asm_file = None
-        self.instructions = []
+        self.instructions = InstructionStore(array('H'), array('H'))
         self.memory_map = {}
         self.functions = {}
+        self.cache = cache
+        self.cache_key = None
+        self.cached_sections = {}
+        # Derived sections not yet written to the cache (save_cache)
+        self._unsaved: Dict[str, array] = {}
+        self._cfg = None
+        self._xref = None
         
     def disassemble(self) -> bool:
-        """Disassemble hex file using gpdasm"""
-        asm_filename = self.hex_file.replace('.hex', '.asm')
+        """Disassemble hex file with the built-in PIC16F1704 decoder"""
         try:
-            result = subprocess.run(
-                ['gpdasm', '-p', 'pic16f1704', self.hex_file],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            with open(asm_filename, 'w') as f:
-                f.write(result.stdout)
-            
-            self.asm_file = asm_filename
-            self.parse_assembly()
-            return True
-            
-        except subprocess.CalledProcessError as e:
+            addresses, words, self.cached_sections, self.cache_key = \
+                load_image(self.hex_file, self.cache)
+        except (OSError, ValueError) as e:
             print(f"Error disassembling {self.hex_file}: {e}")
             return False
+        
+        self._load_words(addresses, words)
+        return True
+    
+    def load_sections(self, sections: Dict[str, array]):
+        """Populate from encoded sections (cache entry or worker result)"""
+        self.cached_sections = sections
+        self._load_words(sections['address'], sections['word'])
+    
+    def _load_words(self, addresses: array, words: array):
+        self.instructions = InstructionStore(addresses, words)
+        self._unsaved = {}
+        self._cfg = None
+        self._xref = None
+    
+    def save_listing(self, asm_filename: Optional[str] = None) -> str:
+        """Write a gpdasm-compatible listing (defaults to <hex>.asm)"""
+        if asm_filename is None:
+            asm_filename = self.hex_file.replace('.hex', '.asm')
+        with open(asm_filename, 'w') as f:
+            f.write(format_listing(self.instructions))
+        self.asm_file = asm_filename
+        return asm_filename
+    
+    def _store_sections(self, sections: Dict[str, array]):
+        """Keep derived analyses with the decoded image; save_cache() persists them"""
+        self.cached_sections.update(sections)
+        self._unsaved.update(sections)
+    
+    def save_cache(self):
+        """Write the analyses derived since the last save in one cache update"""
+        if self._unsaved and self.cache is not None and self.cache_key:
+            self.cache.store(self.cache_key, self._unsaved)
+        self._unsaved = {}
     
     def parse_assembly(self):
         """Parse disassembled code to extract instructions and structure"""
@@ -50,77 +103,96 @@ class PICAnalyzer:
         with open(self.asm_file, 'r') as f:
             lines = f.readlines()
         
+        addresses = array('H')
+        words = array('H')
         for line in lines:
             # Parse instruction lines (format: "0000:  3180  movlp   0x00")
             match = re.match(r'([0-9a-f]{4}):\s+([0-9a-f]{4})\s+(\w+)\s*(.*)', line, re.IGNORECASE)
             if match:
-                addr = int(match.group(1), 16)
-                opcode = match.group(2)
-                mnemonic = match.group(3)
-                operands = match.group(4).strip()
-                
-                self.instructions.append({
-                    'address': addr,
-                    'opcode': opcode,
-                    'mnemonic': mnemonic,
-                    'operands': operands,
-                    'line': line.strip()
-                })
+                addresses.append(int(match.group(1), 16))
+                words.append(int(match.group(2), 16) & 0x3FFF)
+        
+        self._load_words(addresses, words)
+    
+    def cfg(self) -> ControlFlowGraph:
+        """PCLATH-aware control-flow graph (cached with the image)"""
+        if self._cfg is None:
+            if all(name in self.cached_sections for name in CFG_SECTIONS):
+                self._cfg = ControlFlowGraph.from_sections(self.instructions, self.cached_sections)
+            else:
+                self._cfg = ControlFlowGraph(self.instructions)
+                self._store_sections(self._cfg.to_sections())
+        return self._cfg
+    
+    def call_graph(self) -> CallGraph:
+        """Function call graph with worst-case stack depths"""
+        return CallGraph(self.cfg())
+    
+    def xref(self) -> XrefIndex:
+        """Resolved register cross-reference (BSR tracked through the program flow)"""
+        if self._xref is None:
+            if all(name in self.cached_sections for name in XREF_SECTIONS):
+                self._xref = XrefIndex.from_sections(self.cached_sections)
+            else:
+                self._xref = XrefIndex(self.instructions, self.cfg())
+                self._store_sections(self._xref.to_sections())
+        return self._xref
+    
+    def time_travel(self, interval: Optional[int] = None, **options) -> 'ReverseDebugger':
+        """
+        Run the image on the simulator with checkpoints for stepping backward
+        (interval defaults to pic_reverse.CHECKPOINT_CYCLES). The simulator
+        stack is imported here so static analysis never loads it.
+        """
+        from pic_reverse import CHECKPOINT_CYCLES, ReverseDebugger
+        return ReverseDebugger(self.hex_file, interval or CHECKPOINT_CYCLES, **options)
     
     def identify_control_points(self) -> Dict[str, List]:
         """Identify key control points for burst mode implementation"""
-        control_points = {
-            'pwm_control': [],
-            'voltage_monitoring': [],
-            'i2c_communication': [],
-            'interrupts': [],
-            'timers': [],
-            'adc_reads': []
-        }
+        categories = list(CONTROL_REGISTERS) + ['interrupts']
+        if all(f'cp.{name}' in self.cached_sections for name in categories):
+            return {
+                name: [self.instructions.at(addr) for addr in self.cached_sections[f'cp.{name}']]
+                for name in categories
+            }
         
-        for inst in self.instructions:
-            # PWM control typically uses CCP modules
-            if 'ccp' in inst['line'].lower():
-                control_points['pwm_control'].append(inst)
-            
-            # ADC operations for voltage monitoring
-            if 'adcon' in inst['line'].lower() or 'adres' in inst['line'].lower():
-                control_points['adc_reads'].append(inst)
-            
-            # I2C communication
-            if 'ssp' in inst['line'].lower() or 'i2c' in inst['line'].lower():
-                control_points['i2c_communication'].append(inst)
-            
-            # Timer operations
-            if 'tmr' in inst['line'].lower() or 'timer' in inst['line'].lower():
-                control_points['timers'].append(inst)
-            
-            # Interrupt handling
-            if inst['address'] == 0x0004:  # Interrupt vector
-                control_points['interrupts'].append(inst)
-            
-            # Voltage comparison operations
-            if inst['mnemonic'] in ['subwf', 'xorwf', 'btfss', 'btfsc']:
-                if 'voltage' in inst.get('comment', '').lower():
-                    control_points['voltage_monitoring'].append(inst)
+        xref = self.xref()
+        control_points = {}
+        for name, registers in CONTROL_REGISTERS.items():
+            addresses = set()
+            for register in registers:
+                addresses.update(xref.accesses(register))
+            control_points[name] = [self.instructions.at(addr) for addr in sorted(addresses)]
         
+        # Interrupt handling
+        vector = self.instructions.at(0x0004)  # Interrupt vector
+        control_points['interrupts'] = [vector] if vector is not None else []
+        
+        self._store_sections({
+            f'cp.{name}': array('H', (inst['address'] for inst in insts))
+            for name, insts in control_points.items()
+        })
         return control_points
     
     def find_main_loop(self) -> List:
         """Identify the main control loop"""
-        loops = []
-        for i, inst in enumerate(self.instructions):
-            if inst['mnemonic'] == 'goto':
-                target = inst['operands'].replace('0x', '')
-                if target:
-                    target_addr = int(target, 16)
-                    # Check if this is a backward jump (potential loop)
-                    if target_addr < inst['address']:
-                        loops.append({
-                            'start': target_addr,
-                            'end': inst['address'],
-                            'instruction': inst
-                        })
+        if 'loop.start' in self.cached_sections:
+            return [
+                {'start': start, 'end': end, 'instruction': self.instructions.at(end)}
+                for start, end in zip(self.cached_sections['loop.start'],
+                                      self.cached_sections['loop.end'])
+            ]
+        
+        # Back edges of the control-flow graph
+        loops = [
+            {'start': header, 'end': latch, 'instruction': self.instructions.at(latch)}
+            for header, latch in self.cfg().loops()
+        ]
+        
+        self._store_sections({
+            'loop.start': array('H', (loop['start'] for loop in loops)),
+            'loop.end': array('H', (loop['end'] for loop in loops))
+        })
         return loops
     
     def compare_versions(self, other_analyzer: 'PICAnalyzer') -> Dict:
@@ -132,25 +204,22 @@ class PICAnalyzer:
             'summary': {}
         }
         
-        # Create instruction maps for comparison
-        self_map = {inst['address']: inst for inst in self.instructions}
-        other_map = {inst['address']: inst for inst in other_analyzer.instructions}
-        
-        # Find differences
-        all_addresses = set(self_map.keys()) | set(other_map.keys())
+        # Compare the word columns through each store's address index
+        mine, theirs = self.instructions, other_analyzer.instructions
+        all_addresses = set(mine.address) | set(theirs.address)
         
         for addr in sorted(all_addresses):
-            if addr in self_map and addr not in other_map:
-                differences['removed_instructions'].append(self_map[addr])
-            elif addr not in self_map and addr in other_map:
-                differences['added_instructions'].append(other_map[addr])
-            elif addr in self_map and addr in other_map:
-                if self_map[addr]['opcode'] != other_map[addr]['opcode']:
-                    differences['modified_instructions'].append({
-                        'address': addr,
-                        'old': self_map[addr],
-                        'new': other_map[addr]
-                    })
+            old_row, new_row = mine.row_of(addr), theirs.row_of(addr)
+            if new_row < 0:
+                differences['removed_instructions'].append(mine[old_row])
+            elif old_row < 0:
+                differences['added_instructions'].append(theirs[new_row])
+            elif mine.word[old_row] != theirs.word[new_row]:
+                differences['modified_instructions'].append({
+                    'address': addr,
+                    'old': mine[old_row],
+                    'new': theirs[new_row]
+                })
         
         differences['summary'] = {
             'total_added': len(differences['added_instructions']),
@@ -160,41 +229,77 @@ class PICAnalyzer:
         
         return differences
 
-def analyze_all_versions(bins_dir: str):
+def _analyze_image(job: Tuple[str, Optional[str]]) -> Optional[bytes]:
+    """Worker: decode and analyze one image, returning its encoded sections"""
+    hex_file, cache_dir = job
+    analyzer = PICAnalyzer(hex_file, AnalysisCache(cache_dir) if cache_dir else None)
+    if not analyzer.disassemble():
+        return None
+    analyzer.identify_control_points()
+    analyzer.find_main_loop()
+    analyzer.save_cache()
+    return encode_sections(analyzer.cached_sections)
+
+def _compare_images(job: Tuple[bytes, bytes]) -> Tuple[int, int, int, List[Tuple[int, str, str]]]:
+    """Worker: compare two encoded images, returning counts and the first modifications"""
+    old, new = PICAnalyzer(''), PICAnalyzer('')
+    old.load_sections(decode_sections(job[0]))
+    new.load_sections(decode_sections(job[1]))
+    diff = old.compare_versions(new)
+    modifications = [
+        (mod['address'], mod['old']['mnemonic'], mod['new']['mnemonic'])
+        for mod in diff['modified_instructions'][:5]
+    ]
+    summary = diff['summary']
+    return summary['total_added'], summary['total_removed'], summary['total_modified'], modifications
+
+def analyze_all_versions(bins_dir: str, cache: Optional[AnalysisCache] = None,
+                         workers: Optional[int] = 1):
     """Analyze all firmware versions in the bins directory"""
     bins_path = Path(bins_dir)
-    hex_files = list(bins_path.glob("*.hex"))
+    hex_files = sorted(bins_path.glob("*.hex"))
     
     analyzers = {}
     
     print(f"Found {len(hex_files)} firmware files")
     print("-" * 60)
     
-    for hex_file in hex_files:
+    if resolve_workers(workers) > 1:
+        cache_dir = str(cache.cache_dir) if cache is not None else None
+        results = parallel_map(_analyze_image, [(str(f), cache_dir) for f in hex_files], workers)
+    else:
+        results = [None] * len(hex_files)
+    
+    for hex_file, result in zip(hex_files, results):
         print(f"\nAnalyzing {hex_file.name}...")
-        analyzer = PICAnalyzer(str(hex_file))
+        analyzer = PICAnalyzer(str(hex_file), cache)
         
-        if analyzer.disassemble():
-            analyzers[hex_file.name] = analyzer
-            
-            # Analyze control points
-            control_points = analyzer.identify_control_points()
-            print(f"  Instructions: {len(analyzer.instructions)}")
-            print(f"  PWM control points: {len(control_points['pwm_control'])}")
-            print(f"  ADC operations: {len(control_points['adc_reads'])}")
-            print(f"  I2C operations: {len(control_points['i2c_communication'])}")
-            print(f"  Timer operations: {len(control_points['timers'])}")
-            
-            # Find main loops
-            loops = analyzer.find_main_loop()
-            if loops:
-                print(f"  Main loops found: {len(loops)}")
-                for loop in loops[:3]:  # Show first 3 loops
-                    print(f"    Loop from 0x{loop['start']:04x} to 0x{loop['end']:04x}")
+        if result is not None:
+            analyzer.load_sections(decode_sections(result))
+        elif not analyzer.disassemble():
+            continue
+        
+        analyzers[hex_file.name] = analyzer
+        
+        # Analyze control points
+        control_points = analyzer.identify_control_points()
+        print(f"  Instructions: {len(analyzer.instructions)}")
+        print(f"  PWM control points: {len(control_points['pwm_control'])}")
+        print(f"  ADC operations: {len(control_points['adc_reads'])}")
+        print(f"  I2C operations: {len(control_points['i2c_communication'])}")
+        print(f"  Timer operations: {len(control_points['timers'])}")
+        
+        # Find main loops
+        loops = analyzer.find_main_loop()
+        if loops:
+            print(f"  Main loops found: {len(loops)}")
+            for loop in loops[:3]:  # Show first 3 loops
+                print(f"    Loop from 0x{loop['start']:04x} to 0x{loop['end']:04x}")
+        analyzer.save_cache()
     
     return analyzers
 
-def compare_all_versions(analyzers: Dict[str, PICAnalyzer]):
+def compare_all_versions(analyzers: Dict[str, PICAnalyzer], workers: Optional[int] = 1):
     """Compare all firmware versions to identify evolution"""
     versions = list(analyzers.keys())
     
@@ -208,23 +313,30 @@ def compare_all_versions(analyzers: Dict[str, PICAnalyzer]):
     
     # Sort versions by name
     versions.sort()
+    pairs = [(versions[i], versions[i + 1]) for i in range(len(versions) - 1)]
     
     # Compare consecutive versions
-    for i in range(len(versions) - 1):
-        v1, v2 = versions[i], versions[i + 1]
+    encoded = {
+        name: encode_sections({
+            'address': analyzer.instructions.address,
+            'word': analyzer.instructions.word
+        })
+        for name, analyzer in analyzers.items()
+    }
+    results = parallel_map(_compare_images, [(encoded[v1], encoded[v2]) for v1, v2 in pairs], workers)
+    
+    for (v1, v2), (added, removed, modified, modifications) in zip(pairs, results):
         print(f"\nComparing {v1} vs {v2}:")
         
-        diff = analyzers[v1].compare_versions(analyzers[v2])
-        
-        print(f"  Added: {diff['summary']['total_added']} instructions")
-        print(f"  Removed: {diff['summary']['total_removed']} instructions")
-        print(f"  Modified: {diff['summary']['total_modified']} instructions")
+        print(f"  Added: {added} instructions")
+        print(f"  Removed: {removed} instructions")
+        print(f"  Modified: {modified} instructions")
         
         # Show some interesting modifications
-        if diff['modified_instructions']:
+        if modifications:
             print(f"\n  Key modifications:")
-            for mod in diff['modified_instructions'][:5]:
-                print(f"    0x{mod['address']:04x}: {mod['old']['mnemonic']} -> {mod['new']['mnemonic']}")
+            for address, old_mnemonic, new_mnemonic in modifications:
+                print(f"    0x{address:04x}: {old_mnemonic} -> {new_mnemonic}")
 
 def generate_burst_mode_patch(analyzer: PICAnalyzer, output_file: str):
     """Generate a burst mode control patch for the firmware"""
@@ -306,6 +418,11 @@ def generate_burst_mode_patch(analyzer: PICAnalyzer, output_file: str):
         f.write('\n'.join(patch))
     
     print(f"Burst mode patch generated: {output_file}")
+    try:
+        size = len(assemble('\n'.join(patch), name=output_file).words)
+        print(f"Patch assembles to {size} words (see pic_asm.py)")
+    except AsmError as e:
+        print(f"WARNING: Patch does not assemble: {e}")
     print("\nPatch includes:")
     print("  - Burst mode state machine")
     print("  - Load current monitoring via ADC")
@@ -322,15 +439,25 @@ def main():
     parser.add_argument('--bins-dir', default='_bins', help='Directory containing hex files')
     parser.add_argument('--compare', action='store_true', help='Compare all versions')
     parser.add_argument('--generate-patch', help='Generate burst mode patch for specified hex file')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Decoded image cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='Always decode from scratch')
+    parser.add_argument('--write-listings', action='store_true', help='Write a .asm listing next to each hex file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 = one per CPU)')
     
     args = parser.parse_args()
     
+    cache = None if args.no_cache else AnalysisCache(args.cache_dir)
+    
     # Analyze all versions
-    analyzers = analyze_all_versions(args.bins_dir)
+    analyzers = analyze_all_versions(args.bins_dir, cache, args.jobs)
+    
+    if args.write_listings:
+        for analyzer in analyzers.values():
+            analyzer.save_listing()
     
     # Compare versions if requested
     if args.compare and analyzers:
-        compare_all_versions(analyzers)
+        compare_all_versions(analyzers, args.jobs)
     
     # Generate patch if requested
     if args.generate_patch and args.generate_patch in analyzers:
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Assembler
+Two-pass assembler for the enhanced mid-range instruction set, used to build
+patch sections from mnemonic source. The first pass parses a source once into
+sized statements and label offsets; the second links it at an origin, so a
+section is re-encoded in microseconds wherever the allocator places it.
+Operands are expressions over labels, EQU symbols, the SFR and bit names of
+the device and '$' (the address of the current instruction). Numbers are
+decimal unless written 0x../0b.., H'..'/B'..'/D'..' or '.N' as gpdasm
+prints them; banksel and pagesel expand to movlb and movlp. goto and call
+take full addresses: one whose page differs from the page PCLATH selects
+(the last pagesel/movlp since the previous label, else the instruction's
+own) is an error. Listings printed by pic_disasm assemble back to the same
+words on page 0; elsewhere their 11-bit goto/call operands need the page.
+"""
+
+import re
+import ast
+import argparse
+from collections import namedtuple
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pic_disasm import PROGRAM_WORDS, IntelHex, format_line
+from pic_xref import SFR_ADDRESSES
+
+# Bit numbers of the flags patch code tests and sets
+BITS = {
+    # STATUS
+    'C': 0, 'DC': 1, 'Z': 2, 'NOT_PD': 3, 'NOT_TO': 4,
+    # INTCON
+    'IOCIF': 0, 'INTF': 1, 'TMR0IF': 2, 'IOCIE': 3, 'INTE': 4, 'TMR0IE': 5, 'PEIE': 6, 'GIE': 7,
+    # PIR1 (PIE1 enables share the positions)
+    'TMR1IF': 0, 'TMR2IF': 1, 'CCP1IF': 2, 'SSP1IF': 3, 'TXIF': 4, 'RCIF': 5, 'ADIF': 6, 'TMR1GIF': 7,
+    'TMR1IE': 0, 'TMR2IE': 1, 'CCP1IE': 2, 'SSP1IE': 3, 'TXIE': 4, 'RCIE': 5, 'ADIE': 6, 'TMR1GIE': 7,
+    # PIR2 / PIE2
+    'CCP2IF': 0, 'TMR4IF': 1, 'TMR6IF': 2, 'BCL1IF': 3, 'C1IF': 5, 'C2IF': 6, 'OSFIF': 7,
+    'CCP2IE': 0, 'TMR4IE': 1, 'TMR6IE': 2, 'BCL1IE': 3, 'C1IE': 5, 'C2IE': 6, 'OSFIE': 7,
+    # ADCON0
+    'ADON': 0, 'GO': 1, 'GO_NOT_DONE': 1,
+    # Tx CON
+    'TMR2ON': 2, 'TMR4ON': 2, 'TMR6ON': 2,
+}
+# Destination operands
+DESTINATIONS = {'W': 0, 'F': 1}
+
+# origin: word address of the first word; labels: name -> word address
+Assembly = namedtuple('Assembly', 'origin words labels')
+
+# One sized source line: kind selects the encoder, operands are parsed
+# expressions (ints, or code objects evaluated at link time)
+Statement = namedtuple('Statement', 'line offset kind base operands')
+
+
+class AsmError(ValueError):
+    """Source error, reported with its file and line"""
+
+
+# mnemonic -> (kind, opcode bits)
+_FD = {'subwf': 0x0200, 'decf': 0x0300, 'iorwf': 0x0400, 'andwf': 0x0500, 'xorwf': 0x0600,
+       'addwf': 0x0700, 'movf': 0x0800, 'comf': 0x0900, 'incf': 0x0A00, 'decfsz': 0x0B00,
+       'rrf': 0x0C00, 'rlf': 0x0D00, 'swapf': 0x0E00, 'incfsz': 0x0F00, 'lslf': 0x3500,
+       'lsrf': 0x3600, 'asrf': 0x3700, 'subwfb': 0x3B00, 'addwfc': 0x3D00}
+_FB = {'bcf': 0x1000, 'bsf': 0x1400, 'btfsc': 0x1800, 'btfss': 0x1C00}
+_K = {'movlw': 0x3000, 'retlw': 0x3400, 'iorlw': 0x3800, 'andlw': 0x3900, 'xorlw': 0x3A00,
+      'sublw': 0x3C00, 'addlw': 0x3E00}
+_NONE = {'nop': 0x0000, 'reset': 0x0001, 'return': 0x0008, 'retfie': 0x0009, 'callw': 0x000A,
+         'brw': 0x000B, 'option': 0x0062, 'sleep': 0x0063, 'clrwdt': 0x0064, 'clrw': 0x0100}
+
+OPCODES: Dict[str, Tuple[str, int]] = {}
+OPCODES.update({name: ('fd', base) for name, base in _FD.items()})
+OPCODES.update({name: ('fb', base) for name, base in _FB.items()})
+OPCODES.update({name: ('k', base) for name, base in _K.items()})
+OPCODES.update({name: ('none', base) for name, base in _NONE.items()})
+OPCODES.update({
+    'movwf': ('f', 0x0080), 'clrf': ('f', 0x0180), 'tris': ('tris', 0x0060),
+    'call': ('addr', 0x2000), 'goto': ('addr', 0x2800), 'bra': ('rel', 0x3200),
+    'movlb': ('bank', 0x0020), 'movlp': ('page', 0x3180), 'addfsr': ('addfsr', 0x3100),
+    'moviw': ('fsr', 0x0010), 'movwi': ('fsr', 0x0018),
+    # Pseudo-ops: one word each, except dw (one per operand)
+    'banksel': ('banksel', 0x0020), 'pagesel': ('pagesel', 0x3180), 'dw': ('dw', 0),
+})
+_DIRECTIVES = frozenset(['equ', 'end', 'org'])
+
+_MM = {'++': 0, '--': 1}
+_FSR_MM = re.compile(r'^(\+\+|--)?\s*(\w+)\s*(\+\+|--)?$')
+_FSR_K = re.compile(r'^(.*)\[\s*(\w+)\s*\]$')
+_LABEL = re.compile(r'^([A-Za-z_]\w*)\s*:')
+_NUMBERS = (
+    (re.compile(r"\b[hH]'([0-9A-Fa-f]+)'"), r'0x\1'),
+    (re.compile(r"\b[bB]'([01]+)'"), r'0b\1'),
+    (re.compile(r"\b[oO]'([0-7]+)'"), r'0o\1'),
+    (re.compile(r"\b[dD]'(\d+)'"), r'\1'),
+    (re.compile(r'(?<![\w.])\.(\d+)'), r'\1'),
+    (re.compile(r'(?<![\w.])0+(?=[1-9])'), ''),
+    (re.compile(r'(?<!/)/(?!/)'), '//'),
+)
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call,
+          ast.Add, ast.Sub, ast.Mult, ast.FloorDiv, ast.Mod, ast.LShift, ast.RShift,
+          ast.BitAnd, ast.BitOr, ast.BitXor, ast.Invert, ast.USub, ast.UAdd)
+_FUNCTIONS = {'high': lambda value: (value >> 8) & 0xFF, 'low': lambda value: value & 0xFF}
+_PC = '__pc__'
+_GLOBALS = {'__builtins__': {}}
+
+
+class _Scope(dict):
+    """Link-time names; device registers and bits fill in for undefined ones"""
+
+    def __missing__(self, name: str) -> int:
+        key = name.upper()
+        if key in SFR_ADDRESSES:
+            return SFR_ADDRESSES[key]
+        if key in BITS:
+            return BITS[key]
+        if key in DESTINATIONS:
+            return DESTINATIONS[key]
+        if name.lower() in _FUNCTIONS:
+            return _FUNCTIONS[name.lower()]
+        raise KeyError(name)
+
+
+def _expression(text: str, where: str):
+    """An int if text is constant, else a code object to evaluate at link time"""
+    source = text.strip().replace('$', _PC)
+    for pattern, replacement in _NUMBERS:
+        source = pattern.sub(replacement, source)
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError:
+        raise AsmError(f'{where}: bad expression {text.strip()!r}')
+    for node in ast.walk(tree):
+        if not isinstance(node, _NODES) or (isinstance(node, ast.Constant) and type(node.value) is not int):
+            raise AsmError(f'{where}: bad expression {text.strip()!r}')
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or len(node.args) != 1
+                                           or node.func.id.lower() not in _FUNCTIONS or node.keywords):
+            raise AsmError(f'{where}: bad expression {text.strip()!r}')
+    code = compile(tree, where, 'eval')
+    if not any(isinstance(node, ast.Name) for node in ast.walk(tree)):
+        return eval(code, _GLOBALS, _FUNCTIONS)
+    return code
+
+
+def _fsr_index(text: str, where: str) -> int:
+    """FSR0/FSR1, or the numbers gpdasm prints: 0/1 in moviw, 4/6 in addfsr"""
+    key = text.strip().upper()
+    if key in ('FSR0', 'INDF0'):
+        return 0
+    if key in ('FSR1', 'INDF1'):
+        return 1
+    try:
+        return {0: 0, 1: 1, 4: 0, 6: 1}[int(key, 0)]
+    except (ValueError, KeyError):
+        raise AsmError(f'{where}: expected FSR0 or FSR1, not {text.strip()!r}')
+
+
+def _split(text: str) -> List[str]:
+    """Operands separated by commas outside parentheses"""
+    operands, depth, start = [], 0, 0
+    for index, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            operands.append(text[start:index])
+            start = index + 1
+    operands.append(text[start:])
+    return [operand.strip() for operand in operands] if text.strip() else []
+
+
+def _strip_comment(line: str) -> str:
+    """Drop a ';' comment, leaving ';' inside quotes alone"""
+    quote = None
+    for index, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == ';':
+            return line[:index]
+    return line
+
+
+class Program:
+    """
+    Pass one: a parsed, sized source. Sizes never depend on symbol values,
+    so labels are offsets from the origin and link() can place the same
+    program anywhere.
+    """
+
+    def __init__(self, source: str, name: str = '<source>'):
+        self.name = name
+        self.statements: List[Statement] = []
+        self.labels: Dict[str, int] = {}
+        # EQU symbols in definition order (later ones may use earlier ones)
+        self.equates: Dict[str, object] = {}
+        self.size = 0
+        for number, line in enumerate(source.splitlines(), 1):
+            if self._parse(line, f'{name}:{number}'):
+                break
+
+    def _define(self, label: str, where: str):
+        if label in self.labels or label in self.equates:
+            raise AsmError(f'{where}: {label} is already defined')
+        self.labels[label] = self.size
+
+    def _parse(self, line: str, where: str) -> bool:
+        """Add one source line; True at 'end'"""
+        text = _strip_comment(line).rstrip()
+        if not text.strip():
+            return False
+        match = _LABEL.match(text.lstrip())
+        if match:
+            self._define(match.group(1), where)
+            text = ' ' + text.lstrip()[match.end():]
+        else:
+            fields = text.split(None, 2)
+            if len(fields) > 1 and fields[1].lower() == 'equ':
+                name = fields[0]
+                if name in self.labels or name in self.equates:
+                    raise AsmError(f'{where}: {name} is already defined')
+                self.equates[name] = _expression(fields[2] if len(fields) > 2 else '', where)
+                return False
+            # MPASM style: an unknown word in column 0 is a label
+            if not text[0].isspace() and fields[0].lower() not in OPCODES and fields[0].lower() not in _DIRECTIVES:
+                self._define(fields[0], where)
+                text = text[len(fields[0]):]
+        fields = text.split(None, 1)
+        if not fields:
+            return False
+        mnemonic = fields[0].lower()
+        operands = _split(fields[1]) if len(fields) > 1 else []
+        if mnemonic == 'end':
+            return True
+        if mnemonic == 'org':
+            raise AsmError(f'{where}: org is not supported; pass the origin to link()')
+        if mnemonic not in OPCODES:
+            raise AsmError(f'{where}: unknown mnemonic {fields[0]!r}')
+        kind, base = OPCODES[mnemonic]
+        self.statements.append(Statement(where, self.size, kind, base, self._operands(kind, operands, where)))
+        self.size += len(operands) if kind == 'dw' else 1
+        return False
+
+    def _operands(self, kind: str, operands: List[str], where: str) -> tuple:
+        """Parse operands as far as syntax allows; values wait for link()"""
+        counts = {'none': (0, 0), 'fd': (1, 2), 'fb': (2, 2), 'addfsr': (2, 2), 'fsr': (1, 1),
+                  'dw': (1, len(operands) or 1)}
+        low, high = counts.get(kind, (1, 1))
+        if not low <= len(operands) <= high:
+            raise AsmError(f'{where}: expected {low if low == high else f"{low}-{high}"} '
+                           f'operand{"s" if high != 1 else ""}, got {len(operands)}')
+        if kind == 'fsr':
+            match = _FSR_MM.match(operands[0])
+            if match and bool(match.group(1)) != bool(match.group(3)):
+                # ++FSRn, --FSRn, FSRn++, FSRn--
+                mode = _MM[match.group(1)] if match.group(1) else 2 + _MM[match.group(3)]
+                return ('mm', _fsr_index(match.group(2), where), mode)
+            match = _FSR_K.match(operands[0])
+            if not match:
+                raise AsmError(f'{where}: expected ++FSRn, FSRn--, k[FSRn] or the like, not {operands[0]!r}')
+            return ('k', _fsr_index(match.group(2), where), _expression(match.group(1) or '0', where))
+        if kind == 'addfsr':
+            return (_fsr_index(operands[0], where), _expression(operands[1], where))
+        if kind == 'fd' and len(operands) == 2 and operands[1].upper() in DESTINATIONS:
+            return (_expression(operands[0], where), DESTINATIONS[operands[1].upper()])
+        if kind == 'fd' and len(operands) == 1:
+            # MPASM's default destination is the file register
+            return (_expression(operands[0], where), 1)
+        return tuple(_expression(operand, where) for operand in operands)
+
+    def link(self, origin: int = 0, symbols: Optional[Dict[str, int]] = None) -> Assembly:
+        """Pass two: evaluate and encode at origin; symbols adds names (labels win)"""
+        scope = _Scope(symbols or {})
+        labels = {label: origin + offset for label, offset in self.labels.items()}
+        scope.update(labels)
+        where = self.name
+        try:
+            for name, value in self.equates.items():
+                scope[name] = _value(value, scope)
+            words: List[int] = []
+            entries = set(self.labels.values())
+            # Page PCLATH selects for goto/call; None: the instruction's own
+            page = None
+            for statement in self.statements:
+                where = statement.line
+                if statement.offset in entries:
+                    # Reachable from elsewhere, with PCLATH as the caller left it
+                    page = None
+                scope[_PC] = origin + statement.offset
+                if statement.kind == 'fsr':
+                    form, n, value = statement.operands
+                    values = [form, n, _value(value, scope)]
+                else:
+                    values = [_value(value, scope) for value in statement.operands]
+                pc = origin + statement.offset
+                words.extend(_ENCODERS[statement.kind](statement.base, values, pc, where))
+                if statement.kind == 'pagesel':
+                    page = values[0] >> 11
+                elif statement.kind == 'page':
+                    page = values[0] >> 3
+                elif statement.kind == 'addr':
+                    selected = pc >> 11 if page is None else page
+                    if values[0] >> 11 != selected:
+                        raise AsmError(f'{where}: target 0x{values[0]:04X} is on page {values[0] >> 11} '
+                                       f'but PCLATH selects page {selected} (pagesel the target first)')
+        except NameError as e:
+            raise AsmError(f'{where}: undefined symbol {e.name!r}')
+        except (TypeError, ZeroDivisionError) as e:
+            raise AsmError(f'{where}: {e}')
+        return Assembly(origin, words, labels)
+
+
+def _value(value, scope: _Scope) -> int:
+    return value if isinstance(value, int) else eval(value, _GLOBALS, scope)
+
+
+def _check(value: int, low: int, high: int, what: str, where: str) -> int:
+    if not isinstance(value, int) or not low <= value <= high:
+        raise AsmError(f'{where}: {what} {value!r} out of range {low:#x}..{high:#x}')
+    return value
+
+
+def _file(value: int, where: str) -> int:
+    """7-bit file operand of any banked address (banksel selects the bank)"""
+    return _check(value, 0, 0xFFF, 'file register', where) & 0x7F
+
+
+def _encode_fd(base, values, pc, where):
+    return [base | _check(values[1], 0, 1, 'destination', where) << 7 | _file(values[0], where)]
+
+
+def _encode_fb(base, values, pc, where):
+    return [base | _check(values[1], 0, 7, 'bit', where) << 7 | _file(values[0], where)]
+
+
+def _encode_k(base, values, pc, where):
+    return [base | _check(values[0], -0x80, 0xFF, 'literal', where) & 0xFF]
+
+
+def _encode_rel(base, values, pc, where):
+    offset = _check(values[0], 0, 0x7FFF, 'target', where) - (pc + 1)
+    if not -0x100 <= offset <= 0xFF:
+        raise AsmError(f'{where}: bra target 0x{values[0]:04X} is {offset} words away (limit -256..255)')
+    return [base | offset & 0x1FF]
+
+
+def _encode_fsr(base, values, pc, where):
+    form, n, value = values
+    if form == 'mm':
+        return [base | n << 2 | value]
+    # k[FSRn]: 0x3F00 for moviw, 0x3F80 for movwi
+    return [0x3F00 | (base & 0x08) << 4 | n << 6 | _check(value, -0x20, 0x1F, 'offset', where) & 0x3F]
+
+
+_ENCODERS: Dict[str, Callable[[int, list, int, str], List[int]]] = {
+    'none': lambda base, values, pc, where: [base],
+    'fd': _encode_fd,
+    'f': lambda base, values, pc, where: [base | _file(values[0], where)],
+    'tris': lambda base, values, pc, where: [base | _check(values[0], 5, 7, 'tris register', where)],
+    'fb': _encode_fb,
+    'k': _encode_k,
+    'addr': lambda base, values, pc, where: [base | _check(values[0], 0, 0x7FFF, 'target', where) & 0x7FF],
+    'rel': _encode_rel,
+    'bank': lambda base, values, pc, where: [base | _check(values[0], 0, 0x1F, 'bank', where)],
+    'page': lambda base, values, pc, where: [base | _check(values[0], 0, 0x7F, 'page', where)],
+    'addfsr': lambda base, values, pc, where: [base | values[0] << 6
+                                               | _check(values[1], -0x20, 0x1F, 'offset', where) & 0x3F],
+    'fsr': _encode_fsr,
+    'banksel': lambda base, values, pc, where: [base | _check(values[0], 0, 0xFFF, 'file register', where) >> 7],
+    'pagesel': lambda base, values, pc, where: [base | _check(values[0], 0, 0x7FFF, 'target', where) >> 8],
+    'dw': lambda base, values, pc, where: [_check(value, -0x2000, 0x3FFF, 'word', where) & 0x3FFF
+                                           for value in values],
+}
+
+
+@lru_cache(maxsize=256)
+def parse(source: str, name: str = '<source>') -> Program:
+    """Pass one, cached: rebuilding a section at a new address only links"""
+    return Program(source, name)
+
+
+def assemble(source: str, origin: int = 0, symbols: Optional[Dict[str, int]] = None,
+             name: str = '<source>') -> Assembly:
+    """Assemble source at origin; symbols supplies EQU-like names from outside"""
+    return parse(source, name).link(origin, symbols)
+
+
+def listing(assembly: Assembly) -> str:
+    """gpdasm-style listing of an assembly, with its labels"""
+    at: Dict[int, List[str]] = {}
+    for label, address in assembly.labels.items():
+        at.setdefault(address, []).append(label)
+    lines = []
+    for offset, word in enumerate(assembly.words):
+        address = assembly.origin + offset
+        for label in at.get(address, ()):
+            lines.append(f'{label}:')
+        lines.append(format_line(address, word))
+    return '\n'.join(lines) + '\n'
+
+
+def _parse_symbol(text: str) -> Tuple[str, int]:
+    name, _, value = text.partition('=')
+    return name.strip(), int(value, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Assemble PIC16F1704 patch source')
+    parser.add_argument('source', help='Assembly source file')
+    parser.add_argument('--origin', type=lambda s: int(s, 0), default=0, help='Word address of the first word')
+    parser.add_argument('-D', '--define', action='append', default=[], type=_parse_symbol, metavar='NAME=VALUE',
+                        help='Define a symbol (repeatable)')
+    parser.add_argument('--patch', metavar='HEX', help='Write the words into a copy of this image')
+    parser.add_argument('-o', '--output', help='Patched image to write (with --patch)')
+
+    args = parser.parse_args()
+
+    with open(args.source) as f:
+        source = f.read()
+    try:
+        assembly = assemble(source, args.origin, dict(args.define), args.source)
+    except AsmError as e:
+        raise SystemExit(f'error: {e}')
+    end = args.origin + len(assembly.words)
+    if end > PROGRAM_WORDS:
+        raise SystemExit(f'error: {len(assembly.words)} words at 0x{args.origin:04X} run past the end of flash')
+    print(listing(assembly), end='')
+    print(f"; {len(assembly.words)} words at 0x{args.origin:04X}-0x{end - 1:04X}")
+
+    if args.patch:
+        if not args.output:
+            raise SystemExit('error: --patch needs -o/--output')
+        hex_data = IntelHex(args.patch)
+        hex_data.set_words(args.origin, assembly.words)
+        hex_data.save(args.output)
+        print(f"Patched image saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Batched Simulation
+Runs many instances of one image side by side, for fleet-level questions
+(thousands of supplies with different loads on the same firmware). The data
+memory and return stack of every instance are rows of NumPy arrays, and the
+instances standing at the same PC execute that instruction together as
+array operations. Anything the vector path does not model, or that differs
+per instance (a hooked peripheral register, a pending event or interrupt,
+Sleep, the stack limits), falls back to that instance's own simulator for
+one instruction; the simulator works on the same rows, so nothing is copied.
+Instances on the same code path run at near-vector throughput, and a
+divergent one only costs its own scalar steps.
+"""
+
+import time
+import argparse
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pic_disasm import (FORM_ADDFSR, FORM_ADDR, FORM_BANK, FORM_FB, FORM_FD, FORM_FSR_K,
+                        FORM_FSR_MM, FORM_K, FORM_PAGE, FORM_REL, OPCODE_TABLE, PROGRAM_WORDS,
+                        IntelHex)
+from pic_periph import PORTS, Peripherals, SystemState
+from pic_sim import (_ALU, _FLAG_UPDATES, _LITERAL_ALU, _PLAIN_WRITES, _READ_SPECIAL, BSR, DATA_SIZE,
+                     FSR0L, FSR_MAP, GIE, INDF0, INDF1, INTCON, PC_MASK, PCLATH, STATUS, WREG,
+                     PICSimulator)
+from pic_wcet import image_fosc
+
+# Instances at one PC needed before the PC is run as a vector; smaller groups step one by one
+MIN_GROUP = 4
+# Cycles per lockstep round of run()
+QUANTUM = 2000
+# Stands for "no pending event"
+_NEVER = 1 << 62
+# STKPTR as a data memory index, and the stack pointer value when empty / full
+_STKPTR = 4077
+_STACK_EMPTY, _STACK_FULL = 31, 16
+
+
+class _RowSimulator(PICSimulator):
+    """
+    One instance's core. Data memory and the return stack are views of the
+    batch's rows; fast code is translated on first use only, so thousands of
+    instances stay cheap to build.
+    """
+
+    def __init__(self, hex_data: IntelHex, fosc: int, ram_row: np.ndarray, stack_row: np.ndarray):
+        super().__init__(hex_data, fosc)
+        ram_row[:] = np.frombuffer(self.ram, np.uint8)
+        stack_row[:] = np.frombuffer(self.stack, np.uint16)
+        self.ram = memoryview(ram_row)
+        self.stack = memoryview(stack_row)
+        self._defaults = (self.ram, self.stack, self.rh, self.wh, self.ah, FSR_MAP, self)
+        # Program flash changed: this instance no longer runs the batch's code
+        self.diverged = False
+
+    def _route(self, pc: int):
+        if pc in self.breakpoints or pc in self.idle_heads:
+            self.code[pc] = lambda: ~pc
+        elif pc in self.probes:
+            self.code[pc] = self._probed(pc)
+        else:
+            self.code[pc] = None
+
+    def write_flash(self, address: int, word: int):
+        super().write_flash(address, word)
+        self.diverged = True
+
+    def _run_fast(self, limit: int):
+        code = self.code
+        cost = self.cost
+        pc = self.pc
+        cycle = self.cycle
+        count = 0
+        while cycle < limit:
+            op = code[pc]
+            if op is None:
+                op = code[pc] = self._function(pc, False)
+            next_pc = op()
+            if next_pc == pc + 1:
+                cycle += cost[pc]
+            elif next_pc >= 0:
+                cycle += 2
+            else:
+                break
+            pc = next_pc
+            count += 1
+        self.pc = pc
+        self.cycle = cycle
+        self.executed += count
+        if cycle < limit:
+            self.step()
+
+
+class _Status:
+    """ram[3] for the rows of a group, as the pic_sim ALU templates use it"""
+
+    __slots__ = ('ram', 'rows')
+
+    def __init__(self, ram: np.ndarray, rows: np.ndarray):
+        self.ram = ram
+        self.rows = rows
+
+    def __getitem__(self, address: int) -> np.ndarray:
+        return self.ram[self.rows, address].astype(np.int32)
+
+    def __setitem__(self, address: int, value: np.ndarray):
+        self.ram[self.rows, address] = value
+
+
+def _alu_function(name: str) -> Callable:
+    """pic_sim's ALU template for name as a function of (v, w, ram) -> r over arrays"""
+    lines, flags = _ALU[name]
+    body = list(lines)
+    if flags:
+        body.append(_FLAG_UPDATES[flags])
+    namespace = {}
+    exec("def alu(v, w, ram):\n" + ''.join(f'    {line}\n' for line in body) + "    return r\n", namespace)
+    return namespace['alu']
+
+
+_ALU_FUNCTIONS = {name: _alu_function(name) for name in _ALU}
+
+# An op takes the rows at its PC and returns (mask of rows executed or None
+# for all, next PC of the executed rows); None in the table means always scalar
+VectorOp = Callable[[np.ndarray], Tuple[Optional[np.ndarray], object]]
+
+
+class BatchSimulator:
+    """Instances of one image as NumPy rows, run in lockstep rounds"""
+
+    def __init__(self, hex_data: IntelHex, count: int, fosc: Optional[int] = None, min_group: int = MIN_GROUP):
+        self.count = count
+        self.fosc = fosc or image_fosc(hex_data)
+        self.min_group = min_group
+        self.ram = np.zeros((count, DATA_SIZE + 1), np.uint8)
+        self.stack = np.zeros((count, 32), np.uint16)
+        self.systems: List[Peripherals] = []
+        for row in range(count):
+            sim = _RowSimulator(hex_data, self.fosc, self.ram[row], self.stack[row])
+            self.systems.append(Peripherals(sim, idle_skip=False))
+        self.pc = np.zeros(count, np.int64)
+        self.cycle = np.zeros(count, np.int64)
+        self.executed = np.zeros(count, np.int64)
+        # Cycle of each instance's next event; must take the scalar path
+        self.due = np.full(count, _NEVER, np.int64)
+        self.scalar = np.zeros(count, bool)
+        # Watchdog per instance: pending timeout event (-1: none) and period (-1: off),
+        # and the cycle of a clrwdt run on the vector path but not yet told to the simulator
+        self.wdt_due = np.full(count, -1, np.int64)
+        self.wdt_period = np.full(count, -1, np.int64)
+        self.kicked = np.full(count, -1, np.int64)
+        self.time = 0
+        template = self.systems[0].sim
+        self.flash = np.frombuffer(template.flash, np.uint16)
+        self.cost = np.frombuffer(template.cost, np.uint8).astype(np.int64)
+        self.fmap = np.frombuffer(FSR_MAP, np.uint16).astype(np.intp)
+        self.rh = np.zeros(DATA_SIZE + 1, bool)
+        self.wh = np.zeros(DATA_SIZE + 1, bool)
+        self.ah = np.zeros(DATA_SIZE + 1, bool)
+        self.forced = np.zeros(PROGRAM_WORDS, bool)
+        self._ops: Dict[int, Optional[VectorOp]] = {}
+        self.vector_instructions = 0
+        self.vector_groups = 0
+        self.scalar_instructions = 0
+        for row in range(count):
+            self._pull(row)
+        self.sync()
+
+    @classmethod
+    def from_state(cls, state: SystemState, count: int, min_group: int = MIN_GROUP) -> 'BatchSimulator':
+        """count instances, all in a saved state (see pic_snapshot.warm_state)"""
+        batch = cls(state.hex_data, count, state.fosc, min_group)
+        for row, system in enumerate(batch.systems):
+            system.restore(state)
+            batch._pull(row)
+        batch.time = int(batch.cycle.max())
+        batch.sync()
+        return batch
+
+    # -- bookkeeping ------------------------------------------------------
+    def sync(self):
+        """Take up hooks, breakpoints and probes added to the instances' simulators"""
+        sims = [system.sim for system in self.systems]
+        self.rh[:] = np.frombuffer(sims[0].rh, np.uint8)
+        self.wh[:] = np.frombuffer(sims[0].wh, np.uint8)
+        for sim in sims[1:]:
+            self.rh |= np.frombuffer(sim.rh, np.uint8).astype(bool)
+            self.wh |= np.frombuffer(sim.wh, np.uint8).astype(bool)
+        self.ah[:] = self.rh | self.wh
+        self.forced[:] = False
+        for sim in sims:
+            for pc in (*sim.breakpoints, *sim.probes, *sim.idle_heads):
+                self.forced[pc] = True
+        # Word changes and hook layouts alter what an op may do
+        self._ops.clear()
+
+    def _pull(self, row: int):
+        """Copy an instance's core position in after it ran on its own simulator"""
+        sim = self.systems[row].sim
+        self.pc[row], self.cycle[row], self.executed[row] = sim.pc, sim.cycle, sim.executed
+        self.due[row] = sim.events[0][0] if sim.events else _NEVER
+        self.scalar[row] = sim.sleeping or sim.diverged or \
+            bool(sim.ram[INTCON] & GIE and sim.interrupt_requested())
+        event = sim._wdt_event
+        self.wdt_due[row] = event[0] if event is not None and event[2] is not None else -1
+        self.wdt_period[row] = -1 if sim._wdt_period is None else sim._wdt_period
+
+    def _push(self, row: int) -> PICSimulator:
+        sim = self.systems[row].sim
+        if self.kicked[row] >= 0:
+            sim.clrwdt(int(self.kicked[row]))
+            self.kicked[row] = -1
+        sim.pc, sim.cycle, sim.executed = int(self.pc[row]), int(self.cycle[row]), int(self.executed[row])
+        return sim
+
+    def instance(self, row: int) -> Peripherals:
+        """An instance's system, brought up to date for inspection or save()"""
+        self._push(row)
+        return self.systems[row]
+
+    # -- scalar path ------------------------------------------------------
+    def _step(self, row: int, end: int):
+        """One instruction (or a Sleep stretch up to the next event) on the instance's simulator"""
+        sim = self._push(row)
+        executed = sim.executed
+        cycles = 1
+        if sim.sleeping:
+            wake = sim.events[0][0] if sim.events else end
+            cycles = max(1, min(wake, end) - sim.cycle)
+        sim.run(cycles)
+        self.scalar_instructions += sim.executed - executed
+        self._pull(row)
+
+    # -- vector path ------------------------------------------------------
+    def _resolve(self, f: int, mode: str) -> Optional[Callable]:
+        """
+        Address of file register f for a group: (address or array, mask of
+        rows not hooked or None); None if f always needs the scalar path.
+        Mirrors the fast code of pic_sim.
+        """
+        ram, fmap = self.ram, self.fmap
+        flags = {'r': self.rh, 'w': self.wh, 'rw': self.ah}[mode]
+        if 0x0C <= f < 0x70:
+            def banked(rows):
+                address = ram[rows, BSR].astype(np.intp) << 7 | f
+                return address, ~flags[address]
+            return banked
+        if f >= 0x70:
+            return lambda rows: (f, None)
+        if f in (INDF0, INDF1):
+            low = FSR0L + 2 * f
+
+            def indirect(rows):
+                address = fmap[ram[rows, low].astype(np.intp) | ram[rows, low + 1].astype(np.intp) << 8]
+                return address, ~flags[address]
+            return indirect
+        if (mode == 'r' and f not in _READ_SPECIAL) or f in _PLAIN_WRITES:
+            return lambda rows: (f, None)
+        return None
+
+    def _push_return(self, rows: np.ndarray, value: int) -> np.ndarray:
+        """Push value on each row's stack; mask of rows that had room"""
+        ram = self.ram
+        pointer = (ram[rows, _STKPTR].astype(np.intp) + 1) & 31
+        ok = pointer != _STACK_FULL
+        rows, pointer = rows[ok], pointer[ok]
+        self.stack[rows, pointer] = value
+        ram[rows, _STKPTR] = pointer
+        return ok
+
+    def _pop_return(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Pop each row's stack; (mask of rows with something to pop, return addresses)"""
+        ram = self.ram
+        pointer = ram[rows, _STKPTR].astype(np.intp)
+        ok = pointer != _STACK_EMPTY
+        rows, pointer = rows[ok], pointer[ok]
+        ram[rows, _STKPTR] = (pointer - 1) & 31
+        return ok, self.stack[rows, pointer].astype(np.int64)
+
+    def _compile(self, pc: int) -> Optional[VectorOp]:
+        """The vector form of the instruction at pc"""
+        opcode = OPCODE_TABLE[int(self.flash[pc])]
+        name, form, arg, arg2 = opcode.mnemonic, opcode.form, opcode.arg, opcode.arg2
+        ram = self.ram
+        following, skip = (pc + 1) & PC_MASK, (pc + 2) & PC_MASK
+
+        def filtered(resolve):
+            """Wrap an op body f(rows, address) with address resolution and hook filtering"""
+            def wrap(body):
+                def op(rows):
+                    address, ok = resolve(rows)
+                    if ok is not None:
+                        rows, address = rows[ok], address[ok]
+                    return ok, body(rows, address)
+                return op
+            return wrap
+
+        if form == FORM_FD:
+            resolve = self._resolve(arg, 'rw' if arg2 else 'r')
+            if resolve is None:
+                return None
+            alu = _ALU_FUNCTIONS[name]
+
+            @filtered(resolve)
+            def op(rows, address):
+                r = alu(ram[rows, address].astype(np.int32), ram[rows, WREG].astype(np.int32), _Status(ram, rows))
+                ram[rows, address if arg2 else WREG] = r
+                if name in ('decfsz', 'incfsz'):
+                    return np.where(r == 0, skip, following)
+                return following
+            return op
+
+        if form == FORM_FB:
+            mask = 1 << arg2
+            resolve = self._resolve(arg, 'rw' if name in ('bcf', 'bsf') else 'r')
+            if resolve is None:
+                return None
+            if name in ('bcf', 'bsf'):
+                @filtered(resolve)
+                def op(rows, address):
+                    value = ram[rows, address]
+                    ram[rows, address] = value & (0xFF ^ mask) if name == 'bcf' else value | mask
+                    return following
+                return op
+            taken, fall = (skip, following) if name == 'btfss' else (following, skip)
+
+            @filtered(resolve)
+            def op(rows, address):
+                return np.where(ram[rows, address] & mask, taken, fall)
+            return op
+
+        if name in ('movwf', 'clrf'):
+            resolve = self._resolve(arg, 'w')
+            if resolve is None:
+                return None
+
+            @filtered(resolve)
+            def op(rows, address):
+                if name == 'movwf':
+                    ram[rows, address] = ram[rows, WREG]
+                else:
+                    ram[rows, address] = 0
+                    ram[rows, STATUS] |= 4
+                return following
+            return op
+
+        def plain(body):
+            """An op that no row can bail out of"""
+            return lambda rows: (None, body(rows))
+
+        if name == 'clrw':
+            def clrw(rows):
+                ram[rows, WREG] = 0
+                ram[rows, STATUS] |= 4
+                return following
+            return plain(clrw)
+        if form == FORM_K:
+            if name == 'movlw':
+                def movlw(rows):
+                    ram[rows, WREG] = arg
+                    return following
+                return plain(movlw)
+            if name == 'retlw':
+                def retlw(rows):
+                    ok, targets = self._pop_return(rows)
+                    ram[rows[ok], WREG] = arg
+                    return ok, targets
+                return retlw
+            alu = _ALU_FUNCTIONS[_LITERAL_ALU[name]]
+
+            def literal(rows):
+                ram[rows, WREG] = alu(arg, ram[rows, WREG].astype(np.int32), _Status(ram, rows))
+                return following
+            return plain(literal)
+        if form == FORM_ADDR:
+            def absolute(rows):
+                ok = None
+                if name == 'call':
+                    ok = self._push_return(rows, following)
+                    rows = rows[ok]
+                return ok, ram[rows, PCLATH].astype(np.int64) << 8 & 2048 | arg
+            return absolute
+        if form == FORM_REL:
+            target = (pc + 1 + arg) & PC_MASK
+            return plain(lambda rows: target)
+        if form in (FORM_BANK, FORM_PAGE):
+            register = BSR if form == FORM_BANK else PCLATH
+
+            def select(rows):
+                ram[rows, register] = arg
+                return following
+            return plain(select)
+        if form == FORM_ADDFSR:
+            low = FSR0L + 2 * arg2
+
+            def addfsr(rows):
+                value = (ram[rows, low].astype(np.int64) | ram[rows, low + 1].astype(np.int64) << 8) + arg & 65535
+                ram[rows, low] = value & 255
+                ram[rows, low + 1] = value >> 8
+                return following
+            return plain(addfsr)
+        if form in (FORM_FSR_MM, FORM_FSR_K):
+            return self._compile_indirect(name, form, arg, arg2, following)
+        if name == 'return':
+            return self._pop_return
+        if name == 'callw':
+            def callw(rows):
+                ok = self._push_return(rows, following)
+                rows = rows[ok]
+                return ok, (ram[rows, PCLATH].astype(np.int64) << 8 | ram[rows, WREG]) & 4095
+            return callw
+        if name == 'brw':
+            return plain(lambda rows: (pc + 1 + ram[rows, WREG].astype(np.int64)) & 4095)
+        if name in ('nop', 'dw'):
+            return plain(lambda rows: following)
+        if name == 'clrwdt':
+            return self._clrwdt
+        # retfie, sleep, reset, option, tris
+        return None
+
+    def _clrwdt(self, rows: np.ndarray) -> Tuple[np.ndarray, int]:
+        """
+        clrwdt where the pending timeout stays in place (the usual main-loop
+        case): only the deadline moves, and the simulator learns it lazily.
+        """
+        period, due = self.wdt_period[rows], self.wdt_due[rows]
+        ok = (period < 0) | ((due >= 0) & (due <= self.cycle[rows] + period))
+        rows = rows[ok]
+        self.ram[rows, STATUS] |= 0x18
+        self.kicked[rows] = self.cycle[rows]
+        return ok, (int(self.pc[rows[0]]) + 1) & PC_MASK if len(rows) else 0
+
+    def _compile_indirect(self, name: str, form: int, arg: int, arg2: int, following: int) -> VectorOp:
+        """moviw/movwi through FSRn, with pre/post increment/decrement or an offset"""
+        ram, fmap = self.ram, self.fmap
+        write = name == 'movwi'
+        flags = self.wh if write else self.rh
+        low = FSR0L + 2 * arg2
+        mode, step = (arg, 1 if arg in (0, 2) else -1) if form == FORM_FSR_MM else (None, 0)
+
+        def op(rows):
+            fsr = ram[rows, low].astype(np.int64) | ram[rows, low + 1].astype(np.int64) << 8
+            if mode is None:
+                fsr = fsr + arg & 65535
+            elif mode < 2:
+                fsr = fsr + step & 65535
+            address = fmap[fsr]
+            ok = ~flags[address]
+            rows, fsr, address = rows[ok], fsr[ok], address[ok]
+            if mode is not None:
+                updated = fsr + step & 65535 if mode >= 2 else fsr
+                ram[rows, low] = updated & 255
+                ram[rows, low + 1] = updated >> 8
+            if write:
+                ram[rows, address] = ram[rows, WREG]
+            else:
+                value = ram[rows, address]
+                ram[rows, WREG] = value
+                ram[rows, STATUS] = ram[rows, STATUS] & 251 | (value == 0).astype(np.uint8) << 2
+            return ok, following
+        return op
+
+    def _vector(self, pc: int, rows: np.ndarray):
+        """Execute the instruction at pc for rows; rows that cannot go scalar"""
+        if pc not in self._ops:
+            self._ops[pc] = self._compile(pc)
+        op = self._ops[pc]
+        if op is None:
+            self.forced[pc] = True
+            return
+        ok, targets = op(rows)
+        if ok is not None:
+            self.scalar[rows[~ok]] = True
+            rows = rows[ok]
+        following = (pc + 1) & PC_MASK
+        self.cycle[rows] += np.where(np.asarray(targets) == following, self.cost[pc], 2)
+        self.pc[rows] = targets
+        self.executed[rows] += 1
+        self.vector_instructions += len(rows)
+        self.vector_groups += 1
+
+    # -- driver -----------------------------------------------------------
+    def run(self, cycles: int, quantum: int = QUANTUM) -> int:
+        """Advance every instance by cycles, in lockstep rounds of a quantum"""
+        end = self.time + cycles
+        while self.time < end:
+            self.time = min(end, self.time + quantum)
+            self._round(self.time)
+        return self.time
+
+    def _round(self, end: int):
+        """Run every instance up to end"""
+        forced, scalar, min_group = self.forced, self.scalar, self.min_group
+        while True:
+            active = self.cycle < end
+            if not active.any():
+                return
+            pcs = self.pc
+            alone = active & (scalar | (self.cycle >= self.due) | forced[pcs])
+            for row in np.flatnonzero(alone):
+                self._step(row, end)
+            rows = np.flatnonzero(active & ~alone)
+            if not len(rows):
+                continue
+            counts = np.bincount(pcs[rows], minlength=PROGRAM_WORDS)
+            best = int(counts.argmax())
+            if counts[best] < min_group:
+                # Nothing worth a vector: every remaining instance steps on its own
+                for row in rows:
+                    self._step(row, end)
+                continue
+            self._vector(best, rows[pcs[rows] == best])
+
+    # -- results ----------------------------------------------------------
+    def outcomes(self) -> Dict[tuple, List[int]]:
+        """Instances grouped by PWM outputs, port levels and reset count"""
+        groups: Dict[tuple, List[int]] = {}
+        for row, system in enumerate(self.systems):
+            pwm = tuple(sorted((pin, round(duty, 4)) for pin, (_, duty) in system.pwm.outputs.items()))
+            levels = tuple(int(self.ram[row, registers[0]]) for registers in PORTS.values())
+            resets = sum(1 for _, cause in system.sim.resets if cause != 'power-on')
+            groups.setdefault((pwm, levels, resets), []).append(row)
+        return groups
+
+
+def _volts(text: str) -> List[float]:
+    return [float(part) for part in text.split(':')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many instances of a PIC16F1704 image as NumPy batches')
+    parser.add_argument('hex_file', help='Image to run')
+    parser.add_argument('--instances', type=int, default=256, help='Instances in the batch')
+    parser.add_argument('--ms', type=float, default=20.0, help='Simulated time to run the batch')
+    parser.add_argument('--boot-seconds', type=float, default=1.5,
+                        help='Boot one instance this long and start every instance from its snapshot (0: power-on)')
+    parser.add_argument('--adc', metavar='CH=V0[:V1]', help='Spread an ADC input across the instances, e.g. 2=0.5:3.0')
+    parser.add_argument('--min-group', type=int, default=MIN_GROUP, help='Smallest same-PC group run as a vector')
+    parser.add_argument('--check', type=int, default=0, help='Rerun this many instances on their own and compare')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    state = None
+    if args.boot_seconds:
+        from pic_snapshot import warm_state
+        state = warm_state(args.hex_file, args.boot_seconds)
+        batch = BatchSimulator.from_state(state, args.instances, args.min_group)
+    else:
+        hex_data = IntelHex()
+        hex_data.load(args.hex_file)
+        batch = BatchSimulator(hex_data, args.instances, min_group=args.min_group)
+    levels = [None] * args.instances
+    if args.adc:
+        text, _, volts = args.adc.partition('=')
+        channel, points = int(text, 0), _volts(volts)
+        for row, system in enumerate(batch.systems):
+            levels[row] = points[0] + (points[-1] - points[0]) * row / max(1, args.instances - 1)
+            system.adc.set_voltage(channel, levels[row])
+    built = time.perf_counter() - start
+
+    cycles = int(args.ms * batch.fosc / 4000)
+    start = time.perf_counter()
+    batch.run(cycles)
+    elapsed = time.perf_counter() - start
+    total = batch.vector_instructions + batch.scalar_instructions
+    print(f"{args.hex_file}: {args.instances} instances, {args.ms:g} ms each from cycle {batch.time - cycles}, "
+          f"built in {built:.2f} s")
+    print(f"  {total} instructions in {elapsed:.2f} s ({total / elapsed / 1e6 if elapsed else 0:.2f} M/s), "
+          f"{batch.vector_instructions / max(1, total) * 100:.1f}% vectorized, "
+          f"{batch.vector_instructions / max(1, batch.vector_groups):.1f} instances per vector step")
+    for (pwm, ports, resets), rows in sorted(batch.outcomes().items(), key=lambda item: item[1][0]):
+        duties = ', '.join(f'{pin} {duty * 100:.1f}%' for pin, duty in pwm) or 'no PWM'
+        port_text = ' '.join(f'PORT{port}=0x{level:02X}' for port, level in zip(PORTS, ports))
+        span = f'#{rows[0]}' if len(rows) == 1 else f'#{rows[0]}..#{rows[-1]}'
+        print(f"  {len(rows):>5} x {span}: {port_text}, {duties}{f', {resets} resets' if resets else ''}")
+
+    if args.check:
+        from pic_periph import load_system
+        from pic_snapshot import fork
+        mismatched = 0
+        start = time.perf_counter()
+        checked = np.linspace(0, args.instances - 1, min(args.check, args.instances)).astype(int)
+        for row in checked:
+            system = fork(state) if state else load_system(args.hex_file, blocks=False, idle_skip=False)
+            if args.adc:
+                system.adc.set_voltage(channel, levels[row])
+            sim = system.sim
+            while sim.cycle < batch.time:
+                sim.run(batch.time - sim.cycle)
+            same = (sim.pc, sim.cycle, bytes(sim.ram)) == (int(batch.pc[row]), int(batch.cycle[row]),
+                                                           batch.ram[row].tobytes())
+            mismatched += not same
+        alone = (time.perf_counter() - start) / len(checked)
+        print(f"  Check: {len(checked) - mismatched}/{len(checked)} instances identical to a scalar run; "
+              f"scalar {alone:.2f} s per instance, batch {elapsed / args.instances:.4f} s per instance")
+        raise SystemExit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
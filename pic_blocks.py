@@ -0,0 +1,896 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Block Translation Cache
+Execution engine for the simulator that translates hot code into Python
+functions one region at a time. A region starts at a frequently dispatched
+address and inlines straight-line code, both sides of skips (merged again
+where short diamonds rejoin), static gotos, calls and returns, and loops
+back to its entry as a while loop. Successive regions chain through the
+dispatch loop without returning to the interpreter. W and STATUS live in
+locals, literals in W are folded into the code, BSR and PCLATH are tracked
+statically behind an entry guard, and the region only runs when its
+worst-case cycle count fits before the next event, so interrupts and
+peripherals stay cycle exact. Regions are dropped when the flash under them
+is rewritten.
+
+Translation costs a few milliseconds per region, so short runs are
+dominated by it. Measured on V71 with its peripherals attached and no idle
+skip (CPython 3.11): the interpreter runs about 1.5-1.8 MIPS; the block
+cache about 3.5 MIPS over the first 6M cycles while it translates (~80
+regions, ~100 by 12M cycles) and about 14 MIPS once translated. On the bare
+core (the CLI below) the block cache runs 6.5-7.5 MIPS over the first 6M
+cycles and 16-17 MIPS translated.
+"""
+
+import re
+import copy
+import time
+import hashlib
+import argparse
+from collections import OrderedDict
+from types import FunctionType
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pic_disasm import (FORM_ADDFSR, FORM_ADDR, FORM_BANK, FORM_FB, FORM_FD, FORM_FSR_K,
+                        FORM_FSR_MM, FORM_K, FORM_PAGE, FORM_REL, OPCODE_TABLE, PROGRAM_WORDS,
+                        IntelHex)
+from pic_sim import (_ALU, _LITERAL_ALU, FSR0L, FSR_MAP, PC_MASK, PICSimulator,
+                     BSR, PCLATH, STATUS, WREG)
+
+# Dispatches of an address before it is translated; code that runs only a
+# few hundred times (init, rare branches) costs less interpreted than
+# translated. At most 255 (heat is a bytearray).
+HOT_THRESHOLD = 250
+# Instructions emitted per region, and nested conditionals per path
+MAX_REGION = 400
+MAX_NESTING = 60
+# Instructions per path, tried longest first until the region fits MAX_REGION;
+# shorter paths keep both sides of early branches inside the region
+PATH_LIMITS = (64, 40, 24)
+# Instructions per side of a branch that is merged back into one path
+MAX_SIDE = 8
+# Instructions that end a straight run of code
+_CONTROL = frozenset(['btfsc', 'btfss', 'decfsz', 'incfsz', 'goto', 'call', 'callw', 'brw',
+                      'return', 'retlw', 'retfie', 'sleep', 'reset'])
+# Entry-guard misses tolerated before a region is rebuilt without them
+MAX_GUARD_MISSES = 32
+
+_REGION_ARGS = ('budget', 'now', 'ram', 'stk', 'rh', 'wh', 'ah', 'xr', 'xw', 'fmap', 'sim',
+                'kick', 'single', 'miss')
+# Translated regions shared by simulators running the same image and hooks,
+# least recently used first; V71 with its peripherals translates ~100
+REGION_CACHE_SIZE = 2048
+_REGION_CACHE: OrderedDict = OrderedDict()
+
+# Region code keeps W and STATUS in locals
+_LOCAL_ALU = {
+    name: ([line.replace('ram[3]', 'st') for line in lines], flags)
+    for name, (lines, flags) in _ALU.items()
+}
+# Operations that only touch Z compute their result in one expression
+_Z_EXPRESSIONS = {
+    'movf': '{}', 'andwf': '{} & w', 'iorwf': '{} | w', 'xorwf': '{} ^ w',
+    'comf': '{} ^ 255', 'decf': '{} - 1 & 255', 'incf': '{} + 1 & 255',
+    'decfsz': '{} - 1 & 255', 'incfsz': '{} + 1 & 255',
+}
+# STATUS bits kept when an operation writes its carry flags (Z is handled lazily)
+_CARRY_KEEP = {7: 252, 5: 254, 1: 254}
+
+_W_NAME = re.compile(r'\bw\b')
+_V_NAME = re.compile(r'\bv\b')
+_N_NAME = re.compile(r'\bn\b')
+
+# Z flag states along a path: materialised in st, pending in z (set when z is
+# zero), or known to be set
+Z_STATUS, Z_LOCAL, Z_SET = range(3)
+
+
+class _Overflow(Exception):
+    """Region outgrew MAX_REGION"""
+
+
+class _Exit:
+    """Region exit, rendered once it is known whether the region loops"""
+
+    def __init__(self, pc: str, cycles: int, count: int):
+        self.pc = pc
+        self.cycles = cycles
+        self.count = count
+
+
+class _Continue:
+    """Back edge to the region entry"""
+
+    def __init__(self, cycles: int, count: int):
+        self.cycles = cycles
+        self.count = count
+
+
+class _Path:
+    """
+    Statically known state along one path through a region. BSR, PCLATH and
+    literals loaded into W are only stored when the path leaves the region or
+    something reads them (the dirty flags); until then W is folded into the
+    code as a constant. Z is only folded into st when needed.
+    """
+
+    def __init__(self, bsr: Optional[int], pclath: Optional[int]):
+        self.bsr = bsr
+        self.pclath = pclath
+        self.w: Optional[int] = None
+        self.bsr_dirty = False
+        self.pclath_dirty = False
+        self.w_dirty = False
+        self.z = Z_STATUS
+        self.calls: Tuple[int, ...] = ()
+        self.cycles = 0
+        self.count = 0
+        # Worst-case cycles beyond `cycles` taken by merged branches at run time
+        self.slack = 0
+        self.depth = 0
+        self.length = 0
+
+    def fork(self) -> '_Path':
+        path = copy.copy(self)
+        path.depth += 1
+        return path
+
+
+class _RegionBuilder:
+    """Emits the Python source of one region"""
+
+    def __init__(self, sim: PICSimulator, entry: int, bsr: Optional[int], pclath: Optional[int],
+                 path_limit: int):
+        self.flash = sim.flash
+        self.rh, self.wh = sim.rh, sim.wh
+        # Breakpoints and idle-loop heads must be reached through step(),
+        # probed instructions through the per-instruction table
+        self.stops = sim.breakpoints | sim.idle_heads | set(sim.probes)
+        self.entry = entry
+        self.bsr = bsr
+        self.pclath = pclath
+        self.path_limit = path_limit
+        self.remaining = MAX_REGION
+        # Give up as soon as the region outgrows MAX_REGION (a shorter path limit follows)
+        self.strict = path_limit != PATH_LIMITS[-1]
+        self.lines: List[Tuple[int, object]] = []
+        self.covered: Set[int] = set()
+        self.on_path: Set[int] = set()
+        self.loops = False
+        # cy/ic hold cycles and instructions not known statically
+        self.counters = False
+        self.max_cycles = 0
+
+    # -- emission helpers ------------------------------------------------
+    def _emit(self, indent: int, text):
+        self.lines.append((indent, text))
+
+    def _sync(self, indent: int, path: _Path):
+        """Store deferred BSR, PCLATH, W and Z so data memory and locals are current"""
+        self._sync_w(indent, path)
+        if path.bsr_dirty:
+            self._emit(indent, f'ram[8] = {path.bsr}')
+            path.bsr_dirty = False
+        if path.pclath_dirty:
+            self._emit(indent, f'ram[10] = {path.pclath}')
+            path.pclath_dirty = False
+        self._sync_z(indent, path)
+
+    def _sync_w(self, indent: int, path: _Path):
+        if path.w_dirty:
+            self._emit(indent, f'w = {path.w}')
+            path.w_dirty = False
+
+    def _set_w(self, path: _Path, value: Optional[int]):
+        """W becomes a literal (emitted lazily) or an unknown value already in w"""
+        path.w = value
+        path.w_dirty = value is not None
+
+    def _fold(self, path: _Path, text: str) -> str:
+        """Substitute a known W into an expression; the compiler folds the constants"""
+        return text if path.w is None else _W_NAME.sub(str(path.w), text)
+
+    def _sync_z(self, indent: int, path: _Path):
+        if path.z == Z_LOCAL:
+            self._emit(indent, 'st = st & 251 | (z == 0) << 2')
+        elif path.z == Z_SET:
+            self._emit(indent, 'st |= 4')
+        path.z = Z_STATUS
+
+    def _exit(self, indent: int, pc, path: _Path, extra_cycles: int = 0):
+        # Exits may sit inside a bail check, so the path itself stays unsynced
+        self._sync(indent, copy.copy(path))
+        cycles = path.cycles + extra_cycles
+        self.max_cycles = max(self.max_cycles, cycles + path.slack)
+        self._emit(indent, _Exit(str(pc), cycles, path.count))
+
+    def _bail(self, indent: int, pc: int, path: _Path):
+        """Leave before pc so the simulator executes it exactly"""
+        self._exit(indent, ~pc, path)
+
+    def _address(self, indent: int, pc: int, path: _Path, f: int, mode: str) -> Optional[str]:
+        """Operand location for file register f, or None after emitting a bail"""
+        if 0x0C <= f < 0x70:
+            if path.bsr is not None:
+                address = (path.bsr << 7) | f
+                flags = {'r': self.rh[address], 'w': self.wh[address],
+                         'rw': self.rh[address] | self.wh[address]}[mode]
+                if flags:
+                    self._bail(indent, pc, path)
+                    return None
+                return f'ram[{address}]'
+            self._emit(indent, f'a = ram[8] << 7 | {f}')
+            self._emit(indent, f"if {dict(r='rh', w='wh', rw='ah')[mode]}[a]:")
+            self._bail(indent + 1, pc, path)
+            return 'ram[a]'
+        if f >= 0x70:
+            return f'ram[{f}]'
+        if f == WREG:
+            self._sync_w(indent, path)
+            self._set_w(path, None)
+            return 'w'
+        if f == STATUS:
+            if mode == 'r':
+                self._sync_z(indent, path)
+                return 'st'
+            self._bail(indent, pc, path)
+            return None
+        if f in (0, 1):
+            low = FSR0L + 2 * f
+            self._emit(indent, f'a = fmap[ram[{low}] | ram[{low + 1}] << 8]')
+            checks = {'r': ['xr'], 'w': ['xw'], 'rw': ['xr', 'xw']}[mode]
+            self._emit(indent, f"if {' or '.join(c + '[a]' for c in checks)}:")
+            self._bail(indent + 1, pc, path)
+            return 'ram[a]'
+        if 4 <= f <= 7 or (mode == 'r' and f == 11):
+            return f'ram[{f}]'
+        if mode == 'r' and f in (8, 10):
+            self._sync(indent, path)
+            return f'ram[{f}]'
+        self._bail(indent, pc, path)
+        return None
+
+    def _alu(self, indent: int, path: _Path, name: str, operand: str, dest: str):
+        expression = _Z_EXPRESSIONS.get(name)
+        if expression is not None:
+            expression = self._fold(path, expression.format(operand))
+            if dest == 'w':
+                self._set_w(path, None)
+            if name in ('decfsz', 'incfsz'):
+                self._emit(indent, f'r = {dest} = {expression}')
+                return
+            if dest == operand and name == 'movf':
+                self._emit(indent, f'z = {operand}')
+            else:
+                self._emit(indent, f'z = {dest} = {expression}')
+            path.z = Z_LOCAL
+            return
+        lines, flags = _LOCAL_ALU[name]
+        if path.w is not None and name in ('subwf', 'subwfb'):
+            # Complement of a known W is a constant too
+            lines = [_N_NAME.sub(str(path.w ^ 0xFF), line) for line in lines[1:]]
+        if operand.isdigit():
+            lines = [_V_NAME.sub(operand, line) for line in lines]
+        else:
+            self._emit(indent, f'v = {operand}')
+        for line in lines:
+            self._emit(indent, self._fold(path, line))
+        if dest == 'w':
+            self._set_w(path, None)
+        if flags:
+            self._emit(indent, f'st = st & {_CARRY_KEEP[flags]} | s')
+        if flags & 4:
+            self._emit(indent, f'z = {dest} = r')
+            path.z = Z_LOCAL
+        else:
+            self._emit(indent, f'{dest} = r')
+
+    def _push(self, indent: int, pc: int, path: _Path):
+        self._emit(indent, 'p = ram[4077] + 1 & 31')
+        self._emit(indent, 'if p == 16:')
+        self._bail(indent + 1, pc, path)
+        self._emit(indent, f'stk[p] = {(pc + 1) & PC_MASK}')
+        self._emit(indent, 'ram[4077] = p')
+
+    def _target(self, path: _Path, k: int) -> Optional[int]:
+        if path.pclath is None:
+            return None
+        return ((path.pclath << 8) & 0x0800) | k
+
+    # -- region walk ------------------------------------------------------
+    def build(self):
+        self._walk(self.entry, _Path(self.bsr, self.pclath), 1)
+
+    def _walk(self, pc: int, path: _Path, indent: int):
+        added = []
+        try:
+            self._walk_path(pc, path, indent, added)
+        finally:
+            for address in added:
+                self.on_path.discard(address)
+
+    def _walk_path(self, pc: int, path: _Path, indent: int, added: List[int]):
+        while True:
+            if pc == self.entry and path.count:
+                # Back to the entry in a state the entry guard accepts: loop
+                if not path.calls and self.bsr in (None, path.bsr) and \
+                        (self.pclath is None or (path.pclath is not None and
+                                                 path.pclath & 8 == self.pclath & 8)):
+                    self.loops = True
+                    self.max_cycles = max(self.max_cycles, path.cycles + path.slack)
+                    self._sync(indent, path)
+                    self._emit(indent, _Continue(path.cycles, path.count))
+                else:
+                    self._exit(indent, pc, path)
+                return
+            if self.remaining <= 0 and self.strict:
+                raise _Overflow()
+            if pc in self.on_path or self.remaining <= 0 or path.depth >= MAX_NESTING or \
+                    path.length >= self.path_limit or (pc in self.stops and path.count):
+                self._exit(indent, pc, path)
+                return
+            self.on_path.add(pc)
+            added.append(pc)
+            self.covered.add(pc)
+            self.remaining -= 1
+            path.length += 1
+            next_pc = self._instruction(pc, path, indent)
+            if next_pc is None:
+                return
+            pc = next_pc
+
+    def _instruction(self, pc: int, path: _Path, indent: int) -> Optional[int]:
+        """Emit one instruction; returns the next address or None when the path ended"""
+        opcode = OPCODE_TABLE[self.flash[pc]]
+        name, form, arg, arg2 = opcode.mnemonic, opcode.form, opcode.arg, opcode.arg2
+        following = (pc + 1) & PC_MASK
+        skip = (pc + 2) & PC_MASK
+
+        if form == FORM_FD and name != 'clrf':
+            operand = self._address(indent, pc, path, arg, 'rw' if arg2 else 'r')
+            if operand is None:
+                return None
+            self._alu(indent, path, name, operand, operand if arg2 else 'w')
+            path.cycles += 1
+            path.count += 1
+            if name in ('decfsz', 'incfsz'):
+                return self._branch(indent, 'r', following, skip, path)
+            return following
+
+        if form == FORM_FB:
+            mask = 1 << arg2
+            if name in ('bcf', 'bsf') and arg == STATUS:
+                if arg2 < 3:
+                    if arg2 == 2:
+                        path.z = Z_STATUS
+                    self._emit(indent, f'st &= {0xFF ^ mask}' if name == 'bcf' else f'st |= {mask}')
+            elif name in ('bcf', 'bsf'):
+                operand = self._address(indent, pc, path, arg, 'rw')
+                if operand is None:
+                    return None
+                value = f'{operand} & {0xFF ^ mask}' if name == 'bcf' else f'{operand} | {mask}'
+                self._emit(indent, f'{operand} = {value}')
+            else:
+                path.cycles += 1
+                path.count += 1
+                if arg == STATUS and arg2 == 2 and path.z != Z_STATUS:
+                    if path.z == Z_SET:
+                        # Statically known: only one side exists
+                        if name == 'btfss':
+                            path.cycles += 1
+                            return skip
+                        return following
+                    condition = 'not z'
+                elif arg == STATUS:
+                    condition = f'st & {mask}'
+                else:
+                    operand = self._address(indent, pc, path, arg, 'r')
+                    if operand is None:
+                        return None
+                    condition = f'{operand} & {mask}'
+                if name == 'btfss':
+                    return self._branch(indent, condition, skip, following, path, skip_first=True)
+                return self._branch(indent, condition, following, skip, path)
+            path.cycles += 1
+            path.count += 1
+            return following
+
+        if name in ('movwf', 'clrf'):
+            operand = self._address(indent, pc, path, arg, 'w')
+            if operand is None:
+                return None
+            self._emit(indent, f"{operand} = {self._fold(path, 'w') if name == 'movwf' else 0}")
+            if name == 'clrf':
+                path.z = Z_SET
+        elif name == 'clrw':
+            self._set_w(path, 0)
+            path.z = Z_SET
+        elif form == FORM_K:
+            if name == 'movlw':
+                self._set_w(path, arg)
+            elif name == 'retlw':
+                return self._return(indent, pc, path, arg)
+            else:
+                self._alu(indent, path, _LITERAL_ALU[name], str(arg), 'w')
+        elif form == FORM_ADDR:
+            target = self._target(path, arg)
+            if name == 'call':
+                self._push(indent, pc, path)
+                path.calls = path.calls + (following,)
+            path.cycles += 2
+            path.count += 1
+            if target is None:
+                self._exit(indent, f'ram[10] << 8 & 2048 | {arg}', path)
+                return None
+            return target
+        elif form == FORM_REL:
+            path.cycles += 2
+            path.count += 1
+            return (pc + 1 + arg) & PC_MASK
+        elif form == FORM_BANK:
+            path.bsr = arg
+            path.bsr_dirty = True
+        elif form == FORM_PAGE:
+            path.pclath = arg
+            path.pclath_dirty = True
+        elif form == FORM_ADDFSR:
+            low = FSR0L + 2 * arg2
+            self._emit(indent, f'f = (ram[{low}] | ram[{low + 1}] << 8) + {arg} & 65535')
+            self._emit(indent, f'ram[{low}] = f & 255')
+            self._emit(indent, f'ram[{low + 1}] = f >> 8')
+        elif form in (FORM_FSR_MM, FORM_FSR_K):
+            self._indirect(indent, pc, path, name == 'movwi', form, arg, arg2)
+        elif name == 'return':
+            return self._return(indent, pc, path)
+        elif name == 'callw':
+            self._push(indent, pc, path)
+            path.cycles += 2
+            path.count += 1
+            self._exit(indent, '(ram[10] << 8 | w) & 4095', path)
+            return None
+        elif name == 'brw':
+            path.cycles += 2
+            path.count += 1
+            self._exit(indent, f'{pc + 1} + w & 4095', path)
+            return None
+        elif name == 'clrwdt':
+            # clrwdt sets TO and PD, which live in st here
+            self._emit(indent, f'kick(now + cy + {path.cycles})')
+            self._emit(indent, 'st |= 24')
+        elif name not in ('nop', 'dw'):
+            # retfie, sleep, reset, option, tris
+            self._bail(indent, pc, path)
+            return None
+        path.cycles += 1
+        path.count += 1
+        return following
+
+    def _return(self, indent: int, pc: int, path: _Path, literal: Optional[int] = None) -> Optional[int]:
+        """Return, or retlw when literal is given (loaded once the pop is known to succeed)"""
+        if path.calls:
+            # Returning from a call inlined in this region: the address is known
+            if literal is not None:
+                self._set_w(path, literal)
+            self._emit(indent, 'ram[4077] = ram[4077] - 1 & 31')
+            path.cycles += 2
+            path.count += 1
+            following = path.calls[-1]
+            path.calls = path.calls[:-1]
+            return following
+        self._emit(indent, 'p = ram[4077]')
+        self._emit(indent, 'if p == 31:')
+        self._bail(indent + 1, pc, path)
+        if literal is not None:
+            self._set_w(path, literal)
+        self._emit(indent, 'ram[4077] = p - 1 & 31')
+        path.cycles += 2
+        path.count += 1
+        self._exit(indent, 'stk[p]', path)
+        return None
+
+    def _indirect(self, indent: int, pc: int, path: _Path, write: bool, form: int, arg: int, n: int):
+        low = FSR0L + 2 * n
+        if form == FORM_FSR_K:
+            self._emit(indent, f'f = (ram[{low}] | ram[{low + 1}] << 8) + {arg} & 65535')
+            update = None
+        else:
+            step = '+ 1' if arg in (0, 2) else '- 1'
+            self._emit(indent, f'f = ram[{low}] | ram[{low + 1}] << 8')
+            if arg < 2:
+                self._emit(indent, f'f = f {step} & 65535')
+            update = f'f {step} & 65535' if arg >= 2 else 'f'
+        self._emit(indent, 'a = fmap[f]')
+        self._emit(indent, f"if {'xw' if write else 'xr'}[a]:")
+        self._bail(indent + 1, pc, path)
+        if update is not None:
+            self._emit(indent, f'g = {update}')
+            self._emit(indent, f'ram[{low}] = g & 255')
+            self._emit(indent, f'ram[{low + 1}] = g >> 8')
+        if write:
+            self._emit(indent, f"ram[a] = {self._fold(path, 'w')}")
+        else:
+            self._emit(indent, 'z = w = ram[a]')
+            self._set_w(path, None)
+            path.z = Z_LOCAL
+
+    def _branch(self, indent: int, condition: str, when_true: int, when_false: int,
+                path: _Path, skip_first: bool = False) -> Optional[int]:
+        """
+        Two-way split after a skip instruction; the skipping side costs one
+        extra cycle. skip_first marks when_true as the skipping side. Short
+        straight sides that meet again are merged and the path continues at
+        the join (returned); otherwise both sides are walked to their ends.
+        """
+        true_path, false_path = path.fork(), path.fork()
+        if skip_first:
+            true_path.cycles += 1
+        else:
+            false_path.cycles += 1
+        join = self._merge(indent, condition, when_true, when_false, true_path, false_path, path)
+        if join is not None:
+            return join
+        self._emit(indent, f'if {condition}:')
+        self._walk(when_true, true_path, indent + 1)
+        self._emit(indent, 'else:')
+        self._walk(when_false, false_path, indent + 1)
+        return None
+
+    def _straight(self, pc: int, pclath: Optional[int]) -> List[int]:
+        """Addresses reached from pc through instructions with a single static successor"""
+        reached = [pc]
+        for _ in range(MAX_SIDE):
+            opcode = OPCODE_TABLE[self.flash[pc]]
+            if opcode.form == FORM_PAGE:
+                pclath = opcode.arg
+            if opcode.mnemonic == 'goto' and pclath is not None:
+                pc = ((pclath << 8) & 0x0800) | opcode.arg
+            elif opcode.form == FORM_REL:
+                pc = (pc + 1 + opcode.arg) & PC_MASK
+            elif opcode.mnemonic in _CONTROL:
+                break
+            else:
+                pc = (pc + 1) & PC_MASK
+            if pc in reached:
+                break
+            reached.append(pc)
+        return reached
+
+    def _merge(self, indent: int, condition: str, when_true: int, when_false: int,
+               true_path: _Path, false_path: _Path, path: _Path) -> Optional[int]:
+        """Emit both sides of a diamond up to their join, or None when they do not meet"""
+        first = self._straight(when_true, path.pclath)
+        second = self._straight(when_false, path.pclath)
+        join = next((pc for pc in first if pc in second), None)
+        if join is None:
+            return None
+        taken = first[:first.index(join)] + second[:second.index(join)]
+        if any(pc == self.entry or pc in self.on_path or pc in self.stops for pc in taken):
+            return None
+
+        # Work on copies: a failed attempt must leave both sides as they were
+        true_path, false_path = copy.copy(true_path), copy.copy(false_path)
+        lines, remaining = self.lines, self.remaining
+        bodies = []
+        for start, side in ((when_true, true_path), (when_false, false_path)):
+            self.lines = []
+            pc = start
+            while pc is not None and pc != join:
+                self.covered.add(pc)
+                self.remaining -= 1
+                side.length += 1
+                pc = self._instruction(pc, side, indent + 1)
+            bodies.append(self.lines)
+            if pc is None:
+                break
+        self.lines = lines
+        if pc is None or (true_path.bsr, true_path.pclath) != (false_path.bsr, false_path.pclath):
+            # A side leaves the region or the sides disagree on banking: walk a tree
+            self.remaining = remaining
+            return None
+
+        sides = (true_path, false_path)
+        for side, body in zip(sides, bodies):
+            self.lines = body
+            if true_path.z != false_path.z:
+                self._sync_z(indent + 1, side)
+            if true_path.w != false_path.w:
+                self._sync_w(indent + 1, side)
+                side.w = None
+        self.lines = lines
+        cycles = min(side.cycles for side in sides)
+        count = min(side.count for side in sides)
+        for side, body in zip(sides, bodies):
+            if side.cycles > cycles:
+                body.append((indent + 1, f'cy += {side.cycles - cycles}'))
+                self.counters = True
+            if side.count > count:
+                body.append((indent + 1, f'ic += {side.count - count}'))
+                self.counters = True
+        self._emit(indent, f'if {condition}:')
+        self.lines += bodies[0] or [(indent + 1, 'pass')]
+        if bodies[1]:
+            self._emit(indent, 'else:')
+            self.lines += bodies[1]
+
+        path.slack += max(side.cycles for side in sides) - cycles
+        path.cycles, path.count = cycles, count
+        path.length = max(side.length for side in sides)
+        path.bsr, path.pclath, path.z, path.w = true_path.bsr, true_path.pclath, true_path.z, true_path.w
+        path.w_dirty = true_path.w_dirty or false_path.w_dirty
+        path.bsr_dirty = true_path.bsr_dirty or false_path.bsr_dirty
+        path.pclath_dirty = true_path.pclath_dirty or false_path.pclath_dirty
+        return join
+
+    # -- rendering --------------------------------------------------------
+    def source(self) -> str:
+        max_cycles = self.max_cycles
+        body = [f"def region({', '.join(_REGION_ARGS)}):",
+                f'    if budget < {max_cycles}:',
+                '        return single(budget, now)']
+        guards = []
+        if self.bsr is not None:
+            guards.append(f'ram[8] != {self.bsr}')
+        if self.pclath is not None:
+            guards.append(f'ram[10] & 8 != {self.pclath & 8}')
+        if guards:
+            body += [f"    if {' or '.join(guards)}:", '        return miss(budget, now)']
+        body += ['    w = ram[9]', '    st = ram[3]']
+        counters = self.loops or self.counters
+        if counters:
+            body += ['    cy = 0', '    ic = 0']
+        base = 1
+        if self.loops:
+            body.append('    while True:')
+            base = 2
+        for indent, item in self.lines:
+            pad = '    ' * (indent + base - 1)
+            if isinstance(item, _Exit):
+                if counters:
+                    result = f'({item.pc}, cy + {item.cycles}, ic + {item.count})'
+                else:
+                    result = f'({item.pc}, {item.cycles}, {item.count})'
+                body += [f'{pad}ram[9] = w', f'{pad}ram[3] = st', f'{pad}return {result}']
+            elif isinstance(item, _Continue):
+                body += [f'{pad}cy += {item.cycles}', f'{pad}ic += {item.count}',
+                         f'{pad}if cy + {max_cycles} > budget:',
+                         f'{pad}    ram[9] = w', f'{pad}    ram[3] = st',
+                         f'{pad}    return ({self.entry}, cy, ic)']
+            else:
+                if not counters:
+                    item = item.replace('now + cy + ', 'now + ')
+                body.append(pad + item)
+        return '\n'.join(body) + '\n'
+
+
+def translate_region(sim: PICSimulator, entry: int, bsr: Optional[int],
+                     pclath: Optional[int]) -> Tuple[object, frozenset]:
+    """Code object and covered addresses of the region at entry"""
+    for path_limit in PATH_LIMITS:
+        builder = _RegionBuilder(sim, entry, bsr, pclath, path_limit)
+        try:
+            builder.build()
+            break
+        except _Overflow:
+            pass
+    namespace = {}
+    exec(builder.source(), namespace)
+    return namespace['region'].__code__, frozenset(builder.covered)
+
+
+class BlockSimulator(PICSimulator):
+    """
+    Simulator whose dispatch loop runs translated regions. Cold addresses
+    execute one instruction at a time through the per-instruction table and
+    are translated once they have been dispatched HOT_THRESHOLD times.
+    """
+
+    def __init__(self, hex_data: IntelHex, fosc: Optional[int] = None):
+        self.blocks: List[Callable[[int, int], Tuple[int, int, int]]] = [None] * PROGRAM_WORDS
+        self.heat = bytearray(PROGRAM_WORDS)
+        self.misses = bytearray(PROGRAM_WORDS)
+        self.generic = bytearray(PROGRAM_WORDS)
+        # Region entries covering each address, and addresses covered by each region
+        self.covers: Dict[int, Set[int]] = {}
+        self.owned: Dict[int, frozenset] = {}
+        self.regions = 0
+        self._signature = None
+        # Region flags: like rh/wh, plus the core registers regions keep in locals
+        self.xr = bytearray(4097)
+        self.xw = bytearray(4097)
+        super().__init__(hex_data, fosc)
+        self._region_defaults = None
+
+    # -- cache maintenance ----------------------------------------------
+    def invalidate(self, start: int, end: int):
+        super().invalidate(start, end)
+        self._signature = None
+        for pc in range(start, end):
+            self._drop_region(pc)
+            for entry in list(self.covers.get(pc, ())):
+                self._drop_region(entry)
+
+    def _drop_region(self, entry: int):
+        for address in self.owned.pop(entry, ()):
+            owners = self.covers.get(address)
+            if owners is not None:
+                owners.discard(entry)
+        self.blocks[entry] = self._entry(entry)
+        self.heat[entry] = 0
+
+    def flush(self):
+        """Drop every translated region"""
+        self._signature = None
+        self.covers.clear()
+        self.owned.clear()
+        for pc in range(PROGRAM_WORDS):
+            self.blocks[pc] = self._entry(pc)
+            self.heat[pc] = 0
+
+    def _flag(self, address: int, read: bool = False, write: bool = False):
+        super()._flag(address, read, write)
+        self.xr[address] = self.rh[address]
+        self.xw[address] = self.wh[address]
+        for register in (STATUS, BSR, WREG, PCLATH):
+            self.xr[register] = self.xw[register] = 1
+        self._signature = None
+        if self.owned:
+            self.flush()
+
+    def add_breakpoint(self, address: int):
+        super().add_breakpoint(address)
+        self.flush()
+
+    def remove_breakpoint(self, address: int):
+        super().remove_breakpoint(address)
+        self.flush()
+
+    def add_probe(self, address: int, callback: Callable[[], None]):
+        super().add_probe(address, callback)
+        self.flush()
+
+    def remove_probe(self, address: int):
+        super().remove_probe(address)
+        self.flush()
+
+    def enable_idle_skip(self, heads: Optional[List[int]] = None):
+        super().enable_idle_skip(heads)
+        self.flush()
+
+    def disable_idle_skip(self):
+        super().disable_idle_skip()
+        self.flush()
+
+    # -- dispatch ---------------------------------------------------------
+    def _single(self, pc: int) -> Callable[[int, int], Tuple[int, int, int]]:
+        """One instruction through the per-instruction table, in region form"""
+        code, cost = self.code, self.cost
+        following = pc + 1
+
+        def single(budget, now):
+            next_pc = code[pc]()
+            if next_pc == following:
+                return next_pc, cost[pc], 1
+            if next_pc >= 0:
+                return next_pc, 2, 1
+            return next_pc, 0, 0
+        return single
+
+    def _entry(self, pc: int) -> Callable[[int, int], Tuple[int, int, int]]:
+        """Initial block: a stop that defers to step(), or cold code"""
+        if pc in self.breakpoints or pc in self.idle_heads:
+            return lambda budget, now: (~pc, 0, 0)
+        if pc in self.probes:
+            return self._single(pc)
+        return self._cold(pc)
+
+    def _cold(self, pc: int) -> Callable[[int, int], Tuple[int, int, int]]:
+        single = self._single(pc)
+        heat = self.heat
+
+        def cold(budget, now):
+            heat[pc] += 1
+            if heat[pc] >= HOT_THRESHOLD:
+                region = self._translate(pc)
+                self.blocks[pc] = region
+                return region(budget, now)
+            return single(budget, now)
+        return cold
+
+    def _miss(self, pc: int) -> Callable[[int, int], Tuple[int, int, int]]:
+        """Entry guard failed: interpret, and rebuild unspecialised if it keeps failing"""
+        single = self._single(pc)
+
+        def miss(budget, now):
+            self.misses[pc] += 1
+            if self.misses[pc] >= MAX_GUARD_MISSES:
+                self.generic[pc] = 1
+                self._drop_region(pc)
+                self.heat[pc] = HOT_THRESHOLD - 1
+            return single(budget, now)
+        return miss
+
+    def _translate(self, pc: int) -> Callable[[int, int], Tuple[int, int, int]]:
+        if self._signature is None:
+            digest = hashlib.sha256(self.flash.tobytes())
+            digest.update(bytes(self.rh))
+            digest.update(bytes(self.wh))
+            for addresses in (self.breakpoints, self.idle_heads, self.probes):
+                digest.update(repr(sorted(addresses)).encode())
+            self._signature = digest.digest()
+        if self.generic[pc]:
+            bsr = pclath = None
+        else:
+            bsr, pclath = self.ram[8], self.ram[10]
+        key = (self._signature, pc, bsr, None if pclath is None else pclath & 8)
+        cached = _REGION_CACHE.get(key)
+        if cached is None:
+            cached = _REGION_CACHE[key] = translate_region(self, pc, bsr, pclath)
+            if len(_REGION_CACHE) > REGION_CACHE_SIZE:
+                _REGION_CACHE.popitem(last=False)
+        else:
+            _REGION_CACHE.move_to_end(key)
+        code, covered = cached
+        self.owned[pc] = covered
+        for address in covered:
+            self.covers.setdefault(address, set()).add(pc)
+        self.regions += 1
+        defaults = (self.ram, self.stack, self.rh, self.wh, self.ah, self.xr, self.xw,
+                    FSR_MAP, self, self._kick_watchdog, self._single(pc), self._miss(pc))
+        return FunctionType(code, {}, 'region', defaults)
+
+    def _run_fast(self, limit: int):
+        blocks = self.blocks
+        pc = self.pc
+        cycle = self.cycle
+        count = 0
+        while cycle < limit:
+            pc, cycles, executed = blocks[pc](limit - cycle, cycle)
+            cycle += cycles
+            count += executed
+            if pc < 0:
+                pc = ~pc
+                break
+        self.pc = pc
+        self.cycle = cycle
+        self.executed += count
+        if cycle < limit:
+            self.step()
+
+
+def load_block_simulator(hex_file: str, fosc: Optional[int] = None) -> BlockSimulator:
+    hex_data = IntelHex()
+    hex_data.load(hex_file)
+    return BlockSimulator(hex_data, fosc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare interpreter and block-cache throughput')
+    parser.add_argument('hex_file', help='Image to run')
+    parser.add_argument('--cycles', type=int, default=8000000, help='Instruction cycles to simulate')
+    parser.add_argument('--fosc', type=int, help='Oscillator frequency in Hz (default: what the image configures)')
+
+    args = parser.parse_args()
+
+    from pic_sim import load_simulator
+    for label, loader in (('interpreter', load_simulator), ('block cache', load_block_simulator)):
+        sim = loader(args.hex_file, args.fosc)
+        start = time.perf_counter()
+        sim.run(args.cycles)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>12}: {sim.executed} instructions in {elapsed:.3f} s "
+              f"({sim.executed / elapsed / 1e6:.2f} MIPS, {sim.seconds() / elapsed:.2f}x real time)"
+              f", PC=0x{sim.pc:04X}")
+        if isinstance(sim, BlockSimulator):
+            print(f"{'':>12}  {sim.regions} regions translated")
+            # The same span again, with the regions already built
+            executed, cycle = sim.executed, sim.cycle
+            start = time.perf_counter()
+            sim.run(args.cycles)
+            elapsed = time.perf_counter() - start
+            print(f"{'translated':>12}: {sim.executed - executed} instructions in {elapsed:.3f} s "
+                  f"({(sim.executed - executed) / elapsed / 1e6:.2f} MIPS, "
+                  f"{sim.seconds(sim.cycle - cycle) / elapsed:.2f}x real time), {sim.regions} regions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Decoded Firmware Cache
+Content-addressed on-disk store for decoded PIC16F1704 images and the analyses
+derived from them. Entries are keyed by the SHA-256 of the hex payload plus the
+decoder version, so an unchanged corpus reloads without being decoded again.
+"""
+
+import os
+import sys
+import zlib
+import struct
+import hashlib
+import argparse
+from array import array
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from pic_disasm import DECODER_VERSION, IntelHex, image_arrays
+
+# File layout (little-endian):
+#   header   magic, format version, decoder version, section count
+#   body     zlib stream of sections: name, typecode, item count, raw items
+CACHE_MAGIC = b'P16C'
+CACHE_FORMAT = 1
+# Bump when a derived analysis (functions, loops, control points) changes
+ANALYSIS_VERSION = 4
+DEFAULT_CACHE_DIR = '.pic_cache'
+
+_HEADER = struct.Struct('<4sHHH')
+_SECTION = struct.Struct('<BcI')
+
+
+def hash_payload(hex_file: str) -> str:
+    """SHA-256 of a hex file's contents"""
+    with open(hex_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def encode_sections(sections: Dict[str, array]) -> bytes:
+    """Serialize named arrays into the compact cache format"""
+    body = bytearray()
+    for name, values in sections.items():
+        encoded_name = name.encode('ascii')
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        body += _SECTION.pack(len(encoded_name), values.typecode.encode('ascii'), len(values))
+        body += encoded_name
+        body += values.tobytes()
+    header = _HEADER.pack(CACHE_MAGIC, CACHE_FORMAT, DECODER_VERSION, len(sections))
+    return header + zlib.compress(bytes(body))
+
+
+def decode_sections(blob: bytes) -> Optional[Dict[str, array]]:
+    """Parse the cache format; None if the blob is stale or malformed"""
+    if len(blob) < _HEADER.size:
+        return None
+    magic, fmt, decoder, count = _HEADER.unpack_from(blob)
+    if magic != CACHE_MAGIC or fmt != CACHE_FORMAT or decoder != DECODER_VERSION:
+        return None
+
+    try:
+        body = zlib.decompress(blob[_HEADER.size:])
+    except zlib.error:
+        return None
+
+    sections = {}
+    offset = 0
+    try:
+        for _ in range(count):
+            name_len, typecode, length = _SECTION.unpack_from(body, offset)
+            offset += _SECTION.size
+            name = body[offset:offset + name_len].decode('ascii')
+            offset += name_len
+            values = array(typecode.decode('ascii'))
+            size = length * values.itemsize
+            values.frombytes(body[offset:offset + size])
+            offset += size
+            if len(values) != length:
+                # Truncated section
+                return None
+            if sys.byteorder == 'big':
+                values.byteswap()
+            sections[name] = values
+    except (struct.error, ValueError, UnicodeDecodeError):
+        # Truncated header, unknown typecode, ragged item bytes or a mangled name
+        return None
+    return sections
+
+
+class AnalysisCache:
+    """Directory of cache entries, one file per decoded image"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, hex_file: str) -> str:
+        """Cache key for a hex file: payload hash plus decoder/analysis versions"""
+        return f'{hash_payload(hex_file)}-d{DECODER_VERSION}a{ANALYSIS_VERSION}'
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.bin'
+
+    def load(self, key: str) -> Optional[Dict[str, array]]:
+        """Load all sections stored under a key"""
+        try:
+            blob = self.path(key).read_bytes()
+        except OSError:
+            self.misses += 1
+            return None
+
+        sections = decode_sections(blob)
+        if sections is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return sections
+
+    def store(self, key: str, sections: Dict[str, array]):
+        """
+        Merge sections into the entry for a key (atomic replace). Each call
+        rewrites the whole entry, so callers collect an analysis's sections
+        and store them together.
+        """
+        path = self.path(key)
+        existing = decode_sections(path.read_bytes()) if path.exists() else None
+        if existing:
+            existing.update(sections)
+            sections = existing
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_bytes(encode_sections(sections))
+        os.replace(tmp_path, path)
+
+    def clear(self) -> int:
+        """Remove every cache entry, returning the number deleted"""
+        removed = 0
+        for entry in self.cache_dir.glob('*/*.bin'):
+            entry.unlink()
+            removed += 1
+        return removed
+
+
+def load_image(hex_file: str, cache: Optional[AnalysisCache] = None
+               ) -> Tuple[array, array, Dict[str, array], Optional[str]]:
+    """
+    Word arrays for an image, served from the cache when possible.
+    Returns (addresses, words, cached sections, cache key).
+    """
+    key = None
+    if cache is not None:
+        key = cache.key(hex_file)
+        sections = cache.load(key)
+        if sections and 'address' in sections and 'word' in sections:
+            return sections['address'], sections['word'], sections, key
+
+    addresses, words = image_arrays(IntelHex(hex_file))
+    sections = {'address': addresses, 'word': words}
+    if cache is not None:
+        cache.store(key, sections)
+    return addresses, words, sections, key
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the decoded firmware cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Cache directory')
+    parser.add_argument('--clear', action='store_true', help='Delete all cache entries')
+
+    args = parser.parse_args()
+
+    cache = AnalysisCache(args.cache_dir)
+    if args.clear:
+        print(f"Removed {cache.clear()} cache entries")
+        return
+
+    entries = list(cache.cache_dir.glob('*/*.bin'))
+    total = sum(entry.stat().st_size for entry in entries)
+    print(f"{len(entries)} entries, {total} bytes in {cache.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Call Graph and Stack Depth
+Builds the function-level call graph from the control-flow graph and computes
+the worst-case depth of the 16-level hardware return stack from each root.
+The interrupt can preempt main-line code at its deepest point, so the
+combined worst case is main-line depth + 1 (interrupt return address) + ISR depth.
+"""
+
+import sys
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from pic_cfg import CALL, ControlFlowGraph, INDIRECT, INTERRUPT_VECTOR, RESET_VECTOR, build_cfg
+from pic_disasm import InstructionStore, disassemble_file
+
+# Hardware return stack depth of the PIC16F1704
+STACK_LEVELS = 16
+
+
+class CallGraph:
+    """
+    Function entries and the edges between them. Call edges push one stack
+    level; tail jumps into blocks owned by another function push none.
+    """
+
+    def __init__(self, cfg: ControlFlowGraph):
+        self.cfg = cfg
+        self.entries = cfg.function_entries()
+        self.index = {entry: i for i, entry in enumerate(self.entries)}
+        # Roots other than the vectors are code reached only through callw
+        self.indirect_targets = [
+            root for root in cfg.roots if root not in (RESET_VECTOR, INTERRUPT_VECTOR)
+        ]
+
+        # edges[f] = [(callee index, pushes, call site address, indirect)]
+        self.edges: List[List[Tuple[int, int, int, bool]]] = [[] for _ in self.entries]
+        seen = set()
+        owner = cfg.function_owner()
+        for block in range(len(cfg)):
+            caller = self.index[owner[block]]
+            site = cfg.end[block]
+            for succ, kind in cfg.successors(block):
+                callee = self.index[owner[succ]]
+                if kind == CALL:
+                    self._add(seen, caller, callee, 1, site, False)
+                elif callee != caller:
+                    self._add(seen, caller, callee, 0, site, False)
+        for site, target in zip(cfg.call_site, cfg.call_target):
+            if target == INDIRECT:
+                caller = self.index[owner[cfg.block_containing(site)]]
+                for entry in self.indirect_targets:
+                    self._add(seen, caller, self.index[entry], 1, site, True)
+
+        # Every callw may reach every pointer target, which closes cycles that
+        # the firmware never takes; drop those edges and record the assumption
+        component = self._solve()
+        self.indirect_cycles = 0
+        for caller, edges in enumerate(self.edges):
+            kept = [edge for edge in edges
+                    if not edge[3] or component[edge[0]] != component[caller]]
+            self.indirect_cycles += len(edges) - len(kept)
+            edges[:] = kept
+        if self.indirect_cycles:
+            self._solve()
+
+    def _add(self, seen: set, caller: int, callee: int, pushes: int, site: int, indirect: bool):
+        key = (caller, callee, pushes)
+        if key not in seen:
+            seen.add(key)
+            self.edges[caller].append((callee, pushes, site, indirect))
+
+    def _solve(self) -> List[int]:
+        """
+        Tarjan's strongly connected components (iterative); components come
+        out callees-first, so depths are settled in a single pass.
+        """
+        count = len(self.entries)
+        order = [-1] * count
+        low = [0] * count
+        on_stack = [False] * count
+        component = [-1] * count
+        stack = []
+        components = []
+        counter = 0
+
+        for start in range(count):
+            if order[start] >= 0:
+                continue
+            work = [(start, 0)]
+            while work:
+                node, position = work.pop()
+                if position == 0:
+                    order[node] = low[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                edges = self.edges[node]
+                while position < len(edges):
+                    succ = edges[position][0]
+                    position += 1
+                    if order[succ] < 0:
+                        work.append((node, position))
+                        work.append((succ, 0))
+                        break
+                    if on_stack[succ]:
+                        low[node] = min(low[node], order[succ])
+                else:
+                    if low[node] == order[node]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component[member] = len(components)
+                            members.append(member)
+                            if member == node:
+                                break
+                        components.append(members)
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+
+        # depth[f]: stack levels used by calls made from f (None = recursive)
+        self.depth: List[Optional[int]] = [0] * count
+        self.next_hop: List[Optional[Tuple[int, int]]] = [None] * count
+        self.recursive = [False] * count
+        for index, members in enumerate(components):
+            recursive = any(
+                component[callee] == index and pushes
+                for member in members for callee, pushes, _, _ in self.edges[member]
+            )
+            best, hop = 0, None
+            for member in members:
+                for callee, pushes, site, _ in self.edges[member]:
+                    if component[callee] == index:
+                        continue
+                    if self.depth[callee] is None:
+                        recursive = True
+                        continue
+                    if pushes + self.depth[callee] > best or hop is None:
+                        best, hop = pushes + self.depth[callee], (site, callee)
+            for member in members:
+                self.recursive[member] = recursive
+                self.depth[member] = None if recursive else best
+                self.next_hop[member] = hop
+        return component
+
+    def depth_of(self, entry: int) -> Optional[int]:
+        """Worst-case levels pushed below a function entry (None if recursive)"""
+        return self.depth[self.index[entry]]
+
+    def worst_path(self, entry: int) -> List[Tuple[int, int]]:
+        """(call site, callee entry) chain realizing the worst case"""
+        path = []
+        node = self.index[entry]
+        while self.next_hop[node] is not None and len(path) < len(self.entries):
+            site, node = self.next_hop[node]
+            path.append((site, self.entries[node]))
+        return path
+
+    def callers(self, entry: int) -> List[int]:
+        """Call sites that push a frame for a function entry"""
+        target = self.index[entry]
+        return sorted(
+            site for edges in self.edges for callee, pushes, site, _ in edges
+            if callee == target and pushes
+        )
+
+    def stack_report(self) -> Dict:
+        """Worst-case stack usage per root plus interrupt preemption"""
+        main = self.depth_of(RESET_VECTOR) if RESET_VECTOR in self.index else 0
+        isr = self.depth_of(INTERRUPT_VECTOR) if INTERRUPT_VECTOR in self.index else 0
+        combined = None if main is None or isr is None else main + 1 + isr
+        return {
+            'main_depth': main,
+            'isr_depth': isr,
+            'worst_case': combined,
+            'limit': STACK_LEVELS,
+            'overflow': combined is None or combined > STACK_LEVELS,
+            'indirect_calls': sum(1 for target in self.cfg.call_target if target == INDIRECT),
+            'indirect_cycles': self.indirect_cycles,
+        }
+
+
+def analyze_stack(store: InstructionStore) -> CallGraph:
+    return CallGraph(build_cfg(store))
+
+
+def _format_depth(depth: Optional[int]) -> str:
+    return 'unbounded (recursion)' if depth is None else str(depth)
+
+
+def print_report(name: str, graph: CallGraph):
+    report = graph.stack_report()
+    status = 'OVERFLOW' if report['overflow'] else 'ok'
+    print(f"{name}: {_format_depth(report['worst_case'])}/{STACK_LEVELS} levels [{status}]")
+    print(f"  Main line: {_format_depth(report['main_depth'])}  "
+          f"ISR: {_format_depth(report['isr_depth'])}  "
+          f"Indirect call sites: {report['indirect_calls']}")
+    if report['indirect_cycles']:
+        print(f"  Assumes no recursion through function pointers "
+              f"({report['indirect_cycles']} indirect edges ignored)")
+    for root, label in ((RESET_VECTOR, 'reset'), (INTERRUPT_VECTOR, 'ISR')):
+        if root in graph.index:
+            chain = ' -> '.join(f"0x{callee:04X}@0x{site:04X}" for site, callee in graph.worst_path(root))
+            print(f"  Worst {label} path: {chain or '(no calls)'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worst-case hardware stack depth of PIC16F1704 images')
+    parser.add_argument('hex_files', nargs='+', help='Images to check')
+
+    args = parser.parse_args()
+
+    overflow = False
+    for hex_file in args.hex_files:
+        graph = analyze_stack(disassemble_file(hex_file))
+        print_report(hex_file, graph)
+        overflow |= graph.stack_report()['overflow']
+
+    # Non-zero exit lets a build reject patched images that can overflow
+    sys.exit(1 if overflow else 0)
+
+
+if __name__ == "__main__":
+    main()
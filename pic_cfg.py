@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Control-Flow Graph
+Basic blocks and edges for a decoded image. PCLATH (movlp) is tracked through
+the program flow so goto/call operands get their upper address bits from the
+page actually selected, skips split blocks on both outcomes and brw/PCL jump
+tables fan out to their entries. Loops and function entries are derived from
+the graph in linear time.
+"""
+
+import argparse
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from pic_disasm import (
+    InstructionStore, PROGRAM_WORDS, ERASED_WORD, FORM_F, FORM_FD, MNEMONIC_IDS, disassemble_file,
+)
+
+RESET_VECTOR = 0x0000
+INTERRUPT_VECTOR = 0x0004
+
+# PCLATH states (also used by pic_xref for BSR)
+UNKNOWN = -1
+UNREACHED = -2
+
+# Edge kinds
+FALL = 0      # next instruction
+JUMP = 1      # goto / bra
+SKIP = 2      # skip taken (PC + 2)
+CALL = 3      # into the callee
+RETURN = 4    # call site -> instruction after the call
+TABLE = 5     # computed jump table entry
+
+# Call target of callw (PCLATH:W is not tracked)
+INDIRECT = 0xFFFF
+
+# Cache section names written by ControlFlowGraph.to_sections
+CFG_SECTIONS = ('cfg.root', 'cfg.pclath', 'cfg.start', 'cfg.end', 'cfg.edge_offset',
+                'cfg.edge', 'cfg.kind', 'cfg.call_site', 'cfg.call_target')
+
+# Longest brw / addwf PCL jump table followed
+MAX_TABLE_ENTRIES = 256
+
+_M = MNEMONIC_IDS
+_SKIPS = {_M['btfsc'], _M['btfss'], _M['decfsz'], _M['incfsz']}
+_STOPS = {_M['return'], _M['retlw'], _M['retfie'], _M['reset'], _M['dw']}
+_TABLE_ENTRIES = {_M['goto'], _M['bra'], _M['retlw'], _M['return']}
+_GOTO, _CALL, _CALLW, _BRA, _BRW = _M['goto'], _M['call'], _M['callw'], _M['bra'], _M['brw']
+_MOVLP, _MOVWF, _CLRF, _ADDWF, _TRIS = _M['movlp'], _M['movwf'], _M['clrf'], _M['addwf'], _M['tris']
+
+_PCL = 0x02
+_PCLATH = 0x0A
+
+
+def _writes_register(code: int, form: int, f: int, d: int, register: int) -> bool:
+    if f != register or code == _TRIS:
+        return False
+    return code in (_MOVWF, _CLRF) or (form == FORM_FD and d == 1)
+
+
+class ControlFlowGraph:
+    """
+    Basic-block graph in flat arrays: block b covers start[b]..end[b] (inclusive)
+    and its successors are edge[edge_offset[b]:edge_offset[b + 1]].
+    """
+
+    def __init__(self, store: InstructionStore, entries: Optional[Dict[int, int]] = None):
+        if entries is None:
+            # PCLATH resets to 0; the ISR may interrupt any page
+            entries = {RESET_VECTOR: 0, INTERRUPT_VECTOR: UNKNOWN}
+        self.store = store
+        entries = dict(entries)
+        self.pclath = self._track_pclath(entries)
+
+        # callw targets are not tracked, so code only reachable through a
+        # function pointer is picked up as orphan runs after a terminator
+        indirect_sites = [store.address[row] for row in store.rows_for('callw')]
+        while any(self.pclath[address] != UNREACHED for address in indirect_sites):
+            orphans = self._orphans()
+            if not orphans:
+                break
+            entries.update((address, UNKNOWN) for address in orphans)
+            self.pclath = self._track_pclath(entries)
+
+        self.roots = array('H', sorted(entries))
+        self._build_blocks()
+
+    # -- Construction ------------------------------------------------------
+
+    def _successors(self, address: int, pclath: int) -> List[Tuple[int, int, int]]:
+        """(target, kind, PCLATH after) for one instruction"""
+        store = self.store
+        row = store.row_of(address)
+        code, form, f, d = store.op[row], store.form[row], store.arg[row], store.arg2[row]
+
+        if code == _MOVLP:
+            pclath = f
+        elif form in (FORM_F, FORM_FD) and _writes_register(code, form, f, d, _PCLATH):
+            pclath = 0 if code == _CLRF else UNKNOWN
+
+        if code in _SKIPS:
+            return [(address + 1, FALL, pclath), (address + 2, SKIP, pclath)]
+        if code in (_GOTO, _CALL):
+            # An unknown PCLATH falls back to the current page
+            upper = (pclath & 0x78) << 8 if pclath >= 0 else address & 0x7800
+            target = (upper | f) & (PROGRAM_WORDS - 1)
+            if code == _GOTO:
+                return [(target, JUMP, pclath)]
+            # The callee may leave any page selected
+            return [(target, CALL, pclath), (address + 1, RETURN, UNKNOWN)]
+        if code == _CALLW:
+            return [(address + 1, RETURN, UNKNOWN)]
+        if code == _BRA:
+            return [(address + 1 + f, JUMP, pclath)]
+        if code == _BRW or (code == _ADDWF and f == _PCL and d == 1):
+            return [(target, TABLE, pclath) for target in self._table(address + 1)]
+        if form in (FORM_F, FORM_FD) and _writes_register(code, form, f, d, _PCL):
+            # Other PCL writes jump to PCLATH:W, which is not tracked
+            return []
+        if code in _STOPS:
+            return []
+        return [(address + 1, FALL, pclath)]
+
+    def _table(self, address: int) -> List[int]:
+        """Entries of a computed jump table starting at an address"""
+        store = self.store
+        entries = []
+        while len(entries) < MAX_TABLE_ENTRIES:
+            row = store.row_of(address)
+            if row < 0 or store.op[row] not in _TABLE_ENTRIES:
+                break
+            entries.append(address)
+            address += 1
+        return entries
+
+    def _orphans(self) -> List[int]:
+        """Unreached, non-erased addresses that follow a terminator or erased word"""
+        store, pclath = self.store, self.pclath
+        orphans = []
+        for address in range(1, PROGRAM_WORDS):
+            row = store.row_of(address)
+            if pclath[address] != UNREACHED or row < 0 or store.word[row] == ERASED_WORD:
+                continue
+            prev = store.row_of(address - 1)
+            if prev < 0 or store.word[prev] == ERASED_WORD:
+                orphans.append(address)
+            elif pclath[address - 1] != UNREACHED and \
+                    address not in (t for t, _, _ in self._successors(address - 1, pclath[address - 1])):
+                orphans.append(address)
+        return orphans
+
+    def _track_pclath(self, entries: Dict[int, int]) -> array:
+        """Forward dataflow of PCLATH; each address changes state at most twice"""
+        pclath = array('b', [UNREACHED]) * PROGRAM_WORDS
+        row_of = self.store.row_of
+        worklist = []
+
+        def join(address: int, value: int):
+            if not 0 <= address < PROGRAM_WORDS or row_of(address) < 0:
+                return
+            current = pclath[address]
+            if current == value or current == UNKNOWN:
+                return
+            pclath[address] = value if current == UNREACHED else UNKNOWN
+            worklist.append(address)
+
+        for address, value in entries.items():
+            join(address, value)
+        while worklist:
+            address = worklist.pop()
+            for target, _, value in self._successors(address, pclath[address]):
+                join(target, value)
+        return pclath
+
+    def _build_blocks(self):
+        pclath = self.pclath
+        reached = [address for address in range(PROGRAM_WORDS) if pclath[address] != UNREACHED]
+
+        # Leaders: roots and every successor of a control transfer
+        successors = {}
+        leaders = set(self.roots)
+        for address in reached:
+            targets = [
+                (target, kind) for target, kind, _ in self._successors(address, pclath[address])
+                if 0 <= target < PROGRAM_WORDS and pclath[target] != UNREACHED
+            ]
+            if targets != [(address + 1, FALL)]:
+                successors[address] = targets
+                leaders.update(target for target, _ in targets)
+
+        self.start = array('H')
+        self.end = array('H')
+        self.block_at = array('h', [-1]) * PROGRAM_WORDS
+        for address in reached:
+            if (address in leaders or address == 0 or pclath[address - 1] == UNREACHED
+                    or address - 1 in successors or not self.start):
+                self.start.append(address)
+                self.end.append(address)
+            else:
+                self.end[-1] = address
+            self.block_at[address] = len(self.start) - 1
+
+        self.edge_offset = array('I', [0])
+        self.edge = array('H')
+        self.kind = array('B')
+        self.call_site = array('H')
+        self.call_target = array('H')
+        store = self.store
+        for last in self.end:
+            targets = successors.get(last)
+            if targets is None:
+                targets = [(last + 1, FALL)] if last + 1 < PROGRAM_WORDS and \
+                    self.block_at[last + 1] >= 0 else []
+            for target, kind in targets:
+                self.edge.append(self.block_at[target])
+                self.kind.append(kind)
+                if kind == CALL:
+                    self.call_site.append(last)
+                    self.call_target.append(target)
+            if store.op[store.row_of(last)] == _CALLW:
+                self.call_site.append(last)
+                self.call_target.append(INDIRECT)
+            self.edge_offset.append(len(self.edge))
+
+    # -- Cache round trip --------------------------------------------------
+
+    @classmethod
+    def from_sections(cls, store: InstructionStore, sections: Dict[str, array]) -> 'ControlFlowGraph':
+        """Rebuild from cached 'cfg.*' sections"""
+        graph = cls.__new__(cls)
+        graph.store = store
+        graph.roots = sections['cfg.root']
+        graph.pclath = sections['cfg.pclath']
+        graph.start = sections['cfg.start']
+        graph.end = sections['cfg.end']
+        graph.edge_offset = sections['cfg.edge_offset']
+        graph.edge = sections['cfg.edge']
+        graph.kind = sections['cfg.kind']
+        graph.call_site = sections['cfg.call_site']
+        graph.call_target = sections['cfg.call_target']
+        graph.block_at = array('h', [-1]) * PROGRAM_WORDS
+        for block, (first, last) in enumerate(zip(graph.start, graph.end)):
+            for address in range(first, last + 1):
+                graph.block_at[address] = block
+        return graph
+
+    def to_sections(self) -> Dict[str, array]:
+        return {
+            'cfg.root': self.roots,
+            'cfg.pclath': self.pclath,
+            'cfg.start': self.start,
+            'cfg.end': self.end,
+            'cfg.edge_offset': self.edge_offset,
+            'cfg.edge': self.edge,
+            'cfg.kind': self.kind,
+            'cfg.call_site': self.call_site,
+            'cfg.call_target': self.call_target,
+        }
+
+    # -- Queries -----------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def successors(self, block: int) -> List[Tuple[int, int]]:
+        """(successor block, edge kind) pairs"""
+        first, last = self.edge_offset[block], self.edge_offset[block + 1]
+        return list(zip(self.edge[first:last], self.kind[first:last]))
+
+    def predecessors(self) -> List[List[int]]:
+        """Predecessor blocks of every block"""
+        preds = [[] for _ in self.start]
+        for block in range(len(self.start)):
+            for index in range(self.edge_offset[block], self.edge_offset[block + 1]):
+                preds[self.edge[index]].append(block)
+        return preds
+
+    def block_containing(self, address: int) -> int:
+        """Block index for an address, or -1 when unreachable"""
+        if not 0 <= address < PROGRAM_WORDS:
+            return -1
+        return self.block_at[address]
+
+    def reachable(self, address: int) -> bool:
+        return self.block_containing(address) >= 0
+
+    def branch_target(self, address: int) -> Optional[int]:
+        """PCLATH-resolved destination of a goto/call/bra at an address"""
+        store = self.store
+        row = store.row_of(address)
+        if row < 0 or not self.reachable(address):
+            return None
+        for target, kind, _ in self._successors(address, self.pclath[address]):
+            if kind in (JUMP, CALL):
+                return target
+        return None
+
+    def _local_successors(self, block: int):
+        """Successors within the same function (call edges excluded)"""
+        for index in range(self.edge_offset[block], self.edge_offset[block + 1]):
+            if self.kind[index] != CALL:
+                yield self.edge[index]
+
+    def function_entries(self) -> List[int]:
+        """Roots plus every static call target, by address"""
+        return sorted(set(self.roots) | set(t for t in self.call_target if t != INDIRECT))
+
+    def call_counts(self) -> Dict[int, int]:
+        """Number of call sites per static call target"""
+        counts = {}
+        for target in self.call_target:
+            if target != INDIRECT:
+                counts[target] = counts.get(target, 0) + 1
+        return counts
+
+    def function_owner(self) -> array:
+        """
+        Function entry address owning each block: a breadth-first sweep from all
+        entries at once, so blocks shared through tail gotos go to the nearest one.
+        """
+        owner = array('i', [-1]) * len(self.start)
+        queue = []
+        for entry in self.function_entries():
+            block = self.block_at[entry]
+            if owner[block] < 0:
+                owner[block] = entry
+                queue.append(block)
+        for block in queue:
+            for succ in self._local_successors(block):
+                if owner[succ] < 0:
+                    owner[succ] = owner[block]
+                    queue.append(succ)
+        return owner
+
+    def loops(self) -> List[Tuple[int, int]]:
+        """
+        Back edges found by an iterative depth-first search from every function
+        entry: (loop header address, address of the branch closing the loop).
+        """
+        WHITE, GREY, BLACK = 0, 1, 2
+        color = array('B', [WHITE]) * len(self.start)
+        back_edges = []
+
+        for entry in self.function_entries():
+            root = self.block_at[entry]
+            if color[root] != WHITE:
+                continue
+            color[root] = GREY
+            stack = [(root, self._local_successors(root))]
+            while stack:
+                block, pending = stack[-1]
+                for succ in pending:
+                    if color[succ] == WHITE:
+                        color[succ] = GREY
+                        stack.append((succ, self._local_successors(succ)))
+                        break
+                    if color[succ] == GREY:
+                        back_edges.append((self.start[succ], self.end[block]))
+                else:
+                    color[block] = BLACK
+                    stack.pop()
+
+        return sorted(back_edges, key=lambda edge: (edge[1], edge[0]))
+
+
+def build_cfg(store: InstructionStore) -> ControlFlowGraph:
+    return ControlFlowGraph(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the control-flow graph of a PIC16F1704 image')
+    parser.add_argument('hex_file', help='Input hex file')
+
+    args = parser.parse_args()
+
+    store = disassemble_file(args.hex_file)
+    cfg = build_cfg(store)
+    entries = cfg.function_entries()
+    counts = cfg.call_counts()
+    reached = sum(1 for value in cfg.pclath if value != UNREACHED)
+
+    print(f"Blocks: {len(cfg)}  Edges: {len(cfg.edge)}  Reachable words: {reached}")
+    print(f"Functions: {len(entries)}  Indirect call sites: {list(cfg.call_target).count(INDIRECT)}")
+    print("-" * 60)
+    for entry in entries:
+        print(f"  0x{entry:04X}  calls: {counts.get(entry, 0)}")
+    print("-" * 60)
+    for header, latch in cfg.loops():
+        print(f"  Loop 0x{header:04X} <- 0x{latch:04X}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,47 +4,39 @@ PIC Firmware Decompilation Analysis
 Analyzes PIC hex files to determine compilation patterns and decompilation feasibility
 """
 
-import re
-import subprocess
+import argparse
+from array import array
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 import hashlib
 
+from pic_cache import AnalysisCache, DEFAULT_CACHE_DIR, load_image
+from pic_cfg import CFG_SECTIONS, ControlFlowGraph
+from pic_disasm import InstructionStore, format_listing
+from pic_parallel import parallel_map
+from pic_signatures import SignatureMatcher
+
+# Sentinel for "no address" in cached address arrays
+NO_ADDRESS = 0xFFFF
+
 class PICDecompilerAnalysis:
     """Analyze PIC firmware for decompilation possibilities"""
     
-    # Common compiler signatures and patterns
+    # Common compiler startup sequences (instruction n-gram signatures are in pic_signatures)
     COMPILER_SIGNATURES = {
         'XC8': {
-            'patterns': [
-                r'movlp\s+0x[0-9a-f]+.*movlp.*movlp',  # XC8 bank switching pattern
-                r'pagesel.*pagesel',  # Page selection pattern
-                r'banksel.*banksel',  # Bank selection pattern
-            ],
             'startup': [0x3180, 0x0000],  # Common XC8 startup sequence
             'characteristics': 'Optimized code, function prologues'
         },
         'SDCC': {
-            'patterns': [
-                r'goto.*\$\+1',  # SDCC delay pattern
-                r'clrf.*clrf.*clrf',  # SDCC initialization
-            ],
             'startup': [0x0000, 0x2800],  # SDCC startup
             'characteristics': 'Less optimized, predictable patterns'
         },
         'Assembly': {
-            'patterns': [
-                r'nop.*nop.*nop',  # Manual timing delays
-                r'goto\s+\$-[0-9]+',  # Tight loops
-            ],
             'startup': [],
             'characteristics': 'Irregular patterns, manual optimizations'
         },
         'CCS': {
-            'patterns': [
-                r'movf.*movwf.*movf.*movwf',  # CCS variable copying
-                r'bcf.*bsf.*bcf.*bsf',  # CCS bit manipulation
-            ],
             'startup': [0x3000, 0x008A],  # CCS startup
             'characteristics': 'Inline functions, specific optimization patterns'
         }
@@ -60,47 +52,59 @@ class PICDecompilerAnalysis:
         'misc': ['nop', 'clrf', 'clrw', 'clrwdt', 'sleep', 'reset']
     }
     
-    def __init__(self, hex_file: str):
+    # All signatures in one automaton, built once
+    SIGNATURE_MATCHER = SignatureMatcher()
+    
+    def __init__(self, hex_file: str, cache: Optional[AnalysisCache] = None):
         self.hex_file = hex_file
-        self.asm_lines = []
-        self.instructions = []
+        self.instructions = InstructionStore(array('H'), array('H'), self.INSTRUCTION_CATEGORIES)
         self.functions = []
         self.compiler_hints = {}
+        self.cache = cache
+        self.cache_key = None
+        self.cached_sections = {}
+        # Derived sections not yet written to the cache (save_cache)
+        self._unsaved: Dict[str, array] = {}
+        self._cfg = None
         
     def disassemble(self) -> bool:
         """Disassemble hex file and parse instructions"""
         try:
-            result = subprocess.run(
-                ['gpdasm', '-p', 'pic16f1704', self.hex_file],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            self.asm_lines = result.stdout.split('\n')
-            self._parse_instructions()
-            return True
-            
-        except subprocess.CalledProcessError:
+            addresses, words, self.cached_sections, self.cache_key = \
+                load_image(self.hex_file, self.cache)
+        except (OSError, ValueError):
             return False
+        
+        self.instructions = InstructionStore(addresses, words, self.INSTRUCTION_CATEGORIES)
+        self._cfg = None
+        self._unsaved = {}
+        return True
     
-    def _parse_instructions(self):
-        """Parse disassembled instructions"""
-        for line in self.asm_lines:
-            match = re.match(r'([0-9a-f]{4}):\s+([0-9a-f]{4})\s+(\w+)\s*(.*)', line, re.IGNORECASE)
-            if match:
-                addr = int(match.group(1), 16)
-                opcode = int(match.group(2), 16)
-                mnemonic = match.group(3).lower()
-                operands = match.group(4).strip()
-                
-                self.instructions.append({
-                    'address': addr,
-                    'opcode': opcode,
-                    'mnemonic': mnemonic,
-                    'operands': operands,
-                    'category': self._categorize_instruction(mnemonic)
-                })
+    def _store_sections(self, sections: Dict[str, array]):
+        """Keep derived analyses with the decoded image; save_cache() persists them"""
+        self.cached_sections.update(sections)
+        self._unsaved.update(sections)
+    
+    def save_cache(self):
+        """Write the analyses derived since the last save in one cache update"""
+        if self._unsaved and self.cache is not None and self.cache_key:
+            self.cache.store(self.cache_key, self._unsaved)
+        self._unsaved = {}
+    
+    def cfg(self) -> ControlFlowGraph:
+        """PCLATH-aware control-flow graph (cached with the image)"""
+        if self._cfg is None:
+            if all(name in self.cached_sections for name in CFG_SECTIONS):
+                self._cfg = ControlFlowGraph.from_sections(self.instructions, self.cached_sections)
+            else:
+                self._cfg = ControlFlowGraph(self.instructions)
+                self._store_sections(self._cfg.to_sections())
+        return self._cfg
+    
+    @property
+    def asm_lines(self) -> List[str]:
+        """Listing text, rendered on demand from the instruction store"""
+        return format_listing(self.instructions).split('\n')
     
     def _categorize_instruction(self, mnemonic: str) -> str:
         """Categorize instruction by type"""
@@ -116,22 +120,17 @@ class PICDecompilerAnalysis:
         # Check startup sequences
         if len(self.instructions) > 10:
             startup_opcodes = [inst['opcode'] for inst in self.instructions[:5]]
+            # Signature n-grams of every compiler in one pass
+            matched = self.SIGNATURE_MATCHER.scores(self.SIGNATURE_MATCHER.count(self.instructions))
             
             for compiler, info in self.COMPILER_SIGNATURES.items():
-                score = 0.0
+                score = matched.get(compiler, 0.0)
                 
                 # Check startup sequence
                 if info['startup'] and len(info['startup']) <= len(startup_opcodes):
                     if startup_opcodes[:len(info['startup'])] == info['startup']:
                         score += 0.3
                 
-                # Check patterns in assembly
-                asm_text = '\n'.join(self.asm_lines)
-                for pattern in info['patterns']:
-                    matches = len(re.findall(pattern, asm_text, re.IGNORECASE))
-                    if matches > 0:
-                        score += min(0.2, matches * 0.05)
-                
                 scores[compiler] = min(1.0, score)
         
         # Analyze instruction distribution
@@ -162,15 +161,6 @@ class PICDecompilerAnalysis:
         for i, inst in enumerate(self.instructions):
             if inst['mnemonic'] == 'call':
                 dist['function_calls'] += 1
-            elif inst['mnemonic'] == 'goto':
-                # Check for backward jumps (loops)
-                if inst['operands']:
-                    try:
-                        target = int(inst['operands'].replace('0x', ''), 16)
-                        if target < inst['address']:
-                            dist['loops'] += 1
-                    except:
-                        pass
             elif inst['mnemonic'] == 'nop':
                 if i > 0 and self.instructions[i-1]['mnemonic'] == 'nop':
                     dist['nop_sequences'] += 1
@@ -179,38 +169,44 @@ class PICDecompilerAnalysis:
             elif inst['category'] == 'bit_ops':
                 dist['bit_operations'] += 1
         
+        # Loops are back edges of the control-flow graph
+        dist['loops'] = len(self.cfg().loops())
+        
         return dist
     
     def identify_functions(self) -> List[Dict]:
         """Identify probable function boundaries"""
-        functions = []
-        current_func = None
+        if 'func.start' in self.cached_sections:
+            return [
+                {'start': start, 'end': end if end != NO_ADDRESS else None, 'calls': calls}
+                for start, end, calls in zip(self.cached_sections['func.start'],
+                                             self.cached_sections['func.end'],
+                                             self.cached_sections['func.calls'])
+            ]
         
-        for i, inst in enumerate(self.instructions):
-            # Function entry points (called addresses)
-            if inst['mnemonic'] == 'call':
-                if inst['operands']:
-                    try:
-                        target = int(inst['operands'].replace('0x', ''), 16)
-                        # Mark as function entry
-                        if not any(f['start'] == target for f in functions):
-                            functions.append({'start': target, 'end': None, 'calls': 1})
-                        else:
-                            for f in functions:
-                                if f['start'] == target:
-                                    f['calls'] += 1
-                    except:
-                        pass
-            
-            # Function exits
-            elif inst['mnemonic'] in ['return', 'retlw', 'retfie']:
-                # Try to match with nearest function start
-                for f in reversed(functions):
-                    if f['end'] is None and f['start'] < inst['address']:
-                        f['end'] = inst['address']
-                        break
+        # Function entries are the static call targets; each owns the blocks
+        # it reaches first, and ends at its last return
+        cfg = self.cfg()
+        owner = cfg.function_owner()
+        ends = {}
+        for block, entry in enumerate(owner):
+            last = cfg.end[block]
+            if entry >= 0 and self.instructions.at(last)['mnemonic'] in ['return', 'retlw', 'retfie']:
+                ends[entry] = max(ends.get(entry, last), last)
+        
+        functions = [
+            {'start': start, 'end': ends.get(start), 'calls': calls}
+            for start, calls in sorted(cfg.call_counts().items())
+        ]
+        functions = sorted(functions, key=lambda x: x.get('calls', 0), reverse=True)
         
-        return sorted(functions, key=lambda x: x.get('calls', 0), reverse=True)
+        self._store_sections({
+            'func.start': array('H', (f['start'] for f in functions)),
+            'func.end': array('H', (NO_ADDRESS if f['end'] is None else f['end'] for f in functions)),
+            'func.calls': array('H', (f['calls'] for f in functions))
+        })
+        
+        return functions
     
     def analyze_complexity(self) -> Dict[str, any]:
         """Analyze code complexity and structure"""
@@ -319,39 +315,55 @@ void main(void) {
         
         return c_code
 
-def analyze_all_firmware():
+def _analyze_firmware(job: Tuple[str, Optional[str]]) -> Optional[Tuple]:
+    """Worker: compiler scores, complexity metrics and top functions for one image"""
+    hex_file, cache_dir = job
+    analyzer = PICDecompilerAnalysis(hex_file, AnalysisCache(cache_dir) if cache_dir else None)
+    if not analyzer.disassemble():
+        return None
+    
+    compiler_scores = sorted(analyzer.detect_compiler().items(), key=lambda x: x[1], reverse=True)
+    complexity = tuple(analyzer.analyze_complexity().items())
+    functions = tuple(
+        (func['start'], func['calls'])
+        for func in analyzer.identify_functions()[:5] if func['end']
+    )
+    analyzer.save_cache()
+    return tuple(compiler_scores), complexity, functions
+
+def analyze_all_firmware(cache: Optional[AnalysisCache] = None, workers: Optional[int] = 1):
     """Analyze all PIC firmware files"""
     bins_dir = Path('_bins')
+    hex_files = sorted(bins_dir.glob("*.hex"))
     
     print("PIC Firmware Decompilation Analysis")
     print("=" * 60)
     
-    for hex_file in bins_dir.glob("*.hex"):
+    cache_dir = str(cache.cache_dir) if cache is not None else None
+    results = parallel_map(_analyze_firmware, [(str(f), cache_dir) for f in hex_files], workers)
+    
+    for hex_file, result in zip(hex_files, results):
         print(f"\nAnalyzing: {hex_file.name}")
         print("-" * 40)
         
-        analyzer = PICDecompilerAnalysis(str(hex_file))
-        
-        if analyzer.disassemble():
+        if result is not None:
+            compiler_scores, complexity, functions = result
+            
             # Detect compiler
-            compiler_scores = analyzer.detect_compiler()
             print("Compiler Detection:")
-            for compiler, score in sorted(compiler_scores.items(), key=lambda x: x[1], reverse=True):
+            for compiler, score in compiler_scores:
                 print(f"  {compiler}: {score:.1%} confidence")
             
             # Analyze complexity
-            complexity = analyzer.analyze_complexity()
             print(f"\nComplexity Analysis:")
-            for key, value in complexity.items():
+            for key, value in complexity:
                 print(f"  {key}: {value}")
             
             # Show sample functions
-            functions = analyzer.identify_functions()[:5]
             if functions:
                 print(f"\nTop Functions (by call frequency):")
-                for func in functions:
-                    if func['end']:
-                        print(f"  0x{func['start']:04X}: called {func['calls']} times")
+                for start, calls in functions:
+                    print(f"  0x{start:04X}: called {calls} times")
         else:
             print("  Failed to disassemble")
     
@@ -362,9 +374,10 @@ def analyze_all_firmware():
     print("Sample C Skeleton Generation")
     print("=" * 60)
     
-    analyzer = PICDecompilerAnalysis(str(sample_file))
+    analyzer = PICDecompilerAnalysis(str(sample_file), cache)
     if analyzer.disassemble():
         c_code = analyzer.generate_c_skeleton()
+        analyzer.save_cache()
         
         # Save skeleton
         output_file = sample_file.stem + "_skeleton.c"
@@ -443,7 +456,17 @@ def explain_decompilation_challenges():
     
     print(explanation)
 
-if __name__ == "__main__":
-    analyze_all_firmware()
+def main():
+    parser = argparse.ArgumentParser(description='Analyze PIC firmware decompilation feasibility')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Decoded image cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='Always decode from scratch')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 = one per CPU)')
+    
+    args = parser.parse_args()
+    
+    analyze_all_firmware(None if args.no_cache else AnalysisCache(args.cache_dir), args.jobs)
     print("\n" + "=" * 60)
-    explain_decompilation_challenges()
\ No newline at end of file
+    explain_decompilation_challenges()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Disassembler
+In-process decoder for the enhanced mid-range instruction set, replacing the
+gpdasm subprocess used by the analysis tools. Output listings match gpdasm.
+"""
+
+import sys
+import argparse
+from array import array
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'burst_mode'))
+from burst_mode_injector import IntelHex  # noqa: E402
+
+# Bump whenever decoded output changes so cached results are invalidated
+DECODER_VERSION = 1
+
+PROGRAM_WORDS = 0x1000      # 4K words of flash
+CONFIG_BASE = 0x8000        # User ID / configuration word space
+CONFIG_WORDS = 0x0009       # 0x8000-0x8008
+ERASED_WORD = 0x3FFF
+
+# Operand forms
+FORM_NONE = 0      # nop, return, ...
+FORM_F = 1         # movwf f / clrf f / tris f
+FORM_FD = 2        # addwf f, d
+FORM_FB = 3        # bsf f, b
+FORM_K = 4         # movlw k / retlw k / ...
+FORM_ADDR = 5      # goto k / call k
+FORM_BANK = 6      # movlb k
+FORM_PAGE = 7      # movlp k
+FORM_REL = 8       # bra k
+FORM_FSR_MM = 9    # moviw ++FSRn
+FORM_FSR_K = 10    # moviw k[FSRn]
+FORM_ADDFSR = 11   # addfsr FSRn, k
+FORM_DATA = 12     # dw (undefined encoding / config words)
+
+# Instruction cycle classes
+SKIP_MNEMONICS = frozenset(['btfsc', 'btfss', 'decfsz', 'incfsz'])
+BRANCH_MNEMONICS = frozenset(['goto', 'call', 'bra', 'brw', 'callw',
+                              'return', 'retlw', 'retfie'])
+
+# Opcode: one entry of the 16384-word decode table
+#   mnemonic  lower-case mnemonic as printed by gpdasm
+#   form      one of the FORM_* constants
+#   arg       file register, literal or target (meaning depends on form)
+#   arg2      destination bit, bit number or FSR index
+#   text      pre-rendered operand text (None for address-relative forms)
+Opcode = namedtuple('Opcode', 'mnemonic form arg arg2 text')
+
+_BYTE_OPS = ('', '', 'subwf', 'decf', 'iorwf', 'andwf', 'xorwf', 'addwf',
+             'movf', 'comf', 'incf', 'decfsz', 'rrf', 'rlf', 'swapf', 'incfsz')
+_BIT_OPS = ('bcf', 'bsf', 'btfsc', 'btfss')
+_LIT_OPS = {0x30: 'movlw', 0x34: 'retlw', 0x38: 'iorlw', 0x39: 'andlw',
+            0x3A: 'xorlw', 0x3C: 'sublw', 0x3E: 'addlw'}
+_FD_OPS_11 = {0x35: 'lslf', 0x36: 'lsrf', 0x37: 'asrf', 0x3B: 'subwfb',
+              0x3D: 'addwfc'}
+_SIMPLE_OPS = {0x0000: 'nop', 0x0001: 'reset', 0x0008: 'return',
+               0x0009: 'retfie', 0x000A: 'callw', 0x000B: 'brw',
+               0x0062: 'option', 0x0063: 'sleep', 0x0064: 'clrwdt'}
+_MM_FORMATS = ('++{}', '--{}', '{}++', '{}--')
+
+
+def _signed(value: int, bits: int) -> int:
+    """Sign-extend a two's complement field"""
+    if value & (1 << (bits - 1)):
+        return value - (1 << bits)
+    return value
+
+
+def _dec(value: int) -> str:
+    """gpdasm-style signed decimal ('.5' / '-.5')"""
+    return f'-.{-value}' if value < 0 else f'.{value}'
+
+
+def _fsr(n: int) -> str:
+    """FSR index rendered like C's %#x, as gpdasm does"""
+    return f'{n:#x}' if n else '0'
+
+
+def _decode(word: int) -> Opcode:
+    """Decode a single 14-bit instruction word"""
+    top = word >> 8
+
+    if word < 0x0080:
+        if word in _SIMPLE_OPS:
+            return Opcode(_SIMPLE_OPS[word], FORM_NONE, 0, 0, '')
+        if 0x0010 <= word <= 0x001F:
+            n = (word >> 2) & 1
+            mnemonic = 'movwi' if word & 0x08 else 'moviw'
+            return Opcode(mnemonic, FORM_FSR_MM, word & 3, n,
+                          _MM_FORMATS[word & 3].format(_fsr(n)))
+        if 0x0020 <= word <= 0x003F:
+            k = word & 0x1F
+            return Opcode('movlb', FORM_BANK, k, 0, f'0x{k:02x}')
+        if 0x0065 <= word <= 0x0067:
+            return Opcode('tris', FORM_F, word & 7, 0, f'0x{word & 7:02x}')
+    elif word < 0x0100:
+        f = word & 0x7F
+        return Opcode('movwf', FORM_F, f, 0, f'0x{f:02x}')
+    elif top == 0x01:
+        if word < 0x0104:
+            return Opcode('clrw', FORM_NONE, 0, 0, '')
+        if word >= 0x0180:
+            f = word & 0x7F
+            return Opcode('clrf', FORM_F, f, 0, f'0x{f:02x}')
+    elif top < 0x10:
+        f, d = word & 0x7F, (word >> 7) & 1
+        return Opcode(_BYTE_OPS[top], FORM_FD, f, d, f'0x{f:02x}, 0x{d:x}')
+    elif top < 0x20:
+        f, b = word & 0x7F, (word >> 7) & 7
+        return Opcode(_BIT_OPS[(word >> 10) & 3], FORM_FB, f, b,
+                      f'0x{f:02x}, 0x{b:x}')
+    elif top < 0x30:
+        k = word & 0x7FF
+        return Opcode('goto' if word & 0x0800 else 'call', FORM_ADDR, k, 0,
+                      f'0x{k:04x}')
+    elif top in _LIT_OPS:
+        k = word & 0xFF
+        return Opcode(_LIT_OPS[top], FORM_K, k, 0, f'0x{k:02x}')
+    elif top == 0x31:
+        if word & 0x80:
+            k = word & 0x7F
+            return Opcode('movlp', FORM_PAGE, k, 0, f'0x{k:02x}')
+        n, k = (word >> 6) & 1, _signed(word & 0x3F, 6)
+        return Opcode('addfsr', FORM_ADDFSR, k, n, f'{4 + 2 * n}, {_dec(k)}')
+    elif top in (0x32, 0x33):
+        return Opcode('bra', FORM_REL, _signed(word & 0x1FF, 9), 0, None)
+    elif top in _FD_OPS_11:
+        f, d = word & 0x7F, (word >> 7) & 1
+        return Opcode(_FD_OPS_11[top], FORM_FD, f, d, f'0x{f:02x}, 0x{d:x}')
+    elif top == 0x3F:
+        n, k = (word >> 6) & 1, _signed(word & 0x3F, 6)
+        mnemonic = 'movwi' if word & 0x80 else 'moviw'
+        return Opcode(mnemonic, FORM_FSR_K, k, n, f'{_dec(k)}[{n}]')
+
+    return Opcode('dw', FORM_DATA, word, 0, f'0x{word:04x}')
+
+
+# Precomputed decode table indexed by the raw 14-bit word
+OPCODE_TABLE = tuple(_decode(word) for word in range(0x4000))
+
+
+def decode(word: int) -> Opcode:
+    """Look up the decoded form of an instruction word"""
+    return OPCODE_TABLE[word & 0x3FFF]
+
+
+def operand_text(opcode: Opcode, address: int) -> str:
+    """Render the operand field for an instruction at the given address"""
+    if opcode.text is None:
+        return f'0x{(address + 1 + opcode.arg) & 0x7FFF:04x}'
+    return opcode.text
+
+
+def format_line(address: int, word: int, opcode: Optional[Opcode] = None) -> str:
+    """Format one listing line the way gpdasm prints it"""
+    if opcode is None:
+        opcode = OPCODE_TABLE[word & 0x3FFF]
+    operands = operand_text(opcode, address)
+    if operands:
+        return f'{address:04x}:  {word:04x}  {opcode.mnemonic:<8}{operands}'
+    return f'{address:04x}:  {word:04x}  {opcode.mnemonic}'
+
+
+def load_words(hex_data: IntelHex) -> Dict[int, int]:
+    """Collect the programmed words of an image, keyed by word address"""
+    return hex_data.programmed_words()
+
+
+def program_image(hex_data: IntelHex) -> array:
+    """Flash contents as a 4K word array, erased words filled with 0x3FFF"""
+    image = array('H')
+    image.frombytes(hex_data.program.data)
+    if sys.byteorder != 'little':
+        image.byteswap()
+    if max(image) > ERASED_WORD:
+        image = array('H', (word & ERASED_WORD for word in image))
+    return image
+
+
+def image_arrays(hex_data: IntelHex) -> Tuple[array, array]:
+    """Programmed word addresses and their raw 14-bit words"""
+    words = load_words(hex_data)
+    return array('H', words.keys()), array('H', (w & 0x3FFF for w in words.values()))
+
+
+# Mnemonic ids used by the instruction store's opcode-class column
+MNEMONICS = tuple(sorted({opcode.mnemonic for opcode in OPCODE_TABLE}))
+MNEMONIC_IDS = {mnemonic: i for i, mnemonic in enumerate(MNEMONICS)}
+DW_ID = MNEMONIC_IDS['dw']
+
+# Per-word field tables, so store columns are built with plain lookups
+_OP_IDS = array('B', (MNEMONIC_IDS[opcode.mnemonic] for opcode in OPCODE_TABLE))
+_FORMS = array('B', (opcode.form for opcode in OPCODE_TABLE))
+_ARGS = array('h', (opcode.arg for opcode in OPCODE_TABLE))
+_ARG2S = array('B', (opcode.arg2 for opcode in OPCODE_TABLE))
+
+
+class Instruction:
+    """Lightweight dict-style view of one row of an InstructionStore"""
+    
+    __slots__ = ('store', 'row')
+    
+    KEYS = ('address', 'opcode', 'mnemonic', 'operands', 'line',
+            'form', 'arg', 'arg2', 'category')
+    
+    def __init__(self, store: 'InstructionStore', row: int):
+        self.store = store
+        self.row = row
+    
+    def __getitem__(self, key: str):
+        store, row = self.store, self.row
+        if key == 'address':
+            return store.address[row]
+        if key == 'opcode':
+            return store.word[row]
+        if key == 'mnemonic':
+            return MNEMONICS[store.op[row]]
+        if key == 'operands':
+            return store.operands(row)
+        if key == 'line':
+            return store.line(row)
+        if key == 'form':
+            return store.form[row]
+        if key == 'arg':
+            return store.arg[row]
+        if key == 'arg2':
+            return store.arg2[row]
+        if key == 'category':
+            return store.category(row)
+        raise KeyError(key)
+    
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.KEYS
+    
+    def __iter__(self):
+        return iter(self.KEYS)
+    
+    def keys(self):
+        return self.KEYS
+    
+    def to_dict(self) -> Dict:
+        return {key: self[key] for key in self.KEYS}
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Instruction):
+            return self['address'] == other['address'] and self['opcode'] == other['opcode']
+        return NotImplemented
+    
+    def __hash__(self) -> int:
+        return hash((self['address'], self['opcode']))
+    
+    def __repr__(self) -> str:
+        return f"Instruction({self.store.line(self.row)!r})"
+
+
+class InstructionStore:
+    """
+    Struct-of-arrays instruction storage: one compact column per field
+    (address, raw word, opcode class, operand fields) plus an address index.
+    Behaves as a sequence of Instruction views for dict-style callers.
+    """
+    
+    def __init__(self, addresses: array, words: array,
+                 categories: Optional[Dict[str, List[str]]] = None):
+        self.address = addresses if isinstance(addresses, array) else array('H', addresses)
+        self.word = words if isinstance(words, array) else array('H', words)
+        
+        op_ids, forms, args, arg2s = _OP_IDS, _FORMS, _ARGS, _ARG2S
+        self.op = array('B', (op_ids[w] for w in self.word))
+        self.form = array('B', (forms[w] for w in self.word))
+        self.arg = array('h', (args[w] for w in self.word))
+        self.arg2 = array('B', (arg2s[w] for w in self.word))
+        
+        # Address index: flash rows in a flat table, config words in a dict
+        self._rows = array('h', [-1]) * PROGRAM_WORDS
+        self._config_rows = {}
+        for row, address in enumerate(self.address):
+            if address < PROGRAM_WORDS:
+                self._rows[address] = row
+            else:
+                # Configuration words are data, not instructions
+                self._config_rows[address] = row
+                self.op[row] = DW_ID
+                self.form[row] = FORM_DATA
+                self.arg[row] = self.word[row]
+                self.arg2[row] = 0
+        
+        self.categories = None
+        if categories is not None:
+            self.set_categories(categories)
+    
+    def set_categories(self, categories: Dict[str, List[str]]):
+        """Attach a mnemonic -> category classification (first match wins)"""
+        lookup = []
+        for mnemonic in MNEMONICS:
+            category = 'unknown'
+            for name, mnemonics in categories.items():
+                if mnemonic in mnemonics:
+                    category = name
+                    break
+            lookup.append(category)
+        self.categories = tuple(lookup)
+    
+    def __len__(self) -> int:
+        return len(self.address)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Instruction(self, row) for row in range(*index.indices(len(self.address)))]
+        if index < 0:
+            index += len(self.address)
+        if not 0 <= index < len(self.address):
+            raise IndexError(index)
+        return Instruction(self, index)
+    
+    def __iter__(self):
+        for row in range(len(self.address)):
+            yield Instruction(self, row)
+    
+    def row_of(self, address: int) -> int:
+        """Row holding an address, or -1"""
+        if 0 <= address < PROGRAM_WORDS:
+            return self._rows[address]
+        return self._config_rows.get(address, -1)
+    
+    def at(self, address: int) -> Optional[Instruction]:
+        """View of the instruction at an address"""
+        row = self.row_of(address)
+        return Instruction(self, row) if row >= 0 else None
+    
+    def mnemonic(self, row: int) -> str:
+        return MNEMONICS[self.op[row]]
+    
+    def operands(self, row: int) -> str:
+        word = self.word[row]
+        if self.op[row] == DW_ID:
+            return f'0x{word:04x}'
+        return operand_text(OPCODE_TABLE[word], self.address[row])
+    
+    def line(self, row: int) -> str:
+        address, word = self.address[row], self.word[row]
+        if self.op[row] == DW_ID:
+            return f'{address:04x}:  {word:04x}  dw      0x{word:04x}'
+        return format_line(address, word)
+    
+    def category(self, row: int) -> str:
+        if self.categories is None:
+            return 'unknown'
+        return self.categories[self.op[row]]
+    
+    def rows_for(self, *mnemonics: str) -> List[int]:
+        """Rows whose mnemonic is one of the given names"""
+        wanted = {MNEMONIC_IDS[m] for m in mnemonics if m in MNEMONIC_IDS}
+        return [row for row, op in enumerate(self.op) if op in wanted]
+    
+    def lines(self) -> List[str]:
+        return [self.line(row) for row in range(len(self.address))]
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the columns and the address index"""
+        columns = (self.address, self.word, self.op, self.form, self.arg, self.arg2, self._rows)
+        return sum(column.itemsize * len(column) for column in columns)
+    
+    def numpy(self) -> Dict:
+        """Zero-copy NumPy views of the columns (requires numpy)"""
+        import numpy as np
+        return {
+            'address': np.frombuffer(self.address, dtype=np.uint16),
+            'word': np.frombuffer(self.word, dtype=np.uint16),
+            'op': np.frombuffer(self.op, dtype=np.uint8),
+            'form': np.frombuffer(self.form, dtype=np.uint8),
+            'arg': np.frombuffer(self.arg, dtype=np.int16),
+            'arg2': np.frombuffer(self.arg2, dtype=np.uint8),
+        }
+
+
+def disassemble_words(addresses: array, words: array) -> InstructionStore:
+    """Decode parallel address/word arrays into an instruction store"""
+    return InstructionStore(addresses, words)
+
+
+def disassemble(hex_data: IntelHex) -> InstructionStore:
+    """Decode every programmed word of an image"""
+    return disassemble_words(*image_arrays(hex_data))
+
+
+def disassemble_file(hex_file: str) -> InstructionStore:
+    """Load and decode an Intel HEX file"""
+    return disassemble(IntelHex(hex_file))
+
+
+def format_listing(instructions: InstructionStore) -> str:
+    """Render a full gpdasm-compatible listing"""
+    return '\n'.join(instructions.lines()) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Disassemble PIC16F1704 firmware')
+    parser.add_argument('hex_file', help='Input HEX file')
+    parser.add_argument('-o', '--output', help='Write listing to file instead of stdout')
+
+    args = parser.parse_args()
+
+    listing = format_listing(disassemble_file(args.hex_file))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(listing)
+    else:
+        sys.stdout.write(listing)
+
+
+if __name__ == "__main__":
+    main()
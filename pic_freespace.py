@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Free-Space Index
+Run-length index of the flash a patch may use: erased words (0x3FFF) and,
+on request, programmed words the control-flow graph never reaches. Runs are
+split at the 2K-word page boundaries, since a section that straddles one
+cannot reach its own labels without changing PCLATH. A best-fit allocator
+places named patch sections in the runs, largest first, each in the
+smallest run that holds it, so large sections keep the large runs.
+"""
+
+import argparse
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from pic_cfg import ControlFlowGraph
+from pic_disasm import ERASED_WORD, PROGRAM_WORDS, IntelHex, InstructionStore, disassemble, program_image
+
+PAGE_WORDS = 0x0800
+# Reset and interrupt vectors are never handed out
+RESERVED_WORDS = 0x0005
+
+ERASED = 'erased'
+UNREACHABLE = 'unreachable'
+
+# start and length in words; kind is ERASED or UNREACHABLE
+FreeRun = namedtuple('FreeRun', 'start length kind')
+Placement = namedtuple('Placement', 'name start length')
+
+
+def page_of(address: int) -> int:
+    return address // PAGE_WORDS
+
+
+class FreeSpaceIndex:
+    """
+    Free runs of one image, kept sorted by address. allocate() carves
+    sections from the front of the chosen run, so the index always shows
+    what is still free.
+    """
+
+    def __init__(self, flash, reachable=None):
+        """
+        flash: the 4K program words (erased = 0x3FFF); reachable: per-word
+        truth values from the CFG, or None to consider erased words only
+        """
+        import numpy as np
+        flash = np.asarray(flash, dtype=np.uint16)[:PROGRAM_WORDS]
+        kind = np.zeros(PROGRAM_WORDS, dtype=np.int8)
+        kind[flash == ERASED_WORD] = 1
+        if reachable is not None:
+            kind[(kind == 0) & ~np.asarray(reachable, dtype=bool)[:PROGRAM_WORDS]] = 2
+        kind[:RESERVED_WORDS] = 0
+
+        # A run starts wherever the kind changes or a page begins
+        change = np.ones(PROGRAM_WORDS, dtype=bool)
+        change[1:] = kind[1:] != kind[:-1]
+        change[::PAGE_WORDS] = True
+        starts = np.flatnonzero(change)
+        lengths = np.diff(np.append(starts, PROGRAM_WORDS))
+        kinds = kind[starts]
+        self.runs: List[FreeRun] = [FreeRun(int(start), int(length), ERASED if k == 1 else UNREACHABLE)
+                                    for start, length, k in zip(starts, lengths, kinds) if k]
+        self.placements: Dict[str, Placement] = {}
+
+    @classmethod
+    def from_store(cls, store: InstructionStore, flash=None, unreachable: bool = False) -> 'FreeSpaceIndex':
+        import numpy as np
+        if flash is None:
+            flash = np.full(PROGRAM_WORDS, ERASED_WORD, dtype=np.uint16)
+            columns = store.numpy()
+            inside = columns['address'] < PROGRAM_WORDS
+            flash[columns['address'][inside]] = columns['word'][inside]
+        reachable = None
+        if unreachable:
+            reachable = np.frombuffer(ControlFlowGraph(store).block_at, dtype=np.int16) >= 0
+        return cls(flash, reachable)
+
+    @classmethod
+    def from_hex(cls, hex_data: IntelHex, unreachable: bool = False) -> 'FreeSpaceIndex':
+        """Index of a loaded image; unreachable also offers dead code (needs the CFG)"""
+        import numpy as np
+        flash = np.frombuffer(program_image(hex_data), dtype=np.uint16)
+        if not unreachable:
+            return cls(flash)
+        return cls.from_store(disassemble(hex_data), flash, unreachable=True)
+
+    @classmethod
+    def from_file(cls, hex_file: str, unreachable: bool = False) -> 'FreeSpaceIndex':
+        return cls.from_hex(IntelHex(hex_file), unreachable)
+
+    def total(self) -> int:
+        return sum(run.length for run in self.runs)
+
+    def largest(self, page: Optional[int] = None) -> int:
+        return max((run.length for run in self.runs if page is None or page_of(run.start) == page), default=0)
+
+    def find(self, words: int, page: Optional[int] = None) -> Optional[int]:
+        """Index of the best-fit run (smallest that holds words, lowest address on ties)"""
+        best = None
+        for index, run in enumerate(self.runs):
+            if run.length < words or (page is not None and page_of(run.start) != page):
+                continue
+            if best is None or run.length < self.runs[best].length:
+                best = index
+        return best
+
+    def allocate(self, name: str, words: int, page: Optional[int] = None) -> Placement:
+        """Place a section of words (in a given 2K page if set) and mark it used"""
+        if name in self.placements:
+            raise ValueError(f'section {name} is already placed')
+        index = self.find(words, page)
+        if index is None:
+            where = f' in page {page}' if page is not None else ''
+            raise ValueError(f'no free run of {words} words{where} for {name} '
+                             f'(largest is {self.largest(page)})')
+        run = self.runs[index]
+        placement = Placement(name, run.start, words)
+        if run.length == words:
+            del self.runs[index]
+        else:
+            self.runs[index] = FreeRun(run.start + words, run.length - words, run.kind)
+        self.placements[name] = placement
+        return placement
+
+    def allocate_all(self, sections: Dict[str, int],
+                     pages: Optional[Dict[str, int]] = None) -> Dict[str, Placement]:
+        """Place several sections, largest first; pages pins some to a 2K page"""
+        pages = pages or {}
+        # Pinned sections first: they have fewer runs to choose from
+        order = sorted(sections, key=lambda name: (name not in pages, -sections[name], name))
+        for name in order:
+            self.allocate(name, sections[name], pages.get(name))
+        return {name: self.placements[name] for name in sections}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Free flash runs of a PIC16F1704 image and patch placement')
+    parser.add_argument('hex_file', help='Image to index')
+    parser.add_argument('--unreachable', action='store_true',
+                        help='Also offer programmed words the CFG never reaches')
+    parser.add_argument('--place', action='append', default=[], metavar='NAME=WORDS[@PAGE]',
+                        help='Place a section of this many words (repeatable)')
+    parser.add_argument('--min', type=int, default=1, help='Only list runs of at least this many words')
+
+    args = parser.parse_args()
+
+    index = FreeSpaceIndex.from_file(args.hex_file, args.unreachable)
+    print(f"{args.hex_file}: {index.total()} free words in {len(index.runs)} runs, "
+          f"largest {index.largest()}")
+    for page in range(PROGRAM_WORDS // PAGE_WORDS):
+        print(f"  page {page}: largest run {index.largest(page)} words")
+    for run in index.runs:
+        if run.length >= args.min:
+            print(f"  0x{run.start:04X}-0x{run.start + run.length - 1:04X}  {run.length:>5} words  {run.kind}")
+
+    if args.place:
+        sections, pages = {}, {}
+        for text in args.place:
+            name, _, size = text.partition('=')
+            size, _, page = size.partition('@')
+            sections[name] = int(size, 0)
+            if page:
+                pages[name] = int(page, 0)
+        try:
+            placements = index.allocate_all(sections, pages)
+        except ValueError as e:
+            raise SystemExit(f"  {e}")
+        print("Placement:")
+        for placement in placements.values():
+            print(f"  {placement.name:<20} 0x{placement.start:04X}-0x{placement.start + placement.length - 1:04X} "
+                  f"({placement.length} words, page {page_of(placement.start)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 I2C Command Fuzzer
+Coverage-guided fuzzing of the firmware's I2C slave code on the simulator.
+Cases are short sequences of I2C transactions, mutated from the burst-mode
+test commands (or a seed script) and kept when they reach a basic block of
+the handler no earlier case reached. Every case starts from one post-boot
+snapshot, so boot runs once. A case is reported when the bus hangs, the
+slave stops answering, the core resets (stack overflow/underflow, watchdog)
+or the handler writes to protection-related RAM.
+"""
+
+import time
+import random
+import argparse
+from collections import namedtuple
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pic_callgraph import CallGraph
+from pic_cfg import ControlFlowGraph, build_cfg
+from pic_disasm import MNEMONIC_IDS, InstructionStore, disassemble_file
+from pic_i2c import I2CMaster, burst_test_script, parse_script
+from pic_periph import Peripherals, load_system
+from pic_sim import PCON, PCON_STKOVF, PCON_STKUNF
+from pic_xref import XrefIndex
+
+# Bank 0 protection thresholds and limits (IDA analysis: byte_DATA_60-6F)
+PROTECTED_RAM = range(0x60, 0x70)
+# Bus idle between the transactions of a case, and after the last one
+GAP_CYCLES = 200
+SETTLE_CYCLES = 10000
+# Address retries allowed to the liveness read that ends every case
+LIVENESS_RETRIES = 20
+# Case size limits
+MAX_TRANSACTIONS = 8
+MAX_BYTES = 24
+MAX_READ = 4
+# Bytes the mutator favours: frame markers, the burst-mode commands, edges
+INTERESTING = (0x00, 0x01, 0x7F, 0x80, 0xFE, 0xFF, 0x55, 0xAA, 0x50, 0x51, 0x52, 0x53, 0x54)
+
+# Literal instructions whose constant the handler compares input against
+_COMPARES = {MNEMONIC_IDS[m] for m in ('movlw', 'xorlw', 'sublw', 'andlw', 'iorlw', 'addlw')}
+
+# A case is a tuple of (bytes written, bytes read) transactions
+Finding = namedtuple('Finding', 'kind detail case cycle')
+
+
+def handler_blocks(store: InstructionStore, cfg: ControlFlowGraph) -> List[int]:
+    """
+    Start addresses of the blocks of every function that accesses SSP1BUF,
+    plus everything those functions call.
+    """
+    owner = cfg.function_owner()
+    xref = XrefIndex(store, cfg)
+    graph = CallGraph(cfg)
+    pending = {owner[cfg.block_containing(address)] for address in xref.accesses('SSP1BUF')
+               if cfg.block_containing(address) >= 0}
+    functions: Set[int] = set()
+    while pending:
+        entry = pending.pop()
+        if entry < 0 or entry in functions:
+            continue
+        functions.add(entry)
+        for callee, _, _, indirect in graph.edges[graph.index[entry]]:
+            if not indirect:
+                pending.add(graph.entries[callee])
+    return [cfg.start[block] for block in range(len(cfg)) if owner[block] in functions]
+
+
+def handler_tokens(store: InstructionStore, words: Iterable[int]) -> List[bytes]:
+    """
+    Mutation dictionary: the literal operands in the handler, and each pair of
+    consecutive ones (frame markers such as 0x55 0xAA are matched a byte apart).
+    """
+    literals = []
+    for address in sorted(words):
+        row = store.row_of(address)
+        if row >= 0 and store.op[row] in _COMPARES:
+            value = store.arg[row] & 0xFF
+            if not literals or literals[-1] != value:
+                literals.append(value)
+    tokens = {bytes([value]) for value in literals}
+    tokens.update(bytes(pair) for pair in zip(literals, literals[1:]))
+    return sorted(tokens)
+
+
+def format_case(case: Iterable[Tuple[bytes, int]]) -> str:
+    """A case as a pic_i2c.py script"""
+    lines = []
+    for written, read in case:
+        data = ' '.join(f'0x{b:02X}' for b in written)
+        if written and read:
+            lines.append(f'transfer {data} : {read}')
+        elif read:
+            lines.append(f'read {read}')
+        else:
+            lines.append(f'write {data}')
+    return '\n'.join(lines)
+
+
+class I2CFuzzer:
+    """Mutation loop over one system, restarting each case from a snapshot"""
+
+    def __init__(self, system: Peripherals, blocks: List[int], words: Set[int],
+                 protected: Iterable[int] = PROTECTED_RAM, seed: Optional[int] = None,
+                 tokens: Iterable[bytes] = ()):
+        self.system = system
+        self.sim = system.sim
+        self.master = I2CMaster(system)
+        self.random = random.Random(seed)
+        self.blocks = blocks
+        # Instruction addresses of the handler, for attributing protected writes
+        self.words = words
+        self.protected = list(protected)
+        self.tokens = list(tokens)
+        self.hits = bytearray(len(blocks))
+        self.coverage = bytearray(len(blocks))
+        self.corpus: List[tuple] = []
+        self.findings: Dict[Tuple[str, str], Finding] = {}
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.executions = 0
+        self.snapshot_cycle = 0
+        self._writes: List[Tuple[int, int, int]] = []
+        self._snapshot = None
+
+    def prepare(self) -> bool:
+        """Boot, then snapshot the idle slave with coverage probes and RAM watches in place"""
+        if not self.master.wait_ready():
+            return False
+        self.master.idle(SETTLE_CYCLES)
+        sim, ram = self.sim, self.sim.ram
+        for index, address in enumerate(self.blocks):
+            sim.add_probe(address, partial(self.hits.__setitem__, index, 1))
+        for address in self.protected:
+            def write(address: int, value: int):
+                ram[address] = value
+                if sim.pc in self.words:
+                    self._writes.append((sim.pc, address, value))
+            sim.set_hook(address, write=write)
+        self._snapshot = self.system.save()
+        self.snapshot_cycle = sim.cycle
+        return True
+
+    # -- execution --------------------------------------------------------
+    def execute(self, case: tuple) -> List[Finding]:
+        """Run one case from the snapshot; self.hits holds its coverage"""
+        system, sim, master = self.system, self.sim, self.master
+        system.restore(self._snapshot)
+        self.hits[:] = bytes(len(self.hits))
+        self._writes.clear()
+        master.transactions.clear()
+        resets, pcon = len(sim.resets), sim.ram[PCON]
+        findings = []
+
+        for written, read in case:
+            transaction = master.transfer(written, read)
+            if transaction.error == 'timeout':
+                findings.append(Finding('hang', f'clock held after {len(transaction.acked)} bytes',
+                                        case, sim.cycle))
+                break
+            if transaction.error == 'reset':
+                break
+            master.idle(GAP_CYCLES)
+        else:
+            master.idle(SETTLE_CYCLES)
+            master.retries = LIVENESS_RETRIES
+            probe = master.transfer((), 1)
+            master.retries = 0
+            if probe.error in ('nack', 'timeout'):
+                findings.append(Finding('unresponsive', f'liveness read: {probe.error}', case, sim.cycle))
+
+        for cycle, cause in sim.resets[resets:]:
+            kind = 'stack' if cause.startswith('stack') else ('watchdog' if cause == 'watchdog' else 'reset')
+            findings.append(Finding(kind, cause, case, cycle))
+        if sim.ram[PCON] & ~pcon & (PCON_STKOVF | PCON_STKUNF) and len(sim.resets) == resets:
+            # STVREN clear: the stack wrapped without a reset
+            findings.append(Finding('stack', f'PCON 0x{sim.ram[PCON]:02X} without reset', case, sim.cycle))
+        for pc, address, value in self._writes:
+            findings.append(Finding('protected-write', f'0x{pc:04X} wrote 0x{value:02X} to 0x{address:02X}',
+                                    case, sim.cycle))
+        self.executions += 1
+        return findings
+
+    def _record(self, case: tuple, findings: List[Finding]) -> bool:
+        """Merge coverage and findings; whether the case reached new blocks"""
+        new = False
+        for index, hit in enumerate(self.hits):
+            if hit and not self.coverage[index]:
+                self.coverage[index] = 1
+                new = True
+        if new:
+            self.corpus.append(case)
+        for finding in findings:
+            key = (finding.kind, finding.detail)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if key not in self.findings:
+                self.findings[key] = finding
+        return new
+
+    # -- mutation ---------------------------------------------------------
+    def _byte(self) -> int:
+        return self.random.choice(INTERESTING) if self.random.random() < 0.5 else self.random.randrange(256)
+
+    def _mutate_bytes(self, data: bytearray):
+        rnd = self.random
+        choice = rnd.randrange(7)
+        if not data or choice == 0:
+            if len(data) < MAX_BYTES:
+                data.insert(rnd.randrange(len(data) + 1), self._byte())
+        elif choice == 1:
+            data[rnd.randrange(len(data))] ^= 1 << rnd.randrange(8)
+        elif choice == 2:
+            data[rnd.randrange(len(data))] = self._byte()
+        elif choice == 3:
+            del data[rnd.randrange(len(data))]
+        elif choice == 4 and len(data) < MAX_BYTES:
+            index = rnd.randrange(len(data))
+            data.insert(index, data[index])
+        elif choice == 5 and self.tokens:
+            index = rnd.randrange(len(data) + 1)
+            data[index:index] = rnd.choice(self.tokens)
+            del data[MAX_BYTES:]
+        else:
+            del data[rnd.randrange(len(data)):]
+
+    def mutate(self, case: tuple) -> tuple:
+        """One to four stacked byte- or transaction-level mutations"""
+        rnd = self.random
+        transactions = [[bytearray(written), read] for written, read in case]
+        for _ in range(rnd.randint(1, 4)):
+            choice = rnd.randrange(10)
+            if not transactions or (choice == 0 and len(transactions) < MAX_TRANSACTIONS):
+                transactions.insert(rnd.randrange(len(transactions) + 1),
+                                    [bytearray(self._byte() for _ in range(rnd.randint(1, 6))), 0])
+            elif choice == 1 and len(transactions) > 1:
+                del transactions[rnd.randrange(len(transactions))]
+            elif choice == 2 and len(transactions) < MAX_TRANSACTIONS:
+                index = rnd.randrange(len(transactions))
+                transactions.insert(index, [bytearray(transactions[index][0]), transactions[index][1]])
+            elif choice == 3 and len(transactions) > 1:
+                first, second = rnd.sample(range(len(transactions)), 2)
+                transactions[first], transactions[second] = transactions[second], transactions[first]
+            elif choice == 4 and self.corpus:
+                # Splice: the tail of another corpus case
+                other = rnd.choice(self.corpus)
+                start = rnd.randrange(len(other))
+                transactions = transactions[:rnd.randint(0, len(transactions))] + \
+                    [[bytearray(written), read] for written, read in other[start:]]
+                del transactions[MAX_TRANSACTIONS:]
+            elif choice == 5:
+                rnd.choice(transactions)[1] = rnd.randint(0, MAX_READ)
+            else:
+                self._mutate_bytes(rnd.choice(transactions)[0])
+        case = tuple((bytes(written), read) for written, read in transactions if written or read)
+        return case or ((bytes([self._byte()]), 0),)
+
+    # -- driver -----------------------------------------------------------
+    def fuzz(self, seeds: List[tuple], iterations: int, seconds: Optional[float] = None):
+        """Run the seeds, then mutate corpus cases for a number of iterations or seconds"""
+        for case in seeds:
+            self._record(case, self.execute(case))
+        if not self.corpus:
+            self.corpus.extend(seeds)
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        for _ in range(iterations):
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            case = self.mutate(self.random.choice(self.corpus))
+            self._record(case, self.execute(case))
+
+
+def seed_cases(script: Optional[str] = None) -> List[tuple]:
+    """One single-transaction case per step of a script (default: burst-mode test commands)"""
+    if script:
+        with open(script) as f:
+            steps = parse_script(f.read())
+    else:
+        steps = burst_test_script()
+    return [((bytes(step[1]), step[2]),) for step in steps if step[0] == 'transfer']
+
+
+def _parse_range(text: str) -> range:
+    start, _, end = text.partition(':')
+    start = int(start, 0)
+    return range(start, int(end, 0) + 1 if end else start + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz the I2C slave code of a PIC16F1704 image on the simulator')
+    parser.add_argument('hex_file', help='Image to fuzz')
+    parser.add_argument('--iterations', type=int, default=2000, help='Mutated cases to run')
+    parser.add_argument('--seconds', type=float, help='Stop after this much host time')
+    parser.add_argument('--seed', type=int, help='Random seed')
+    parser.add_argument('--script', help='Seed transactions (pic_i2c.py script; default: burst-mode test commands)')
+    parser.add_argument('--protect', action='append', metavar='START[:END]',
+                        help='Protected data addresses (default: 0x60:0x6F, repeatable)')
+    parser.add_argument('--blocks', action='store_true', help='Run on the block translation cache')
+
+    args = parser.parse_args()
+
+    store = disassemble_file(args.hex_file)
+    cfg = build_cfg(store)
+    blocks = handler_blocks(store, cfg)
+    words = set()
+    for address in blocks:
+        block = cfg.block_containing(address)
+        words.update(range(cfg.start[block], cfg.end[block] + 1))
+    protected = [address for text in args.protect for address in _parse_range(text)] \
+        if args.protect else PROTECTED_RAM
+
+    if not blocks:
+        print(f"{args.hex_file}: no code accessing SSP1BUF found, fuzzing without coverage")
+    system = load_system(args.hex_file, blocks=args.blocks)
+    fuzzer = I2CFuzzer(system, blocks, words, protected, args.seed, handler_tokens(store, words))
+    if not fuzzer.prepare():
+        print(f"{args.hex_file}: slave never enabled (PC=0x{system.sim.pc:04X})")
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    fuzzer.fuzz(seed_cases(args.script), args.iterations, args.seconds)
+    elapsed = time.perf_counter() - start
+
+    covered = sum(fuzzer.coverage)
+    print(f"{args.hex_file}: handler {len(blocks)} blocks, snapshot at cycle {fuzzer.snapshot_cycle}")
+    print(f"  {fuzzer.executions} cases in {elapsed:.2f} s ({fuzzer.executions / elapsed if elapsed else 0:.0f}/s)")
+    print(f"  Coverage: {covered}/{len(blocks)} blocks, corpus {len(fuzzer.corpus)}")
+    uncovered = [address for index, address in enumerate(blocks) if not fuzzer.coverage[index]]
+    if uncovered:
+        print(f"  Not reached: {' '.join(f'0x{address:04X}' for address in uncovered[:16])}"
+              f"{' ...' if len(uncovered) > 16 else ''}")
+    print(f"  Findings: {len(fuzzer.findings)}")
+    for key, finding in sorted(fuzzer.findings.items()):
+        print(f"  [{finding.kind}] {finding.detail} (x{fuzzer.counts[key]}, cycle {finding.cycle})")
+        for line in format_case(finding.case).splitlines():
+            print(f"      {line}")
+    raise SystemExit(1 if fuzzer.findings else 0)
+
+
+if __name__ == "__main__":
+    main()
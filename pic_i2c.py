@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 I2C Master Stand-in
+Scriptable bus master attached to the emulated MSSP slave of a simulated
+image, in place of the miner control board on J15. Each byte costs nine
+SCL periods of simulated time while the firmware keeps running; when the
+slave stretches the clock the master waits for the firmware to release it.
+Every transaction reports its latency in instruction cycles, Start to Stop.
+
+Throughput is bounded by the simulator: on V71 the burst test script
+(--repeat 300) runs at about 1.2-1.9k transactions per host second on the
+interpreter and write-only scripts at 1.7-2.3k, depending on the host.
+--blocks is slower here (about 1.1k and 1.7k on the same host as the
+upper figures) because bus timing cuts execution into short runs.
+"""
+
+import io
+import time
+import argparse
+import contextlib
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence
+
+from pic_periph import Peripherals, load_system
+from pic_sim import GIE, INTCON
+
+# Standard-mode SCL
+BUS_HZ = 100000
+# Longest clock stretch before the transaction is abandoned (instruction cycles)
+STRETCH_TIMEOUT = 200000
+# Boot budget for wait_ready() (instruction cycles)
+BOOT_CYCLES = 20000000
+# Bus idle time before retrying a transaction whose address was not acknowledged
+RETRY_GAP = 1000
+
+# error: None, 'nack' (address or data refused), 'timeout' (clock held), 'reset'
+# attempts: address-NACK retries + 1; cycles and stretch cover all of them
+Transaction = namedtuple('Transaction', 'address written data acked cycles stretch error attempts')
+
+
+class I2CMaster:
+    """Byte-level master driving a Peripherals.mssp slave"""
+
+    def __init__(self, system: Peripherals, address: Optional[int] = None, bus_hz: int = BUS_HZ,
+                 timeout: int = STRETCH_TIMEOUT, retries: int = 0):
+        self.system = system
+        self.sim = system.sim
+        self.slave = system.mssp
+        self.address = address
+        self.bit_cycles = max(1, round(self.sim.fosc / 4 / bus_hz))
+        self.timeout = timeout
+        # Address NACKs (slave busy or overrun) retried like a bus master would
+        self.retries = retries
+        self._due = 0
+        self.transactions: List[Transaction] = []
+        self.slave.release_callbacks.append(self._released)
+
+    def _released(self):
+        self.sim.stop_reason = 'clock released'
+
+    def slave_address(self) -> int:
+        """Address given explicitly, else the one the firmware loaded into SSP1ADD"""
+        if self.address is not None:
+            return self.address
+        return self.sim.peek('SSP1ADD') >> 1
+
+    def wait_ready(self, max_cycles: int = BOOT_CYCLES) -> bool:
+        """Run until the slave is enabled with interrupts on (the end of boot)"""
+        sim = self.sim
+        end = sim.cycle + max_cycles
+        while sim.cycle < end:
+            if self.slave.enabled() and sim.ram[INTCON] & GIE:
+                return True
+            sim.run(min(10000, end - sim.cycle))
+        return False
+
+    def idle(self, cycles: int):
+        """Leave the bus idle while the firmware runs"""
+        self._advance(cycles)
+
+    # -- bus timing -------------------------------------------------------
+    def _clock(self, bits: int):
+        """Bus time owed to the firmware; run in one go before the next slave event"""
+        self._due += bits * self.bit_cycles
+
+    def _settle(self):
+        self._advance(self._due)
+        self._due = 0
+
+    def _advance(self, cycles: int):
+        sim = self.sim
+        end = sim.cycle + cycles
+        while sim.cycle < end:
+            sim.run(end - sim.cycle)
+            if sim.stop_reason not in (None, 'clock released'):
+                break
+
+    def _stretch(self) -> Optional[int]:
+        """Cycles the slave held SCL low after the acknowledge, or None if it never let go"""
+        sim, slave = self.sim, self.slave
+        if not slave.holding:
+            return 0
+        self._settle()
+        start = sim.cycle
+        while slave.holding:
+            waited = sim.cycle - start
+            if waited >= self.timeout:
+                return None
+            sim.run(self.timeout - waited)
+            if sim.stop_reason not in (None, 'clock released'):
+                return None
+        return sim.cycle - start
+
+    # -- transactions -----------------------------------------------------
+    def transfer(self, write: Sequence[int] = (), read: int = 0,
+                 address: Optional[int] = None) -> Transaction:
+        """
+        Write bytes, then (after a repeated Start when both are given) read
+        bytes, acknowledging all but the last. One Start and one Stop per
+        attempt; a refused address is retried up to self.retries times.
+        """
+        sim = self.sim
+        address = self.slave_address() if address is None else address
+        start, resets = sim.cycle, len(sim.resets)
+        stretch = 0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._advance(RETRY_GAP)
+            acked, data, held, error = self._attempt(write, read, address)
+            stretch += held
+            # Only a refused first address is safe to repeat: nothing was delivered
+            if acked != (False,):
+                break
+        if len(sim.resets) != resets:
+            error = 'reset'
+        transaction = Transaction(address, bytes(write), bytes(data), acked,
+                                  sim.cycle - start, stretch, error, attempt + 1)
+        self.transactions.append(transaction)
+        return transaction
+
+    def _attempt(self, write: Sequence[int], read: int, address: int) -> tuple:
+        """(acks, data read, cycles stretched, error) of one Start ... Stop"""
+        slave = self.slave
+        acked, data = [], []
+        stretch, error = 0, None
+
+        phases = []
+        if write or not read:
+            phases.append((False, list(write)))
+        if read:
+            phases.append((True, read))
+        for reading, payload in phases:
+            self._settle()
+            slave.start()
+            # Start condition, then eight address bits
+            self._clock(9)
+            self._settle()
+            ack = slave.address(address, reading)
+            acked.append(ack)
+            self._clock(1)
+            if not ack:
+                error = 'nack'
+                break
+            for index in range(payload if reading else len(payload)):
+                held = self._stretch()
+                if held is None:
+                    error = 'timeout'
+                    break
+                stretch += held
+                self._clock(8)
+                self._settle()
+                if reading:
+                    data.append(slave.read(index < payload - 1))
+                else:
+                    ack = slave.write(payload[index])
+                    acked.append(ack)
+                self._clock(1)
+                if not ack:
+                    error = 'nack'
+                    break
+            else:
+                held = self._stretch()
+                if held is None:
+                    error = 'timeout'
+                stretch += held or 0
+            if error:
+                break
+        self._settle()
+        slave.stop()
+        self._clock(1)
+        self._settle()
+        return tuple(acked), data, stretch, error
+
+    def write(self, data: Sequence[int], address: Optional[int] = None) -> Transaction:
+        return self.transfer(write=data, address=address)
+
+    def read(self, count: int, address: Optional[int] = None) -> Transaction:
+        return self.transfer(read=count, address=address)
+
+
+def parse_script(text: str) -> List[tuple]:
+    """
+    One step per line: 'write 0x50 0x01', 'read 2', 'transfer 0x53 : 1'
+    (write then read after a repeated Start) or 'idle 5000'. '#' starts a comment.
+    """
+    steps = []
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        command, args = words[0].lower(), words[1:]
+        if command == 'write':
+            steps.append(('transfer', [int(word, 0) for word in args], 0))
+        elif command == 'read':
+            steps.append(('transfer', [], int(args[0], 0)))
+        elif command == 'transfer' and ':' in args:
+            split = args.index(':')
+            steps.append(('transfer', [int(word, 0) for word in args[:split]], int(args[split + 1], 0)))
+        elif command == 'idle':
+            steps.append(('idle', int(args[0], 0)))
+        else:
+            raise ValueError(f"line {number}: cannot parse '{line.strip()}'")
+    return steps
+
+
+def burst_test_script() -> List[tuple]:
+    """The burst-mode validation commands of burst_mode_firmware_patch, as transactions"""
+    from burst_mode_firmware_patch import APW12FirmwarePatcher, generate_test_commands
+    with contextlib.redirect_stdout(io.StringIO()):
+        commands: Dict[str, List[int]] = generate_test_commands()
+    queries = (APW12FirmwarePatcher.I2C_COMMANDS['GET_BURST_STATUS'],
+               APW12FirmwarePatcher.I2C_COMMANDS['GET_LOAD_CURRENT'])
+    steps = []
+    for name, data in commands.items():
+        steps.append(('transfer', data, 1 if data[0] in queries else 0, name))
+    return steps
+
+
+def run_script(master: I2CMaster, steps: List[tuple]) -> List[tuple]:
+    """(step label, Transaction) for each transaction step"""
+    results = []
+    for step in steps:
+        if step[0] == 'idle':
+            master.idle(step[1])
+            continue
+        transaction = master.transfer(step[1], step[2])
+        label = step[3] if len(step) > 3 else \
+            ' '.join(f'{b:02X}' for b in step[1]) + (f' : {step[2]}' if step[2] else '')
+        results.append((label, transaction))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the I2C slave of a simulated PIC16F1704 image')
+    parser.add_argument('hex_file', help='Image to run')
+    parser.add_argument('--script', help='Transaction script (default: burst-mode test commands)')
+    parser.add_argument('--address', type=lambda s: int(s, 0), help='7-bit slave address (default: from SSP1ADD)')
+    parser.add_argument('--bus-hz', type=int, default=BUS_HZ, help='SCL frequency')
+    parser.add_argument('--repeat', type=int, default=1, help='Run the script this many times')
+    parser.add_argument('--retries', type=int, default=0, help='Retry transactions whose address is NACKed')
+    # Bus timing slices execution into runs shorter than most translated
+    # regions, so the plain interpreter is usually the faster engine here
+    parser.add_argument('--blocks', action='store_true', help='Run on the block translation cache')
+
+    args = parser.parse_args()
+
+    system = load_system(args.hex_file, blocks=args.blocks)
+    master = I2CMaster(system, args.address, args.bus_hz, retries=args.retries)
+    if not master.wait_ready():
+        print(f"{args.hex_file}: slave never enabled (PC=0x{system.sim.pc:04X})")
+        raise SystemExit(1)
+    if args.script:
+        with open(args.script) as f:
+            steps = parse_script(f.read())
+    else:
+        steps = burst_test_script()
+
+    print(f"{args.hex_file}: slave 0x{master.slave_address():02X}, "
+          f"{args.bus_hz / 1000:g} kHz bus, ready at cycle {system.sim.cycle}")
+    start = time.perf_counter()
+    results = []
+    for _ in range(args.repeat):
+        results = run_script(master, steps)
+    elapsed = time.perf_counter() - start
+
+    us = 4e6 / system.sim.fosc
+    for label, t in results:
+        acks = ''.join('A' if ack else 'N' for ack in t.acked)
+        response = ' '.join(f'{b:02X}' for b in t.data)
+        print(f"  {label:<22} {acks:<5} {response:<12} {t.cycles:>6} cycles ({t.cycles * us:.0f} us)"
+              f"  stretch {t.stretch}{f'  tries {t.attempts}' if t.attempts > 1 else ''}"
+              f"{'  ' + t.error.upper() if t.error else ''}")
+    count = len(master.transactions)
+    latencies = sorted(t.cycles for t in master.transactions)
+    failed = sum(1 for t in master.transactions if t.error)
+    print(f"  {count} transactions in {elapsed:.3f} s host time "
+          f"({count / elapsed if elapsed else 0:.0f}/s), {failed} failed")
+    if latencies:
+        print(f"  Latency min/median/max: {latencies[0]}/{latencies[len(latencies) // 2]}/{latencies[-1]} cycles")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
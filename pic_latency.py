@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Interrupt Latency and ISR Jitter
+Measures, per interrupt source, the cycles from the interrupt flag rising to
+the first ISR instruction, the cycles spent in the ISR until RETFIE returns,
+and the interval between successive services of the source, on the
+simulator with its peripherals. Samples go into fixed-size log-linear
+histograms, so memory stays constant however long the run. An original and
+a patched image are run over the same stretch and reported side by side, to
+show what an injected hook (such as the burst-mode Timer4 hook) costs the
+timing of every other source.
+
+Flag rises are seen where the peripheral models raise them (event
+callbacks), at the exact cycle. Flags set another way (software, an I2C
+master driven between runs) still count as services but carry no latency.
+"""
+
+import math
+import heapq
+import time
+import argparse
+from array import array
+from collections import namedtuple
+from typing import Dict, Optional, Tuple
+
+from pic_blocks import BlockSimulator
+from pic_disasm import IntelHex
+from pic_parallel import parallel_map
+from pic_periph import ADIF, PIR1, SSP1IF, TIMERS, TMR0IF, Peripherals, attach_peripherals
+from pic_sim import INTCON, PEIE, PIR_PIE, PICSimulator
+from pic_wcet import image_fosc
+
+# Values below 2**HISTOGRAM_BITS are kept exactly; above, each power of two
+# is split into 2**(HISTOGRAM_BITS - 1) buckets (at most 1/32, 3.1%, relative error)
+HISTOGRAM_BITS = 6
+# Largest power of two tracked; bigger samples land in the last bucket
+HISTOGRAM_RANGE = 40
+RUN_SECONDS = 2.0
+# Simulated time skipped before measuring (boot code, peripheral setup)
+BOOT_SECONDS = 1.5
+
+# name, flag register and bit, enable register and bit, needs PEIE
+Source = namedtuple('Source', 'name flag_register flag enable_register enable peripheral')
+# One histogram summary; values in instruction cycles
+Summary = namedtuple('Summary', 'count minimum p50 p90 p99 maximum mean stdev')
+
+_PIE = dict(PIR_PIE)
+SOURCES = (
+    Source('TMR0', INTCON, TMR0IF, INTCON, 0x20, False),
+    *(Source(f'TMR{number}', pir, flag, _PIE[pir], flag, True)
+      for number, (_, _, _, pir, flag) in sorted(TIMERS.items())),
+    Source('ADC', PIR1, ADIF, _PIE[PIR1], ADIF, True),
+    Source('SSP1', PIR1, SSP1IF, _PIE[PIR1], SSP1IF, True),
+)
+# Registers holding any source's flag
+FLAG_REGISTERS = tuple(sorted({source.flag_register for source in SOURCES}))
+
+
+class Histogram:
+    """
+    Streaming histogram of non-negative integers in a fixed array of
+    counters, with exact count, minimum, maximum, mean and deviation.
+    """
+
+    def __init__(self, bits: int = HISTOGRAM_BITS, range_bits: int = HISTOGRAM_RANGE):
+        self.bits = bits
+        self.limit = (1 << range_bits) - 1
+        half = 1 << (bits - 1)
+        self.counts = array('Q', bytes(8 * ((1 << bits) + (range_bits - bits) * half)))
+        self.count = 0
+        self.minimum: Optional[int] = None
+        self.maximum: Optional[int] = None
+        self.total = 0
+        self.squares = 0
+
+    def _bucket(self, value: int) -> int:
+        bits = self.bits
+        if value < 1 << bits:
+            return value
+        shift = value.bit_length() - bits
+        half = 1 << (bits - 1)
+        return (1 << bits) + (shift - 1) * half + (value >> shift) - half
+
+    def _lower(self, bucket: int) -> int:
+        """Smallest value that falls in bucket"""
+        bits = self.bits
+        if bucket < 1 << bits:
+            return bucket
+        half = 1 << (bits - 1)
+        shift, top = divmod(bucket - (1 << bits), half)
+        return (top + half) << (shift + 1)
+
+    def add(self, value: int):
+        value = min(max(value, 0), self.limit)
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other: 'Histogram'):
+        """Add another histogram of the same shape into this one"""
+        if len(other.counts) != len(self.counts):
+            raise ValueError('histograms differ in shape')
+        for bucket, count in enumerate(other.counts):
+            if count:
+                self.counts[bucket] += count
+        if other.count:
+            self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+            self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+
+    def percentile(self, percent: float) -> Optional[int]:
+        """Lower edge of the bucket holding the given percentile, within [min, max]"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self._lower(bucket), self.minimum), self.maximum)
+        return self.maximum
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def stdev(self) -> Optional[float]:
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(0.0, self.squares / self.count - mean * mean))
+
+    def summary(self) -> Summary:
+        return Summary(self.count, self.minimum, self.percentile(50), self.percentile(90),
+                       self.percentile(99), self.maximum, self.mean(), self.stdev())
+
+
+class SourceStats:
+    """Histograms of one source: latency, ISR duration and service interval"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.duration = Histogram()
+        self.interval = Histogram()
+        # Services whose flag rise was not seen
+        self.untimed = 0
+
+    def merge(self, other: 'SourceStats'):
+        self.latency.merge(other.latency)
+        self.duration.merge(other.duration)
+        self.interval.merge(other.interval)
+        self.untimed += other.untimed
+
+
+class LatencyMonitor:
+    """Flag rises, ISR entries and exits of one simulator turned into statistics"""
+
+    def __init__(self, sources=SOURCES):
+        self.sources = sources
+        self.stats: Dict[str, SourceStats] = {source.name: SourceStats() for source in sources}
+        self.all = SourceStats()
+        self.entries = 0
+        # Cycle each source's flag last rose (until serviced)
+        self.raised: Dict[str, int] = {}
+        self.served: Dict[str, int] = {}
+        # Last ISR entry cycle, and the sources of the ISR running (None outside one)
+        self.entry: Optional[int] = None
+        self.serving: Optional[Tuple[str, ...]] = None
+
+    def rising(self, before: bytes, after: bytes, cycle: int):
+        """Record flags set between two snapshots of FLAG_REGISTERS"""
+        for source in self.sources:
+            index = FLAG_REGISTERS.index(source.flag_register)
+            if after[index] & ~before[index] & source.flag:
+                self.raised[source.name] = cycle
+
+    def enter(self, ram, cycle: int):
+        """The ISR starts at cycle; charge it to every enabled source with its flag set"""
+        serving = []
+        for source in self.sources:
+            if not ram[source.flag_register] & source.flag or not ram[source.enable_register] & source.enable:
+                continue
+            if source.peripheral and not ram[INTCON] & PEIE:
+                continue
+            stats = self.stats[source.name]
+            raised = self.raised.pop(source.name, None)
+            if raised is None:
+                stats.untimed += 1
+            else:
+                stats.latency.add(cycle - raised)
+                self.all.latency.add(cycle - raised)
+            previous = self.served.get(source.name)
+            if previous is not None:
+                stats.interval.add(cycle - previous)
+            self.served[source.name] = cycle
+            serving.append(source.name)
+        if self.entry is not None:
+            self.all.interval.add(cycle - self.entry)
+        self.entries += 1
+        self.entry, self.serving = cycle, tuple(serving)
+
+    def leave(self, cycle: int):
+        """RETFIE completed at cycle"""
+        if self.serving is None:
+            return
+        duration = cycle - self.entry
+        for name in self.serving:
+            self.stats[name].duration.add(duration)
+        self.all.duration.add(duration)
+        self.serving = None
+
+    def reset(self, cause: str):
+        # A reset abandons the ISR and any pending flags
+        self.raised.clear()
+        self.serving = None
+
+
+class _Monitored:
+    """Simulator hooks feeding a LatencyMonitor (mixed into an engine class)"""
+
+    monitor: Optional[LatencyMonitor] = None
+
+    def _fire_events(self):
+        monitor = self.monitor
+        if monitor is None:
+            return super()._fire_events()
+        # PICSimulator._fire_events, noting flags each callback raises at its due cycle
+        self._epoch += 1
+        ram = self.ram
+        events = self.events
+        while events and events[0][0] <= self.cycle:
+            due, _, callback = heapq.heappop(events)
+            if callback:
+                before = bytes(ram[address] for address in FLAG_REGISTERS)
+                callback()
+                after = bytes(ram[address] for address in FLAG_REGISTERS)
+                if after != before:
+                    monitor.rising(before, after, due)
+
+    def interrupt(self):
+        super().interrupt()
+        if self.monitor is not None and self.pc == 0x0004:
+            # After the automatic context save: cycle is the first ISR instruction
+            self.monitor.enter(self.ram, self.cycle)
+
+    def retfie(self) -> int:
+        if self.monitor is not None:
+            # Called from the exact path at the start of the two-cycle RETFIE
+            self.monitor.leave(self.cycle + 2)
+        return super().retfie()
+
+
+class LatencySimulator(_Monitored, PICSimulator):
+    pass
+
+
+class LatencyBlockSimulator(_Monitored, BlockSimulator):
+    pass
+
+
+def load_monitored(hex_file: str, blocks: bool = True, fosc: Optional[int] = None) -> Peripherals:
+    """load_system() on an engine that can carry a LatencyMonitor"""
+    hex_data = IntelHex()
+    hex_data.load(hex_file)
+    engine = LatencyBlockSimulator if blocks else LatencySimulator
+    return attach_peripherals(engine(hex_data, fosc))
+
+
+def measure(hex_file: str, cycles: int, start: int = 0, blocks: bool = True,
+            fosc: Optional[int] = None, adc: Optional[Dict[int, float]] = None) -> Tuple[LatencyMonitor, Peripherals]:
+    """Run an image, then measure interrupts over cycles"""
+    system = load_monitored(hex_file, blocks, fosc)
+    sim = system.sim
+    for channel, volts in (adc or {}).items():
+        system.adc.set_voltage(channel, volts)
+    if start:
+        sim.run(start)
+    monitor = sim.monitor = LatencyMonitor()
+    sim.reset_callbacks.append(monitor.reset)
+    end = sim.cycle + cycles
+    while sim.cycle < end:
+        sim.run(end - sim.cycle)
+    sim.monitor = None
+    return monitor, system
+
+
+def _measure_image(task: tuple) -> tuple:
+    """Worker: (monitor, resets while measured, host seconds) for one image"""
+    hex_file, cycles, start, blocks, adc = task
+    began = time.perf_counter()
+    monitor, system = measure(hex_file, cycles, start, blocks, adc=adc)
+    resets = [entry for entry in system.sim.resets if entry[0] >= start]
+    return monitor, resets, time.perf_counter() - began
+
+
+def _cells(summary: Summary, untimed: int = 0) -> str:
+    if not summary.count:
+        return f"{'-':>6}" + ' ' * 35 + (f'{untimed:>6} untimed' if untimed else '')
+    text = (f"{summary.count:>6} {summary.minimum:>6} {summary.p50:>6} {summary.p99:>6} "
+            f"{summary.maximum:>6} {summary.stdev:>8.1f}")
+    return text + (f' +{untimed} untimed' if untimed else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Interrupt latency and ISR duration of two PIC16F1704 images')
+    parser.add_argument('original', help='Reference image')
+    parser.add_argument('patched', help='Image under test')
+    parser.add_argument('--seconds', type=float, default=RUN_SECONDS, help='Simulated time measured')
+    parser.add_argument('--boot-seconds', type=float, default=BOOT_SECONDS,
+                        help='Simulated time run before measuring')
+    parser.add_argument('--adc', action='append', default=[], metavar='CH=VOLTS',
+                        help='Hold an ADC input at a voltage (repeatable)')
+    parser.add_argument('--interpreter', action='store_true', help='Do not translate regions')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 = one per CPU)')
+
+    args = parser.parse_args()
+
+    adc = {}
+    for text in args.adc:
+        channel, _, volts = text.partition('=')
+        adc[int(channel, 0)] = float(volts)
+    fosc = image_fosc(IntelHex(args.original))
+    cycles_per_second = fosc / 4
+    start = int(args.boot_seconds * cycles_per_second)
+    cycles = int(args.seconds * cycles_per_second)
+    images = (args.original, args.patched)
+    results = parallel_map(_measure_image, [(image, cycles, start, not args.interpreter, adc)
+                                            for image in images], args.jobs)
+
+    print(f"Interrupts from {args.boot_seconds:g} s for {args.seconds:g} s simulated "
+          f"(cycles; 1 cycle = {4e6 / fosc:g} us)")
+    for label, image, (monitor, resets, seconds) in zip(('original', 'patched'), images, results):
+        print(f"  {label:<9}{image}: {monitor.entries} ISR entries, {len(resets)} resets "
+              f"({seconds:.2f} s host)")
+        if resets:
+            print(f"           first reset at cycle {resets[0][0]}: {resets[0][1]}")
+    header = f"{'n':>6} {'min':>6} {'p50':>6} {'p99':>6} {'max':>6} {'stdev':>8}"
+    print(f"\n  {'source':<7}{'measure':<10}{'original':<42}  patched")
+    print(f"  {'':<17}{header}     {header}")
+    names = [source.name for source in SOURCES] + ['all']
+    for name in names:
+        sides = [monitor.stats[name] if name != 'all' else monitor.all for monitor, _, _ in results]
+        if not any(side.latency.count or side.duration.count or side.untimed for side in sides):
+            continue
+        for measure_name in ('latency', 'duration', 'interval'):
+            cells = [_cells(getattr(side, measure_name).summary(),
+                            side.untimed if measure_name == 'latency' else 0) for side in sides]
+            print(f"  {name:<7}{measure_name:<10}{cells[0]:<46}{cells[1]}")
+            name = ''
+    if not any(monitor.entries for monitor, _, _ in results):
+        print('  no interrupts taken')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Lockstep Differential Simulation
+Runs an original and a patched image side by side on the simulator with
+their peripherals and feeds both the same stimuli at the same cycle: ADC
+input voltages, external pin levels and I2C transactions. The two runs are
+compared after every quantum of cycles on what the power supply would show
+to the outside: port pin changes, PWM duty/period on each pin, I2C acks and
+read data, and resets. The first divergence is reported per stimulus set;
+sets run in parallel across processes.
+"""
+
+import time
+import random
+import argparse
+from collections import namedtuple
+from typing import List, Optional, Sequence, Tuple
+
+from pic_i2c import I2CMaster, burst_test_script, parse_script
+from pic_parallel import parallel_map
+from pic_periph import Peripherals, load_system
+from pic_wcet import FOSC_HZ
+
+# Cycles run between comparisons
+QUANTUM = 2000
+# Timing slack allowed between matching pin/PWM changes (patched code may run a little longer)
+TOLERANCE = 256
+# Simulated time per stimulus set unless the set says otherwise
+RUN_SECONDS = 2.0
+
+# kind: 'pin', 'pwm', 'i2c' or 'reset'; original/patched: what each side showed
+Divergence = namedtuple('Divergence', 'cycle kind original patched')
+# One stimulus at a cycle: ('adc', channel, volts), ('pin', name, level) or pic_i2c transfer step
+Stimulus = namedtuple('Stimulus', 'cycle action')
+
+
+def parse_stimuli(text: str, fosc: float = FOSC_HZ) -> List[Stimulus]:
+    """
+    One stimulus per line, prefixed with its time in cycles or milliseconds:
+    '250ms adc 2 1.65', '400000 pin RC4 1', '1.2ms write 0x50 0x01',
+    '300ms transfer 0x53 : 1'. '#' starts a comment.
+    """
+    stimuli = []
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        when, command, args = words[0], words[1].lower() if len(words) > 1 else '', words[2:]
+        cycle = round(float(when[:-2]) * fosc / 4000) if when.endswith('ms') else int(when, 0)
+        if command == 'adc':
+            stimuli.append(Stimulus(cycle, ('adc', int(args[0], 0), float(args[1]))))
+        elif command == 'pin':
+            stimuli.append(Stimulus(cycle, ('pin', args[0].upper(), int(args[1], 0))))
+        else:
+            try:
+                steps = parse_script(' '.join(words[1:]))
+            except ValueError:
+                raise ValueError(f"line {number}: cannot parse '{line.strip()}'")
+            stimuli.extend(Stimulus(cycle, step) for step in steps)
+    stimuli.sort(key=lambda stimulus: stimulus.cycle)
+    return stimuli
+
+
+def random_stimuli(seed: int, seconds: float = RUN_SECONDS, fosc: float = FOSC_HZ,
+                   channels: Sequence[int] = (0, 1, 2, 3)) -> List[Stimulus]:
+    """ADC levels every 20-200 ms and the burst-mode test commands at random times"""
+    rnd = random.Random(seed)
+    end = int(seconds * fosc / 4)
+    ms = fosc / 4000
+    stimuli = [Stimulus(0, ('adc', channel, rnd.uniform(0.0, 3.3))) for channel in channels]
+    cycle = 0
+    while True:
+        cycle += int(rnd.uniform(20, 200) * ms)
+        if cycle >= end:
+            break
+        stimuli.append(Stimulus(cycle, ('adc', rnd.choice(channels), rnd.uniform(0.0, 3.3))))
+    # I2C only once the slave is up (boot takes about 1.2 s on V71)
+    for step in burst_test_script():
+        stimuli.append(Stimulus(int(rnd.uniform(0.6, 1.0) * end), step))
+    stimuli.sort(key=lambda stimulus: stimulus.cycle)
+    return stimuli
+
+
+class _Side:
+    """One image under test: its system, bus master and compared-so-far positions"""
+
+    def __init__(self, system: Peripherals):
+        self.system = system
+        self.sim = system.sim
+        self.master = I2CMaster(system)
+        # Entries of ports.log, pwm.log and sim.resets already matched
+        self.matched = {'pin': 0, 'pwm': 0, 'reset': 0}
+
+    def stream(self, kind: str) -> list:
+        if kind == 'pin':
+            return self.system.ports.log
+        if kind == 'pwm':
+            return self.system.pwm.log
+        return self.sim.resets
+
+    def advance(self, cycle: int):
+        if cycle > self.sim.cycle:
+            self.sim.run(cycle - self.sim.cycle)
+
+    def apply(self, action: tuple) -> Optional[tuple]:
+        """Apply a stimulus; I2C steps return (acks, data, error)"""
+        if action[0] == 'adc':
+            self.system.adc.set_voltage(action[1], action[2])
+        elif action[0] == 'pin':
+            self.system.ports.set_pin(action[1], action[2])
+        elif action[0] == 'idle':
+            self.master.idle(action[1])
+        else:
+            transaction = self.master.transfer(action[1], action[2])
+            return transaction.acked, transaction.data.hex(' '), transaction.error
+        return None
+
+
+def _event(kind: str, entry: tuple) -> tuple:
+    """The part of a log entry that must match (everything but the cycle)"""
+    if kind == 'pwm':
+        return entry[1], entry[2], round(entry[3], 6)
+    return tuple(entry[1:])
+
+
+class Lockstep:
+    """Original and patched images driven in lockstep"""
+
+    def __init__(self, original: str, patched: str, blocks: bool = True,
+                 quantum: int = QUANTUM, tolerance: int = TOLERANCE):
+        self.sides = (_Side(load_system(original, blocks=blocks)), _Side(load_system(patched, blocks=blocks)))
+        self.quantum = quantum
+        self.tolerance = tolerance
+
+    def _compare(self, now: int) -> Optional[Divergence]:
+        a, b = self.sides
+        tolerance = self.tolerance
+        for kind in ('reset', 'pin', 'pwm'):
+            left, right = a.stream(kind), b.stream(kind)
+            index = a.matched[kind]
+            while index < len(left) and index < len(right):
+                x, y = left[index], right[index]
+                if _event(kind, x) != _event(kind, y) or abs(x[0] - y[0]) > tolerance:
+                    return Divergence(min(x[0], y[0]), kind, x, y)
+                index += 1
+            a.matched[kind] = b.matched[kind] = index
+            # A change on one side only, with no counterpart within the tolerance
+            if index < len(left) and left[index][0] + tolerance < now:
+                return Divergence(left[index][0], kind, left[index], None)
+            if index < len(right) and right[index][0] + tolerance < now:
+                return Divergence(right[index][0], kind, None, right[index])
+        return None
+
+    def run(self, stimuli: List[Stimulus], cycles: int) -> Tuple[Optional[Divergence], int]:
+        """(first divergence or None, cycles compared)"""
+        a, b = self.sides
+        pending = list(stimuli)
+        now = 0
+        while now < cycles:
+            target = min(now + self.quantum, cycles)
+            if pending and pending[0].cycle < target:
+                target = max(pending[0].cycle, now)
+            a.advance(target)
+            b.advance(target)
+            now = max(a.sim.cycle, b.sim.cycle)
+            while pending and pending[0].cycle <= now:
+                action = pending.pop(0).action
+                first, second = a.apply(action), b.apply(action)
+                if first != second:
+                    return Divergence(now, 'i2c', first, second), now
+                now = max(a.sim.cycle, b.sim.cycle)
+            divergence = self._compare(now)
+            if divergence:
+                return divergence, now
+        return self._compare(cycles + self.tolerance + 1), cycles
+
+
+def _run_set(task: tuple) -> tuple:
+    """Worker: (name, divergence, cycles compared, host seconds) for one stimulus set"""
+    original, patched, name, stimuli, cycles, blocks, tolerance = task
+    start = time.perf_counter()
+    divergence, compared = Lockstep(original, patched, blocks, tolerance=tolerance).run(stimuli, cycles)
+    return name, divergence, compared, time.perf_counter() - start
+
+
+def _describe(value) -> str:
+    if value is None:
+        return 'nothing'
+    if isinstance(value, tuple) and len(value) == 4 and isinstance(value[1], str) and value[1].startswith('R'):
+        _, pin, period, duty = value
+        return f'{pin} {duty * 100:.1f}% of {period} cycles' if period else f'{pin} off'
+    if isinstance(value, tuple) and len(value) == 3 and isinstance(value[1], str) and value[1].startswith('R'):
+        return f'{value[1]}={value[2]}'
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run original and patched PIC16F1704 images in lockstep')
+    parser.add_argument('original', help='Reference image')
+    parser.add_argument('patched', help='Image under test')
+    parser.add_argument('--stimulus', action='append', default=[], help='Stimulus file (repeatable)')
+    parser.add_argument('--random', type=int, default=0, help='Also run this many random stimulus sets')
+    parser.add_argument('--seed', type=int, default=1, help='First seed of the random sets')
+    parser.add_argument('--seconds', type=float, default=RUN_SECONDS, help='Simulated time per set')
+    parser.add_argument('--tolerance', type=int, default=TOLERANCE, help='Timing slack in cycles')
+    parser.add_argument('--interpreter', action='store_true', help='Do not translate regions')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 = one per CPU)')
+
+    args = parser.parse_args()
+
+    fosc = load_system(args.original, blocks=False).sim.fosc
+    cycles = int(args.seconds * fosc / 4)
+    tasks = []
+    for path in args.stimulus:
+        with open(path) as f:
+            tasks.append((path, parse_stimuli(f.read(), fosc)))
+    for seed in range(args.seed, args.seed + args.random):
+        tasks.append((f'random seed {seed}', random_stimuli(seed, args.seconds, fosc)))
+    if not tasks:
+        tasks.append(('no stimulus', []))
+
+    start = time.perf_counter()
+    results = parallel_map(_run_set, [(args.original, args.patched, name, stimuli, cycles,
+                                       not args.interpreter, args.tolerance) for name, stimuli in tasks],
+                           args.jobs)
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.original} vs {args.patched}: {len(results)} stimulus sets, "
+          f"{args.seconds:g} s simulated each, {elapsed:.2f} s host time")
+    diverged = 0
+    for name, divergence, compared, seconds in results:
+        if divergence is None:
+            print(f"  {name:<24} identical through cycle {compared} ({seconds:.2f} s)")
+            continue
+        diverged += 1
+        print(f"  {name:<24} {divergence.kind.upper()} diverges at cycle {divergence.cycle} "
+              f"({divergence.cycle * 4e3 / fosc:.3f} ms)")
+        print(f"      original: {_describe(divergence.original)}")
+        print(f"      patched:  {_describe(divergence.patched)}")
+    raise SystemExit(1 if diverged else 0)
+
+
+if __name__ == "__main__":
+    main()
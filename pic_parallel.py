@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Parallel Corpus Execution
+Process-pool helper shared by the analysis tools. Results always come back in
+input order so reports are deterministic regardless of worker count.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, Optional
+
+
+def resolve_workers(workers: Optional[int]) -> int:
+    """Worker count: None or <= 0 means one per CPU"""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def parallel_map(func: Callable, items: Iterable, workers: Optional[int] = 1,
+                 chunksize: Optional[int] = None) -> List:
+    """
+    Apply a module-level function to every item, in order.
+    With a single worker everything runs in-process (no pool start-up cost).
+    """
+    items = list(items)
+    workers = min(resolve_workers(workers), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, items, chunksize=chunksize))
@@ -0,0 +1,805 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Peripheral Models
+Event-driven models of the peripherals the APW12 firmware drives: Timer0,
+Timer2/4/6 (the Timer4 interrupt), PWM through CCP1/2 and PWM3/4 routed by
+PPS (RC5 to the NCP1654), the ADC, the MSSP in I2C slave mode and the ports.
+Counters are not ticked: each model keeps the cycle its state was last
+settled at, computes register values on demand through read hooks and
+schedules one simulator event for the next flag it will raise. Polling loops
+such as WAIT_ADC, and the main loop once it only waits for interrupts, are
+fast-forwarded to that event (PICSimulator.enable_idle_skip).
+
+Measured with the block cache and idle skip (CPython 3.11): V71 runs 5 s of
+simulated time at about 5x real time (start-up and translation dominate),
+60 s at 25x and 300 s in 8.3 s (36x), with 98% of cycles skipped; Version_F
+runs 30 s at 19x and 300 s at 30x. What remains is mostly the ~200 Timer0
+overflows per second, each of which costs two main-loop passes before the
+loop is skipped again. The interpreter (--interpreter) runs 30 s of V71 at
+about 18x.
+"""
+
+import copy
+import time
+import argparse
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from pic_disasm import IntelHex
+from pic_sim import INTCON, PICSimulator, load_simulator
+from pic_xref import register_address
+
+_R = register_address
+PIR1, PIR2 = _R('PIR1'), _R('PIR2')
+TMR0, OPTION_REG = _R('TMR0'), _R('OPTION_REG')
+ADCON0, ADCON1, ADRESH, ADRESL = _R('ADCON0'), _R('ADCON1'), _R('ADRESH'), _R('ADRESL')
+SSP1BUF, SSP1ADD, SSP1MSK = _R('SSP1BUF'), _R('SSP1ADD'), _R('SSP1MSK')
+SSP1STAT, SSP1CON1, SSP1CON2, SSP1CON3 = _R('SSP1STAT'), _R('SSP1CON1'), _R('SSP1CON2'), _R('SSP1CON3')
+CCPTMRS = _R('CCPTMRS')
+
+# INTCON / PIR bits
+TMR0IF = 0x04
+ADIF, SSP1IF = 0x40, 0x08
+
+# Timer2-type timers: (TMRx, PRx, TxCON, PIR register, interrupt flag)
+TIMERS = {
+    2: (_R('TMR2'), _R('PR2'), _R('T2CON'), PIR1, 0x02),
+    4: (_R('TMR4'), _R('PR4'), _R('T4CON'), PIR2, 0x02),
+    6: (_R('TMR6'), _R('PR6'), _R('T6CON'), PIR2, 0x04),
+}
+TIMER_PRESCALE = (1, 4, 16, 64)
+
+# PWM generators: name -> (duty registers, control register, CCPTMRS shift, PPS output code)
+PWM_SOURCES = {
+    'CCP1': ((_R('CCPR1L'),), _R('CCP1CON'), 0, 0x0C),
+    'CCP2': ((_R('CCPR2L'),), _R('CCP2CON'), 2, 0x0D),
+    'PWM3': ((_R('PWM3DCH'), _R('PWM3DCL')), _R('PWM3CON'), 4, 0x0E),
+    'PWM4': ((_R('PWM4DCH'), _R('PWM4DCL')), _R('PWM4CON'), 6, 0x0F),
+}
+# CCPTMRS selection -> timer number
+PWM_TIMERS = (2, 4, 6, 2)
+
+# Ports: letter -> (PORTx, LATx, TRISx, ANSELx, implemented pins)
+PORTS = {
+    'A': (_R('PORTA'), _R('LATA'), _R('TRISA'), _R('ANSELA'), 0x3F),
+    'C': (_R('PORTC'), _R('LATC'), _R('TRISC'), _R('ANSELC'), 0x3F),
+}
+# Output pins with a PPS register (RA3 is input only)
+PPS_PINS = {f'R{port}{bit}': _R(f'R{port}{bit}PPS')
+            for port in 'AC' for bit in range(6) if (port, bit) != ('A', 3)}
+
+# ADC clock: ADCS -> Fosc divisor (None = FRC)
+ADC_DIVISORS = (2, 8, 32, None, 4, 16, 64, None)
+FRC_TAD = 1.6e-6
+# Acquisition-to-result time of one 10-bit conversion
+CONVERSION_TADS = 11.5
+ADC_VREF = 3.3
+
+# SSP1STAT / SSP1CON1 / SSP1CON2 / SSP1CON3 bits
+SSP_BF, SSP_RW, SSP_S, SSP_P, SSP_DA = 0x01, 0x04, 0x08, 0x10, 0x20
+SSP_CKP, SSP_SSPEN, SSP_SSPOV, SSP_WCOL = 0x10, 0x20, 0x40, 0x80
+SSP_SEN, SSP_ACKSTAT = 0x01, 0x40
+SSP_SCIE, SSP_PCIE = 0x20, 0x40
+# SSPM values of the I2C slave modes (7-bit, 10-bit, and with Start/Stop interrupts)
+SLAVE_MODES = (0x6, 0x7, 0xE, 0xF)
+
+# Saved system: the core, one state per model, and what is needed to build a
+# system to restore it into (pic_snapshot.fork). Event callbacks of the core
+# and the models are kept as (owner, method name): owner -1 is the core,
+# otherwise an index into Peripherals.models.
+SystemState = namedtuple('SystemState', 'core models engine fosc hex_data idle_heads')
+
+
+class Peripheral:
+    """Base for one peripheral attached to a Peripherals bus"""
+
+    # Attributes that connect the model rather than hold its state
+    wiring = ('bus', 'sim', 'ram')
+
+    def __init__(self, bus: 'Peripherals'):
+        self.bus = bus
+        self.sim = bus.sim
+        self.ram = bus.sim.ram
+
+    def reset(self):
+        """Follow a core reset (registers already hold their reset values)"""
+
+    def save(self) -> Dict:
+        """Model state; a pending event is recorded by its sequence number"""
+        state = {}
+        for name, value in vars(self).items():
+            if name in self.wiring:
+                continue
+            if name == '_event':
+                value = value[1] if value is not None and value[2] else None
+            state[name] = copy.copy(value)
+        return state
+
+    def restore(self, state: Dict, events: Dict[int, list]):
+        for name, value in state.items():
+            setattr(self, name, events.get(value) if name == '_event' else copy.copy(value))
+
+
+class Timer0(Peripheral):
+    """
+    8-bit Timer0 on the instruction clock with the OPTION_REG prescaler;
+    overflow sets TMR0IF. The T0CKI pin is not modelled, so the timer stops
+    when clocked from it.
+    """
+
+    def __init__(self, bus: 'Peripherals'):
+        super().__init__(bus)
+        self.overflows = 0
+        self._event = None
+        self._base = 0
+        self._value = 0
+        self._prescale: Optional[int] = None
+        self.sim.set_hook(TMR0, read=self._read, write=self._write)
+        bus.watch(OPTION_REG, self._option)
+
+    def reset(self):
+        if self._event:
+            self.sim.cancel(self._event)
+        self._event = None
+        self._base = self.sim.cycle
+        self._value = self.ram[TMR0]
+        self._configure()
+
+    def _configure(self):
+        option = self.ram[OPTION_REG]
+        if option & 0x20:
+            self._prescale = None
+        else:
+            self._prescale = 1 if option & 0x08 else 2 << (option & 0x07)
+        self._schedule()
+
+    def value(self, cycle: Optional[int] = None) -> int:
+        cycle = self.sim.cycle if cycle is None else cycle
+        if self._prescale is None or cycle <= self._base:
+            return self._value
+        return (self._value + (cycle - self._base) // self._prescale) & 0xFF
+
+    def _settle(self):
+        cycle = self.sim.cycle
+        if self._prescale is not None and cycle > self._base:
+            ticks = (cycle - self._base) // self._prescale
+            self._value = (self._value + ticks) & 0xFF
+            self._base += ticks * self._prescale
+
+    def _schedule(self):
+        if self._event:
+            self.sim.cancel(self._event)
+            self._event = None
+        if self._prescale is not None:
+            self._event = self.sim.schedule(self._base + (256 - self._value) * self._prescale,
+                                            self._overflow)
+
+    def _overflow(self):
+        self._event = None
+        self._settle()
+        self.overflows += 1
+        self.ram[INTCON] |= TMR0IF
+        self._schedule()
+
+    def _read(self, address: int) -> int:
+        self.ram[TMR0] = value = self.value()
+        return value
+
+    def _write(self, address: int, value: int):
+        # A write clears the prescaler and inhibits counting for two cycles
+        self.ram[TMR0] = self._value = value
+        self._base = self.sim.cycle + 2
+        self._schedule()
+
+    def _option(self, address: int, value: int):
+        self._settle()
+        self._configure()
+
+
+class Timer2(Peripheral):
+    """
+    Timer2-type timer: TMRx counts prescaled instruction cycles up to PRx and
+    restarts at zero on the following tick; every OUTPS+1 such matches set the
+    interrupt flag. No event is scheduled while the flag is still set, so a
+    timer nobody services does not interrupt idle skipping; interrupts counts
+    flag raises whether or not the flag was already set. Also the time base
+    of the PWM generators.
+    """
+
+    def __init__(self, bus: 'Peripherals', number: int):
+        super().__init__(bus)
+        self.number = number
+        self.tmr, self.pr, self.con, self.pir, self.flag = TIMERS[number]
+        self.matches = 0
+        self.interrupts = 0
+        self._event = None
+        self._base = 0
+        self._value = 0
+        self._period = 0x100
+        self._prescale: Optional[int] = None
+        self._postscale = 1
+        self._post = 0
+        self.sim.set_hook(self.tmr, read=self._read, write=self._write)
+        bus.watch(self.pr, self._write_pr)
+        bus.watch(self.con, self._write_con)
+        bus.watch(self.pir, self._write_pir, quiet=True)
+
+    def reset(self):
+        if self._event:
+            self.sim.cancel(self._event)
+        self._event = None
+        self._base = self.sim.cycle
+        self._value = self.ram[self.tmr]
+        self._post = 0
+        self._period = self.ram[self.pr] + 1
+        self._configure()
+
+    def _configure(self):
+        con = self.ram[self.con]
+        self._prescale = TIMER_PRESCALE[con & 0x03] if con & 0x04 else None
+        self._postscale = ((con >> 3) & 0x0F) + 1
+        self._schedule()
+
+    def period_cycles(self) -> Optional[int]:
+        """Instruction cycles per TMRx period (None while stopped)"""
+        return None if self._prescale is None else self._period * self._prescale
+
+    def _ticks(self, ticks: int) -> Tuple[int, int]:
+        """(value, matches) after counting ticks from the settled value"""
+        value, period = self._value, self._period
+        if value >= period:
+            # Above PRx: counts on to 0xFF and wraps without a match
+            wrap = 0x100 - value
+            if ticks < wrap:
+                return value + ticks, 0
+            value, ticks = 0, ticks - wrap
+        first = period - value
+        if ticks < first:
+            return value + ticks, 0
+        return (value + ticks) % period, 1 + (ticks - first) // period
+
+    def _to_match(self, matches: int) -> int:
+        """Ticks from the settled value to the given number of matches"""
+        value, period = self._value, self._period
+        ticks = 0
+        if value >= period:
+            ticks, value = 0x100 - value, 0
+        return ticks + period - value + (matches - 1) * period
+
+    def value(self, cycle: Optional[int] = None) -> int:
+        cycle = self.sim.cycle if cycle is None else cycle
+        if self._prescale is None or cycle <= self._base:
+            return self._value
+        return self._ticks((cycle - self._base) // self._prescale)[0]
+
+    def _settle(self):
+        cycle = self.sim.cycle
+        if self._prescale is not None and cycle > self._base:
+            ticks = (cycle - self._base) // self._prescale
+            self._value, matches = self._ticks(ticks)
+            self.matches += matches
+            raised, self._post = divmod(self._post + matches, self._postscale)
+            self.interrupts += raised
+            self._base += ticks * self._prescale
+
+    def _schedule(self):
+        if self._event:
+            self.sim.cancel(self._event)
+            self._event = None
+        # Raising a flag that is already set changes nothing; the PIR watch
+        # schedules again once the firmware clears it
+        if self._prescale is not None and not self.ram[self.pir] & self.flag:
+            ticks = self._to_match(self._postscale - self._post)
+            self._event = self.sim.schedule(self._base + ticks * self._prescale, self._interrupt)
+
+    def _interrupt(self):
+        self._event = None
+        self._settle()
+        self.ram[self.pir] |= self.flag
+        self._schedule()
+
+    def _write_pir(self, address: int, value: int):
+        if self._event is None and not value & self.flag:
+            self._settle()
+            self._schedule()
+
+    def _read(self, address: int) -> int:
+        self.ram[address] = value = self.value()
+        return value
+
+    def _write(self, address: int, value: int):
+        # Clears the prescaler and postscaler counts
+        self._settle()
+        self.ram[address] = self._value = value
+        self._base = self.sim.cycle
+        self._post = 0
+        self._schedule()
+
+    def _write_pr(self, address: int, value: int):
+        self._settle()
+        self._period = value + 1
+        self._schedule()
+        self.bus.pwm.update()
+
+    def _write_con(self, address: int, value: int):
+        self._settle()
+        self._base = self.sim.cycle
+        self._post = 0
+        self._configure()
+        self.bus.pwm.update()
+
+
+class PWM(Peripheral):
+    """
+    10-bit PWM outputs of CCP1/2 (CCPRxL:DCxB) and PWM3/4 (PWMxDCH:DCL) on
+    the timer CCPTMRS selects, driving the pins whose RxyPPS selects them.
+    Duty changes apply at once rather than at the next period boundary.
+    """
+
+    def __init__(self, bus: 'Peripherals'):
+        super().__init__(bus)
+        # pin -> (period in cycles, duty fraction); absent when not driven
+        self.outputs: Dict[str, Tuple[int, float]] = {}
+        self.log: List[Tuple[int, str, int, float]] = []
+        for duty, control, _, _ in PWM_SOURCES.values():
+            for address in duty + (control,):
+                bus.watch(address, self._changed, quiet=True)
+        bus.watch(CCPTMRS, self._changed, quiet=True)
+        for address in PPS_PINS.values():
+            bus.watch(address, self._changed, quiet=True)
+
+    def reset(self):
+        self.update()
+
+    def _changed(self, address: int, value: int):
+        self.update()
+
+    def source_state(self, name: str) -> Optional[Tuple[int, float]]:
+        """(period in cycles, duty fraction) of a generator, None when off"""
+        duty_registers, control, shift, _ = PWM_SOURCES[name]
+        ram = self.ram
+        con = ram[control]
+        if name.startswith('CCP'):
+            if con & 0x0C != 0x0C:
+                return None
+            duty = (ram[duty_registers[0]] << 2) | ((con >> 4) & 0x03)
+            inverted = False
+        else:
+            if not con & 0x80:
+                return None
+            duty = (ram[duty_registers[0]] << 2) | (ram[duty_registers[1]] >> 6)
+            inverted = bool(con & 0x10)
+        timer = self.bus.timers[PWM_TIMERS[(ram[CCPTMRS] >> shift) & 0x03]]
+        period = timer.period_cycles()
+        if period is None:
+            return None
+        # Duty is counted in oscillator periods (4 per instruction cycle)
+        fraction = min(1.0, duty / (4.0 * timer._period))
+        return period, 1.0 - fraction if inverted else fraction
+
+    def update(self):
+        ram = self.ram
+        states = {name: self.source_state(name) for name in PWM_SOURCES}
+        codes = {code: name for name, (_, _, _, code) in PWM_SOURCES.items()}
+        outputs = {}
+        for pin, pps in PPS_PINS.items():
+            name = codes.get(ram[pps])
+            if name is None or states[name] is None:
+                continue
+            _, _, tris, _, _ = PORTS[pin[1]]
+            if not ram[tris] & (1 << int(pin[2])):
+                outputs[pin] = states[name]
+        for pin in sorted(set(outputs) | set(self.outputs)):
+            state = outputs.get(pin)
+            if state != self.outputs.get(pin):
+                period, duty = state if state else (0, 0.0)
+                self.log.append((self.sim.cycle, pin, period, duty))
+        self.outputs = outputs
+
+    def pwm_state(self, pin: str) -> Optional[Tuple[int, float]]:
+        """(period in cycles, duty fraction) driven on a pin such as 'RC5'"""
+        return self.outputs.get(pin)
+
+    def frequency(self, pin: str) -> Optional[float]:
+        state = self.outputs.get(pin)
+        return None if state is None else self.sim.fosc / 4 / state[0]
+
+
+class ADC(Peripheral):
+    """
+    10-bit ADC: setting GO with ADON schedules the result 11.5 TAD later;
+    completion writes ADRESH:ADRESL (ADFM justified), clears GO and sets
+    ADIF. Inputs are fixed codes or callables of the cycle, per channel.
+    """
+
+    def __init__(self, bus: 'Peripherals'):
+        super().__init__(bus)
+        self.inputs: Dict[int, Union[int, Callable[[int], int]]] = {}
+        self.conversions = 0
+        self._event = None
+        bus.watch(ADCON0, self._control)
+
+    def reset(self):
+        if self._event:
+            self.sim.cancel(self._event)
+        self._event = None
+
+    def set_input(self, channel: int, value: Union[int, Callable[[int], int]]):
+        """Conversion result for a channel: a 10-bit code or callable(cycle) -> code"""
+        self.inputs[channel] = value
+
+    def set_voltage(self, channel: int, volts: float, reference: float = ADC_VREF):
+        self.inputs[channel] = max(0, min(1023, round(volts / reference * 1023)))
+
+    def conversion_cycles(self) -> int:
+        divisor = ADC_DIVISORS[(self.ram[ADCON1] >> 4) & 0x07]
+        if divisor is None:
+            return max(1, round(CONVERSION_TADS * FRC_TAD * self.sim.fosc / 4))
+        return max(1, round(CONVERSION_TADS * divisor / 4))
+
+    def _control(self, address: int, value: int):
+        if not value & 0x01:
+            self.ram[ADCON0] = value & ~0x02 & 0xFF
+        if self.ram[ADCON0] & 0x02:
+            if self._event is None:
+                self._event = self.sim.schedule(self.sim.cycle + self.conversion_cycles(), self._complete)
+        elif self._event is not None:
+            # GO cleared by software aborts the conversion
+            self.sim.cancel(self._event)
+            self._event = None
+
+    def _complete(self):
+        self._event = None
+        ram = self.ram
+        channel = (ram[ADCON0] >> 2) & 0x1F
+        source = self.inputs.get(channel, 0)
+        code = (source(self.sim.cycle) if callable(source) else source) & 0x3FF
+        if ram[ADCON1] & 0x80:
+            ram[ADRESH], ram[ADRESL] = code >> 8, code & 0xFF
+        else:
+            ram[ADRESH], ram[ADRESL] = code >> 2, (code & 0x03) << 6
+        ram[ADCON0] &= ~0x02 & 0xFF
+        ram[PIR1] |= ADIF
+        self.conversions += 1
+
+
+class MSSPSlave(Peripheral):
+    """
+    MSSP in I2C slave mode as seen from the bus. A master drives it through
+    start(), address(), write(), read() and stop(); each call is one complete
+    bus phase including the acknowledge, and raises SSP1IF as the hardware
+    does on the ninth clock. The clock is held low (CKP clear) after an
+    address or data byte the firmware must service; release callbacks run
+    when the firmware sets CKP again.
+    """
+
+    wiring = Peripheral.wiring + ('release_callbacks',)
+
+    def __init__(self, bus: 'Peripherals'):
+        super().__init__(bus)
+        self.holding = False
+        self.release_callbacks: List[Callable[[], None]] = []
+        self.interrupts = 0
+        self.sim.set_hook(SSP1BUF, read=self._read_buffer, write=self._write_buffer)
+        self.sim.set_hook(SSP1STAT, write=self._write_status)
+        bus.watch(SSP1CON1, self._write_control)
+
+    def reset(self):
+        self.holding = False
+
+    def enabled(self) -> bool:
+        con1 = self.ram[SSP1CON1]
+        return bool(con1 & SSP_SSPEN) and con1 & 0x0F in SLAVE_MODES
+
+    def _interrupt(self):
+        self.interrupts += 1
+        self.ram[PIR1] |= SSP1IF
+
+    def _start_stop_interrupts(self) -> bool:
+        # PCIE/SCIE, or the SSPM modes that always interrupt on Start and Stop
+        return self.enabled() and bool(self.ram[SSP1CON1] & 0x08)
+
+    def _hold(self):
+        self.ram[SSP1CON1] &= ~SSP_CKP & 0xFF
+        self.holding = True
+
+    # -- bus side ---------------------------------------------------------
+    def start(self):
+        ram = self.ram
+        ram[SSP1STAT] = (ram[SSP1STAT] & ~SSP_P & 0xFF) | SSP_S
+        if self.enabled() and ram[SSP1CON3] & SSP_SCIE or self._start_stop_interrupts():
+            self._interrupt()
+
+    def stop(self):
+        ram = self.ram
+        ram[SSP1STAT] = (ram[SSP1STAT] & ~(SSP_S | SSP_RW) & 0xFF) | SSP_P
+        self.holding = False
+        if self.enabled() and ram[SSP1CON3] & SSP_PCIE or self._start_stop_interrupts():
+            self._interrupt()
+
+    def address(self, address: int, read: bool) -> bool:
+        """Address byte (7-bit); returns whether the slave acknowledged"""
+        ram = self.ram
+        if not self.enabled():
+            return False
+        byte = (address << 1) | int(read)
+        mask = ram[SSP1MSK] & 0xFE
+        if (byte & mask) != (ram[SSP1ADD] & mask):
+            return False
+        status = ram[SSP1STAT]
+        if status & SSP_BF or ram[SSP1CON1] & SSP_SSPOV:
+            ram[SSP1CON1] |= SSP_SSPOV
+            self._interrupt()
+            return False
+        ram[SSP1BUF] = byte
+        status = (status & ~(SSP_DA | SSP_RW | SSP_P) & 0xFF) | SSP_BF | SSP_S
+        ram[SSP1STAT] = status | SSP_RW if read else status
+        if read or ram[SSP1CON2] & SSP_SEN:
+            self._hold()
+        self._interrupt()
+        return True
+
+    def write(self, byte: int) -> bool:
+        """Data byte from the master; returns whether the slave acknowledged"""
+        ram = self.ram
+        if ram[SSP1STAT] & SSP_BF or ram[SSP1CON1] & SSP_SSPOV:
+            ram[SSP1CON1] |= SSP_SSPOV
+            self._interrupt()
+            return False
+        ram[SSP1BUF] = byte & 0xFF
+        ram[SSP1STAT] |= SSP_BF | SSP_DA
+        if ram[SSP1CON2] & SSP_SEN:
+            self._hold()
+        self._interrupt()
+        return True
+
+    def read(self, ack: bool) -> int:
+        """Data byte to the master, which answers with ack (more wanted) or not"""
+        ram = self.ram
+        byte = ram[SSP1BUF]
+        ram[SSP1STAT] = (ram[SSP1STAT] & ~SSP_BF & 0xFF) | SSP_DA
+        if ack:
+            ram[SSP1CON2] &= ~SSP_ACKSTAT & 0xFF
+            self._hold()
+        else:
+            # The transfer ends; R/W reads back clear until the next address
+            ram[SSP1CON2] |= SSP_ACKSTAT
+            ram[SSP1STAT] &= ~SSP_RW & 0xFF
+        self._interrupt()
+        return byte
+
+    # -- firmware side ----------------------------------------------------
+    def _read_buffer(self, address: int) -> int:
+        self.ram[SSP1STAT] &= ~SSP_BF & 0xFF
+        return self.ram[SSP1BUF]
+
+    def _write_buffer(self, address: int, value: int):
+        ram = self.ram
+        if ram[SSP1STAT] & SSP_RW:
+            if ram[SSP1STAT] & SSP_BF:
+                ram[SSP1CON1] |= SSP_WCOL
+                return
+            ram[SSP1STAT] |= SSP_BF
+        ram[SSP1BUF] = value
+
+    def _write_status(self, address: int, value: int):
+        # Only SMP and CKE are writable
+        self.ram[SSP1STAT] = (self.ram[SSP1STAT] & 0x3F) | (value & 0xC0)
+
+    def _write_control(self, address: int, value: int):
+        if self.holding and value & SSP_CKP:
+            self.holding = False
+            for callback in self.release_callbacks:
+                callback()
+
+
+class Ports(Peripheral):
+    """
+    PORTA/PORTC kept in data memory at their pin levels whenever LATx, TRISx,
+    ANSELx or an external input changes, so reading a port needs no hook.
+    Output level changes are logged per pin.
+    """
+
+    def __init__(self, bus: 'Peripherals'):
+        super().__init__(bus)
+        # External levels driven onto input pins, per port
+        self.inputs = {port: 0 for port in PORTS}
+        self.log: List[Tuple[int, str, int]] = []
+        self._outputs = {port: (0, 0) for port in PORTS}
+        for port, (port_register, lat, tris, ansel, _) in PORTS.items():
+            self.sim.set_hook(port_register, write=self._write_port)
+            for address in (lat, tris, ansel):
+                bus.watch(address, self._changed, quiet=True)
+
+    def reset(self):
+        for port in PORTS:
+            self.update(port)
+
+    def _port_of(self, address: int) -> str:
+        for port, registers in PORTS.items():
+            if address in registers[:4]:
+                return port
+        raise KeyError(address)
+
+    def _write_port(self, address: int, value: int):
+        # Writes to PORTx go to the output latch
+        port = self._port_of(address)
+        self.ram[PORTS[port][1]] = value
+        self.update(port)
+
+    def _changed(self, address: int, value: int):
+        port = self._port_of(address)
+        self.update(port)
+        if address == PORTS[port][2]:
+            self.bus.pwm.update()
+
+    def update(self, port: str):
+        ram = self.ram
+        port_register, lat, tris, ansel, mask = PORTS[port]
+        direction = ram[tris]
+        levels = (ram[lat] & ~direction) | (self.inputs[port] & direction & ~ram[ansel])
+        ram[port_register] = levels & mask
+        outputs = (~direction & mask, ram[lat] & ~direction & mask)
+        previous = self._outputs[port]
+        if outputs != previous:
+            changed = (outputs[1] ^ previous[1]) | (outputs[0] ^ previous[0])
+            for bit in range(8):
+                if changed & (1 << bit) and outputs[0] & (1 << bit):
+                    self.log.append((self.sim.cycle, f'R{port}{bit}', (outputs[1] >> bit) & 1))
+            self._outputs[port] = outputs
+
+    def set_pin(self, pin: str, level: int):
+        """Drive an input pin ('RC4') from outside"""
+        port, bit = pin[1], int(pin[2])
+        if level:
+            self.inputs[port] |= 1 << bit
+        else:
+            self.inputs[port] &= ~(1 << bit)
+        self.update(port)
+
+    def level(self, pin: str) -> int:
+        port_register = PORTS[pin[1]][0]
+        return (self.ram[port_register] >> int(pin[2])) & 1
+
+
+class Peripherals:
+    """
+    The peripheral set of one simulator. Registers watched by several models
+    share a single write hook that stores the value and then notifies each
+    model in turn.
+    """
+
+    def __init__(self, sim: PICSimulator, idle_skip: bool = True):
+        self.sim = sim
+        self._watchers: Dict[int, List[Callable[[int, int], None]]] = {}
+        self.timer0 = Timer0(self)
+        self.timers = {number: Timer2(self, number) for number in TIMERS}
+        self.pwm = PWM(self)
+        self.adc = ADC(self)
+        self.mssp = MSSPSlave(self)
+        self.ports = Ports(self)
+        self.models: List[Peripheral] = [self.timer0, *self.timers.values(),
+                                         self.pwm, self.adc, self.mssp, self.ports]
+        sim.reset_callbacks.append(self._reset)
+        self._reset('power-on')
+        if idle_skip:
+            sim.enable_idle_skip()
+
+    def watch(self, address: int, callback: Callable[[int, int], None], quiet: bool = False):
+        """
+        Call callback(address, value) after every program write to address. A
+        quiet callback depends only on the register contents, so rewriting the
+        value already held need not reach it (PICSimulator.set_hook); the
+        register is quiet while all of its callbacks are.
+        """
+        watchers = self._watchers.get(address)
+        if watchers is None:
+            watchers = self._watchers[address] = []
+            ram = self.sim.ram
+
+            def write(address: int, value: int):
+                ram[address] = value
+                for watcher in watchers:
+                    watcher(address, value)
+            self.sim.set_hook(address, write=write, quiet=quiet)
+        elif not quiet:
+            self.sim.quiet_writes.discard(address)
+        watchers.append(callback)
+
+    def _reset(self, cause: str):
+        for model in self.models:
+            model.reset()
+
+    def save(self) -> SystemState:
+        """Core and peripheral state, for restore() on this system or a fork of it"""
+        owners = {id(self.sim): -1}
+        owners.update((id(model), index) for index, model in enumerate(self.models))
+
+        def translate(callback):
+            owner = owners.get(id(getattr(callback, '__self__', None)))
+            return callback if owner is None else (owner, callback.__name__)
+        sim = self.sim
+        return SystemState(sim.save(translate), tuple(model.save() for model in self.models),
+                           type(sim), sim.fosc, sim.hex_data, frozenset(sim.idle_heads))
+
+    def restore(self, state: SystemState):
+        def resolve(callback):
+            if not isinstance(callback, tuple):
+                return callback
+            owner, name = callback
+            return getattr(self.sim if owner < 0 else self.models[owner], name)
+        events = self.sim.restore(state.core, resolve)
+        for model, saved in zip(self.models, state.models):
+            model.restore(saved, events)
+
+    def summary(self) -> Dict:
+        for timer in self.timers.values():
+            timer._settle()
+        return {
+            'timer0_overflows': self.timer0.overflows,
+            'timer_interrupts': {number: timer.interrupts for number, timer in self.timers.items()},
+            'adc_conversions': self.adc.conversions,
+            'ssp_interrupts': self.mssp.interrupts,
+            'pwm': dict(self.pwm.outputs),
+            'idle_cycles': self.sim.idle_cycles,
+        }
+
+
+def attach_peripherals(sim: PICSimulator, idle_skip: bool = True) -> Peripherals:
+    return Peripherals(sim, idle_skip)
+
+
+def load_system(hex_file: str, blocks: bool = True, fosc: Optional[int] = None,
+                idle_skip: bool = True) -> Peripherals:
+    """Simulator (translated regions unless blocks is False) with peripherals attached"""
+    if blocks:
+        from pic_blocks import BlockSimulator
+        hex_data = IntelHex()
+        hex_data.load(hex_file)
+        sim = BlockSimulator(hex_data, fosc)
+    else:
+        sim = load_simulator(hex_file, fosc)
+    return attach_peripherals(sim, idle_skip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a PIC16F1704 image against its peripherals')
+    parser.add_argument('hex_file', help='Image to run')
+    parser.add_argument('--seconds', type=float, default=1.0, help='Simulated time')
+    parser.add_argument('--adc', action='append', default=[], metavar='CH=VOLTS',
+                        help='Fixed ADC input voltage, e.g. 2=1.65 (repeatable)')
+    parser.add_argument('--interpreter', action='store_true', help='Do not translate regions')
+    parser.add_argument('--no-idle-skip', action='store_true', help='Execute polling loops in full')
+
+    args = parser.parse_args()
+
+    system = load_system(args.hex_file, blocks=not args.interpreter, idle_skip=not args.no_idle_skip)
+    for setting in args.adc:
+        channel, volts = setting.split('=')
+        system.adc.set_voltage(int(channel, 0), float(volts))
+    sim = system.sim
+
+    start = time.perf_counter()
+    sim.run(int(args.seconds * sim.fosc / 4))
+    elapsed = time.perf_counter() - start
+
+    summary = system.summary()
+    print(f"{args.hex_file}")
+    print(f"  {sim.seconds():.3f} s simulated in {elapsed:.3f} s host time "
+          f"({sim.seconds() / elapsed if elapsed else 0:.2f}x real time, "
+          f"{sim.executed / elapsed / 1e6 if elapsed else 0:.2f} MIPS)")
+    print(f"  Idle loops skipped: {summary['idle_cycles'] / sim.cycle * 100 if sim.cycle else 0:.1f}% of cycles")
+    timers = ', '.join(f"Timer{number}: {count}" for number, count in summary['timer_interrupts'].items())
+    print(f"  Timer flags: Timer0: {summary['timer0_overflows']}, {timers}")
+    print(f"  ADC conversions: {summary['adc_conversions']}  MSSP interrupts: {summary['ssp_interrupts']}")
+    for pin, (period, duty) in sorted(summary['pwm'].items()):
+        print(f"  PWM {pin}: {sim.fosc / 4 / period:.0f} Hz, {duty * 100:.1f}% duty")
+    for cycle, cause in sim.resets[1:6]:
+        print(f"  Reset at cycle {cycle}: {cause}")
+    if len(sim.resets) > 6:
+        print(f"  ... {len(sim.resets) - 6} more resets")
+    print(f"  PC=0x{sim.pc:04X}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Reverse Execution
+Time-travel debugging on the simulator: run an image forward until a fault
+(a reset such as a stack overflow or the watchdog, a write to a watched
+register, a breakpoint), then step backward to the instruction that caused
+it. Running forward saves a system snapshot every so many cycles; going back
+restores the nearest earlier snapshot and replays forward to the wanted
+instruction, so no per-instruction state is kept. The checkpoint interval
+trades memory (one snapshot per interval) against the replay each backward
+step costs (up to one interval).
+"""
+
+import time
+import argparse
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from pic_disasm import format_line
+from pic_periph import Peripherals, load_system
+from pic_sim import WREG
+from pic_xref import register_address, register_name
+
+# Default cycles between checkpoints (5 ms of device time at 16 MHz)
+CHECKPOINT_CYCLES = 20000
+# Past this many checkpoints every other one is dropped and the interval doubles
+MAX_CHECKPOINTS = 4096
+
+# One instruction boundary: the cycle it starts at and the PC about to run
+Position = namedtuple('Position', 'cycle pc')
+Checkpoint = namedtuple('Checkpoint', 'cycle state')
+
+
+class ReverseDebugger:
+    """
+    One image on the simulator with a checkpointed history. Positions are
+    instruction boundaries, identified by their cycle (interrupt entries and
+    skipped idle loops count as one step each). Inputs changed on the system
+    between run() calls are kept, since each call starts with a checkpoint.
+    """
+
+    def __init__(self, hex_file: str, interval: int = CHECKPOINT_CYCLES,
+                 max_checkpoints: int = MAX_CHECKPOINTS, blocks: bool = True, idle_skip: bool = True):
+        self.system: Peripherals = load_system(hex_file, blocks=blocks, idle_skip=idle_skip)
+        self.sim = self.system.sim
+        self.interval = interval
+        self.max_checkpoints = max(2, max_checkpoints)
+        self.checkpoints: List[Checkpoint] = []
+        # Furthest cycle reached; checkpoints are only taken there
+        self.frontier = self.sim.cycle
+        self.fault: Optional[str] = None
+        self._faulting = True
+        self._history: Optional[Tuple[int, int, List[Position]]] = None
+        self.watched: Set[int] = set()
+        self._hooked: Set[int] = set()
+        # Address whose writes history() replays record, and their cycles
+        self._tracked: Optional[int] = None
+        self._writes: Set[int] = set()
+        self.sim.reset_callbacks.append(self._reset)
+        self._checkpoint()
+
+    # -- faults -----------------------------------------------------------
+    def _stop(self, reason: str):
+        if self._faulting:
+            self.fault = reason
+            self.sim.stop_reason = reason
+
+    def _reset(self, cause: str):
+        self._stop(f'reset: {cause}')
+
+    def _hook(self, address: int):
+        """Route program writes to address through _written (once per address)"""
+        if address in self._hooked:
+            return
+        sim, ram = self.sim, self.sim.ram
+        previous = sim.write_hooks.get(address)
+
+        def write(address: int, value: int):
+            if previous:
+                previous(address, value)
+            else:
+                ram[address] = value
+            self._written(address, value)
+        sim.set_hook(address, write=write)
+        self._hooked.add(address)
+        self._history = None
+
+    def _written(self, address: int, value: int):
+        if address in self.watched:
+            self._stop(f'write 0x{value:02X} to {register_name(address)}')
+        if address == self._tracked:
+            # The writing instruction has not finished: cycle is its start
+            self._writes.add(self.sim.cycle)
+
+    def watch(self, addresses: Iterable[int]):
+        """Stop after any program write to these data addresses"""
+        for address in addresses:
+            self.watched.add(address)
+            self._hook(address)
+
+    def break_at(self, address: int):
+        """Stop before the instruction at address"""
+        self.sim.add_breakpoint(address)
+
+    # -- checkpoints ------------------------------------------------------
+    def _checkpoint(self):
+        cycle = self.sim.cycle
+        if self.checkpoints and self.checkpoints[-1].cycle >= cycle:
+            return
+        self.checkpoints.append(Checkpoint(cycle, self.system.save()))
+        if len(self.checkpoints) > self.max_checkpoints:
+            # Thin out: keep the first and every other one after it
+            self.checkpoints[1:] = self.checkpoints[2::2]
+            self.interval *= 2
+            self._history = None
+
+    def _restore(self, index: int):
+        self.system.restore(self.checkpoints[index].state)
+
+    def memory(self) -> int:
+        """Bytes of core state held by the checkpoints"""
+        return sum(len(c.state.core.blob) + len(c.state.core.flash) for c in self.checkpoints)
+
+    @property
+    def position(self) -> Position:
+        return Position(self.sim.cycle, self.sim.pc)
+
+    # -- forward ----------------------------------------------------------
+    def _run(self, cycles: int) -> Optional[str]:
+        """Run up to cycles, checkpointing at the frontier; the fault that stopped it"""
+        sim = self.sim
+        end = sim.cycle + cycles
+        self.fault = None
+        while sim.cycle < end:
+            # Checkpoints are due every interval from the last one, once past the frontier
+            if sim.cycle < self.frontier:
+                target = min(end, self.frontier)
+            else:
+                target = min(end, self.checkpoints[-1].cycle + self.interval)
+            sim.run(target - sim.cycle)
+            if sim.cycle > self.frontier:
+                self.frontier = sim.cycle
+                if sim.cycle >= self.checkpoints[-1].cycle + self.interval:
+                    self._checkpoint()
+            if sim.stop_reason:
+                return self.fault or sim.stop_reason
+        return None
+
+    def run(self, cycles: int) -> Optional[str]:
+        """Run forward until a fault (returned) or for a number of cycles (None)"""
+        if self.sim.cycle >= self.frontier:
+            self._checkpoint()
+        return self._run(cycles)
+
+    def step(self, count: int = 1) -> Optional[str]:
+        """Execute count instructions forward"""
+        for _ in range(count):
+            reason = self._run(1)
+            if reason and reason != 'breakpoint':
+                return reason
+        return None
+
+    # -- backward ---------------------------------------------------------
+    def _replay_to(self, cycle: int):
+        """Restore the last checkpoint at or before cycle and run up to it"""
+        sim = self.sim
+        self._restore(max(0, bisect_right([c.cycle for c in self.checkpoints], cycle) - 1))
+        self._faulting = False
+        try:
+            while sim.cycle < cycle:
+                sim.run(cycle - sim.cycle)
+        finally:
+            self._faulting = True
+
+    def history(self, index: int) -> List[Position]:
+        """Every position from checkpoint index up to the next one (or the frontier)"""
+        end = self.checkpoints[index + 1].cycle if index + 1 < len(self.checkpoints) else self.frontier
+        cached = self._history
+        if cached and cached[0] == self.checkpoints[index].cycle and cached[1] == end:
+            return cached[2]
+        sim = self.sim
+        here = sim.cycle
+        self._restore(index)
+        positions = [Position(sim.cycle, sim.pc)]
+        self._faulting = False
+        try:
+            while sim.cycle < end:
+                sim.run(1)
+                if sim.cycle != positions[-1].cycle:
+                    positions.append(Position(sim.cycle, sim.pc))
+        finally:
+            self._faulting = True
+        self._history = (self.checkpoints[index].cycle, end, positions)
+        self._replay_to(here)
+        return positions
+
+    def recent(self, count: int) -> List[Position]:
+        """The last count positions before the current one, oldest first"""
+        cycle = self.sim.cycle
+        found: List[Position] = []
+        index = bisect_left([c.cycle for c in self.checkpoints], cycle) - 1
+        while index >= 0 and len(found) < count:
+            positions = self.history(index)
+            before = positions[:bisect_left([p.cycle for p in positions], cycle)]
+            found[:0] = before[-(count - len(found)):]
+            cycle = self.checkpoints[index].cycle
+            index -= 1
+        return found
+
+    def goto(self, cycle: int):
+        """Move to the position at cycle (replaying from the nearest checkpoint)"""
+        self._replay_to(min(cycle, self.frontier))
+
+    def step_back(self, count: int = 1) -> Position:
+        """Move count instructions back; stops at the first checkpoint"""
+        positions = self.recent(count)
+        if positions:
+            self.goto(positions[0].cycle)
+        return self.position
+
+    def back_to(self, pc: int) -> Optional[Position]:
+        """Move back to the last time the instruction at pc was about to run"""
+        return self._search(lambda positions: [p for p in positions if p.pc == pc])
+
+    def last_write(self, address: int) -> Optional[Position]:
+        """Move back to the instruction that last wrote a data address"""
+        self._hook(address)
+        self._tracked = address
+        self._history = None
+        try:
+            return self._search(lambda positions: [p for p in positions if p.cycle in self._writes],
+                                clear=self._writes.clear)
+        finally:
+            self._tracked = None
+            self._history = None
+
+    def _search(self, match: Callable[[List[Position]], List[Position]],
+                clear: Optional[Callable[[], None]] = None) -> Optional[Position]:
+        """Latest earlier position picked by match, interval by interval backward"""
+        cycle = self.sim.cycle
+        index = bisect_left([c.cycle for c in self.checkpoints], cycle) - 1
+        while index >= 0:
+            if clear:
+                clear()
+                self._history = None
+            positions = self.history(index)
+            hits = [p for p in match(positions) if p.cycle < cycle]
+            if hits:
+                self.goto(hits[-1].cycle)
+                return hits[-1]
+            index -= 1
+        self.goto(cycle)
+        return None
+
+
+def _parse_range(text: str) -> range:
+    """'0x60:0x6F' or one address; register names are accepted for single addresses"""
+    start, _, end = text.partition(':')
+    start = int(start, 0) if start[0].isdigit() else register_address(start)
+    return range(start, int(end, 0) + 1 if end else start + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a PIC16F1704 image to a fault and step back from it')
+    parser.add_argument('hex_file', help='Image to run')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Simulated time to run for a fault')
+    parser.add_argument('--watch', action='append', default=[], metavar='START[:END]',
+                        help='Stop on writes to these data addresses or a register (repeatable)')
+    parser.add_argument('--break', dest='breaks', action='append', default=[], type=lambda s: int(s, 0),
+                        metavar='ADDR', help='Stop before this instruction (repeatable)')
+    parser.add_argument('--back', type=int, default=16, help='Instructions to show before the fault')
+    parser.add_argument('--interval', type=int, default=CHECKPOINT_CYCLES, help='Cycles between checkpoints')
+    parser.add_argument('--no-idle-skip', action='store_true', help='Step through idle loops instruction by instruction')
+    parser.add_argument('--interpreter', action='store_true', help='Do not translate regions')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    debugger = ReverseDebugger(args.hex_file, args.interval, blocks=not args.interpreter,
+                               idle_skip=not args.no_idle_skip)
+    debugger.watch(address for text in args.watch for address in _parse_range(text))
+    for address in args.breaks:
+        debugger.break_at(address)
+    sim = debugger.sim
+    reason = debugger.run(int(args.seconds * sim.fosc / 4))
+    forward = time.perf_counter() - start
+    print(f"{args.hex_file}: {'stopped' if reason else 'no fault'} at cycle {sim.cycle} "
+          f"({sim.seconds() * 1000:.3f} ms){f': {reason}' if reason else ''}")
+    print(f"  {len(debugger.checkpoints)} checkpoints every {debugger.interval} cycles, "
+          f"{debugger.memory()} bytes, forward run {forward:.2f} s")
+    if not reason:
+        return
+
+    start = time.perf_counter()
+    positions = debugger.recent(args.back)
+    backward = time.perf_counter() - start
+    print(f"  Last {len(positions)} instructions (replayed in {backward * 1000:.1f} ms):")
+    for position in positions:
+        debugger.goto(position.cycle)
+        w = sim.ram[WREG]
+        print(f"    {position.cycle:>10}  W=0x{w:02X}  {format_line(position.pc, sim.flash[position.pc])}")
+    debugger.goto(debugger.frontier)
+    print(f"  > {sim.cycle:>10}  PC=0x{sim.pc:04X}")
+    raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+PIC Compiler Signature Matching
+Finds instruction n-gram signatures in a decoded image in one pass. Every
+instruction becomes one symbol (its mnemonic; GOTO and BRA are split into
+'$+1' jumps to the next word, '$-' backward jumps and the rest), and all
+signatures of all compilers are compiled into a single Aho-Corasick
+automaton over those symbols, so the scan costs one table lookup per
+instruction however many signatures there are. Runs of consecutive
+addresses are scanned separately: no signature spans a gap in the image.
+"""
+
+import argparse
+from array import array
+from collections import deque, namedtuple
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from pic_disasm import DW_ID, MNEMONIC_IDS, MNEMONICS, PROGRAM_WORDS, InstructionStore, disassemble_file
+
+# Symbols beyond the mnemonics: jump to the next word, backward jump
+SYMBOLS = MNEMONICS + ('goto$+1', 'goto$-', 'bra$+1', 'bra$-')
+SYMBOL_IDS = {symbol: index for index, symbol in enumerate(SYMBOLS)}
+_GOTO, _BRA = MNEMONIC_IDS['goto'], MNEMONIC_IDS['bra']
+
+# compiler: owner of the score; pattern: symbols separated by spaces, with
+# 'a|b' for alternatives; weight per match, capped at limit per signature
+Signature = namedtuple('Signature', 'compiler pattern weight limit')
+
+SIGNATURES = (
+    # pagesel / banksel expansions ahead of calls, jumps and file accesses
+    Signature('XC8', 'movlp call', 0.05, 0.2),
+    Signature('XC8', 'movlp goto', 0.05, 0.2),
+    Signature('XC8', 'movlb movf|movwf|clrf|bcf|bsf|btfsc|btfss', 0.05, 0.2),
+    # Two-cycle delay and block clearing
+    Signature('SDCC', 'goto$+1', 0.05, 0.2),
+    Signature('SDCC', 'clrf clrf clrf', 0.05, 0.2),
+    # Manual timing delays and tight loops
+    Signature('Assembly', 'nop nop nop', 0.05, 0.2),
+    Signature('Assembly', 'decfsz|incfsz goto$-|bra$-', 0.05, 0.2),
+    # Variable copying and bit toggling
+    Signature('CCS', 'movf movwf movf movwf', 0.05, 0.2),
+    Signature('CCS', 'bcf bsf bcf bsf', 0.05, 0.2),
+)
+
+
+def _expand(pattern: str) -> List[Tuple[int, ...]]:
+    """Every symbol sequence a pattern stands for"""
+    sequences = [()]
+    for token in pattern.split():
+        try:
+            choices = [SYMBOL_IDS[symbol] for symbol in token.split('|')]
+        except KeyError as e:
+            raise ValueError(f"unknown symbol {e.args[0]!r} in signature '{pattern}'")
+        sequences = [sequence + (choice,) for sequence in sequences for choice in choices]
+    return sequences
+
+
+def symbols(instructions: InstructionStore) -> array:
+    """One symbol per instruction row"""
+    refined = array('B', instructions.op)
+    address, arg, op = instructions.address, instructions.arg, instructions.op
+    for row, symbol in enumerate(op):
+        if symbol == _GOTO:
+            here = address[row]
+            target = (here & 0x7800) | arg[row]
+            if target == here + 1:
+                refined[row] = SYMBOL_IDS['goto$+1']
+            elif target < here:
+                refined[row] = SYMBOL_IDS['goto$-']
+        elif symbol == _BRA:
+            if arg[row] == 0:
+                refined[row] = SYMBOL_IDS['bra$+1']
+            elif arg[row] < 0:
+                refined[row] = SYMBOL_IDS['bra$-']
+    return refined
+
+
+class SignatureMatcher:
+    """
+    Aho-Corasick automaton over instruction symbols. The transition table is
+    complete (states x symbols), so matching never follows failure links.
+    """
+
+    def __init__(self, signatures: Sequence[Signature] = SIGNATURES):
+        self.signatures = tuple(signatures)
+        width = len(SYMBOLS)
+        # Trie: children per state, signatures ending at each state
+        children: List[Dict[int, int]] = [{}]
+        ends: List[List[int]] = [[]]
+        for index, signature in enumerate(self.signatures):
+            for sequence in _expand(signature.pattern):
+                state = 0
+                for symbol in sequence:
+                    child = children[state].get(symbol)
+                    if child is None:
+                        child = children[state][symbol] = len(children)
+                        children.append({})
+                        ends.append([])
+                    state = child
+                if index not in ends[state]:
+                    ends[state].append(index)
+
+        # Breadth-first: each state's transitions default to its failure state's
+        self.width = width
+        self.delta = array('I', bytes(4 * width * len(children)))
+        self.outputs: List[Tuple[int, ...]] = [()] * len(children)
+        fail = [0] * len(children)
+        delta = self.delta
+        queue = deque()
+        for symbol, child in children[0].items():
+            delta[symbol] = child
+            queue.append(child)
+        self.outputs[0] = tuple(ends[0])
+        while queue:
+            state = queue.popleft()
+            self.outputs[state] = tuple(ends[state]) + self.outputs[fail[state]]
+            base, fallback = state * width, fail[state] * width
+            delta[base:base + width] = delta[fallback:fallback + width]
+            for symbol, child in children[state].items():
+                fail[child] = delta[fallback + symbol]
+                delta[base + symbol] = child
+                queue.append(child)
+
+    @property
+    def states(self) -> int:
+        return len(self.outputs)
+
+    def count(self, instructions: InstructionStore) -> List[int]:
+        """Matches of each signature (overlapping matches all count)"""
+        counts = [0] * len(self.signatures)
+        delta, outputs, width = self.delta, self.outputs, self.width
+        state = 0
+        previous = -2
+        for address, symbol in zip(instructions.address, symbols(instructions)):
+            if address >= PROGRAM_WORDS or symbol == DW_ID:
+                # Data words break sequences like gaps do
+                state = 0
+                continue
+            if address != previous + 1:
+                state = 0
+            previous = address
+            state = delta[state * width + symbol]
+            for index in outputs[state]:
+                counts[index] += 1
+        return counts
+
+    def scores(self, counts: Iterable[int]) -> Dict[str, float]:
+        """Per-compiler score: each signature adds weight per match, up to its limit"""
+        scores: Dict[str, float] = {}
+        for signature, count in zip(self.signatures, counts):
+            scores.setdefault(signature.compiler, 0.0)
+            if count:
+                scores[signature.compiler] += min(signature.limit, count * signature.weight)
+        return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count compiler signatures in PIC16F1704 images')
+    parser.add_argument('hex_files', nargs='+', help='Images to scan')
+
+    args = parser.parse_args()
+
+    matcher = SignatureMatcher()
+    print(f"{len(matcher.signatures)} signatures, {matcher.states} automaton states")
+    for hex_file in args.hex_files:
+        counts = matcher.count(disassemble_file(hex_file))
+        scores = matcher.scores(counts)
+        print(f"\n{hex_file}: " + ', '.join(f'{compiler} {score:.2f}' for compiler, score in scores.items()))
+        for signature, count in zip(matcher.signatures, counts):
+            if count:
+                print(f"  {signature.compiler:<9} {signature.pattern:<48} {count:>5}")
+
+
+if __name__ == "__main__":
+    main()
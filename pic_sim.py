@@ -0,0 +1,1251 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Instruction-Set Simulator
+Cycle-counting model of the enhanced mid-range core: W, BSR, PCLATH, FSR0/1
+with INDF, the 16-level return stack, the interrupt controller with automatic
+context save, the watchdog and flash self-write. Every program word is
+translated once into a small Python function, so the main loop is a single
+table dispatch per instruction. Instructions that touch special registers or
+hooked peripherals fall back to an exact (slower) variant of the same code.
+
+This interpreter falls short of several MIPS: on V71 from reset (CPython
+3.11) it runs 1.8 MIPS over 2M cycles and 1.6 MIPS over 20M, 0.5-0.7x real
+time at 16 MHz. The block cache (pic_blocks, --blocks below) runs it at 5.8
+MIPS over 2M cycles, translation included, and 12 MIPS over 20M (4x real
+time).
+"""
+
+import time
+import heapq
+import struct
+import argparse
+from array import array
+from collections import namedtuple
+from types import FunctionType
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pic_disasm import (CONFIG_BASE, ERASED_WORD, FORM_ADDFSR, FORM_ADDR, FORM_BANK,
+                        FORM_FB, FORM_FD, FORM_FSR_K, FORM_FSR_MM, FORM_K, FORM_PAGE,
+                        FORM_REL, BRANCH_MNEMONICS, OPCODE_TABLE, PROGRAM_WORDS,
+                        IntelHex, load_words, program_image)
+from pic_cfg import RESET_VECTOR, ControlFlowGraph, build_cfg
+from pic_disasm import disassemble
+from pic_wcet import image_fosc
+from pic_xref import register_address
+
+# Core registers, stored at their bank 0 addresses in data memory
+INDF0, INDF1, PCL, STATUS, FSR0L, FSR0H, FSR1L, FSR1H, BSR, WREG, PCLATH, INTCON = range(12)
+STATUS_C, STATUS_DC, STATUS_Z = 0x01, 0x02, 0x04
+STATUS_PD, STATUS_TO = 0x08, 0x10
+GIE, PEIE = 0x80, 0x40
+
+DATA_SIZE = 0x1000          # 32 banks x 128 bytes
+STACK_LEVELS = 16
+STACK_EMPTY = 0x1F          # STKPTR value with nothing pushed
+PC_MASK = PROGRAM_WORDS - 1
+ROW_WORDS = 32              # Flash erase/write row
+
+# Cycles from recognising an interrupt to executing at the vector
+INTERRUPT_LATENCY = 3
+# Longest body (words, including called code) of a polling loop that may be fast-forwarded
+MAX_IDLE_LOOP = 16
+# LFINTOSC ticks per watchdog prescaler step, and its nominal frequency
+LFINTOSC_HZ = 31000
+
+_R = register_address
+PIR_PIE = ((_R('PIR1'), _R('PIE1')), (_R('PIR2'), _R('PIE2')), (_R('PIR3'), _R('PIE3')))
+SHADOW = _R('STATUS_SHAD')  # STATUS, WREG, BSR, PCLATH, FSR0L/H, FSR1L/H shadows
+STKPTR, TOSL, TOSH = _R('STKPTR'), _R('TOSL'), _R('TOSH')
+PCON, WDTCON = _R('PCON'), _R('WDTCON')
+PMADRL, PMADRH, PMDATL, PMDATH = _R('PMADRL'), _R('PMADRH'), _R('PMDATL'), _R('PMDATH')
+PMCON1, PMCON2 = _R('PMCON1'), _R('PMCON2')
+FVRCON = _R('FVRCON')
+TRIS_REGISTERS = {5: _R('TRISA'), 7: _R('TRISC')}
+
+# Non-zero power-on values; everything else resets to 0
+RESET_VALUES = {
+    STATUS: 0x18, STKPTR: STACK_EMPTY, PCON: 0x1C, WDTCON: 0x16, PMCON1: 0x80,
+    _R('OPTION_REG'): 0xFF, _R('TRISA'): 0x3F, _R('TRISC'): 0x3F,
+    _R('ANSELA'): 0x17, _R('ANSELC'): 0x0F, _R('OSCCON'): 0x38,
+    _R('OSCSTAT'): 0x5F,    # oscillators reported stable, so boot polls pass
+    _R('PR2'): 0xFF, _R('PR4'): 0xFF, _R('PR6'): 0xFF, _R('SSP1MSK'): 0xFF,
+}
+
+# PCON reset-cause bits (active low except the stack flags)
+PCON_STKOVF, PCON_STKUNF, PCON_RWDT, PCON_RI, PCON_POR = 0x80, 0x40, 0x10, 0x04, 0x02
+
+# Saved core: blob = _CORE_HEADER fields + data memory + return stack; flash =
+# (address, word) pairs differing from the loaded image; events = (cycle,
+# sequence, callback) with callbacks as given to schedule() unless translated
+CoreState = namedtuple('CoreState', 'blob flash resets events latches pending_reset')
+# pc, cycle, executed, sleeping, event sequence, NVM unlock step, idle cycles,
+# watchdog deadline, period and event sequence (-1 for none)
+_CORE_HEADER = struct.Struct('<HQQBQBQqqq')
+
+# Placeholder data address for FSR values that are not plain data memory
+# (program flash, unimplemented space); every hook flag is set on it
+SPECIAL = DATA_SIZE
+
+
+def _fsr_map() -> array:
+    """FSR value -> data memory address (SPECIAL for flash and reserved space)"""
+    table = array('H', [SPECIAL]) * 0x10000
+    for fsr in range(DATA_SIZE):
+        offset = fsr & 0x7F
+        table[fsr] = offset if offset < 0x0C or offset >= 0x70 else fsr
+    # Linear view of the general purpose RAM, 80 bytes per bank
+    for n in range(31 * 80):
+        table[0x2000 + n] = (n // 80) * 0x80 + 0x20 + n % 80
+    return table
+
+
+FSR_MAP = _fsr_map()
+
+# Core registers that need the exact path: INDF/PCL on any access, and
+# registers with write masks or side effects on writes
+_READ_SPECIAL = (INDF0, INDF1, PCL)
+_WRITE_SPECIAL = (INDF0, INDF1, PCL, STATUS, BSR, PCLATH, INTCON)
+# Core registers that fast code may write directly
+_PLAIN_WRITES = (FSR0L, FSR0H, FSR1L, FSR1H, WREG)
+
+# Instruction template: (result lines, flag update mask)
+#   v is the operand, w is W, n is ~W and c is the carry in
+_ALU = {
+    'addwf': (['r = v + w', 's = r >> 8 | ((v & 15) + (w & 15)) >> 3 & 2', 'r &= 255'], 7),
+    'addwfc': (['c = ram[3] & 1', 'r = v + w + c',
+                's = r >> 8 | ((v & 15) + (w & 15) + c) >> 3 & 2', 'r &= 255'], 7),
+    'subwf': (['n = w ^ 255', 'r = v + n + 1',
+               's = r >> 8 | ((v & 15) + (n & 15) + 1) >> 3 & 2', 'r &= 255'], 7),
+    'subwfb': (['n = w ^ 255', 'c = ram[3] & 1', 'r = v + n + c',
+                's = r >> 8 | ((v & 15) + (n & 15) + c) >> 3 & 2', 'r &= 255'], 7),
+    'andwf': (['r = v & w'], 4),
+    'iorwf': (['r = v | w'], 4),
+    'xorwf': (['r = v ^ w'], 4),
+    'comf': (['r = v ^ 255'], 4),
+    'decf': (['r = v - 1 & 255'], 4),
+    'incf': (['r = v + 1 & 255'], 4),
+    'movf': (['r = v'], 4),
+    'rrf': (['r = v >> 1 | (ram[3] & 1) << 7', 's = v & 1'], 1),
+    'rlf': (['r = (v << 1 | ram[3] & 1) & 255', 's = v >> 7'], 1),
+    'swapf': (['r = (v << 4 | v >> 4) & 255'], 0),
+    'lslf': (['r = v << 1 & 255', 's = v >> 7'], 5),
+    'lsrf': (['r = v >> 1', 's = v & 1'], 5),
+    'asrf': (['r = v >> 1 | v & 128', 's = v & 1'], 5),
+    'decfsz': (['r = v - 1 & 255'], 0),
+    'incfsz': (['r = v + 1 & 255'], 0),
+}
+_USES_W = frozenset(['addwf', 'addwfc', 'subwf', 'subwfb', 'andwf', 'iorwf', 'xorwf'])
+_LITERAL_ALU = {'addlw': 'addwf', 'sublw': 'subwf', 'andlw': 'andwf',
+                'iorlw': 'iorwf', 'xorlw': 'xorwf'}
+_FLAG_UPDATES = {
+    1: 'ram[3] = ram[3] & 254 | s',
+    4: 'ram[3] = ram[3] & 251 | (r == 0) << 2',
+    5: 'ram[3] = ram[3] & 250 | s | (r == 0) << 2',
+    7: 'ram[3] = ram[3] & 248 | s | (r == 0) << 2',
+}
+
+_ARG_NAMES = ('ram', 'stk', 'rh', 'wh', 'ah', 'fmap', 'sim')
+# Translated code objects shared by every simulator, keyed by (pc, word, exact)
+_CODE_CACHE: Dict[Tuple[int, int, bool], object] = {}
+
+
+class _Emitter:
+    """
+    Renders one instruction as Python source. Fast code works on data memory
+    directly and bails out (returns ~pc) before any side effect when it meets
+    a hooked or special register; exact code routes every access through the
+    simulator so hooks and special registers behave.
+    """
+
+    def __init__(self, pc: int, word: int, exact: bool):
+        self.pc = pc
+        self.word = word
+        self.exact = exact
+        self.next = (pc + 1) & PC_MASK
+        self.bail = f'return {~pc}'
+        self.lines: List[str] = []
+
+    def source(self) -> str:
+        body = self._body()
+        if body is None:
+            body = [self.bail]
+        elif not body or not body[-1].startswith('return'):
+            body.append(f'return {self.next}')
+        return f"def op({', '.join(_ARG_NAMES)}):\n" + ''.join(f'    {line}\n' for line in body)
+
+    def _address(self, f: int, mode: str) -> Optional[str]:
+        """Address expression for file register f ('r', 'w' or 'rw' access)"""
+        if self.exact:
+            if 0x0C <= f < 0x70:
+                self.lines.append(f'a = ram[8] << 7 | {f}')
+                return 'a'
+            return str(f)
+        flags = {'r': 'rh', 'w': 'wh', 'rw': 'ah'}[mode]
+        if 0x0C <= f < 0x70:
+            self.lines += [f'a = ram[8] << 7 | {f}', f'if {flags}[a]: {self.bail}']
+            return 'a'
+        if f >= 0x70:
+            return str(f)
+        if f in (INDF0, INDF1):
+            low = FSR0L + 2 * f
+            self.lines += [f'a = fmap[ram[{low}] | ram[{low + 1}] << 8]',
+                           f'if {flags}[a]: {self.bail}']
+            return 'a'
+        if mode == 'r' and f not in _READ_SPECIAL:
+            return str(f)
+        if f in _PLAIN_WRITES:
+            return str(f)
+        return None
+
+    def _load(self, address: str) -> str:
+        return f'sim.read({address})' if self.exact else f'ram[{address}]'
+
+    def _store(self, address: str, value: str) -> str:
+        return f'sim.write({address}, {value})' if self.exact else f'ram[{address}] = {value}'
+
+    def _push(self):
+        if self.exact:
+            self.lines.append(f'sim.push({self.next})')
+        else:
+            self.lines += ['p = ram[4077] + 1 & 31', f'if p == 16: {self.bail}',
+                           f'stk[p] = {self.next}', 'ram[4077] = p']
+
+    def _pop(self, *then: str):
+        """Pop the return address; `then` runs once the pop is known to succeed"""
+        if self.exact:
+            self.lines += list(then) + ['return sim.pop()']
+        else:
+            self.lines += ['p = ram[4077]', f'if p == 31: {self.bail}', *then,
+                           'ram[4077] = p - 1 & 31', 'return stk[p]']
+
+    def _alu(self, name: str, dest: Optional[str]):
+        """Emit an ALU operation on v; dest None means W"""
+        lines, flags = _ALU[name]
+        if name in _USES_W:
+            self.lines.append('w = ram[9]')
+        self.lines += lines
+        self.lines.append(self._store(dest, 'r') if dest else 'ram[9] = r')
+        if flags:
+            self.lines.append(_FLAG_UPDATES[flags])
+
+    def _indirect(self, n: int, mode: int, write: bool):
+        """moviw/movwi with pre/post increment or decrement (mode 0-3)"""
+        low = FSR0L + 2 * n
+        step = '+ 1' if mode in (0, 2) else '- 1'
+        self.lines.append(f'f = ram[{low}] | ram[{low + 1}] << 8')
+        if mode < 2:
+            self.lines.append(f'f = f {step} & 65535')
+        if not self.exact:
+            self.lines += ['a = fmap[f]', f"if {'wh' if write else 'rh'}[a]: {self.bail}"]
+        after = f'f {step} & 65535' if mode >= 2 else 'f'
+        self.lines += [f'g = {after}', f'ram[{low}] = g & 255', f'ram[{low + 1}] = g >> 8']
+        self._indirect_access(write)
+
+    def _indirect_offset(self, n: int, k: int, write: bool):
+        """moviw/movwi k[FSRn]"""
+        low = FSR0L + 2 * n
+        self.lines.append(f'f = (ram[{low}] | ram[{low + 1}] << 8) + {k} & 65535')
+        if not self.exact:
+            self.lines += ['a = fmap[f]', f"if {'wh' if write else 'rh'}[a]: {self.bail}"]
+        self._indirect_access(write)
+
+    def _indirect_access(self, write: bool):
+        if write:
+            self.lines.append('sim.write_fsr(f, ram[9])' if self.exact else 'ram[a] = ram[9]')
+        else:
+            self.lines += ['v = sim.read_fsr(f)' if self.exact else 'v = ram[a]',
+                           'ram[9] = v', 'ram[3] = ram[3] & 251 | (v == 0) << 2']
+
+    def _body(self) -> Optional[List[str]]:
+        opcode = OPCODE_TABLE[self.word]
+        name, form, arg, arg2 = opcode.mnemonic, opcode.form, opcode.arg, opcode.arg2
+        lines = self.lines
+        skip = (self.pc + 2) & PC_MASK
+
+        if form == FORM_FD:
+            mode = 'rw' if arg2 else 'r'
+            address = self._address(arg, mode)
+            if address is None:
+                return None
+            lines.append(f'v = {self._load(address)}')
+            self._alu(name, address if arg2 else None)
+            if name in ('decfsz', 'incfsz'):
+                lines.append(f'return {skip} if r == 0 else {self.next}')
+        elif form == FORM_FB:
+            mask = 1 << arg2
+            if name in ('bcf', 'bsf'):
+                address = self._address(arg, 'rw')
+                if address is None:
+                    return None
+                value = f'{self._load(address)} & {0xFF ^ mask}' if name == 'bcf' \
+                    else f'{self._load(address)} | {mask}'
+                lines.append(self._store(address, value))
+            else:
+                address = self._address(arg, 'r')
+                if address is None:
+                    return None
+                taken, fall = (skip, self.next) if name == 'btfss' else (self.next, skip)
+                lines.append(f'return {taken} if {self._load(address)} & {mask} else {fall}')
+        elif name == 'movwf':
+            address = self._address(arg, 'w')
+            if address is None:
+                return None
+            lines.append(self._store(address, 'ram[9]'))
+        elif name == 'clrf':
+            address = self._address(arg, 'w')
+            if address is None:
+                return None
+            lines += [self._store(address, '0'), 'ram[3] |= 4']
+        elif name == 'clrw':
+            lines += ['ram[9] = 0', 'ram[3] |= 4']
+        elif form == FORM_K:
+            if name == 'movlw':
+                lines.append(f'ram[9] = {arg}')
+            elif name == 'retlw':
+                self._pop(f'ram[9] = {arg}')
+            else:
+                lines.append(f'v = {arg}')
+                self._alu(_LITERAL_ALU[name], None)
+        elif form == FORM_ADDR:
+            target = f'return ram[10] << 8 & 2048 | {arg}'
+            if name == 'call':
+                self._push()
+            lines.append(target)
+        elif form == FORM_REL:
+            lines.append(f'return {(self.pc + 1 + arg) & PC_MASK}')
+        elif form == FORM_BANK:
+            lines.append(f'ram[8] = {arg}')
+        elif form == FORM_PAGE:
+            lines.append(f'ram[10] = {arg}')
+        elif form == FORM_ADDFSR:
+            low = FSR0L + 2 * arg2
+            lines += [f'f = (ram[{low}] | ram[{low + 1}] << 8) + {arg} & 65535',
+                      f'ram[{low}] = f & 255', f'ram[{low + 1}] = f >> 8']
+        elif form == FORM_FSR_MM:
+            self._indirect(arg2, arg, name == 'movwi')
+        elif form == FORM_FSR_K:
+            self._indirect_offset(arg2, arg, name == 'movwi')
+        elif name == 'return':
+            self._pop()
+        elif name == 'callw':
+            self._push()
+            lines.append('return (ram[10] << 8 | ram[9]) & 4095')
+        elif name == 'brw':
+            lines.append(f'return {self.pc + 1} + ram[9] & 4095')
+        elif name in ('nop', 'dw'):
+            pass
+        elif not self.exact:
+            # retfie, sleep, clrwdt, reset, option, tris
+            return None
+        elif name == 'retfie':
+            lines.append('return sim.retfie()')
+        elif name == 'sleep':
+            lines.append(f'return sim.sleep({self.next})')
+        elif name == 'clrwdt':
+            lines.append('sim.clrwdt()')
+        elif name == 'reset':
+            lines.append("sim.request_reset('reset instruction')")
+        elif name == 'option':
+            lines.append(f"sim.write({_R('OPTION_REG')}, ram[9])")
+        elif name == 'tris':
+            if arg in TRIS_REGISTERS:
+                lines.append(f'sim.write({TRIS_REGISTERS[arg]}, ram[9])')
+        return lines
+
+
+def translate(pc: int, word: int, exact: bool):
+    """Code object for the instruction at pc (cached across simulators)"""
+    key = (pc, word, exact)
+    code = _CODE_CACHE.get(key)
+    if code is None:
+        namespace = {}
+        exec(_Emitter(pc, word, exact).source(), namespace)
+        code = _CODE_CACHE[key] = namespace['op'].__code__
+    return code
+
+
+def _pure(opcode) -> bool:
+    """Instruction that writes nothing but W, STATUS, BSR and PCLATH"""
+    name, form = opcode.mnemonic, opcode.form
+    if form == FORM_FD:
+        return opcode.arg2 == 0
+    if form == FORM_FB:
+        return name in ('btfsc', 'btfss') or opcode.arg == STATUS
+    return form in (FORM_K, FORM_BANK, FORM_PAGE, FORM_REL) or \
+        name in ('goto', 'return', 'nop', 'clrw', 'clrwdt')
+
+
+def delay_counter(flash, cfg: ControlFlowGraph, pc: int) -> Optional[int]:
+    """
+    File operand of a 'decfsz f,f / goto $-1' delay loop headed at pc (a
+    general-purpose register), or None
+    """
+    opcode = OPCODE_TABLE[flash[pc]]
+    if opcode.mnemonic != 'decfsz' or opcode.arg2 != 1 or opcode.arg < 0x20:
+        return None
+    back = (pc + 1) & PC_MASK
+    if OPCODE_TABLE[flash[back]].mnemonic in ('goto', 'bra') and cfg.branch_target(back) == pc:
+        return opcode.arg
+    return None
+
+
+def find_idle_loops(flash, cfg: ControlFlowGraph) -> List[int]:
+    """
+    Heads of short polling loops: a backward goto/bra whose body, and any code
+    it calls, only reads memory and writes W/STATUS/BSR/PCLATH. Such a loop
+    repeats identically until an event or interrupt changes memory, which the
+    simulator verifies at run time before skipping iterations. Delay loops
+    (delay_counter) are included; they are counted down arithmetically.
+    Branch and call targets are resolved with PCLATH as the CFG tracks it.
+    """
+    heads = []
+    for pc in range(PROGRAM_WORDS):
+        if delay_counter(flash, cfg, pc) is not None:
+            heads.append(pc)
+            continue
+        if OPCODE_TABLE[flash[pc]].mnemonic not in ('goto', 'bra'):
+            continue
+        target = cfg.branch_target(pc)
+        if target is None:
+            continue
+        if not 0 <= pc - target < MAX_IDLE_LOOP:
+            continue
+        body = [address for address in range(target, pc)
+                if OPCODE_TABLE[flash[address]].mnemonic != 'call']
+        for address in range(target, pc):
+            callee = OPCODE_TABLE[flash[address]]
+            if callee.mnemonic == 'call':
+                # Called code up to its first return
+                entry = cfg.branch_target(address)
+                if entry is None:
+                    body = None
+                    break
+                for offset in range(MAX_IDLE_LOOP):
+                    body.append((entry + offset) & PC_MASK)
+                    if OPCODE_TABLE[flash[(entry + offset) & PC_MASK]].mnemonic in ('return', 'retlw'):
+                        break
+                else:
+                    body = None
+                    break
+        if body is not None and len(body) <= MAX_IDLE_LOOP and \
+                all(_pure(OPCODE_TABLE[flash[address]]) for address in body):
+            heads.append(target)
+    return heads
+
+
+def main_loop_head(cfg: ControlFlowGraph) -> Optional[int]:
+    """
+    Header of the firmware's main loop: the widest loop in the code reset runs
+    (called functions excluded), or None. It is far longer than the loops
+    find_idle_loops accepts, but once the firmware only waits for interrupts
+    it repeats with identical data memory, which _skip_idle checks at run time.
+    """
+    owner = cfg.function_owner()
+    loops = [(latch - header, header) for header, latch in cfg.loops()
+             if owner[cfg.block_containing(latch)] == RESET_VECTOR]
+    return max(loops)[1] if loops else None
+
+
+class PICSimulator:
+    """
+    PIC16F1704 core. Data memory is one bytearray indexed by absolute address
+    (bank * 0x80 + offset) with the core registers and common RAM stored at
+    their bank 0 addresses. Time is counted in instruction cycles (Fosc/4);
+    Fosc defaults to what the image configures (pic_wcet.image_fosc).
+    """
+
+    def __init__(self, hex_data: IntelHex, fosc: Optional[int] = None):
+        self.fosc = fosc or image_fosc(hex_data)
+        self.hex_data = hex_data
+        self.flash = program_image(hex_data)
+        # Flash as loaded; saved states record only the words that differ
+        self.image = self.flash.tobytes()
+        words = load_words(hex_data)
+        self.config = [words.get(CONFIG_BASE + i, ERASED_WORD) & 0x3FFF for i in range(0x0B)]
+
+        self.ram = bytearray(DATA_SIZE + 1)
+        self.stack = array('H', [0]) * 32
+        # Hook flags: reads (rh), writes (wh) and either (ah) divert fast code
+        self.rh = bytearray(DATA_SIZE + 1)
+        self.wh = bytearray(DATA_SIZE + 1)
+        self.ah = bytearray(DATA_SIZE + 1)
+        self.read_hooks: Dict[int, Callable[[int], int]] = {}
+        self.write_hooks: Dict[int, Callable[[int, int], None]] = {}
+        # Hooked addresses where writing the value already held does nothing
+        self.quiet_writes: Set[int] = set()
+
+        self.pc = 0
+        self.cycle = 0
+        self.executed = 0
+        self.sleeping = False
+        self.stop_reason: Optional[str] = None
+        self.breakpoints = set()
+        # Called before the instruction at their address executes (add_probe)
+        self.probes: Dict[int, Callable[[], None]] = {}
+        # Polling loops fast-forwarded to the next event (enable_idle_skip)
+        self.idle_heads: Set[int] = set()
+        self.idle_cycles = 0
+        # Delay-loop heads among them -> counter register (delay_counter)
+        self._delay_counters: Dict[int, int] = {}
+        # Called with the cause after every reset, so peripherals can follow
+        self.reset_callbacks: List[Callable[[str], None]] = []
+        self.resets: List[Tuple[int, str]] = []
+        self.events: List[list] = []
+        self._sequence = 0
+        self._stopped_at = None
+        self._jump = -1
+        self._reset: Optional[str] = None
+        self._wdt_event = None
+        self._wdt_deadline: Optional[int] = None
+        self._wdt_period: Optional[int] = None
+        # Idle-loop probes, one per head: the epoch is bumped whenever memory
+        # may change other than by the program itself (events, interrupts,
+        # hooks, flash writes)
+        self._epoch = 0
+        self._idle_probes: Dict[int, tuple] = {}
+        self._limit = 0
+        self._nvm_unlock = 0
+        self._latches: Dict[int, int] = {}
+
+        self._defaults = (self.ram, self.stack, self.rh, self.wh, self.ah, FSR_MAP, self)
+        self.cost = array('B', [1]) * PROGRAM_WORDS
+        self.code: List[Callable[[], int]] = [None] * PROGRAM_WORDS
+        self.exact: List[Optional[Callable[[], int]]] = [None] * PROGRAM_WORDS
+        self.invalidate(0, PROGRAM_WORDS)
+
+        for address in _READ_SPECIAL:
+            self._flag(address, read=True)
+        for address in _WRITE_SPECIAL:
+            self._flag(address, write=True)
+        self._flag(SPECIAL, read=True, write=True)
+        # Interrupt enables and flags: writes must re-evaluate pending interrupts
+        for pir, pie in PIR_PIE:
+            self._flag(pir, write=True)
+            self._flag(pie, write=True)
+        self.set_hook(TOSL, read=self._read_tos, write=self._write_tos)
+        self.set_hook(TOSH, read=self._read_tos, write=self._write_tos)
+        self.set_hook(STKPTR, write=lambda a, v: self.ram.__setitem__(a, v & 0x1F))
+        self.set_hook(WDTCON, write=self._write_wdtcon)
+        self.set_hook(PMCON1, write=self._write_pmcon1)
+        self.set_hook(PMCON2, write=self._write_pmcon2)
+        # The fixed voltage reference is reported ready as soon as it is enabled
+        self.set_hook(FVRCON, write=lambda a, v: self.ram.__setitem__(a, (v & 0xBF) | (v & 0x80) >> 1))
+        # Read-only: compiler start-up code clears whole banks, OSCSTAT included
+        self.set_hook(_R('OSCSTAT'), write=lambda a, v: None)
+
+        self.reset('power-on')
+
+    # ------------------------------------------------------------------
+    # Program memory
+    # ------------------------------------------------------------------
+    def invalidate(self, start: int, end: int):
+        """Drop translated code for [start, end) after flash changes"""
+        self._epoch += 1
+        for head in [head for head in self._delay_counters if start <= head + 1 and head < end]:
+            # Rewritten: left to the general idle check, which never skips a delay
+            del self._delay_counters[head]
+        for pc in range(start, end):
+            self._route(pc)
+            self.exact[pc] = None
+            self.cost[pc] = 2 if OPCODE_TABLE[self.flash[pc]].mnemonic in BRANCH_MNEMONICS else 1
+
+    def _route(self, pc: int):
+        """Breakpoints and idle-loop heads defer to step(); everything else runs fast code"""
+        if pc in self.breakpoints or pc in self.idle_heads:
+            self.code[pc] = lambda: ~pc
+        elif pc in self.probes:
+            self.code[pc] = self._probed(pc)
+        else:
+            self.code[pc] = self._trampoline(pc)
+
+    def _probed(self, pc: int) -> Callable[[], int]:
+        callback = self.probes[pc]
+        op = None
+
+        def probed():
+            nonlocal op
+            if op is None:
+                op = self._function(pc, False)
+            next_pc = op()
+            # A bail to step() is reported there instead
+            if next_pc >= 0:
+                callback()
+            return next_pc
+        return probed
+
+    def _trampoline(self, pc: int) -> Callable[[], int]:
+        def translate_on_first_use():
+            self.code[pc] = op = self._function(pc, False)
+            return op()
+        return translate_on_first_use
+
+    def _function(self, pc: int, exact: bool) -> Callable[[], int]:
+        code = translate(pc, self.flash[pc], exact)
+        return FunctionType(code, {}, 'op', self._defaults)
+
+    def write_flash(self, address: int, word: int):
+        address &= PC_MASK
+        self.flash[address] = word & 0x3FFF
+        self.invalidate(address, address + 1)
+
+    # ------------------------------------------------------------------
+    # Data memory
+    # ------------------------------------------------------------------
+    def _flag(self, address: int, read: bool = False, write: bool = False):
+        if read:
+            self.rh[address] = 1
+        if write:
+            self.wh[address] = 1
+        self.ah[address] = self.rh[address] | self.wh[address]
+
+    def set_hook(self, address: int, read: Optional[Callable[[int], int]] = None,
+                 write: Optional[Callable[[int, int], None]] = None, quiet: bool = False):
+        """
+        Attach peripheral behaviour to a data address. A read hook returns the
+        value seen by the program; a write hook receives the value and is
+        responsible for storing whatever the register ends up holding. A quiet
+        write hook has no effect when the value equals what the register
+        holds, so such writes are dropped and do not stop idle skipping.
+        """
+        if read:
+            self.read_hooks[address] = read
+        if write:
+            self.write_hooks[address] = write
+            if quiet:
+                self.quiet_writes.add(address)
+            else:
+                self.quiet_writes.discard(address)
+        self._flag(address, read=read is not None, write=write is not None)
+
+    def read(self, address: int) -> int:
+        """Read data memory as the program would (hooks and special registers apply)"""
+        if address < 0x0C:
+            if address <= INDF1:
+                return self.read_fsr(self._fsr(address))
+            if address == PCL:
+                # The PC has already advanced past the instruction reading it
+                return (self.pc + 1) & 0xFF
+            return self.ram[address]
+        hook = self.read_hooks.get(address)
+        if hook:
+            self._epoch += 1
+            return hook(address)
+        return self.ram[address]
+
+    def write(self, address: int, value: int):
+        """Write data memory as the program would"""
+        ram = self.ram
+        if address < 0x0C:
+            if address <= INDF1:
+                self.write_fsr(self._fsr(address), value)
+            elif address == PCL:
+                ram[PCL] = value
+                self._jump = ((ram[PCLATH] << 8) | value) & PC_MASK
+            elif address == STATUS:
+                ram[STATUS] = (ram[STATUS] & 0x18) | (value & 0x07)
+            elif address == BSR:
+                ram[BSR] = value & 0x1F
+            elif address == PCLATH:
+                ram[PCLATH] = value & 0x7F
+            else:
+                ram[address] = value
+            return
+        hook = self.write_hooks.get(address)
+        if hook:
+            if ram[address] == value and address in self.quiet_writes:
+                return
+            self._epoch += 1
+            hook(address, value)
+        elif address < DATA_SIZE:
+            ram[address] = value
+
+    def _fsr(self, address: int) -> int:
+        low = FSR0L + 2 * address
+        return self.ram[low] | (self.ram[low + 1] << 8)
+
+    def read_fsr(self, fsr: int) -> int:
+        """Indirect read: data memory, linear RAM or program flash (low byte)"""
+        if fsr >= 0x8000:
+            fsr &= 0x7FFF
+            return self.flash[fsr] & 0xFF if fsr < PROGRAM_WORDS else 0
+        address = FSR_MAP[fsr]
+        return 0 if address == SPECIAL else self.read(address)
+
+    def write_fsr(self, fsr: int, value: int):
+        address = FSR_MAP[fsr]
+        if address != SPECIAL:
+            self.write(address, value)
+
+    def peek(self, register) -> int:
+        """Raw register value by name or address, without side effects"""
+        address = register_address(register) if isinstance(register, str) else register
+        return self.ram[address]
+
+    def poke(self, register, value: int):
+        address = register_address(register) if isinstance(register, str) else register
+        self.ram[address] = value & 0xFF
+
+    # ------------------------------------------------------------------
+    # Return stack
+    # ------------------------------------------------------------------
+    def push(self, address: int):
+        ram = self.ram
+        pointer = (ram[STKPTR] + 1) & 0x1F
+        if pointer == STACK_LEVELS:
+            ram[PCON] |= PCON_STKOVF
+            if self.config[8] & 0x0200:     # STVREN
+                self.request_reset('stack overflow')
+                return
+            pointer = 0
+        self.stack[pointer] = address
+        ram[STKPTR] = pointer
+
+    def pop(self) -> int:
+        ram = self.ram
+        pointer = ram[STKPTR]
+        if pointer == STACK_EMPTY:
+            ram[PCON] |= PCON_STKUNF
+            if self.config[8] & 0x0200:
+                self.request_reset('stack underflow')
+            return 0
+        ram[STKPTR] = (pointer - 1) & 0x1F
+        return self.stack[pointer]
+
+    def stack_depth(self) -> int:
+        pointer = self.ram[STKPTR]
+        return 0 if pointer == STACK_EMPTY else pointer + 1
+
+    def _read_tos(self, address: int) -> int:
+        top = self.stack[self.ram[STKPTR]]
+        return top & 0xFF if address == TOSL else top >> 8
+
+    def _write_tos(self, address: int, value: int):
+        pointer = self.ram[STKPTR]
+        top = self.stack[pointer]
+        if address == TOSL:
+            self.stack[pointer] = (top & 0x7F00) | value
+        else:
+            self.stack[pointer] = (top & 0xFF) | ((value & 0x7F) << 8)
+
+    # ------------------------------------------------------------------
+    # Interrupts, sleep and resets
+    # ------------------------------------------------------------------
+    def interrupt_requested(self) -> bool:
+        """Any enabled interrupt flag set (wakes from sleep even with GIE clear)"""
+        ram = self.ram
+        intcon = ram[INTCON]
+        if intcon & (intcon >> 3) & 0x07:
+            return True
+        if intcon & PEIE:
+            for pir, pie in PIR_PIE:
+                if ram[pir] & ram[pie]:
+                    return True
+        return False
+
+    def interrupt(self):
+        """Automatic context save and vector to 0x0004"""
+        ram = self.ram
+        ram[SHADOW:SHADOW + 8] = bytes((ram[STATUS], ram[WREG], ram[BSR], ram[PCLATH],
+                                        ram[FSR0L], ram[FSR0H], ram[FSR1L], ram[FSR1H]))
+        ram[INTCON] &= ~GIE & 0xFF
+        self.push(self.pc)
+        self.pc = 0x0004
+        self.cycle += INTERRUPT_LATENCY
+        self._epoch += 1
+        if self._reset:
+            self.reset(self._reset)
+
+    def retfie(self) -> int:
+        ram = self.ram
+        shadow = ram[SHADOW:SHADOW + 8]
+        ram[STATUS] = (ram[STATUS] & 0x18) | (shadow[0] & 0x07)
+        ram[WREG], ram[BSR], ram[PCLATH] = shadow[1], shadow[2] & 0x1F, shadow[3] & 0x7F
+        ram[FSR0L:FSR1H + 1] = shadow[4:8]
+        ram[INTCON] |= GIE
+        return self.pop()
+
+    def sleep(self, next_pc: int) -> int:
+        self.sleeping = True
+        self.ram[STATUS] = (self.ram[STATUS] & ~STATUS_PD & 0xFF) | STATUS_TO
+        self._update_watchdog()
+        return next_pc
+
+    def clrwdt(self, cycle: Optional[int] = None):
+        """Clear the watchdog (cycle: when, for callers running ahead of self.cycle)"""
+        self.ram[STATUS] |= STATUS_PD | STATUS_TO
+        self._kick_watchdog(cycle)
+
+    def request_reset(self, cause: str):
+        """Reset after the current instruction completes"""
+        self._reset = cause
+
+    def reset(self, cause: str = 'power-on'):
+        """
+        Reset the core. Power-on clears all data memory; other resets keep
+        general purpose RAM and record the cause in PCON like the hardware.
+        """
+        ram = self.ram
+        pcon = ram[PCON]
+        if cause == 'power-on':
+            ram[:DATA_SIZE] = bytes(DATA_SIZE)
+        else:
+            for bank in range(32):
+                base = bank * 0x80
+                ram[base + 0x0C:base + 0x20] = bytes(0x14)
+            ram[:0x0C] = bytes(0x0C)
+            ram[0xFE0:DATA_SIZE] = bytes(0x20)
+        for address, value in RESET_VALUES.items():
+            ram[address] = value
+        if cause != 'power-on':
+            ram[PCON] = (pcon & (PCON_STKOVF | PCON_STKUNF)) | 0x1E
+            if cause == 'watchdog':
+                ram[PCON] &= ~PCON_RWDT & 0xFF
+                ram[STATUS] &= ~STATUS_TO & 0xFF
+            elif cause == 'reset instruction':
+                ram[PCON] &= ~PCON_RI & 0xFF
+        self.pc = 0
+        self.sleeping = False
+        self._reset = None
+        self._jump = -1
+        self._nvm_unlock = 0
+        self._latches.clear()
+        self.resets.append((self.cycle, cause))
+        self._epoch += 1
+        self._update_watchdog()
+        for callback in self.reset_callbacks:
+            callback(cause)
+
+    # ------------------------------------------------------------------
+    # Watchdog
+    # ------------------------------------------------------------------
+    def watchdog_enabled(self) -> bool:
+        mode = (self.config[7] >> 3) & 0x03
+        return mode == 3 or (mode == 2 and not self.sleeping) or \
+            (mode == 1 and self.ram[WDTCON] & 0x01)
+
+    def watchdog_period(self) -> int:
+        """Watchdog timeout in instruction cycles (WDTPS prescaler, 31 kHz LFINTOSC)"""
+        ticks = 32 << ((self.ram[WDTCON] >> 1) & 0x1F)
+        return ticks * self.fosc // (4 * LFINTOSC_HZ)
+
+    def _update_watchdog(self):
+        """Recompute the timeout after WDTCON, Sleep or a reset changed it, and restart it"""
+        self._wdt_period = self.watchdog_period() if self.watchdog_enabled() else None
+        self._kick_watchdog()
+
+    def _kick_watchdog(self, cycle: Optional[int] = None):
+        """
+        Restart the timeout. The pending event is left in place when it is due
+        no later than the new deadline, so clrwdt in a main loop costs no heap
+        traffic; the event re-arms itself for the latest deadline when it fires.
+        """
+        period = self._wdt_period
+        if period is None:
+            self._wdt_deadline = None
+            return
+        self._wdt_deadline = deadline = (self.cycle if cycle is None else cycle) + period
+        event = self._wdt_event
+        if event is not None and event[2] is not None and event[0] <= deadline:
+            return
+        if event is not None:
+            self.cancel(event)
+        self._wdt_event = self.schedule(deadline, self._watchdog)
+
+    def _watchdog(self):
+        self._wdt_event = None
+        deadline = self._wdt_deadline
+        if deadline is None:
+            return
+        if deadline > self.cycle:
+            self._wdt_event = self.schedule(deadline, self._watchdog)
+        elif self.sleeping:
+            self.sleeping = False
+            self.ram[STATUS] &= ~STATUS_TO & 0xFF
+            self._update_watchdog()
+        else:
+            self.reset('watchdog')
+
+    def _write_wdtcon(self, address: int, value: int):
+        self.ram[address] = value & 0x3F
+        self._update_watchdog()
+
+    # ------------------------------------------------------------------
+    # Flash self-read/write through PMCON1/PMCON2
+    # ------------------------------------------------------------------
+    def _pm_address(self) -> int:
+        return ((self.ram[PMADRH] & 0x7F) << 8) | self.ram[PMADRL]
+
+    def _write_pmcon2(self, address: int, value: int):
+        # Unlock sequence: 0x55 then 0xAA immediately before setting WR
+        self._nvm_unlock = 1 if value == 0x55 else (2 if value == 0xAA and self._nvm_unlock == 1 else 0)
+
+    def _write_pmcon1(self, address: int, value: int):
+        ram = self.ram
+        ram[address] = 0x80 | (value & 0x74)
+        pm = self._pm_address()
+        config_space = value & 0x40
+        if value & 0x01:
+            if config_space:
+                word = self.config[pm & 0x0F] if (pm & 0x0F) < len(self.config) else 0
+            else:
+                word = self.flash[pm & PC_MASK]
+            ram[PMDATL], ram[PMDATH] = word & 0xFF, word >> 8
+        if value & 0x02 and not (value & 0x04 and self._nvm_unlock == 2):
+            ram[address] |= 0x08    # WRERR: write without the unlock sequence
+        elif value & 0x02 and not config_space:
+            row = pm & PC_MASK & ~(ROW_WORDS - 1)
+            if value & 0x10:
+                for address in range(row, row + ROW_WORDS):
+                    self.flash[address] = ERASED_WORD
+                self.invalidate(row, row + ROW_WORDS)
+                self.cycle += self.fosc // 2000    # ~2 ms erase, CPU stalled
+            elif value & 0x20:
+                self._latches[pm & (ROW_WORDS - 1)] = ((ram[PMDATH] & 0x3F) << 8) | ram[PMDATL]
+            else:
+                self._latches[pm & (ROW_WORDS - 1)] = ((ram[PMDATH] & 0x3F) << 8) | ram[PMDATL]
+                for offset, word in self._latches.items():
+                    self.flash[row + offset] &= word    # programming only clears bits
+                self._latches.clear()
+                self.invalidate(row, row + ROW_WORDS)
+                self.cycle += self.fosc // 2000
+        self._nvm_unlock = 0
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+    def schedule(self, cycle: int, callback: Callable[[], None]) -> list:
+        """Run callback once the cycle counter reaches cycle; returns a handle"""
+        self._sequence += 1
+        event = [cycle, self._sequence, callback]
+        heapq.heappush(self.events, event)
+        return event
+
+    def cancel(self, event: list):
+        event[2] = None
+
+    def _next_event(self) -> Optional[int]:
+        events = self.events
+        while events and events[0][2] is None:
+            heapq.heappop(events)
+        return events[0][0] if events else None
+
+    def _fire_events(self):
+        self._epoch += 1
+        events = self.events
+        while events and events[0][0] <= self.cycle:
+            _, _, callback = heapq.heappop(events)
+            if callback:
+                callback()
+
+    # ------------------------------------------------------------------
+    # Save and restore
+    # ------------------------------------------------------------------
+    def save(self, translate: Optional[Callable[[Callable], object]] = None) -> CoreState:
+        """
+        Machine state as compact immutable data, for restore() on this or an
+        identical simulator. translate maps event callbacks to something that
+        restore()'s resolve maps back (Peripherals.save uses names).
+        """
+        events = tuple((event[0], event[1], translate(event[2]) if translate else event[2])
+                       for event in self.events if event[2] is not None)
+        wdt = self._wdt_event
+        header = _CORE_HEADER.pack(
+            self.pc, self.cycle, self.executed, self.sleeping, self._sequence, self._nvm_unlock,
+            self.idle_cycles, -1 if self._wdt_deadline is None else self._wdt_deadline,
+            -1 if self._wdt_period is None else self._wdt_period,
+            wdt[1] if wdt is not None and wdt[2] is not None else -1)
+        flash = b''
+        if self.flash.tobytes() != self.image:
+            image = array('H', self.image)
+            flash = array('H', (value for address, word in enumerate(self.flash)
+                                if word != image[address] for value in (address, word))).tobytes()
+        return CoreState(header + bytes(self.ram) + self.stack.tobytes(), flash, tuple(self.resets),
+                         events, tuple(self._latches.items()), self._reset)
+
+    def restore(self, state: CoreState, resolve: Optional[Callable[[object], Callable]] = None) -> Dict[int, list]:
+        """Return to a saved state; returns the new event handles by sequence number"""
+        (self.pc, self.cycle, self.executed, sleeping, self._sequence, self._nvm_unlock,
+         self.idle_cycles, deadline, period, wdt_event) = _CORE_HEADER.unpack_from(state.blob)
+        self.sleeping = bool(sleeping)
+        self._wdt_deadline = None if deadline < 0 else deadline
+        self._wdt_period = None if period < 0 else period
+        # In place: translated code holds these objects
+        ram_end = _CORE_HEADER.size + len(self.ram)
+        self.ram[:] = state.blob[_CORE_HEADER.size:ram_end]
+        self.stack[:] = array('H', state.blob[ram_end:])
+
+        flash = array('H', self.image)
+        pairs = array('H', state.flash)
+        for index in range(0, len(pairs), 2):
+            flash[pairs[index]] = pairs[index + 1]
+        if flash != self.flash:
+            changed = [address for address in range(PROGRAM_WORDS) if self.flash[address] != flash[address]]
+            self.flash[:] = flash
+            for address in changed:
+                self.invalidate(address, address + 1)
+
+        self.resets[:] = state.resets
+        self._latches.clear()
+        self._latches.update(state.latches)
+        self._reset = state.pending_reset
+        self.events[:] = [[cycle, sequence, resolve(callback) if resolve else callback]
+                          for cycle, sequence, callback in state.events]
+        heapq.heapify(self.events)
+        handles = {event[1]: event for event in self.events}
+        self._wdt_event = handles.get(wdt_event)
+        self.stop_reason = None
+        self._stopped_at = None
+        self._jump = -1
+        self._idle_probes.clear()
+        self._epoch += 1
+        return handles
+
+    # ------------------------------------------------------------------
+    # Execution
+    # ------------------------------------------------------------------
+    def step(self):
+        """Execute one instruction exactly (hooks, special registers, breakpoints)"""
+        pc = self.pc
+        if pc in self.breakpoints and self._stopped_at != (pc, self.cycle):
+            # Stop once; resuming from the same place executes the instruction
+            self._stopped_at = (pc, self.cycle)
+            self.stop_reason = 'breakpoint'
+            return
+        if pc in self.idle_heads and self._skip_idle(pc):
+            # Back to the dispatch loop, which may now be at an event
+            return
+        op = self.exact[pc]
+        if op is None:
+            op = self.exact[pc] = self._function(pc, True)
+        if pc in self.probes:
+            self.probes[pc]()
+        self._jump = -1
+        next_pc = op()
+        if self._jump >= 0:
+            # A PCL write is a jump (2 cycles) even when it lands on the next word
+            next_pc, self._jump = self._jump, -1
+            self.cycle += 2
+        else:
+            self.cycle += self.cost[pc] if next_pc == pc + 1 else 2
+        self.executed += 1
+        self.pc = next_pc
+        if self._reset:
+            self.reset(self._reset)
+
+    def _run_fast(self, limit: int):
+        """Dispatch loop; leaves after the first instruction that needs the exact path"""
+        code = self.code
+        cost = self.cost
+        pc = self.pc
+        cycle = self.cycle
+        count = 0
+        while cycle < limit:
+            next_pc = code[pc]()
+            if next_pc == pc + 1:
+                cycle += cost[pc]
+            elif next_pc >= 0:
+                cycle += 2
+            else:
+                break
+            pc = next_pc
+            count += 1
+        self.pc = pc
+        self.cycle = cycle
+        self.executed += count
+        if cycle < limit:
+            self.step()
+
+    def run(self, cycles: int) -> int:
+        """Run for a number of instruction cycles (or until a stop condition)"""
+        end = self.cycle + cycles
+        self.stop_reason = None
+        while self.stop_reason is None:
+            if self.events and self.events[0][0] <= self.cycle:
+                self._fire_events()
+            if self.cycle >= end:
+                break
+            if self.sleeping:
+                if not self.interrupt_requested():
+                    wake = self._next_event()
+                    self.cycle = end if wake is None else max(self.cycle, min(wake, end))
+                    continue
+                # Waking clears the watchdog, which may run again outside Sleep
+                self.sleeping = False
+                self._update_watchdog()
+            if self.ram[INTCON] & GIE and self.interrupt_requested():
+                self.interrupt()
+                continue
+            limit = self._next_event()
+            self._limit = end if limit is None else min(limit, end)
+            self._run_fast(self._limit)
+        self._limit = 0
+        return self.cycle
+
+    def run_until(self, address: int, max_cycles: int) -> bool:
+        """Run until the PC reaches address; False if max_cycles elapse first"""
+        temporary = address not in self.breakpoints
+        self.add_breakpoint(address)
+        try:
+            self.run(max_cycles)
+        finally:
+            if temporary:
+                self.remove_breakpoint(address)
+        return self.stop_reason == 'breakpoint'
+
+    def add_breakpoint(self, address: int):
+        """Stop before executing address (the fast code there defers to step())"""
+        self.breakpoints.add(address)
+        self._route(address)
+
+    def remove_breakpoint(self, address: int):
+        self.breakpoints.discard(address)
+        self._route(address)
+
+    def add_probe(self, address: int, callback: Callable[[], None]):
+        """Call callback each time the instruction at address executes (coverage)"""
+        self.probes[address] = callback
+        self._route(address)
+
+    def remove_probe(self, address: int):
+        self.probes.pop(address, None)
+        self._route(address)
+
+    # ------------------------------------------------------------------
+    # Idle fast-forward
+    # ------------------------------------------------------------------
+    def enable_idle_skip(self, heads: Optional[List[int]] = None):
+        """
+        Fast-forward polling loops (default: every loop find_idle_loops reports
+        and the main loop)
+        """
+        cfg = build_cfg(disassemble(self.hex_data))
+        if heads is None:
+            heads = find_idle_loops(self.flash, cfg)
+            main_loop = main_loop_head(cfg)
+            if main_loop is not None:
+                heads.append(main_loop)
+        for head in heads:
+            counter = delay_counter(self.flash, cfg, head)
+            if counter is not None:
+                self._delay_counters[head] = counter
+            self.idle_heads.add(head)
+            self._route(head)
+
+    def disable_idle_skip(self):
+        heads, self.idle_heads = self.idle_heads, set()
+        self._delay_counters.clear()
+        for head in heads:
+            self._route(head)
+
+    def _skip_idle(self, pc: int) -> bool:
+        """
+        At a polling-loop head: when the previous visit to it left the same data
+        memory and stack and nothing but the program touched memory since, the
+        loop will repeat identically, with the same period, until the next event.
+        Skip whole iterations up to it; cycle and instruction counts stay exact.
+        Returns whether any were skipped.
+        """
+        counter = self._delay_counters.get(pc)
+        if counter is not None:
+            return self._skip_delay(counter)
+        ram = self.ram
+        probe = self._idle_probes.get(pc)
+        skip = 0
+        if probe is not None and probe[4] == self._epoch and \
+                self.cycle > probe[1] and ram == probe[3] and self.stack == probe[6]:
+            period = self.cycle - probe[1]
+            skip = (self._limit - self.cycle) // period
+            if skip > 0:
+                self.cycle += skip * period
+                self.executed += skip * (self.executed - probe[2])
+                self.idle_cycles += skip * period
+                if probe[5] is not None and self._wdt_deadline is not None and \
+                        self._wdt_deadline != probe[5]:
+                    # The loop clears the watchdog every iteration
+                    self._wdt_deadline += skip * period
+        self._idle_probes[pc] = (pc, self.cycle, self.executed, bytes(ram), self._epoch,
+                            self._wdt_deadline, array('H', self.stack))
+        return skip > 0
+
+    def _skip_delay(self, f: int) -> bool:
+        """
+        At a 'decfsz f,f / goto $-1' head: each pass that does not exit takes
+        3 cycles and only decrements the counter, so run as many as the next
+        event allows in one step and leave the last pass to execute.
+        """
+        ram = self.ram
+        address = f if f >= 0x70 else ram[BSR] * 0x80 + f
+        value = ram[address]
+        skip = min((value or 256) - 1, (self._limit - self.cycle) // 3)
+        if skip <= 0:
+            return False
+        ram[address] = (value - skip) & 0xFF
+        self.cycle += skip * 3
+        self.executed += skip * 2
+        self.idle_cycles += skip * 3
+        return True
+
+    def seconds(self, cycles: Optional[int] = None) -> float:
+        """Simulated time for a cycle count (default: elapsed)"""
+        return (self.cycle if cycles is None else cycles) * 4 / self.fosc
+
+    def state(self) -> Dict:
+        ram = self.ram
+        return {
+            'pc': self.pc, 'w': ram[WREG], 'status': ram[STATUS], 'bsr': ram[BSR],
+            'pclath': ram[PCLATH], 'fsr0': self._fsr(0), 'fsr1': self._fsr(1),
+            'intcon': ram[INTCON], 'stack': [self.stack[i] for i in range(self.stack_depth())],
+            'cycle': self.cycle, 'executed': self.executed,
+        }
+
+
+def load_simulator(hex_file: str, fosc: Optional[int] = None) -> PICSimulator:
+    hex_data = IntelHex()
+    hex_data.load(hex_file)
+    return PICSimulator(hex_data, fosc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a PIC16F1704 image on the instruction-set simulator')
+    parser.add_argument('hex_file', help='Image to run')
+    parser.add_argument('--cycles', type=int, default=2000000, help='Instruction cycles to simulate')
+    parser.add_argument('--until', type=lambda s: int(s, 0), help='Stop when the PC reaches this address')
+    parser.add_argument('--fosc', type=int, help='Oscillator frequency in Hz (default: what the image configures)')
+    parser.add_argument('--blocks', action='store_true', help='Run on the block translation cache (pic_blocks)')
+
+    args = parser.parse_args()
+
+    if args.blocks:
+        from pic_blocks import BlockSimulator
+        hex_data = IntelHex()
+        hex_data.load(args.hex_file)
+        sim = BlockSimulator(hex_data, args.fosc)
+    else:
+        sim = load_simulator(args.hex_file, args.fosc)
+    start = time.perf_counter()
+    if args.until is not None:
+        reached = sim.run_until(args.until, args.cycles)
+    else:
+        sim.run(args.cycles)
+        reached = None
+    elapsed = time.perf_counter() - start
+
+    state = sim.state()
+    mips = sim.executed / elapsed / 1e6 if elapsed else 0.0
+    print(f"{args.hex_file}")
+    print(f"  Executed {sim.executed} instructions in {sim.cycle} cycles "
+          f"({sim.seconds() * 1000:.2f} ms simulated at {sim.fosc / 1e6:g} MHz)")
+    print(f"  Host time {elapsed:.3f} s: {mips:.2f} MIPS, "
+          f"{sim.seconds() / elapsed if elapsed else 0:.2f}x real time")
+    if reached is not None:
+        print(f"  0x{args.until:04X} {'reached' if reached else 'not reached'}")
+    print(f"  PC=0x{state['pc']:04X} W=0x{state['w']:02X} STATUS=0x{state['status']:02X} "
+          f"BSR={state['bsr']} PCLATH=0x{state['pclath']:02X} "
+          f"FSR0=0x{state['fsr0']:04X} FSR1=0x{state['fsr1']:04X}")
+    print(f"  Stack: {' '.join(f'0x{a:04X}' for a in state['stack']) or '(empty)'}")
+    for cycle, cause in sim.resets[1:]:
+        print(f"  Reset at cycle {cycle}: {cause}")
+
+
+if __name__ == "__main__":
+    main()
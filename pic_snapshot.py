@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Emulation Snapshots
+Warm-state capture for the simulator and its peripherals. A SystemState
+(Peripherals.save) packs registers, data memory and the return stack into
+one bytes blob, keeps flash as the words that differ from the loaded image
+and records pending events by owner and method name. It is immutable, so
+any number of branches can start from it: restore() rewinds a live system
+in place, and fork() builds a new system in the saved state without running
+the boot code again. States pickle to files for reuse across runs.
+"""
+
+import time
+import pickle
+import argparse
+from typing import List, Optional
+
+from pic_periph import PORTS, Peripherals, SystemState, load_system
+from pic_sim import PICSimulator
+
+
+def fork(state: SystemState) -> Peripherals:
+    """A new, independent system in the saved state (same engine, clock and image)"""
+    sim: PICSimulator = state.engine(state.hex_data, state.fosc)
+    system = Peripherals(sim, idle_skip=False)
+    if state.idle_heads:
+        sim.enable_idle_skip(sorted(state.idle_heads))
+    system.restore(state)
+    return system
+
+
+def state_size(state: SystemState) -> int:
+    """Bytes held by the core blob and flash delta (model states and events excluded)"""
+    return len(state.core.blob) + len(state.core.flash)
+
+
+def save_state(state: SystemState, path: str):
+    """Write a state to disk; ADC inputs given as callables must be module-level functions"""
+    with open(path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_state(path: str) -> SystemState:
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def warm_state(hex_file: str, seconds: float, blocks: bool = True) -> SystemState:
+    """Boot an image and run it for some simulated time, then save it"""
+    system = load_system(hex_file, blocks=blocks)
+    system.sim.run(int(seconds * system.sim.fosc / 4))
+    return system.save()
+
+
+def _volts(text: str) -> List[float]:
+    """'0.5:3.0' -> the range's end points; '1.65' -> one value"""
+    return [float(part) for part in text.split(':')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot a warmed-up PIC16F1704 image and branch from it')
+    parser.add_argument('hex_file', nargs='?', help='Image to boot (not needed with --load)')
+    parser.add_argument('--boot-seconds', type=float, default=1.5, help='Simulated time before the snapshot')
+    parser.add_argument('--branches', type=int, default=100, help='Scenario branches to run from the snapshot')
+    parser.add_argument('--branch-cycles', type=int, default=20000, help='Instruction cycles per branch')
+    parser.add_argument('--adc', metavar='CH=V0[:V1]',
+                        help='Sweep an ADC input across the branches, e.g. 2=0.5:3.0')
+    parser.add_argument('--save', help='Write the snapshot to this file')
+    parser.add_argument('--load', help='Start from a snapshot file instead of booting')
+    parser.add_argument('--interpreter', action='store_true', help='Do not translate regions')
+
+    args = parser.parse_args()
+    if not args.load and not args.hex_file:
+        parser.error('a hex file or --load is required')
+
+    start = time.perf_counter()
+    if args.load:
+        state = load_state(args.load)
+        source = args.load
+    else:
+        state = warm_state(args.hex_file, args.boot_seconds, blocks=not args.interpreter)
+        source = args.hex_file
+    boot = time.perf_counter() - start
+    if args.save:
+        save_state(state, args.save)
+
+    start = time.perf_counter()
+    system = fork(state)
+    forked = time.perf_counter() - start
+    cycle = system.sim.cycle
+    print(f"{source}: snapshot at cycle {cycle} ({system.sim.seconds() * 1000:.1f} ms), "
+          f"{state_size(state)} bytes core, {len(state.core.events)} pending events")
+    print(f"  {'Loaded' if args.load else 'Booted'} in {boot:.3f} s, forked in {forked * 1000:.1f} ms")
+
+    channel: Optional[int] = None
+    if args.adc:
+        text, _, volts = args.adc.partition('=')
+        channel, points = int(text, 0), _volts(volts)
+    outcomes = {}
+    restore_time = run_time = 0.0
+    for branch in range(args.branches):
+        start = time.perf_counter()
+        system.restore(state)
+        restore_time += time.perf_counter() - start
+        label = f'branch {branch}'
+        if channel is not None:
+            low, high = points[0], points[-1]
+            level = low + (high - low) * branch / max(1, args.branches - 1)
+            system.adc.set_voltage(channel, level)
+            label = f'AN{channel} {level:.2f} V'
+        start = time.perf_counter()
+        system.sim.run(args.branch_cycles)
+        run_time += time.perf_counter() - start
+        pwm = tuple(sorted((pin, round(duty, 4)) for pin, (_, duty) in system.pwm.outputs.items()))
+        levels = tuple(system.sim.ram[registers[0]] for registers in PORTS.values())
+        outcome = (pwm, levels, len(system.sim.resets) - len(state.core.resets))
+        outcomes.setdefault(outcome, []).append(label)
+
+    count = max(1, args.branches)
+    print(f"  {args.branches} branches of {args.branch_cycles} cycles: restore {restore_time / count * 1e6:.0f} us, "
+          f"run {run_time / count * 1000:.2f} ms per branch")
+    for (pwm, levels, resets), labels in outcomes.items():
+        duties = ', '.join(f'{pin} {duty * 100:.1f}%' for pin, duty in pwm) or 'no PWM'
+        ports = ' '.join(f'PORT{port}=0x{level:02X}' for port, level in zip(PORTS, levels))
+        span = labels[0] if len(labels) == 1 else f'{labels[0]} .. {labels[-1]}'
+        print(f"  {len(labels):>4} x {span}: {ports}, {duties}{f', {resets} resets' if resets else ''}")
+
+
+if __name__ == "__main__":
+    main()
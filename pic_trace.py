@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Execution Trace
+Records every instruction the simulator executes (PC, cycle, W after it),
+every data-memory write the program makes and every interrupt entry into a
+compact binary file, and queries it through a memory map.
+
+Instructions are stored in chunks, column by column: PC and cycle as deltas
+from the previous instruction, W as the XOR with the previous W, writes as
+(instruction delta, address, value) columns. Each column is compressed on
+its own, so a query decompresses only the columns it needs. A footer lists
+per chunk its cycle range, the addresses written in it and a bitmap of the
+PCs executed, so queries skip chunks that cannot match.
+"""
+
+import os
+import zlib
+import mmap
+import time
+import struct
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from typing import Dict, List, Optional
+
+from pic_cache import decode_sections, encode_sections
+from pic_disasm import PROGRAM_WORDS, IntelHex
+from pic_periph import attach_peripherals
+from pic_sim import GIE, INDF0, INDF1, INTCON, WREG, PICSimulator
+from pic_wcet import FOSC_HZ, image_fosc
+from pic_xref import register_address, register_name
+
+# File layout: header, chunks (columns back to back), footer (pic_cache
+# sections), tail (footer offset and length)
+TRACE_MAGIC = b'P16T'
+TRACE_FORMAT = 1
+_HEADER = struct.Struct('<4sHI')
+_TAIL = struct.Struct('<QQ4s')
+
+CHUNK_INSTRUCTIONS = 65536
+COLUMNS = ('pc', 'cycle', 'w', 'windex', 'waddr', 'wvalue', 'irq')
+_TYPECODES = {'pc': 'H', 'cycle': 'I', 'w': 'B', 'windex': 'I', 'waddr': 'H', 'wvalue': 'B', 'irq': 'I'}
+_PC_MAP_BYTES = PROGRAM_WORDS // 8
+# Decoded chunks kept by the reader
+_CHUNK_CACHE = 4
+
+TraceWrite = namedtuple('TraceWrite', 'index cycle pc address value')
+# writes: [(address, value)]; interrupt: the instruction is the first of an ISR entry
+TraceStep = namedtuple('TraceStep', 'index cycle pc w writes interrupt')
+
+
+class TraceRecorder:
+    """Accumulates one chunk in arrays and appends it to the file when full"""
+
+    def __init__(self, path: str, fosc: int = FOSC_HZ, chunk_instructions: int = CHUNK_INSTRUCTIONS):
+        self.file = open(path, 'wb')
+        self.file.write(_HEADER.pack(TRACE_MAGIC, TRACE_FORMAT, fosc))
+        self.chunk_instructions = chunk_instructions
+        self.instructions = 0
+        self.writes = 0
+        self.interrupts = 0
+        self.index: Dict[str, array] = {
+            'first': array('Q'), 'count': array('I'), 'first_cycle': array('Q'), 'last_cycle': array('Q'),
+            'offset': array('Q'), 'lengths': array('I'), 'address_start': array('I'),
+            'addresses': array('H'), 'pc_map': array('B'),
+        }
+        self._start_chunk()
+
+    def _start_chunk(self):
+        self._columns = {name: array(_TYPECODES[name]) for name in COLUMNS}
+        self._pc = 0
+        self._cycle = None
+        self._w = 0
+        self._last_write = 0
+        self._written = set()
+        self._pc_map = bytearray(_PC_MAP_BYTES)
+
+    # -- recording ----------------------------------------------------------
+    def write(self, address: int, value: int):
+        """The instruction being executed writes value to address"""
+        columns = self._columns
+        index = len(columns['pc'])
+        columns['windex'].append(index - self._last_write)
+        columns['waddr'].append(address)
+        columns['wvalue'].append(value & 0xFF)
+        self._last_write = index
+        self._written.add(address)
+
+    def step(self, pc: int, cycle: int, w: int):
+        """The instruction at pc, started at cycle, is complete; w is W after it"""
+        columns = self._columns
+        if self._cycle is None:
+            self._cycle = self._first_cycle = cycle
+        columns['pc'].append((pc - self._pc) & 0xFFFF)
+        columns['cycle'].append(cycle - self._cycle)
+        columns['w'].append(w ^ self._w)
+        self._pc, self._cycle, self._w = pc, cycle, w
+        self._pc_map[pc >> 3] |= 1 << (pc & 7)
+        if len(columns['pc']) >= self.chunk_instructions:
+            self.flush()
+
+    def interrupt(self):
+        """The next instruction is the first of an interrupt entry"""
+        self._columns['irq'].append(len(self._columns['pc']))
+
+    def flush(self):
+        columns = self._columns
+        count = len(columns['pc'])
+        if not count:
+            return
+        index = self.index
+        index['first'].append(self.instructions)
+        index['count'].append(count)
+        index['first_cycle'].append(self._first_cycle)
+        index['last_cycle'].append(self._cycle)
+        index['offset'].append(self.file.tell())
+        index['address_start'].append(len(index['addresses']))
+        index['addresses'].extend(sorted(self._written))
+        index['pc_map'].frombytes(self._pc_map)
+        for name in COLUMNS:
+            values = columns[name]
+            blob = zlib.compress(values.tobytes(), 6)
+            index['lengths'].append(len(blob))
+            self.file.write(blob)
+        self.instructions += count
+        self.writes += len(columns['waddr'])
+        self.interrupts += len(columns['irq'])
+        self._start_chunk()
+
+    def close(self):
+        self.flush()
+        footer = encode_sections(self.index)
+        offset = self.file.tell()
+        self.file.write(footer)
+        self.file.write(_TAIL.pack(offset, len(footer), TRACE_MAGIC))
+        self.file.close()
+
+
+class TracingSimulator(PICSimulator):
+    """
+    Simulator that runs every instruction through step() while a recorder is
+    attached, so each program write goes through write() and is logged.
+    """
+
+    def __init__(self, hex_data: IntelHex, fosc: Optional[int] = None):
+        self.recorder: Optional[TraceRecorder] = None
+        super().__init__(hex_data, fosc)
+
+    def write(self, address: int, value: int):
+        # INDF writes are logged at the address they resolve to
+        if self.recorder is not None and address not in (INDF0, INDF1):
+            self.recorder.write(address, value)
+        super().write(address, value)
+
+    def interrupt(self):
+        if self.recorder is not None:
+            self.recorder.interrupt()
+        super().interrupt()
+
+    def _run_fast(self, limit: int):
+        recorder = self.recorder
+        if recorder is None:
+            return super()._run_fast(limit)
+        ram = self.ram
+        while self.cycle < limit and self.stop_reason is None:
+            pc, cycle, executed = self.pc, self.cycle, self.executed
+            self.step()
+            # A breakpoint stop executes nothing
+            if self.executed != executed:
+                recorder.step(pc, cycle, ram[WREG])
+            # Back to run() wherever it has work: events, Sleep, interrupts
+            if (self.events and self.events[0][0] <= self.cycle) or self.sleeping or \
+                    (ram[INTCON] & GIE and self.interrupt_requested()):
+                break
+
+
+class TraceReader:
+    """Memory-mapped trace file with chunk-indexed queries"""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, self.fosc = _HEADER.unpack_from(self.map)
+        offset, length, tail_magic = _TAIL.unpack_from(self.map, len(self.map) - _TAIL.size)
+        if magic != TRACE_MAGIC or tail_magic != TRACE_MAGIC or fmt != TRACE_FORMAT:
+            raise ValueError(f"{path}: not a complete trace file")
+        index = decode_sections(self.map[offset:offset + length])
+        if index is None:
+            raise ValueError(f"{path}: unreadable trace index")
+        self.index = index
+        self.chunks = len(index['first'])
+        # Column offsets within the file
+        self._starts = array('Q')
+        for chunk in range(self.chunks):
+            position = index['offset'][chunk]
+            for column in range(len(COLUMNS)):
+                self._starts.append(position)
+                position += index['lengths'][chunk * len(COLUMNS) + column]
+        self._cache: OrderedDict = OrderedDict()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return sum(self.index['count'])
+
+    # -- decoding ----------------------------------------------------------
+    def _column(self, chunk: int, name: str) -> array:
+        """One decoded column; pc, cycle and w come back as absolute values"""
+        key = (chunk, name)
+        values = self._cache.get(key)
+        if values is not None:
+            self._cache.move_to_end(key)
+            return values
+        slot = chunk * len(COLUMNS) + COLUMNS.index(name)
+        start = self._starts[slot]
+        values = array(_TYPECODES[name])
+        values.frombytes(zlib.decompress(self.map[start:start + self.index['lengths'][slot]]))
+        if name in ('pc', 'cycle', 'w', 'windex'):
+            values = self._undelta(chunk, name, values)
+        self._cache[key] = values
+        if len(self._cache) > _CHUNK_CACHE * len(COLUMNS):
+            self._cache.popitem(last=False)
+        return values
+
+    def _undelta(self, chunk: int, name: str, values: array) -> array:
+        """Absolute values of a delta column (needs numpy)"""
+        import numpy as np
+        deltas = np.frombuffer(values, dtype=f'u{values.itemsize}')
+        if name == 'cycle':
+            result = np.cumsum(deltas, dtype=np.uint64) + np.uint64(self.index['first_cycle'][chunk])
+            typecode = 'Q'
+        elif name == 'w':
+            result = np.bitwise_xor.accumulate(deltas)
+            typecode = values.typecode
+        else:
+            # pc and windex: summed in the column's own width, so pc wraps at 16 bits
+            result = np.cumsum(deltas, dtype=deltas.dtype)
+            typecode = values.typecode
+        decoded = array(typecode)
+        decoded.frombytes(result.tobytes())
+        return decoded
+
+    def _written_in(self, chunk: int, address: int) -> bool:
+        index = self.index
+        start = index['address_start'][chunk]
+        end = index['address_start'][chunk + 1] if chunk + 1 < self.chunks else len(index['addresses'])
+        position = bisect_left(index['addresses'], address, start, end)
+        return position < end and index['addresses'][position] == address
+
+    def _chunk_at(self, cycle: int) -> int:
+        return max(0, bisect_right(self.index['first_cycle'], cycle) - 1)
+
+    # -- queries -------------------------------------------------------------
+    def writes(self, register, start: int = 0, end: Optional[int] = None) -> List[TraceWrite]:
+        """Every program write to a register (name or data address), in order"""
+        address = register_address(register) if isinstance(register, str) else register
+        index = self.index
+        found = []
+        for chunk in range(self.chunks):
+            if index['last_cycle'][chunk] < start or (end is not None and index['first_cycle'][chunk] > end):
+                continue
+            if not self._written_in(chunk, address):
+                continue
+            addresses = self._column(chunk, 'waddr')
+            rows, values = self._column(chunk, 'windex'), self._column(chunk, 'wvalue')
+            pcs, cycles = self._column(chunk, 'pc'), self._column(chunk, 'cycle')
+            first = index['first'][chunk]
+            for position, written in enumerate(addresses):
+                if written != address:
+                    continue
+                row = rows[position]
+                if start <= cycles[row] and (end is None or cycles[row] <= end):
+                    found.append(TraceWrite(first + row, cycles[row], pcs[row], address, values[position]))
+        return found
+
+    def executions(self, pc: int, limit: Optional[int] = None) -> List[int]:
+        """Cycles at which the instruction at pc started"""
+        pc_map = self.index['pc_map']
+        found = []
+        for chunk in range(self.chunks):
+            if not pc_map[chunk * _PC_MAP_BYTES + (pc >> 3)] & (1 << (pc & 7)):
+                continue
+            pcs, cycles = self._column(chunk, 'pc'), self._column(chunk, 'cycle')
+            found.extend(cycles[row] for row, executed in enumerate(pcs) if executed == pc)
+            if limit is not None and len(found) >= limit:
+                return found[:limit]
+        return found
+
+    def interrupts(self) -> List[int]:
+        """Cycles of the first ISR instruction of every interrupt entry"""
+        found = []
+        for chunk in range(self.chunks):
+            rows = self._column(chunk, 'irq')
+            if rows:
+                cycles = self._column(chunk, 'cycle')
+                found.extend(cycles[row] for row in rows if row < len(cycles))
+        return found
+
+    def steps(self, chunk: int, first: int = 0, last: Optional[int] = None) -> List[TraceStep]:
+        """Instructions first..last (chunk rows) with their writes"""
+        pcs, cycles, ws = self._column(chunk, 'pc'), self._column(chunk, 'cycle'), self._column(chunk, 'w')
+        last = len(pcs) - 1 if last is None else min(last, len(pcs) - 1)
+        rows, addresses, values = (self._column(chunk, 'windex'), self._column(chunk, 'waddr'),
+                                   self._column(chunk, 'wvalue'))
+        irqs = set(self._column(chunk, 'irq'))
+        base = self.index['first'][chunk]
+        position = bisect_left(rows, first)
+        steps = []
+        for row in range(first, last + 1):
+            writes = []
+            while position < len(rows) and rows[position] == row:
+                writes.append((addresses[position], values[position]))
+                position += 1
+            steps.append(TraceStep(base + row, cycles[row], pcs[row], ws[row], writes, row in irqs))
+        return steps
+
+    def around(self, cycle: int, before: int = 10, after: int = 10) -> List[TraceStep]:
+        """PC history: the instructions before and after the one running at cycle"""
+        if not self.chunks:
+            return []
+        chunk = self._chunk_at(cycle)
+        row = max(0, bisect_right(self._column(chunk, 'cycle'), cycle) - 1)
+        steps = []
+        # Earlier chunks for the instructions before, later ones for those after
+        current, first = chunk, row - before
+        while first < 0 and current > 0:
+            current -= 1
+            first += self.index['count'][current]
+        if first < 0:
+            first = 0
+        while current < chunk:
+            steps.extend(self.steps(current, first))
+            current, first = current + 1, 0
+        steps.extend(self.steps(chunk, first, row + after))
+        remaining = row + after - (self.index['count'][chunk] - 1)
+        current = chunk + 1
+        while remaining > 0 and current < self.chunks:
+            steps.extend(self.steps(current, 0, remaining - 1))
+            remaining -= self.index['count'][current]
+            current += 1
+        return steps
+
+
+def record_trace(hex_file: str, path: str, cycles: int, start: int = 0,
+                 fosc: Optional[int] = None, chunk_instructions: int = CHUNK_INSTRUCTIONS) -> TraceRecorder:
+    """Run an image with its peripherals and trace cycles start..start+cycles"""
+    hex_data = IntelHex()
+    hex_data.load(hex_file)
+    sim = TracingSimulator(hex_data, fosc)
+    # Polling loops run in full so the trace holds every instruction
+    attach_peripherals(sim, idle_skip=False)
+    if start:
+        sim.run(start)
+    recorder = sim.recorder = TraceRecorder(path, sim.fosc, chunk_instructions)
+    try:
+        sim.run(cycles)
+    finally:
+        sim.recorder = None
+        recorder.close()
+    return recorder
+
+
+def _format_step(step: TraceStep, marker: str = ' ') -> str:
+    writes = ' '.join(f'{register_name(address)}=0x{value:02X}' for address, value in step.writes)
+    irq = '  <interrupt>' if step.interrupt else ''
+    return f"  {marker} {step.cycle:>10}  0x{step.pc:04X}  W=0x{step.w:02X}  {writes}{irq}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record and query PIC16F1704 execution traces')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Run an image and write a trace')
+    record.add_argument('hex_file', help='Image to run')
+    record.add_argument('trace', help='Output trace file')
+    record.add_argument('--start-ms', type=float, default=0.0, help='Run untraced for this long first')
+    record.add_argument('--ms', type=float, default=100.0, help='Simulated time to trace')
+    record.add_argument('--chunk', type=int, default=CHUNK_INSTRUCTIONS, help='Instructions per chunk')
+    query = commands.add_parser('query', help='Query a trace')
+    query.add_argument('trace', help='Trace file')
+    query.add_argument('--writes', action='append', default=[], metavar='REGISTER',
+                       help='List writes to a register (name or address)')
+    query.add_argument('--around', type=int, metavar='CYCLE', help='PC history around a cycle')
+    query.add_argument('--window', type=int, default=10, help='Instructions either side for --around')
+    query.add_argument('--pc', type=lambda s: int(s, 0), help='Cycles at which an address executed')
+    query.add_argument('--interrupts', action='store_true', help='List interrupt entries')
+    query.add_argument('--limit', type=int, default=20, help='Entries to print per query')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        cycles_per_ms = image_fosc(IntelHex(args.hex_file)) / 4000
+        start = time.perf_counter()
+        recorder = record_trace(args.hex_file, args.trace, int(args.ms * cycles_per_ms),
+                                int(args.start_ms * cycles_per_ms), chunk_instructions=args.chunk)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(args.trace)
+        print(f"{args.trace}: {recorder.instructions} instructions, {recorder.writes} writes, "
+              f"{recorder.interrupts} interrupts in {len(recorder.index['first'])} chunks")
+        print(f"  {size} bytes ({size / max(1, recorder.instructions):.2f} bytes/instruction), "
+              f"recorded in {elapsed:.2f} s")
+        return
+
+    reader = TraceReader(args.trace)
+    print(f"{args.trace}: {len(reader)} instructions in {reader.chunks} chunks")
+    for register in args.writes:
+        target = int(register, 0) if register[0].isdigit() else register
+        writes = reader.writes(target)
+        print(f"  Writes to {register}: {len(writes)}")
+        for write in writes[:args.limit]:
+            print(f"    cycle {write.cycle:>10}  0x{write.pc:04X}  <- 0x{write.value:02X}")
+    if args.pc is not None:
+        cycles = reader.executions(args.pc)
+        print(f"  0x{args.pc:04X} executed {len(cycles)} times: "
+              f"{' '.join(str(cycle) for cycle in cycles[:args.limit])}{' ...' if len(cycles) > args.limit else ''}")
+    if args.interrupts:
+        cycles = reader.interrupts()
+        print(f"  Interrupts: {len(cycles)}: "
+              f"{' '.join(str(cycle) for cycle in cycles[:args.limit])}{' ...' if len(cycles) > args.limit else ''}")
+    if args.around is not None:
+        print(f"  Around cycle {args.around}:")
+        steps = reader.around(args.around, args.window, args.window)
+        for step in steps:
+            current = step.cycle <= args.around and all(
+                other.cycle > args.around for other in steps if other.index == step.index + 1)
+            print(_format_step(step, '>' if current else ' '))
+    reader.close()
+
+
+if __name__ == "__main__":
+    main()
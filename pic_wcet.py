@@ -0,0 +1,710 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Static Cycle Estimator
+Worst- and best-case instruction-cycle counts over the recovered control flow.
+Branches, calls, returns and taken skips cost 2 cycles, everything else 1.
+Loops are bounded from their decfsz/incfsz counters or from explicit
+--loop-bound HEADER=N bounds; a region containing any other loop has no WCET
+(it is reported as unbounded, with the loops that need a bound).
+"""
+
+import argparse
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pic_cfg import (
+    CALL, FALL, INTERRUPT_VECTOR, RESET_VECTOR, RETURN, SKIP,
+    ControlFlowGraph, build_cfg,
+)
+from pic_disasm import (FORM_F, FORM_FB, FORM_FD, MNEMONIC_IDS, IntelHex, InstructionStore,
+                        disassemble, disassemble_file)
+from pic_xref import XrefIndex, register_address
+
+# Oscillator frequency when an image does not determine it (image_fosc). Every
+# image in _bins selects the 16 MHz HFINTOSC: CONFIG1 FOSC = INTOSC and OSCCON
+# IRCF = 1111 (V71 writes 0x78); the 4x PLL (CONFIG2 PLLEN) only multiplies
+# the 8 MHz setting, so it does not apply.
+FOSC_HZ = 16000000
+
+# Configuration words and the fields that pick the clock
+CONFIG1, CONFIG2 = 0x8007, 0x8008
+FOSC_INTOSC = 0b100
+PLLEN = 1 << 8
+# OSCCON: SPLLEN<7>, IRCF<6:3>, SCS<1:0>; value at power-on
+SPLLEN = 1 << 7
+OSCCON_RESET = 0x38
+# HFINTOSC/MFINTOSC/LFINTOSC output per IRCF setting, in Hz
+IRCF_HZ = {
+    0b1111: 16000000, 0b1110: 8000000, 0b1101: 4000000, 0b1100: 2000000,
+    0b1011: 1000000, 0b1010: 500000, 0b1001: 250000, 0b1000: 125000,
+    0b0111: 500000, 0b0110: 250000, 0b0101: 125000, 0b0100: 62500,
+    0b0011: 31250, 0b0010: 31250, 0b0001: 31000, 0b0000: 31000,
+}
+SOSC_HZ = 32768
+
+# Address of the I2C command processor (IDA analysis)
+I2C_HANDLER = 0x053D
+# PIR2 bit carrying TMR4IF
+TMR4IF_BIT = 1
+
+# Path enumeration cap per region
+MAX_PATHS = 1024
+
+_M = MNEMONIC_IDS
+_TWO_CYCLE = {_M[m] for m in ('goto', 'call', 'callw', 'bra', 'brw', 'return', 'retlw', 'retfie')}
+_SKIPS = {_M['btfsc'], _M['btfss'], _M['decfsz'], _M['incfsz']}
+_COUNTERS = {_M['decfsz'], _M['incfsz']}
+_MOVLW, _MOVWF, _GOTO, _CALL = _M['movlw'], _M['movwf'], _M['goto'], _M['call']
+_BRA, _MOVLP, _MOVLB = _M['bra'], _M['movlp'], _M['movlb']
+_WREG = 0x09
+# Common RAM, the same in every bank
+_COMMON = range(0x70, 0x80)
+
+# Executions of 1-cycle and 2-cycle instructions; taken skips are 2-cycle
+# executions counted again in 'skips'
+Cost = namedtuple('Cost', 'one two skips')
+ZERO = Cost(0, 0, 0)
+ONE_CYCLE = Cost(1, 0, 0)
+TWO_CYCLE = Cost(0, 1, 0)
+TAKEN_SKIP = Cost(0, 1, 1)
+
+
+def cycles(cost: Cost) -> int:
+    return cost.one + 2 * cost.two
+
+
+def _plus(a: Cost, b: Cost) -> Cost:
+    return Cost(a.one + b.one, a.two + b.two, a.skips + b.skips)
+
+
+def _times(a: Cost, n: int) -> Cost:
+    return Cost(a.one * n, a.two * n, a.skips * n)
+
+
+Loop = namedtuple('Loop', 'header latch bound exact')
+Path = namedtuple('Path', 'blocks decisions worst best')
+
+
+class RegionTiming:
+    """Cycle bounds for a region of code entered at one address"""
+
+    def __init__(self, entry: int, exits: Tuple[int, ...] = ()):
+        self.entry = entry
+        self.exits = exits
+        self.worst: Optional[Cost] = None
+        self.best: Optional[Cost] = None
+        self.worst_blocks: List[int] = []
+        self.loops: List[Loop] = []
+        self.paths: List[Path] = []
+        self.path_count = 0
+        self.recursive = False
+        self.indirect = False
+
+    @property
+    def wcet(self) -> Optional[int]:
+        """Worst-case cycles; None without a terminating path or with an unbounded loop"""
+        return None if self.worst is None else cycles(self.worst)
+
+    @property
+    def bcet(self) -> Optional[int]:
+        return None if self.best is None else cycles(self.best)
+
+    @property
+    def assumed_loops(self) -> List[Loop]:
+        return [loop for loop in self.loops if not loop.exact]
+
+    @property
+    def unbounded_loops(self) -> List[Loop]:
+        return [loop for loop in self.loops if loop.bound is None]
+
+
+class CycleEstimator:
+    """
+    Longest/shortest path over the intra-procedural CFG, with callee bounds
+    folded in at every call site (functions are memoized).
+    """
+
+    def __init__(self, store: InstructionStore, cfg: Optional[ControlFlowGraph] = None,
+                 loop_bounds: Optional[Dict[int, int]] = None):
+        self.store = store
+        self.cfg = cfg if cfg is not None else build_cfg(store)
+        self.loop_bounds = loop_bounds or {}
+        self._predecessors: Optional[List[List[int]]] = None
+        self._functions: Dict[int, RegionTiming] = {}
+        self._active = set()
+        self.indirect_targets = [
+            root for root in self.cfg.roots if root not in (RESET_VECTOR, INTERRUPT_VECTOR)
+        ]
+
+    # -- Per-instruction costs ---------------------------------------------
+
+    def _cost(self, address: int) -> Cost:
+        store = self.store
+        row = store.row_of(address)
+        code = store.op[row]
+        if code in _TWO_CYCLE:
+            return TWO_CYCLE
+        # Writes to PCL are computed jumps
+        if store.form[row] in (FORM_F, FORM_FD) and store.arg[row] == 0x02 and \
+                (code == _MOVWF or (store.form[row] == FORM_FD and store.arg2[row])):
+            return TWO_CYCLE
+        return ONE_CYCLE
+
+    def _callee(self, site: int, worst: bool, region: RegionTiming) -> Cost:
+        """Cost of the function(s) a call site enters"""
+        if self.store.op[self.store.row_of(site)] == _CALL:
+            targets = [self.cfg.branch_target(site)]
+        else:
+            region.indirect = True
+            targets = self.indirect_targets
+        costs = []
+        for target in targets:
+            timing = self.function(target)
+            # A cycle back into an active function counts its body once
+            region.recursive = region.recursive or timing.recursive
+            if timing.best is None:
+                continue
+            region.indirect = region.indirect or timing.indirect
+            region.loops.extend(loop for loop in timing.loops if loop not in region.loops)
+            # An unbounded callee leaves the caller without a WCET (see region)
+            costs.append((timing.worst or ZERO) if worst else timing.best)
+        if not costs:
+            return ZERO
+        return max(costs, key=cycles) if worst else min(costs, key=cycles)
+
+    def _edge_cost(self, block: int, kind: int, worst: bool, region: RegionTiming) -> Cost:
+        """Cost of a block's last instruction when it leaves through an edge"""
+        last = self.cfg.end[block]
+        if kind == RETURN:
+            return _plus(TWO_CYCLE, self._callee(last, worst, region))
+        if kind == SKIP:
+            return TAKEN_SKIP
+        if kind == FALL and self.store.op[self.store.row_of(last)] in _SKIPS:
+            return ONE_CYCLE
+        return self._cost(last)
+
+    # -- Regions -----------------------------------------------------------
+
+    def function(self, entry: int) -> RegionTiming:
+        """Timing of a called function (entry to return), memoized"""
+        if entry in self._functions:
+            return self._functions[entry]
+        if entry in self._active:
+            timing = RegionTiming(entry)
+            timing.recursive = True
+            return timing
+        self._active.add(entry)
+        timing = self.region(entry, max_paths=0)
+        self._active.discard(entry)
+        self._functions[entry] = timing
+        return timing
+
+    def region(self, entry: int, exits: Iterable[int] = (), max_paths: int = MAX_PATHS) -> RegionTiming:
+        """
+        Timing from an entry address until a return/retfie or one of the exit
+        addresses, with up to max_paths individual paths enumerated.
+        """
+        cfg = self.cfg
+        exits = tuple(sorted(exits))
+        timing = RegionTiming(entry, exits)
+        entry_block = cfg.block_containing(entry)
+        if entry_block < 0:
+            raise ValueError(f"0x{entry:04X} is not reachable code")
+        exit_set = set(exits)
+
+        def first(block: int) -> int:
+            return entry if block == entry_block else cfg.start[block]
+
+        def edges(block: int) -> List[Tuple[int, int]]:
+            """(successor block or -1 for a region exit, kind)"""
+            result = []
+            for succ, kind in cfg.successors(block):
+                if kind == CALL:
+                    continue
+                result.append((-1 if cfg.start[succ] in exit_set else succ, kind))
+            return result
+
+        # Depth-first search: postorder and back edges
+        color = {entry_block: 1}
+        postorder = []
+        back_edges = []
+        stack = [(entry_block, iter(edges(entry_block)))]
+        while stack:
+            block, pending = stack[-1]
+            for succ, _ in pending:
+                if succ < 0:
+                    continue
+                state = color.get(succ, 0)
+                if state == 0:
+                    color[succ] = 1
+                    stack.append((succ, iter(edges(succ))))
+                    break
+                if state == 1:
+                    back_edges.append((block, succ))
+            else:
+                color[block] = 2
+                postorder.append(block)
+                stack.pop()
+
+        topo = postorder[::-1]
+        back = set(back_edges)
+        forward = {
+            block: [(succ, kind) for succ, kind in edges(block) if (block, succ) not in back]
+            for block in topo
+        }
+
+        base = {}
+        for block in topo:
+            cost = ZERO
+            for address in range(first(block), cfg.end[block]):
+                cost = _plus(cost, self._cost(address))
+            base[block] = cost
+
+        edge_worst = {}
+        edge_best = {}
+        for block in topo:
+            for succ, kind in edges(block):
+                edge_worst[block, succ, kind] = self._edge_cost(block, kind, True, timing)
+                edge_best[block, succ, kind] = self._edge_cost(block, kind, False, timing)
+
+        # Loop extras, innermost (smallest body) first
+        extra_worst = {block: ZERO for block in topo}
+        extra_best = {block: ZERO for block in topo}
+        predecessors = {block: [] for block in topo}
+        for block in topo:
+            for succ, _ in forward[block]:
+                if succ >= 0:
+                    predecessors[succ].append(block)
+        bodies = []
+        for latch, header in back_edges:
+            body = {latch}
+            work = [latch]
+            while work:
+                node = work.pop()
+                if node == header:
+                    continue
+                for pred in predecessors[node]:
+                    if pred not in body:
+                        body.add(pred)
+                        work.append(pred)
+            body.add(header)
+            bodies.append((len(body), latch, header, body))
+        bodies.sort()
+
+        # Smaller loops on the same header nest inside the larger ones
+        nested = {}
+        for _, latch, header, body in bodies:
+            nested[header] = nested.get(header, set()) | body
+            bound, exact = self._loop_bound(header, latch, nested[header])
+            timing.loops.append(Loop(cfg.start[header], cfg.end[latch], bound, exact))
+            kind = next(kind for succ, kind in edges(latch) if succ == header)
+            for worst in (True, False):
+                extra = extra_worst if worst else extra_best
+                edge_cost = edge_worst if worst else edge_best
+                path = {}
+                for block in topo:
+                    if block not in body:
+                        continue
+                    if block == header:
+                        # Inner loops on the same header run in full every pass
+                        here = _plus(base[block], extra[block])
+                    else:
+                        incoming = [
+                            _plus(path[pred], edge_cost[pred, block, k])
+                            for pred in predecessors[block] if pred in path
+                            for s, k in forward[pred] if s == block
+                        ]
+                        if not incoming:
+                            continue
+                        here = _plus(max(incoming, key=cycles) if worst else min(incoming, key=cycles),
+                                     _plus(base[block], extra[block]))
+                    path[block] = here
+                if latch not in path:
+                    continue
+                iteration = _plus(path[latch], edge_cost[latch, header, kind])
+                if bound is not None and (worst or exact):
+                    extra[header] = _plus(extra[header], _times(iteration, bound - 1))
+
+        # Longest / shortest path to any exit
+        worst_to = {}
+        best_to = {}
+        choice = {}
+        for block in postorder:
+            candidates = []
+            for succ, kind in forward[block]:
+                if succ >= 0 and succ not in worst_to:
+                    continue
+                tail_worst = worst_to[succ] if succ >= 0 else ZERO
+                tail_best = best_to[succ] if succ >= 0 else ZERO
+                candidates.append((
+                    _plus(edge_worst[block, succ, kind], tail_worst),
+                    _plus(edge_best[block, succ, kind], tail_best),
+                    succ,
+                ))
+            if not edges(block):
+                # return / retfie / retlw
+                candidates.append((self._cost(cfg.end[block]), self._cost(cfg.end[block]), -1))
+            if not candidates:
+                continue
+            worst = max(candidates, key=lambda c: cycles(c[0]))
+            best = min(candidates, key=lambda c: cycles(c[1]))
+            worst_to[block] = _plus(_plus(base[block], extra_worst[block]), worst[0])
+            best_to[block] = _plus(_plus(base[block], extra_best[block]), best[1])
+            choice[block] = worst[2]
+
+        if entry_block in worst_to:
+            timing.best = best_to[entry_block]
+            if not timing.unbounded_loops:
+                timing.worst = worst_to[entry_block]
+                block = entry_block
+                while block >= 0:
+                    timing.worst_blocks.append(first(block))
+                    block = choice[block]
+
+        # Path counts and enumeration
+        counts = {}
+        for block in postorder:
+            total = sum(counts.get(succ, 0) if succ >= 0 else 1 for succ, _ in forward[block])
+            counts[block] = total + (1 if not edges(block) else 0)
+        timing.path_count = counts.get(entry_block, 0)
+        if max_paths and timing.worst is not None:
+            self._enumerate(timing, entry_block, first, edges, forward, base,
+                            extra_worst, extra_best, edge_worst, edge_best, worst_to, max_paths)
+        return timing
+
+    def _enumerate(self, timing, entry_block, first, edges, forward, base,
+                   extra_worst, extra_best, edge_worst, edge_best, worst_to, max_paths):
+        cfg = self.cfg
+        stack = [(entry_block, [entry_block], [], ZERO, ZERO)]
+        while stack and len(timing.paths) < max_paths:
+            block, blocks, decisions, worst, best = stack.pop()
+            worst = _plus(worst, _plus(base[block], extra_worst[block]))
+            best = _plus(best, _plus(base[block], extra_best[block]))
+            if not edges(block):
+                end = self._cost(cfg.end[block])
+                timing.paths.append(Path([first(b) for b in blocks], decisions,
+                                         _plus(worst, end), _plus(best, end)))
+                continue
+            branches = forward[block]
+            for succ, kind in reversed(branches):
+                if succ >= 0 and succ not in worst_to:
+                    continue
+                step = decisions
+                if len(branches) > 1:
+                    step = decisions + [(cfg.end[block], cfg.start[succ] if succ >= 0 else -1)]
+                next_worst = _plus(worst, edge_worst[block, succ, kind])
+                next_best = _plus(best, edge_best[block, succ, kind])
+                if succ < 0:
+                    timing.paths.append(Path([first(b) for b in blocks], step, next_worst, next_best))
+                else:
+                    stack.append((succ, blocks + [succ], step, next_worst, next_best))
+        timing.paths.sort(key=lambda path: cycles(path.worst), reverse=True)
+
+    def _loop_bound(self, header: int, latch: int, body) -> Tuple[Optional[int], bool]:
+        """
+        Iteration bound for a back edge: explicit, or from a decfsz/incfsz
+        counter (its initial value when _counter_init finds it, else the
+        8-bit maximum). None when neither applies, or when the loop body
+        writes the counter itself.
+        """
+        cfg, store = self.cfg, self.store
+        start = cfg.start[header]
+        if start in self.loop_bounds:
+            return self.loop_bounds[start], True
+
+        # The counter skip ends the latch or the block just before a 'goto header'
+        candidates = [cfg.end[latch], cfg.start[latch] - 1]
+        for address in candidates:
+            row = store.row_of(address)
+            if row < 0 or store.op[row] not in _COUNTERS:
+                continue
+            counter = store.arg[row]
+            if counter != _WREG and any(
+                    self._writes(other, counter)
+                    for block in body for other in range(cfg.start[block], cfg.end[block] + 1)
+                    if other != address):
+                return None, False
+            value = self._counter_init(header, body, counter)
+            if value is None:
+                return 256, False
+            if store.op[row] == _M['incfsz']:
+                value = 256 - value
+            return value or 256, True
+
+        return None, False
+
+    def _counter_init(self, header: int, body, counter: int) -> Optional[int]:
+        """
+        Value a loop counter holds every time the loop is entered, or None:
+        the loop must only be entered by falling into its header from the
+        block before it, and that block must load the counter with 'movlw k;
+        movwf f' (W with 'movlw k' just before the header) and not touch it
+        again. A loop re-entered by an enclosing loop that jumps straight back
+        to the header starts from whatever the counter was left at.
+        """
+        cfg, store = self.cfg, self.store
+        start = cfg.start[header]
+        entry = cfg.block_containing(start - 1)
+        if self._predecessors is None:
+            self._predecessors = cfg.predecessors()
+        if entry < 0 or entry in body or \
+                any(pred != entry for pred in self._predecessors[header] if pred not in body):
+            return None
+        if counter == _WREG:
+            row = store.row_of(start - 1)
+            return store.arg[row] if store.op[row] == _MOVLW else None
+        for address in range(start - 1, cfg.start[entry], -1):
+            row = store.row_of(address)
+            code = store.op[row]
+            if code == _MOVWF and store.arg[row] == counter:
+                init = store.row_of(address - 1)
+                return store.arg[init] if store.op[init] == _MOVLW else None
+            if (code == _MOVLB and counter not in _COMMON) or self._writes(address, counter):
+                return None
+        return None
+
+    def _writes(self, address: int, register: int) -> bool:
+        """Whether the instruction at an address writes a register directly"""
+        store = self.store
+        row = store.row_of(address)
+        if row < 0 or store.arg[row] != register:
+            return False
+        form = store.form[row]
+        return form in (FORM_F, FORM_FB) or (form == FORM_FD and bool(store.arg2[row]))
+
+
+def locate_timer4_handler(store: InstructionStore, cfg: ControlFlowGraph,
+                          xref: Optional[XrefIndex] = None) -> Optional[Tuple[int, Tuple[int, ...]]]:
+    """
+    Entry and exit of the ISR's Timer4 branch: the code run when the TMR4IF
+    test (PIR2 bit 1) finds the flag set, up to where the branches rejoin.
+    The test skips a goto, or a bra when a patch hook has moved it; either
+    side may then go through a 'movlp / goto' stub, which is followed.
+    """
+    if xref is None:
+        xref = XrefIndex(store, cfg)
+    owner = cfg.function_owner()
+    btfss, btfsc = _M['btfss'], _M['btfsc']
+    for address in sorted(xref.accesses('PIR2')):
+        row = store.row_of(address)
+        block = cfg.block_containing(address)
+        if store.op[row] not in (btfss, btfsc) or store.arg2[row] != TMR4IF_BIT:
+            continue
+        if block < 0 or owner[block] != INTERRUPT_VECTOR:
+            continue
+        skipped = store.row_of(address + 1)
+        if skipped < 0 or store.op[skipped] not in (_GOTO, _BRA):
+            continue
+        target = _through_stubs(store, cfg, cfg.branch_target(address + 1))
+        after = _through_stubs(store, cfg, address + 2)
+        if store.op[row] == btfss:
+            return after, (target,)
+        return target, (after,)
+    return None
+
+
+def _through_stubs(store: InstructionStore, cfg: ControlFlowGraph, address: int) -> int:
+    """Where a chain of 'movlp k / goto' stubs starting at address ends up"""
+    while True:
+        row, jump = store.row_of(address), store.row_of(address + 1)
+        if row < 0 or jump < 0 or store.op[row] != _MOVLP or store.op[jump] != _GOTO or \
+                cfg.block_containing(address) != cfg.block_containing(address + 1):
+            return address
+        target = cfg.branch_target(address + 1)
+        if target is None or target == address:
+            return address
+        address = target
+
+
+def default_targets(store: InstructionStore, cfg: ControlFlowGraph) -> Dict[str, Tuple[int, Tuple[int, ...]]]:
+    """Timer4 ISR branch (whole ISR if not found) and the I2C command processor"""
+    timer4 = locate_timer4_handler(store, cfg)
+    return {
+        'timer4_isr': timer4 or (INTERRUPT_VECTOR, ()),
+        'i2c_handler': (I2C_HANDLER, ()),
+    }
+
+
+def oscillator_hz(store: InstructionStore, cfg: Optional[ControlFlowGraph] = None) -> Optional[int]:
+    """
+    Fosc the image configures, or None when it cannot be told statically:
+    CONFIG1 must select the internal oscillator and every OSCCON write must
+    sit in one basic block as an operation on OSCCON after a 'movlw k'
+    (bank/page selects may come between), or a bit operation. The value is
+    tracked from OSCCON's reset state.
+    """
+    config1, config2 = store.at(CONFIG1), store.at(CONFIG2)
+    if config1 is None or config1['opcode'] & 0b111 != FOSC_INTOSC:
+        return None
+    if cfg is None:
+        cfg = build_cfg(store)
+    writes = sorted(XrefIndex(store, cfg).writes(register_address('OSCCON')))
+    if not writes or len({cfg.block_containing(address) for address in writes}) != 1:
+        return None
+    value = OSCCON_RESET
+    for address in writes:
+        instruction = store.at(address)
+        name, form, arg2 = instruction['mnemonic'], instruction['form'], instruction['arg2']
+        if form == FORM_FB:
+            value = value | 1 << arg2 if name == 'bsf' else value & ~(1 << arg2)
+        elif name == 'clrf':
+            value = 0
+        else:
+            # W from the movlw before it; bank and page selects leave W alone
+            before = store.at(address - 1)
+            while before is not None and before['mnemonic'] in ('movlb', 'movlp', 'nop'):
+                before = store.at(before['address'] - 1)
+            if before is None or before['mnemonic'] != 'movlw' or \
+                    cfg.block_containing(before['address']) != cfg.block_containing(address):
+                return None
+            w = before['arg']
+            if form == FORM_FD and arg2 != 1:
+                return None
+            if name == 'movwf':
+                value = w
+            elif name == 'iorwf':
+                value |= w
+            elif name == 'andwf':
+                value &= w
+            elif name == 'xorwf':
+                value ^= w
+            else:
+                return None
+    select, ircf = value & 0b11, value >> 3 & 0b1111
+    if select == 0b01:
+        return SOSC_HZ
+    pll = select == 0b00 and ((config2 is not None and config2['opcode'] & PLLEN) or value & SPLLEN)
+    if pll and ircf == 0b1110:
+        return 4 * IRCF_HZ[ircf]
+    return IRCF_HZ[ircf]
+
+
+def image_fosc(hex_data: IntelHex) -> int:
+    """oscillator_hz of a loaded image, FOSC_HZ when it cannot be derived"""
+    return oscillator_hz(disassemble(hex_data)) or FOSC_HZ
+
+
+def analyze_timing(hex_file: str, targets: Optional[Dict[str, Tuple[int, Tuple[int, ...]]]] = None,
+                   loop_bounds: Optional[Dict[int, int]] = None, max_paths: int = MAX_PATHS) -> Dict[str, RegionTiming]:
+    store = disassemble_file(hex_file)
+    cfg = build_cfg(store)
+    estimator = CycleEstimator(store, cfg, loop_bounds)
+    if targets is None:
+        targets = default_targets(store, cfg)
+    results = {}
+    for name, (entry, exits) in targets.items():
+        if not cfg.reachable(entry):
+            continue
+        results[name] = estimator.region(entry, exits, max_paths)
+    return results
+
+
+def _usec(cost: Optional[Cost], fosc: int) -> str:
+    if cost is None:
+        return 'n/a'
+    return f"{cycles(cost) * 4e6 / fosc:.1f} us"
+
+
+def _mix(cost: Cost) -> str:
+    return f"1-cycle {cost.one}, 2-cycle {cost.two} (taken skips {cost.skips})"
+
+
+def print_timing(name: str, timing: RegionTiming, fosc: int = FOSC_HZ, show_paths: int = 5):
+    exits = ', '.join(f"0x{e:04X}" for e in timing.exits) or 'return'
+    print(f"{name}: 0x{timing.entry:04X} -> {exits}")
+    if timing.best is None:
+        print("  No terminating path")
+        return
+    if timing.worst is None:
+        print("  WCET: unbounded (loops below need --loop-bound HEADER=N)")
+    else:
+        print(f"  WCET: {timing.wcet} cycles ({_usec(timing.worst, fosc)})  {_mix(timing.worst)}")
+    print(f"  BCET: {timing.bcet} cycles ({_usec(timing.best, fosc)})  {_mix(timing.best)}")
+    print(f"  Paths: {timing.path_count}  Loops (with callees): {len(timing.loops)}")
+    for loop in timing.assumed_loops:
+        if loop.bound is None:
+            print(f"    Loop 0x{loop.header:04X}<-0x{loop.latch:04X}: no bound")
+        else:
+            print(f"    Loop 0x{loop.header:04X}<-0x{loop.latch:04X}: at most {loop.bound} iterations "
+                  f"(counter value on entry not known)")
+    if timing.recursive:
+        print("  WARNING: recursion reached; recursive calls counted once")
+    if timing.indirect:
+        print("  Note: callw sites bounded over all function-pointer targets")
+    for index, path in enumerate(timing.paths[:show_paths]):
+        decisions = ' '.join(
+            f"0x{site:04X}>{'exit' if target < 0 else f'0x{target:04X}'}"
+            for site, target in path.decisions
+        )
+        print(f"    Path {index + 1}: {cycles(path.worst)}/{cycles(path.best)} cycles "
+              f"[{_mix(path.worst)}] {decisions}")
+
+
+def _delta(old: Optional[int], new: Optional[int]) -> str:
+    return 'n/a' if old is None or new is None else f"{new - old:+d}"
+
+
+def _wcet_text(timing: RegionTiming) -> str:
+    if timing.worst is None and timing.best is not None:
+        return 'unbounded'
+    return str(timing.wcet)
+
+
+def print_diff(original: Dict[str, RegionTiming], patched: Dict[str, RegionTiming]):
+    print(f"{'Region':<14}{'WCET orig':>11}{'WCET new':>10}{'delta':>8}"
+          f"{'BCET orig':>11}{'BCET new':>10}{'delta':>8}{'paths':>12}")
+    for name in original:
+        if name not in patched:
+            print(f"{name:<14} not present in patched image")
+            continue
+        old, new = original[name], patched[name]
+        print(f"{name:<14}{_wcet_text(old):>11}{_wcet_text(new):>10}{_delta(old.wcet, new.wcet):>8}"
+              f"{str(old.bcet):>11}{str(new.bcet):>10}{_delta(old.bcet, new.bcet):>8}"
+              f"{f'{old.path_count}->{new.path_count}':>12}")
+
+
+def _parse_target(text: str) -> Tuple[str, Tuple[int, Tuple[int, ...]]]:
+    """NAME=ENTRY[:EXIT[,EXIT...]] with hex or decimal addresses"""
+    name, _, spec = text.partition('=')
+    entry, _, exits = spec.partition(':')
+    return name, (int(entry, 0), tuple(int(e, 0) for e in exits.split(',') if e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static WCET/BCET estimation for PIC16F1704 code paths')
+    parser.add_argument('original', help='Original hex file')
+    parser.add_argument('patched', nargs='?', help='Patched hex file to compare against')
+    parser.add_argument('--target', action='append', default=[],
+                        help='Region NAME=ENTRY[:EXIT,...] (default: Timer4 ISR branch and I2C handler)')
+    parser.add_argument('--loop-bound', action='append', default=[],
+                        help='Loop iteration bound HEADER=N (regions with a loop that has '
+                             'neither a counter nor a bound get no WCET)')
+    parser.add_argument('--paths', type=int, default=5, help='Paths to list per region')
+    parser.add_argument('--fosc', type=int, help='Oscillator frequency in Hz (default: what each image configures)')
+
+    args = parser.parse_args()
+
+    targets = dict(_parse_target(t) for t in args.target) or None
+    loop_bounds = {int(h, 0): int(n, 0) for h, n in (b.split('=') for b in args.loop_bound)}
+
+    original = analyze_timing(args.original, targets, loop_bounds)
+    fosc = args.fosc or image_fosc(IntelHex(args.original))
+    print(f"Original: {args.original} ({fosc / 1e6:g} MHz)")
+    print("-" * 60)
+    for name, timing in original.items():
+        print_timing(name, timing, fosc, args.paths)
+
+    if args.patched:
+        patched = analyze_timing(args.patched, targets, loop_bounds)
+        fosc = args.fosc or image_fosc(IntelHex(args.patched))
+        print(f"\nPatched: {args.patched} ({fosc / 1e6:g} MHz)")
+        print("-" * 60)
+        for name, timing in patched.items():
+            print_timing(name, timing, fosc, args.paths)
+        print("\nDifference")
+        print("-" * 60)
+        print_diff(original, patched)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+PIC16F1704 Register Cross-Reference
+Tracks BSR (movlb) state over the control-flow graph so every file-register
+operand resolves to an absolute data address and SFR name, then indexes the
+accesses so "every access to register X" is a dictionary lookup across images.
+"""
+
+import argparse
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from pic_cfg import (
+    ControlFlowGraph, INTERRUPT_VECTOR, RESET_VECTOR, RETURN, UNKNOWN, UNREACHED,
+)
+from pic_disasm import (
+    InstructionStore, PROGRAM_WORDS, FORM_F, FORM_FD, FORM_FB, MNEMONIC_IDS,
+    disassemble_file,
+)
+
+# Core registers, mirrored at offsets 0x00-0x0B of every bank
+CORE_REGISTERS = {
+    0x00: 'INDF0', 0x01: 'INDF1', 0x02: 'PCL', 0x03: 'STATUS',
+    0x04: 'FSR0L', 0x05: 'FSR0H', 0x06: 'FSR1L', 0x07: 'FSR1H',
+    0x08: 'BSR', 0x09: 'WREG', 0x0A: 'PCLATH', 0x0B: 'INTCON',
+}
+
+# Banked special function registers (absolute address = bank * 0x80 + offset)
+SFR_MAP = {
+    # Bank 0
+    0x00C: 'PORTA', 0x00E: 'PORTC', 0x011: 'PIR1', 0x012: 'PIR2', 0x013: 'PIR3',
+    0x015: 'TMR0', 0x016: 'TMR1L', 0x017: 'TMR1H', 0x018: 'T1CON', 0x019: 'T1GCON',
+    0x01A: 'TMR2', 0x01B: 'PR2', 0x01C: 'T2CON',
+    # Bank 1
+    0x08C: 'TRISA', 0x08E: 'TRISC', 0x091: 'PIE1', 0x092: 'PIE2', 0x093: 'PIE3',
+    0x095: 'OPTION_REG', 0x096: 'PCON', 0x097: 'WDTCON', 0x098: 'OSCTUNE',
+    0x099: 'OSCCON', 0x09A: 'OSCSTAT', 0x09B: 'ADRESL', 0x09C: 'ADRESH',
+    0x09D: 'ADCON0', 0x09E: 'ADCON1', 0x09F: 'ADCON2',
+    # Bank 2
+    0x10C: 'LATA', 0x10E: 'LATC', 0x111: 'CM1CON0', 0x112: 'CM1CON1',
+    0x113: 'CM2CON0', 0x114: 'CM2CON1', 0x115: 'CMOUT', 0x116: 'BORCON',
+    0x117: 'FVRCON', 0x118: 'DAC1CON0', 0x119: 'DAC1CON1', 0x11C: 'ZCD1CON',
+    # Bank 3
+    0x18C: 'ANSELA', 0x18E: 'ANSELC', 0x191: 'PMADRL', 0x192: 'PMADRH',
+    0x193: 'PMDATL', 0x194: 'PMDATH', 0x195: 'PMCON1', 0x196: 'PMCON2',
+    0x197: 'VREGCON', 0x199: 'RC1REG', 0x19A: 'TX1REG', 0x19B: 'SP1BRGL',
+    0x19C: 'SP1BRGH', 0x19D: 'RC1STA', 0x19E: 'TX1STA', 0x19F: 'BAUD1CON',
+    # Bank 4
+    0x20C: 'WPUA', 0x20E: 'WPUC', 0x211: 'SSP1BUF', 0x212: 'SSP1ADD',
+    0x213: 'SSP1MSK', 0x214: 'SSP1STAT', 0x215: 'SSP1CON1', 0x216: 'SSP1CON2',
+    0x217: 'SSP1CON3',
+    # Bank 5
+    0x28C: 'ODCONA', 0x28E: 'ODCONC', 0x291: 'CCPR1L', 0x292: 'CCPR1H',
+    0x293: 'CCP1CON', 0x298: 'CCPR2L', 0x299: 'CCPR2H', 0x29A: 'CCP2CON',
+    0x29E: 'CCPTMRS',
+    # Bank 6-7
+    0x30C: 'SLRCONA', 0x30E: 'SLRCONC',
+    0x38C: 'INLVLA', 0x38E: 'INLVLC', 0x391: 'IOCAP', 0x392: 'IOCAN',
+    0x393: 'IOCAF', 0x397: 'IOCCP', 0x398: 'IOCCN', 0x399: 'IOCCF',
+    # Bank 8
+    0x415: 'TMR4', 0x416: 'PR4', 0x417: 'T4CON', 0x41C: 'TMR6', 0x41D: 'PR6',
+    0x41E: 'T6CON',
+    # Bank 10
+    0x511: 'OPA1CON', 0x515: 'OPA2CON',
+    # Bank 12
+    0x617: 'PWM3DCL', 0x618: 'PWM3DCH', 0x619: 'PWM3CON', 0x61A: 'PWM4DCL',
+    0x61B: 'PWM4DCH', 0x61C: 'PWM4CON',
+    # Bank 13
+    0x691: 'COG1PHR', 0x692: 'COG1PHF', 0x693: 'COG1BLKR', 0x694: 'COG1BLKF',
+    0x695: 'COG1DBR', 0x696: 'COG1DBF', 0x697: 'COG1CON0', 0x698: 'COG1CON1',
+    0x699: 'COG1RIS', 0x69A: 'COG1RSIM', 0x69B: 'COG1FIS', 0x69C: 'COG1FSIM',
+    0x69D: 'COG1ASD0', 0x69E: 'COG1ASD1', 0x69F: 'COG1STR',
+    # Bank 28 (PPS inputs)
+    0xE0F: 'PPSLOCK', 0xE10: 'INTPPS', 0xE11: 'T0CKIPPS', 0xE12: 'T1CKIPPS',
+    0xE13: 'T1GPPS', 0xE14: 'CCP1PPS', 0xE15: 'CCP2PPS', 0xE17: 'COGINPPS',
+    0xE20: 'SSPCLKPPS', 0xE21: 'SSPDATPPS', 0xE22: 'SSPSSPPS', 0xE24: 'RXPPS',
+    0xE25: 'CKPPS', 0xE28: 'CLCIN0PPS', 0xE29: 'CLCIN1PPS', 0xE2A: 'CLCIN2PPS',
+    0xE2B: 'CLCIN3PPS',
+    # Bank 29 (PPS outputs)
+    0xE90: 'RA0PPS', 0xE91: 'RA1PPS', 0xE92: 'RA2PPS', 0xE94: 'RA4PPS',
+    0xE95: 'RA5PPS', 0xEA0: 'RC0PPS', 0xEA1: 'RC1PPS', 0xEA2: 'RC2PPS',
+    0xEA3: 'RC3PPS', 0xEA4: 'RC4PPS', 0xEA5: 'RC5PPS',
+    # Bank 30 (CLC)
+    0xF0F: 'CLCDATA', 0xF10: 'CLC1CON', 0xF11: 'CLC1POL', 0xF12: 'CLC1SEL0',
+    0xF13: 'CLC1SEL1', 0xF14: 'CLC1SEL2', 0xF15: 'CLC1SEL3', 0xF16: 'CLC1GLS0',
+    0xF17: 'CLC1GLS1', 0xF18: 'CLC1GLS2', 0xF19: 'CLC1GLS3', 0xF1A: 'CLC2CON',
+    0xF1B: 'CLC2POL', 0xF1C: 'CLC2SEL0', 0xF1D: 'CLC2SEL1', 0xF1E: 'CLC2SEL2',
+    0xF1F: 'CLC2SEL3', 0xF20: 'CLC2GLS0', 0xF21: 'CLC2GLS1', 0xF22: 'CLC2GLS2',
+    0xF23: 'CLC2GLS3',
+    # Bank 31 (interrupt shadow registers and stack)
+    0xFE4: 'STATUS_SHAD', 0xFE5: 'WREG_SHAD', 0xFE6: 'BSR_SHAD',
+    0xFE7: 'PCLATH_SHAD', 0xFE8: 'FSR0L_SHAD', 0xFE9: 'FSR0H_SHAD',
+    0xFEA: 'FSR1L_SHAD', 0xFEB: 'FSR1H_SHAD', 0xFED: 'STKPTR', 0xFEE: 'TOSL',
+    0xFEF: 'TOSH',
+}
+
+SFR_ADDRESSES = {name: address for address, name in SFR_MAP.items()}
+SFR_ADDRESSES.update({name: address for address, name in CORE_REGISTERS.items()})
+
+# Access flags
+READ = 0x01
+WRITE = 0x02
+
+# Bank states (UNREACHED comes from pic_cfg)
+UNKNOWN_BANK = UNKNOWN
+
+# Cache section names written by XrefIndex.to_sections
+XREF_SECTIONS = ('xref.bank', 'xref.reg', 'xref.inst', 'xref.flags')
+
+# Operand file address (0x00-0x7F) with an unknown bank is recorded here
+UNRESOLVED = 0x8000
+
+_M = MNEMONIC_IDS
+_WRITE_ONLY = {_M['movwf'], _M['clrf']}
+_READ_ONLY = {_M['btfsc'], _M['btfss']}
+_READ_WRITE_BITS = {_M['bcf'], _M['bsf']}
+_TRIS = _M['tris']
+
+
+def resolve(f: int, bank: int) -> int:
+    """Absolute data address for a 7-bit file operand in a bank"""
+    if f < 0x0C or f >= 0x70:
+        # Core registers and common RAM are visible from every bank
+        return f
+    if bank < 0:
+        return UNRESOLVED | f
+    return (bank << 7) | f
+
+
+def register_name(address: int) -> str:
+    """Symbolic name for an absolute data address"""
+    if address & UNRESOLVED:
+        f = address & 0x7F
+        return f'?:0x{f:02X}'
+    if address < 0x0C:
+        return CORE_REGISTERS[address]
+    if address in SFR_MAP:
+        return SFR_MAP[address]
+    return f'RAM_{address:03X}'
+
+
+def register_address(name: str) -> int:
+    """Absolute address for an SFR name or a numeric address string"""
+    key = name.upper()
+    if key in SFR_ADDRESSES:
+        return SFR_ADDRESSES[key]
+    return int(name, 0)
+
+
+def _access_flags(op: int, form: int, d: int) -> int:
+    if op in _WRITE_ONLY:
+        return WRITE
+    if op in _READ_ONLY:
+        return READ
+    if op in _READ_WRITE_BITS or (form == FORM_FD and d):
+        return READ | WRITE
+    return READ
+
+
+def track_banks(store: InstructionStore, cfg: ControlFlowGraph,
+                entries: Optional[Dict[int, int]] = None) -> array:
+    """
+    Forward dataflow of the BSR value over the basic blocks of a CFG.
+    Result entries are a bank number, UNKNOWN_BANK or UNREACHED per address.
+    """
+    if entries is None:
+        # BSR resets to 0; the ISR may interrupt any bank
+        entries = {RESET_VECTOR: 0, INTERRUPT_VECTOR: UNKNOWN_BANK}
+
+    banks = array('b', [UNREACHED]) * PROGRAM_WORDS
+    block_in = array('b', [UNREACHED]) * len(cfg)
+    op, form, arg, arg2, row_of = store.op, store.form, store.arg, store.arg2, store.row_of
+    movlb, clrf, movwf = _M['movlb'], _M['clrf'], _M['movwf']
+    worklist = []
+
+    def join(block: int, bank: int):
+        current = block_in[block]
+        if current == bank or current == UNKNOWN_BANK:
+            return
+        block_in[block] = bank if current == UNREACHED else UNKNOWN_BANK
+        worklist.append(block)
+
+    for address, bank in entries.items():
+        if cfg.reachable(address):
+            join(cfg.block_containing(address), bank)
+
+    while worklist:
+        block = worklist.pop()
+        bank = block_in[block]
+        for address in range(cfg.start[block], cfg.end[block] + 1):
+            banks[address] = bank
+            row = row_of(address)
+            code = op[row]
+            if code == movlb:
+                bank = arg[row]
+            elif form[row] in (FORM_F, FORM_FD) and code != _TRIS and arg[row] == 0x08:
+                if code == clrf:
+                    bank = 0
+                elif code == movwf or (form[row] == FORM_FD and arg2[row]):
+                    bank = UNKNOWN_BANK
+        for succ, kind in cfg.successors(block):
+            # The callee may leave any bank selected
+            join(succ, UNKNOWN_BANK if kind == RETURN else bank)
+
+    return banks
+
+
+class XrefIndex:
+    """Register -> accessing instruction index for one image"""
+
+    def __init__(self, store: InstructionStore, cfg: Optional[ControlFlowGraph] = None,
+                 entries: Optional[Dict[int, int]] = None):
+        if cfg is None:
+            cfg = ControlFlowGraph(store)
+        self.banks = track_banks(store, cfg, entries)
+        self.register = array('H')
+        self.instruction = array('H')
+        self.flags = array('B')
+
+        op, form, arg, arg2, addresses = store.op, store.form, store.arg, store.arg2, store.address
+        banks = self.banks
+        for row in range(len(addresses)):
+            kind = form[row]
+            if kind not in (FORM_F, FORM_FD, FORM_FB) or op[row] == _TRIS:
+                continue
+            address = addresses[row]
+            if address >= PROGRAM_WORDS:
+                continue
+            self.register.append(resolve(arg[row], banks[address]))
+            self.instruction.append(address)
+            self.flags.append(_access_flags(op[row], kind, arg2[row]))
+
+        self._build_index()
+
+    def _build_index(self):
+        self.by_register: Dict[int, array] = {}
+        for register, address in zip(self.register, self.instruction):
+            entry = self.by_register.get(register)
+            if entry is None:
+                entry = self.by_register[register] = array('H')
+            entry.append(address)
+
+    @classmethod
+    def from_sections(cls, sections: Dict[str, array]) -> 'XrefIndex':
+        """Rebuild from cached 'xref.*' sections"""
+        index = cls.__new__(cls)
+        index.banks = sections['xref.bank']
+        index.register = sections['xref.reg']
+        index.instruction = sections['xref.inst']
+        index.flags = sections['xref.flags']
+        index._build_index()
+        return index
+
+    def to_sections(self) -> Dict[str, array]:
+        return {
+            'xref.bank': self.banks,
+            'xref.reg': self.register,
+            'xref.inst': self.instruction,
+            'xref.flags': self.flags,
+        }
+
+    def bank_at(self, address: int) -> int:
+        """BSR value on entry to an instruction"""
+        return self.banks[address]
+
+    def accesses(self, register) -> array:
+        """Instruction addresses touching a register (name or absolute address)"""
+        if isinstance(register, str):
+            register = register_address(register)
+        return self.by_register.get(register, array('H'))
+
+    def _filtered(self, register, flag: int) -> List[int]:
+        if isinstance(register, str):
+            register = register_address(register)
+        return [
+            address for reg, address, flags in zip(self.register, self.instruction, self.flags)
+            if reg == register and flags & flag
+        ]
+
+    def reads(self, register) -> List[int]:
+        return self._filtered(register, READ)
+
+    def writes(self, register) -> List[int]:
+        return self._filtered(register, WRITE)
+
+    def registers(self) -> List[str]:
+        """Names of every register accessed, sorted by address"""
+        return [register_name(register) for register in sorted(self.by_register)]
+
+    def unresolved(self) -> int:
+        """Number of banked accesses whose BSR could not be determined"""
+        return sum(1 for register in self.register if register & UNRESOLVED)
+
+
+class CorpusXref:
+    """Register accesses across many images: name -> image -> addresses"""
+
+    def __init__(self):
+        self.images: Dict[str, XrefIndex] = {}
+        self.by_register: Dict[int, Dict[str, array]] = {}
+
+    def add(self, image: str, index: XrefIndex):
+        self.images[image] = index
+        for register, addresses in index.by_register.items():
+            self.by_register.setdefault(register, {})[image] = addresses
+
+    def lookup(self, register) -> Dict[str, array]:
+        """Every access to a register, per image"""
+        if isinstance(register, str):
+            register = register_address(register)
+        return self.by_register.get(register, {})
+
+
+def build_corpus_xref(hex_files: Iterable[str]) -> CorpusXref:
+    corpus = CorpusXref()
+    for hex_file in hex_files:
+        corpus.add(Path(hex_file).name, XrefIndex(disassemble_file(hex_file)))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-reference PIC16F1704 register accesses')
+    parser.add_argument('register', help='SFR name (e.g. PR2) or absolute address (e.g. 0x41B)')
+    parser.add_argument('hex_files', nargs='*', help='Images to search (default: _bins/*.hex)')
+
+    args = parser.parse_args()
+
+    hex_files = args.hex_files or sorted(str(f) for f in Path('_bins').glob('*.hex'))
+    corpus = build_corpus_xref(hex_files)
+    register = register_address(args.register)
+
+    print(f"Accesses to {register_name(register)} (0x{register:03X}), 'w' marks writes")
+    print("-" * 60)
+    for image, index in corpus.images.items():
+        addresses = index.accesses(register)
+        writes = set(index.writes(register))
+        listing = ', '.join(f"0x{a:04X}{'w' if a in writes else ''}" for a in addresses)
+        print(f"{image}: {len(addresses)} [{listing}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Shared fixtures: the checked-in firmware images and their listings"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'burst_mode'))
+
+BINS = ROOT / '_bins'
+V71_HEX = BINS / 'PIC16F1704_APW12_1.2_V71.hex'
+HEX_FILES = sorted(BINS.glob('*.hex'))
+
+
+@pytest.fixture(scope='session')
+def v71_store():
+    from pic_disasm import disassemble_file
+    return disassemble_file(str(V71_HEX))
+
+
+# Counts in 0x70 and copies the count to PR2, 8 cycles a pass
+COUNT_PROGRAM = """
+    clrf    0x70
+LOOP:
+    incf    0x70, F
+    movf    0x70, W
+    banksel PR2
+    movwf   PR2
+    movlb   0
+    goto    LOOP
+"""
+COUNT_MOVWF_PR2 = 4
+
+
+@pytest.fixture(scope='session')
+def count_hex(tmp_path_factory):
+    """COUNT_PROGRAM saved as a hex file"""
+    from burst_mode_injector import IntelHex
+    from pic_asm import assemble
+    image = IntelHex()
+    image.set_words(0, assemble(COUNT_PROGRAM).words)
+    path = tmp_path_factory.mktemp('count') / 'count.hex'
+    image.save(str(path))
+    return str(path)
@@ -0,0 +1,19 @@
+import subprocess
+import sys
+
+from conftest import ROOT, V71_HEX
+from pic_analyzer import PICAnalyzer
+from pic_reverse import CHECKPOINT_CYCLES
+
+
+def test_import_leaves_simulator_unloaded():
+    loaded = subprocess.run(
+        [sys.executable, '-c', "import sys, pic_analyzer; "
+                               "print(sorted(m for m in ('pic_reverse', 'pic_periph', 'pic_sim') if m in sys.modules))"],
+        cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == '[]'
+
+
+def test_time_travel_default_interval():
+    debugger = PICAnalyzer(str(V71_HEX)).time_travel()
+    assert debugger.interval == CHECKPOINT_CYCLES
@@ -0,0 +1,17 @@
+import pytest
+
+from pic_asm import AsmError, assemble
+
+
+def test_cross_page_call_needs_pagesel():
+    with pytest.raises(AsmError, match='page 1'):
+        assemble('call TARGET', 0x053C, {'TARGET': 0x0F00})
+    words = assemble('pagesel TARGET\n call TARGET\n pagesel $\n goto $', 0x053C, {'TARGET': 0x0F00}).words
+    assert words == [0x318F, 0x2700, 0x3185, 0x2D3F]
+
+
+def test_pagesel_is_forgotten_at_labels():
+    source = 'pagesel TARGET\nAGAIN:\n goto TARGET'
+    with pytest.raises(AsmError):
+        assemble(source, 0, {'TARGET': 0x0800})
+    assert assemble('goto TARGET', 0x0800, {'TARGET': 0x0F00}).words == [0x2F00]
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from conftest import V71_HEX
+from burst_mode_batch import DEFAULT_BASE, UnitImageBuilder, literal_sites, patch_base
+from burst_mode_injector import IntelHex
+
+
+def test_v71_voltage_defaults_per_path():
+    sites = {site.name: (site.address, site.default) for site in literal_sites(IntelHex(str(V71_HEX)))}
+    assert sites == {
+        'VOLTAGE_BASE_A': (0x0069, 0xB4), 'VOLTAGE_ADJUST_A': (0x006D, 0xC8),
+        'VOLTAGE_BASE_B': (0x0092, 0xB8), 'VOLTAGE_ADJUST_B': (0x0096, 0xCA),
+    }
+
+
+def test_unit_build_matches_full_rebuild():
+    image, sites = patch_base(str(V71_HEX))
+    builder = UnitImageBuilder(image, sites)
+    values = {'VOLTAGE_BASE_B': 0xBA, 'BURST_THRESH_L': 0x10}
+    text = builder.build(values)
+    assert text == builder.rebuild(values)
+
+    unit = IntelHex()
+    unit.load_text(text.decode('ascii'))
+    assert unit.get_word(0x0092) == 0x30BA
+    assert unit.get_word(0x0069) == image.get_word(0x0069)
+
+
+def test_default_base_does_not_depend_on_the_working_directory():
+    assert os.path.samefile(DEFAULT_BASE, V71_HEX)
+
+
+@pytest.mark.parametrize('serials', [
+    ['A1', 'A2', 'A1'], ['A1', '../A2'], ['A1', 'sub/A2'], ['A1', 'sub\\A2'], ['A1', '..'], ['A1', ''],
+])
+def test_write_all_rejects_bad_serials_before_writing(tmp_path, serials):
+    image, sites = patch_base(str(V71_HEX))
+    builder = UnitImageBuilder(image, sites)
+    output = tmp_path / 'units'
+    with pytest.raises(ValueError):
+        builder.write_all([(serial, {}) for serial in serials], str(output))
+    assert not output.exists()
+
+
+def test_write_all_writes_one_file_per_unit(tmp_path):
+    image, sites = patch_base(str(V71_HEX))
+    builder = UnitImageBuilder(image, sites)
+    units = [('A1', {}), ('A2', {'BURST_THRESH_L': 0x10})]
+    assert builder.write_all(units, str(tmp_path), 'unit-{serial}.hex') == 2
+    assert (tmp_path / 'unit-A2.hex').read_bytes() == builder.build({'BURST_THRESH_L': 0x10})
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['unit-A1.hex', 'unit-A2.hex']
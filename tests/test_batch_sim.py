@@ -0,0 +1,105 @@
+import numpy as np
+
+from conftest import V71_HEX
+from burst_mode_injector import IntelHex
+from pic_asm import assemble
+from pic_batch import BatchSimulator
+from pic_periph import Peripherals
+from pic_sim import PICSimulator
+
+SEED, COUNT, ACC = 0x70, 0x71, 0x72
+# Each pass takes one of four paths by the seed (brw), then moves the seed on,
+# so instances split apart and meet again at DONE
+PROGRAM = f"""
+START:
+    movf    {SEED:#x}, W
+    andlw   0x03
+    brw
+    bra     COUNTED
+    bra     INDIRECT
+    bra     NESTED
+    bra     WATCHDOG
+COUNTED:
+    movlw   3
+    movwf   {COUNT:#x}
+COUNTED_LOOP:
+    call    ADD_SEED
+    decfsz  {COUNT:#x}, F
+    bra     COUNTED_LOOP
+    bra     DONE
+INDIRECT:
+    movlw   0x20
+    movwf   FSR0L
+    clrf    FSR0H
+    movf    {SEED:#x}, W
+    movwi   FSR0++
+    addlw   0x11
+    movwi   ++FSR0
+    moviw   --FSR0
+    addwf   {ACC:#x}, F
+    moviw   1[FSR0]
+    xorwf   {ACC + 1:#x}, F
+    bra     DONE
+NESTED:
+    call    TWICE
+    addwf   {ACC:#x}, F
+    bra     DONE
+WATCHDOG:
+    clrwdt
+    movf    {SEED:#x}, W
+    andlw   0x0F
+    movwf   {COUNT:#x}
+    incf    {COUNT:#x}, F
+WATCHDOG_LOOP:
+    incf    {ACC:#x}, F
+    decfsz  {COUNT:#x}, F
+    bra     WATCHDOG_LOOP
+DONE:
+    incf    {SEED:#x}, F
+    goto    START
+ADD_SEED:
+    movf    {SEED:#x}, W
+    addwf   {ACC:#x}, F
+    btfsc   STATUS, C
+    incf    {ACC + 1:#x}, F
+    return
+TWICE:
+    call    ADD_SEED
+    call    ADD_SEED
+    retlw   7
+"""
+
+
+def test_batch_matches_scalar_runs_across_branches():
+    image = IntelHex()
+    image.set_words(0, assemble(PROGRAM).words)
+    seeds = [row * 37 & 0xFF for row in range(24)]
+    batch = BatchSimulator(image, len(seeds), min_group=2)
+    batch.ram[:, SEED] = seeds
+    batch.run(20000)
+    assert batch.vector_instructions > batch.scalar_instructions
+
+    for row, seed in enumerate(seeds):
+        sim = PICSimulator(image, batch.fosc)
+        Peripherals(sim, idle_skip=False)
+        sim.ram[SEED] = seed
+        sim.run(batch.time)
+        assert (sim.pc, sim.cycle, bytes(sim.ram)) == (int(batch.pc[row]), int(batch.cycle[row]),
+                                                       batch.ram[row].tobytes())
+
+
+def test_v71_batch_matches_scalar_runs():
+    image = IntelHex(str(V71_HEX))
+    batch = BatchSimulator(image, 8)
+    for row, system in enumerate(batch.systems):
+        system.adc.set_voltage(2, 0.5 + 0.3 * row)
+    batch.run(200000)
+    assert batch.vector_instructions
+
+    for row in (0, 7):
+        sim = PICSimulator(image, batch.fosc)
+        Peripherals(sim, idle_skip=False).adc.set_voltage(2, 0.5 + 0.3 * row)
+        while sim.cycle < batch.time:
+            sim.run(batch.time - sim.cycle)
+        assert (sim.pc, sim.cycle) == (int(batch.pc[row]), int(batch.cycle[row]))
+        assert np.array_equal(np.frombuffer(sim.ram, np.uint8), batch.ram[row])
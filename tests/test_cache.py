@@ -0,0 +1,46 @@
+import zlib
+from array import array
+
+import pytest
+
+from conftest import V71_HEX
+from pic_analyzer import PICAnalyzer
+from pic_cache import AnalysisCache, _HEADER, _SECTION, decode_sections, encode_sections
+
+
+def test_sections_round_trip():
+    sections = {'address': array('H', range(10)), 'word': array('H', [0x3FFF] * 10)}
+    assert decode_sections(encode_sections(sections)) == sections
+
+
+def _entry(body: bytes) -> bytes:
+    """A well-formed header in front of an arbitrary section body"""
+    return encode_sections({'a': array('H')})[:_HEADER.size] + zlib.compress(body)
+
+
+@pytest.mark.parametrize('blob', [
+    encode_sections({'a': array('H', range(4))})[:_HEADER.size + 3],  # truncated compressed body
+    _entry(b'\x01'),                                                  # truncated section header
+    _entry(_SECTION.pack(1, b'Q', 1) + b'a' + b'\0' * 2),              # unknown typecode
+    _entry(_SECTION.pack(1, b'H', 4) + b'\xff' + b'\0' * 8),           # non-ASCII name
+    _entry(_SECTION.pack(1, b'H', 4) + b'a' + b'\0' * 3),              # ragged item bytes
+    _entry(_SECTION.pack(1, b'H', 4) + b'a' + b'\0' * 4),              # fewer items than declared
+])
+def test_malformed_entry_is_a_miss(blob):
+    assert decode_sections(blob) is None
+
+
+def test_analysis_stores_once(tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path))
+    stores = []
+    original = AnalysisCache.store
+    monkeypatch.setattr(AnalysisCache, 'store',
+                        lambda self, key, sections: stores.append(set(sections)) or original(self, key, sections))
+    analyzer = PICAnalyzer(str(V71_HEX), cache=cache)
+    analyzer.disassemble()
+    stores.clear()
+    analyzer.identify_control_points()
+    analyzer.find_main_loop()
+    analyzer.save_cache()
+    assert len(stores) == 1
+    assert set(cache.load(cache.key(str(V71_HEX)))) >= stores[0]
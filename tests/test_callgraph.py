@@ -0,0 +1,27 @@
+from conftest import V71_HEX
+from burst_mode_injector import IntelHex
+from pic_asm import assemble
+from pic_callgraph import analyze_stack
+from pic_cfg import INTERRUPT_VECTOR, RESET_VECTOR
+from pic_disasm import disassemble
+
+
+def test_v71_stack_depth(v71_store):
+    graph = analyze_stack(v71_store)
+    report = graph.stack_report()
+    assert (report['main_depth'], report['isr_depth'], report['worst_case']) == (3, 3, 7)
+    assert not report['overflow'] and report['indirect_calls'] == 0
+    # The worst paths push one level per call, from call sites the graph knows
+    for root, depth in ((RESET_VECTOR, 3), (INTERRUPT_VECTOR, 3)):
+        path = graph.worst_path(root)
+        assert len(path) == depth
+        assert all(site in graph.callers(callee) for site, callee in path)
+    assert graph.worst_path(INTERRUPT_VECTOR)[1] == (0x0DDC, 0x053D)
+
+
+def test_recursion_is_unbounded():
+    image = IntelHex()
+    image.set_words(0, assemble('goto MAIN\n nop\n nop\n nop\n retfie\nMAIN:\n call SELF\n goto $\n'
+                                'SELF:\n call SELF\n return').words)
+    report = analyze_stack(disassemble(image)).stack_report()
+    assert report['main_depth'] is None and report['worst_case'] is None and report['overflow']
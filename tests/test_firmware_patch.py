@@ -0,0 +1,49 @@
+import json
+
+from conftest import V71_HEX
+from burst_mode_firmware_patch import APW12FirmwarePatcher
+from burst_mode_injector import IntelHex
+from pic_cfg import build_cfg
+from pic_disasm import disassemble
+from pic_periph import load_system
+from pic_wcet import locate_timer4_handler
+
+
+def test_v71_patch_runs_from_reset_and_timer4(tmp_path):
+    patcher = APW12FirmwarePatcher(str(V71_HEX))
+    image = patcher.apply_patch(patcher.create_patch(), verbose=False)
+    # Reset vector and the ISR's 'btfss PIR2, TMR4IF / goto' become 'pagesel / goto'
+    assert patcher.entries['reset']['site'] == 0x0000
+    assert patcher.entries['timer4']['site'] == 0x000D
+    for entry, hook in (('reset', 'reset_hook'), ('timer4', 'timer4_isr_hook')):
+        site, address = patcher.entries[entry]['site'], patcher.layout[hook]
+        assert [image.get_word(site), image.get_word(site + 1)] == [0x3180 | address >> 8, 0x2800 | address & 0x7FF]
+    output = tmp_path / 'patched.hex'
+    image.save(str(output))
+    # WCET still compares the Timer4 branch, now entered in the hook
+    store = disassemble(image)
+    assert locate_timer4_handler(store, build_cfg(store)) == (patcher.layout['timer4_isr_hook'] + 2, (0x00AB,))
+
+    original = load_system(str(V71_HEX))
+    patched = load_system(str(output))
+    runs = []
+    patched.sim.add_probe(patcher.layout['burst_mode_logic'], lambda: runs.append(patched.sim.cycle))
+    original.sim.run(8000000)
+    patched.sim.run(8000000)
+    assert len(runs) > 10
+    assert (patched.sim.ram[patcher.BURST_VARIABLES['BURST_THRESH_L']],
+            patched.sim.ram[patcher.BURST_VARIABLES['BURST_THRESH_H']]) == (25, 30)
+    # The state machine only keeps its own state: the firmware's output is unchanged
+    assert patched.pwm.outputs['RC5'] == original.pwm.outputs['RC5']
+
+
+def test_checked_in_patch_matches_the_generator():
+    patcher = APW12FirmwarePatcher(str(V71_HEX))
+    patch_data = patcher.create_patch()
+    burst_mode = V71_HEX.parent.parent / 'burst_mode'
+    with open(burst_mode / 'apw12_burst_mode_patch.json') as f:
+        saved = json.load(f)
+    assert saved['modifications'] == patch_data['modifications']
+    image = patcher.apply_patch(patch_data, verbose=False)
+    assert IntelHex(str(burst_mode / 'PIC16F1704_APW12_1.2_V71_BURST_MODE.hex')).programmed_words() == \
+        image.programmed_words()
@@ -0,0 +1,37 @@
+from conftest import V71_HEX
+from pic_cfg import build_cfg
+from pic_disasm import disassemble_file
+from pic_fuzz import I2CFuzzer, handler_blocks, handler_tokens, seed_cases
+from pic_periph import load_system
+
+
+def _fuzzer(seed: int) -> I2CFuzzer:
+    store = disassemble_file(str(V71_HEX))
+    cfg = build_cfg(store)
+    blocks = handler_blocks(store, cfg)
+    words = set()
+    for address in blocks:
+        block = cfg.block_containing(address)
+        words.update(range(cfg.start[block], cfg.end[block] + 1))
+    fuzzer = I2CFuzzer(load_system(str(V71_HEX)), blocks, words, seed=seed, tokens=handler_tokens(store, words))
+    assert fuzzer.prepare()
+    return fuzzer
+
+
+def test_v71_fuzz_smoke():
+    fuzzer = _fuzzer(seed=1)
+    seeds = seed_cases()
+    # Every case starts from the snapshot: the same case reaches the same blocks
+    first = fuzzer.execute(seeds[0]), bytes(fuzzer.hits), fuzzer.sim.cycle
+    fuzzer.execute(seeds[-1])
+    assert (fuzzer.execute(seeds[0]), bytes(fuzzer.hits), fuzzer.sim.cycle) == first
+    assert any(first[1])
+
+    fuzzer.fuzz(seeds, iterations=30)
+    assert fuzzer.executions == 3 + len(seeds) + 30
+    assert 0 < sum(fuzzer.coverage) <= len(fuzzer.blocks) and fuzzer.corpus
+    # A seeded run is reproducible
+    again = _fuzzer(seed=1)
+    again.fuzz(seeds, iterations=30)
+    assert again.corpus == fuzzer.corpus and again.coverage == fuzzer.coverage
+    assert again.findings.keys() == fuzzer.findings.keys()
@@ -0,0 +1,37 @@
+import sys
+
+import pytest
+
+from conftest import V71_HEX
+from pic_i2c import I2CMaster, main
+from pic_periph import load_system
+
+
+def test_v71_acknowledges_a_write_transaction():
+    system = load_system(str(V71_HEX))
+    master = I2CMaster(system, retries=10)
+    assert master.wait_ready()
+    assert master.slave_address() == 0x10
+
+    transaction = master.write([0x50, 0x01])
+    assert transaction.acked == (True, True, True) and transaction.error is None
+    assert transaction.written == b'\x50\x01'
+    # Start, address and two data bytes at nine SCL periods each
+    assert transaction.cycles >= 3 * 9 * master.bit_cycles
+    assert master.transactions == [transaction]
+
+    # No device at the neighbouring address: every attempt is refused
+    refused = master.write([0x00], address=0x11)
+    assert refused.acked == (False,) and refused.error == 'nack'
+    assert refused.attempts == master.retries + 1
+    assert [cause for _, cause in system.sim.resets] == ['power-on']
+
+
+def test_script_without_transactions(tmp_path, monkeypatch, capsys):
+    script = tmp_path / 'idle.txt'
+    script.write_text('idle 100\n')
+    monkeypatch.setattr(sys, 'argv', ['pic_i2c.py', str(V71_HEX), '--script', str(script)])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 0
+    assert '0 transactions' in capsys.readouterr().out
@@ -0,0 +1,100 @@
+from conftest import BINS, V71_HEX
+from burst_mode_injector import BurstModeInjector, IntelHex
+from pic_lockstep import Lockstep
+from pic_periph import load_system
+from pic_sim import load_simulator
+
+LOOP_HEAD = 0x0264
+BURST_STATE, LOAD_CURRENT = 0x2E0, 0x2E5
+
+
+def test_v71_main_loop_header_is_the_injection_point():
+    assert BurstModeInjector(str(V71_HEX)).find_injection_point() == LOOP_HEAD
+
+
+def test_v71_hook_runs_every_main_loop_iteration(tmp_path):
+    injector = BurstModeInjector(str(V71_HEX))
+    output = tmp_path / 'injected.hex'
+    assert injector.inject_burst_mode(str(output))
+    image = IntelHex(str(output))
+    # pagesel HOOK / goto HOOK over 'clrwdt' and 'movlw 0x02'
+    assert [image.get_word(LOOP_HEAD), image.get_word(LOOP_HEAD + 1)] == \
+        [0x3180 | injector.hook_address >> 8, 0x2800 | injector.hook_address & 0x7FF]
+
+    # From reset on the bare simulator
+    sim = load_simulator(str(output))
+    assert sim.run_until(injector.hook_address, 5000000)
+    assert sim.run_until(injector.free_space, 100)
+
+    # With peripherals the loop comes back every time (executed in full, as
+    # idle skipping fast-forwards the main loop)
+    sim = load_system(str(output), idle_skip=False).sim
+    visits = {LOOP_HEAD: 0, injector.hook_address: 0, LOOP_HEAD + 2: 0}
+    for address in visits:
+        sim.add_probe(address, lambda address=address: visits.__setitem__(address, visits[address] + 1))
+    sim.run(4000000)
+    assert visits[LOOP_HEAD] > 1000
+    assert visits[injector.hook_address] == visits[LOOP_HEAD]
+    assert visits[LOOP_HEAD + 2] >= visits[LOOP_HEAD] - 1
+
+
+def test_v71_burst_state_follows_the_load_with_hysteresis(tmp_path):
+    injector = BurstModeInjector(str(V71_HEX))
+    output = tmp_path / 'injected.hex'
+    assert injector.inject_burst_mode(str(output))
+    system = load_system(str(output))
+    assert system.sim.run_until(injector.free_space, 5000000)
+
+    def state_at(code: int) -> int:
+        for channel in range(32):
+            system.adc.set_input(channel, code)
+        system.sim.run(400000)
+        return system.sim.ram[BURST_STATE] & 1
+
+    # Load is ADRES >> 2; enter below 0x20, leave at 0x40
+    assert state_at(0x1F << 2) == 1
+    assert state_at(0x30 << 2) == 1
+    assert state_at(0x40 << 2) == 0
+    assert state_at(0x30 << 2) == 0
+    assert state_at(0x1F << 2) == 1
+    assert system.sim.ram[LOAD_CURRENT] == 0x1F
+
+
+def test_v71_injection_leaves_the_outputs_alone(tmp_path):
+    injector = BurstModeInjector(str(V71_HEX))
+    output = tmp_path / 'injected.hex'
+    assert injector.inject_burst_mode(str(output))
+    divergence, compared = Lockstep(str(V71_HEX), str(output)).run([], 4000000)
+    assert divergence is None and compared == 4000000
+
+
+def test_hook_relocates_a_displaced_call(tmp_path):
+    """Version_C's main loop header is 'clrwdt / call 0x05C5'"""
+    injector = BurstModeInjector(str(BINS / 'PIC16F1704-APW12_121215-v74_Version_C.hex'))
+    output = tmp_path / 'injected.hex'
+    assert injector.inject_burst_mode(str(output))
+    head = injector.find_injection_point()
+    sim = load_system(str(output)).sim
+    assert sim.run_until(injector.hook_address, 3000000)
+    assert sim.run_until(0x05C5, 10000)
+    assert sim.run_until(head + 2, 10000)
+
+
+def test_word_view_and_set_words():
+    image = IntelHex()
+    image.set_words(0x10, [0x3012, 0x0008])
+    assert image.program.data[0x20:0x24] == b'\x12\x30\x08\x00'
+    assert image.get_word(0x10) == 0x3012 and image.get_word(0x11) == 0x0008
+    assert list(image.program.view()[0x10:0x12]) == [0x3012, 0x0008]
+
+
+def test_word_view_on_big_endian_host_is_a_swapped_copy(monkeypatch):
+    import sys
+    image = IntelHex()
+    image.set_words(0x10, [0x3012])
+    monkeypatch.setattr(sys, 'byteorder', 'big')
+    view = image.program.view()
+    # Here the native read is little-endian, so the host-order copy comes back swapped
+    assert view[0x10] == 0x1230
+    view[0x10] = 0
+    assert image.program.data[0x20:0x22] == b'\x12\x30'
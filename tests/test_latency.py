@@ -0,0 +1,54 @@
+import pytest
+
+from pic_latency import HISTOGRAM_BITS, Histogram
+
+
+def test_buckets_are_exact_then_log_linear():
+    histogram = Histogram()
+    exact = 1 << HISTOGRAM_BITS
+    assert [histogram._bucket(value) for value in range(exact)] == list(range(exact))
+    # Each power of two from 64 up is split into 32 buckets
+    assert [histogram._bucket(value) for value in (64, 65, 66, 127, 128, 131, 132)] == [64, 64, 65, 95, 96, 96, 97]
+    previous = -1
+    for value in range(1 << 14):
+        bucket = histogram._bucket(value)
+        lower = histogram._lower(bucket)
+        assert bucket in (previous, previous + 1)
+        assert lower <= value and (value - lower) * 32 <= lower
+        previous = bucket
+    assert histogram._bucket(histogram.limit) == len(histogram.counts) - 1
+
+
+def test_percentiles_at_the_edges():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None and histogram.mean() is None
+    assert histogram.summary().count == 0
+
+    histogram.add(1000)
+    # 1000 falls in the bucket starting at 992; the percentile is clamped to [min, max]
+    assert histogram._lower(histogram._bucket(1000)) == 992
+    assert histogram.summary() == (1, 1000, 1000, 1000, 1000, 1000, 1000.0, 0.0)
+
+    histogram.add(-5)
+    histogram.add(1 << 50)
+    assert (histogram.minimum, histogram.maximum) == (0, histogram.limit)
+    # Percentiles report the lower edge of their bucket, so p100 need not be the maximum
+    assert histogram.percentile(0) == 0
+    assert histogram.percentile(100) == histogram._lower(len(histogram.counts) - 1) < histogram.limit
+
+
+def test_merge_equals_one_histogram_of_all_values():
+    values = list(range(0, 5000, 7))
+    whole, first, second = Histogram(), Histogram(), Histogram()
+    for value in values:
+        whole.add(value)
+        (first if value % 2 else second).add(value)
+    first.merge(second)
+    first.merge(Histogram())
+    assert first.counts == whole.counts and first.summary() == whole.summary()
+
+    empty = Histogram()
+    empty.merge(whole)
+    assert empty.summary() == whole.summary()
+    with pytest.raises(ValueError):
+        whole.merge(Histogram(bits=4))
@@ -0,0 +1,26 @@
+from conftest import V71_HEX
+from burst_mode_injector import IntelHex
+from pic_lockstep import Lockstep
+
+# 'bcf PWM3CON, PWM3POL' in V71's PWM3 setup
+PWM3POL_CLEAR = 0x0A7E
+
+
+def test_identical_images_do_not_diverge():
+    divergence, compared = Lockstep(str(V71_HEX), str(V71_HEX)).run([], 200000)
+    assert divergence is None and compared == 200000
+
+
+def test_pwm3_polarity_change_diverges_on_rc5(tmp_path):
+    image = IntelHex()
+    image.load(str(V71_HEX))
+    assert image.get_word(PWM3POL_CLEAR) == 0x1219
+    image.set_words(PWM3POL_CLEAR, [0x1619])
+    patched = tmp_path / 'inverted.hex'
+    image.save(str(patched))
+
+    divergence, _ = Lockstep(str(V71_HEX), str(patched)).run([], 200000)
+    assert divergence.kind == 'pwm'
+    (_, pin, period, duty), (_, _, patched_period, patched_duty) = divergence.original, divergence.patched
+    assert pin == 'RC5' and period == patched_period > 0
+    assert abs(duty + patched_duty - 1.0) < 1e-6
@@ -0,0 +1,23 @@
+from conftest import BINS, HEX_FILES
+from pic_analyzer import _analyze_image, _compare_images, analyze_all_versions
+from pic_parallel import parallel_map, resolve_workers
+
+
+def test_resolve_workers():
+    assert resolve_workers(3) == 3
+    assert resolve_workers(0) == resolve_workers(None) >= 1
+
+
+def test_pool_results_match_serial_in_order(capsys):
+    jobs = [(str(path), None) for path in HEX_FILES]
+    serial = parallel_map(_analyze_image, jobs, 1)
+    assert parallel_map(_analyze_image, jobs, 2) == serial
+    pairs = list(zip(serial, serial[1:]))
+    assert parallel_map(_compare_images, pairs, 3) == [_compare_images(pair) for pair in pairs]
+
+    # The analyzer takes the pool's sections in place of decoding itself
+    analyzers = {name: analyzer.identify_control_points()
+                 for name, analyzer in analyze_all_versions(str(BINS), workers=2).items()}
+    assert analyzers == {name: analyzer.identify_control_points()
+                         for name, analyzer in analyze_all_versions(str(BINS), workers=1).items()}
+    assert list(analyzers) == [path.name for path in HEX_FILES]
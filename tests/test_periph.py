@@ -0,0 +1,51 @@
+import pytest
+
+from conftest import BINS, V71_HEX
+from pic_periph import load_system
+
+
+def test_v71_drives_pwm3_on_rc5():
+    system = load_system(str(V71_HEX))
+    system.sim.run(system.sim.fosc // 4)
+    period, duty = system.pwm.outputs['RC5']
+    assert period > 0 and duty > 0
+    assert system.pwm.source_state('PWM3') == (period, duty)
+
+
+@pytest.mark.parametrize('hex_file', [V71_HEX, BINS / 'PIC16F1704_APW12_Version_F.hex'],
+                         ids=lambda path: path.stem)
+def test_idle_skip_is_exact(hex_file):
+    """Fast-forwarded delay loops and main-loop passes leave the same state as running them"""
+    skipping = load_system(str(hex_file))
+    running = load_system(str(hex_file), idle_skip=False)
+    for system in (skipping, running):
+        system.sim.run(8000000)
+    assert (skipping.sim.pc, skipping.sim.cycle, skipping.sim.executed) == \
+        (running.sim.pc, running.sim.cycle, running.sim.executed)
+    assert skipping.sim.ram == running.sim.ram
+    assert skipping.ports.log == running.ports.log
+    summaries = [system.summary() for system in (skipping, running)]
+    assert summaries[0].pop('idle_cycles') > 0.8 * skipping.sim.cycle
+    assert summaries[0] == {key: value for key, value in summaries[1].items() if key != 'idle_cycles'}
+
+
+def test_v71_main_loop_is_skipped():
+    system = load_system(str(V71_HEX))
+    assert 0x0264 in system.sim.idle_heads
+    system.sim.run(8000000)
+    assert system.sim.idle_cycles > 0.95 * system.sim.cycle
+
+
+def test_unserviced_timer_flag_is_raised_again_once_cleared():
+    """V71 never clears TMR2IF, so Timer2 stops scheduling events until it is cleared"""
+    system = load_system(str(V71_HEX))
+    sim, timer = system.sim, system.timers[2]
+    sim.run(2000000)
+    assert sim.ram[timer.pir] & timer.flag and timer._event is None
+    raised = system.summary()['timer_interrupts'][2]
+    assert raised > 1
+    sim.write(timer.pir, sim.ram[timer.pir] & ~timer.flag)
+    assert timer._event is not None
+    sim.run(timer.period_cycles() * timer._postscale)
+    assert sim.ram[timer.pir] & timer.flag
+    assert system.summary()['timer_interrupts'][2] == raised + 1
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import COUNT_MOVWF_PR2 as MOVWF_PR2
+from pic_periph import load_system
+from pic_reverse import Position, ReverseDebugger
+from pic_xref import register_address
+
+CYCLES = 5000
+
+
+@pytest.fixture(scope='module')
+def forward(count_hex):
+    """Every position of a plain forward run up to CYCLES"""
+    sim = load_system(count_hex, blocks=False, idle_skip=False).sim
+    positions = [Position(sim.cycle, sim.pc)]
+    while sim.cycle < CYCLES:
+        sim.run(1)
+        positions.append(Position(sim.cycle, sim.pc))
+    return positions
+
+
+@pytest.mark.parametrize('blocks', [True, False])
+def test_step_back_back_to_and_last_write(count_hex, forward, blocks):
+    debugger = ReverseDebugger(count_hex, interval=700, blocks=blocks, idle_skip=False)
+    assert debugger.run(CYCLES) is None
+    assert debugger.position == forward[-1]
+
+    assert debugger.step_back() == forward[-2]
+    assert debugger.step_back(10) == forward[-12]
+
+    movwfs = [position for position in forward[:-12] if position.pc == MOVWF_PR2]
+    assert debugger.back_to(MOVWF_PR2) == movwfs[-1] == debugger.position
+    # The write that movwf is about to make is not in the past yet
+    assert debugger.last_write(register_address('PR2')) == movwfs[-2] == debugger.position
+    assert debugger.back_to(0x7FF) is None and debugger.position == movwfs[-2]
+
+    # Back to the start: stepping stops at the first position
+    debugger.goto(forward[3].cycle)
+    assert debugger.step_back(10) == forward[0]
+
+
+def test_checkpoints_thin_out_past_the_limit(count_hex, forward):
+    debugger = ReverseDebugger(count_hex, interval=500, max_checkpoints=4, idle_skip=False)
+    for _ in range(3):
+        debugger.run(500)
+    assert [c.cycle for c in debugger.checkpoints] == [0, 500, 1000, 1500]
+    debugger.run(500)
+    # A fifth checkpoint drops every other one after the first and doubles the interval
+    assert [c.cycle for c in debugger.checkpoints] == [0, 1000, 2000]
+    assert debugger.interval == 1000
+    debugger.run(CYCLES - 2000)
+    assert [c.cycle for c in debugger.checkpoints] == [0, 2000, 4000]
+    assert debugger.interval == 2000
+    # Replays from the thinned checkpoints land on the same positions
+    assert debugger.step_back(100) == forward[-101]
@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import V71_HEX
+from burst_mode_injector import IntelHex
+from pic_asm import assemble
+from pic_decompiler_analysis import PICDecompilerAnalysis
+from pic_disasm import DW_ID, PROGRAM_WORDS, disassemble, disassemble_file
+from pic_signatures import SIGNATURES, Signature, SignatureMatcher, _expand, symbols
+
+TEST_SIGNATURES = (
+    Signature('A', 'nop nop', 0.3, 1.0),
+    Signature('A', 'nop nop nop', 0.3, 1.0),
+    Signature('B', 'movf|movwf clrf', 0.25, 0.4),
+    Signature('B', 'clrf movwf', 0.25, 0.4),
+    Signature('C', 'goto$+1', 0.1, 1.0),
+    Signature('C', 'decfsz|incfsz goto$-|bra$-', 0.1, 1.0),
+)
+
+
+def _naive(store, signatures):
+    """Each signature counted at every start of a run of consecutive program words"""
+    refined, runs, run, previous = symbols(store), [], [], -2
+    for address, symbol in zip(store.address, refined):
+        if address >= PROGRAM_WORDS or symbol == DW_ID or address != previous + 1:
+            runs.append(run)
+            run = []
+        if address < PROGRAM_WORDS and symbol != DW_ID:
+            run.append(symbol)
+        previous = address
+    runs.append(run)
+    counts = []
+    for signature in signatures:
+        sequences = _expand(signature.pattern)
+        counts.append(sum(tuple(run[start:start + len(sequence)]) == sequence
+                          for run in runs for sequence in sequences for start in range(len(run))))
+    return counts
+
+
+def test_counts_with_alternatives_gaps_and_data_words():
+    image = IntelHex()
+    image.set_words(0x000, assemble("""
+        nop
+        nop
+        nop
+        nop
+        dw      0x0002          ; data word: breaks the nop run
+        nop
+        nop
+        movf    0x20, W
+        clrf    0x21
+        movwf   0x22
+        clrf    0x23
+        goto    $+1
+    LOOP:
+        decfsz  0x24, F
+        bra     LOOP
+    """).words)
+    # A gap at 0x021: only the last two nops are consecutive
+    image.set_words(0x020, assemble('nop').words)
+    image.set_words(0x022, assemble('nop\n nop').words)
+    store = disassemble(image)
+
+    matcher = SignatureMatcher(TEST_SIGNATURES)
+    counts = matcher.count(store)
+    assert counts == [3 + 1 + 1, 2, 2, 1, 1, 1]
+    assert counts == _naive(store, TEST_SIGNATURES)
+    # Weight per match, capped at the signature's limit
+    scores = matcher.scores(counts)
+    assert scores == pytest.approx({'A': 1.0 + 0.6, 'B': 0.4 + 0.25, 'C': 0.1 + 0.1})
+
+
+def test_v71_counts_and_compiler():
+    store = disassemble_file(str(V71_HEX))
+    matcher = SignatureMatcher()
+    assert matcher.count(store) == _naive(store, SIGNATURES)
+
+    analysis = PICDecompilerAnalysis(str(V71_HEX))
+    analysis.disassemble()
+    scores = analysis.detect_compiler()
+    assert max(scores, key=scores.get) == 'XC8'
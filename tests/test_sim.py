@@ -0,0 +1,42 @@
+import pytest
+
+from burst_mode_injector import IntelHex
+from pic_asm import assemble
+from pic_blocks import BlockSimulator
+from pic_cfg import build_cfg
+from pic_disasm import disassemble
+from pic_sim import WREG, PICSimulator, delay_counter, find_idle_loops
+
+
+def _image(source: str) -> IntelHex:
+    image = IntelHex()
+    image.set_words(0, assemble(source).words)
+    return image
+
+
+@pytest.mark.parametrize('engine', [PICSimulator, BlockSimulator])
+@pytest.mark.parametrize('offset, lands, w', [(1, 3, 0xB0), (0, 2, 0xA0)])
+def test_computed_jump_through_pcl(engine, offset, lands, w):
+    """addwf PCL jumps relative to the next instruction and always takes 2 cycles"""
+    sim = engine(_image(f'movlw {offset}\n addwf PCL, F\n movlw 0xA0\n movlw 0xB0\n goto $'))
+    sim.run(3)
+    assert (sim.pc, sim.cycle, sim.executed) == (lands, 3, 2)
+    sim.run(1)
+    assert sim.ram[WREG] == w
+
+
+@pytest.mark.parametrize('page, delay', [(0, True), (1, False)])
+def test_delay_loop_target_follows_pclath(page, delay):
+    """The goto closing a delay loop goes where PCLATH points, not to the current page"""
+    image = IntelHex()
+    # movlp page / decfsz 0x20, F / goto 0x001 / goto $, and 'goto $' at 0x0802
+    # (raw words: the assembler refuses a goto PCLATH does not reach)
+    image.set_words(0, [0x3180 | page << 3, 0x0BA0, 0x2801, 0x2803])
+    image.set_words(0x0802, [0x2802])
+    sim = PICSimulator(image)
+    cfg = build_cfg(disassemble(image))
+    assert (delay_counter(sim.flash, cfg, 1) is not None) == delay
+    assert (1 in find_idle_loops(sim.flash, cfg)) == delay
+    sim.enable_idle_skip()
+    sim.run(1000)
+    assert sim.pc == (0x0003 if delay else 0x0802)
@@ -0,0 +1,38 @@
+from conftest import V71_HEX
+from pic_periph import load_system
+from pic_snapshot import fork, load_state, save_state
+
+BOOT, SPAN = 2000000, 400000
+
+
+def _observe(system):
+    sim = system.sim
+    return sim.pc, sim.cycle, sim.executed, bytes(sim.ram), bytes(sim.stack), dict(system.pwm.outputs)
+
+
+def test_restore_and_forks_continue_like_the_original(tmp_path):
+    system = load_system(str(V71_HEX))
+    system.sim.run(BOOT)
+    boot = system.sim.cycle
+    state = system.save()
+    system.sim.run(SPAN)
+    expected = _observe(system)
+
+    # Rewinding the live system in place
+    system.restore(state)
+    assert system.sim.cycle == boot
+    system.sim.run(SPAN)
+    assert _observe(system) == expected
+
+    # A fork, and a fork of the state after a round trip through a file
+    path = str(tmp_path / 'v71.snap')
+    save_state(state, path)
+    branches = [fork(state), fork(load_state(path))]
+    for branch in branches:
+        branch.sim.run(SPAN)
+        assert _observe(branch) == expected
+
+    # Branches share nothing: a change in one leaves the state and the others alone
+    branches[0].sim.ram[0x70] ^= 0xFF
+    assert fork(state).sim.ram[0x70] != branches[0].sim.ram[0x70]
+    assert branches[1].sim.ram[0x70] == expected[3][0x70]
@@ -0,0 +1,45 @@
+from conftest import COUNT_MOVWF_PR2 as MOVWF_PR2
+from burst_mode_injector import IntelHex
+from pic_sim import WREG, PICSimulator
+from pic_trace import TraceReader, record_trace
+from pic_xref import register_address
+
+CYCLES = 2000
+CHUNK = 100
+
+
+def test_trace_round_trip_across_chunks(count_hex, tmp_path):
+    path = str(tmp_path / 'count.trace')
+    recorder = record_trace(count_hex, path, CYCLES, chunk_instructions=CHUNK)
+
+    # The same run, one instruction at a time
+    sim = PICSimulator(IntelHex(count_hex))
+    expected = []
+    while sim.cycle < CYCLES:
+        pc, cycle = sim.pc, sim.cycle
+        sim.step()
+        expected.append((pc, cycle, sim.ram[WREG]))
+
+    reader = TraceReader(path)
+    try:
+        assert len(reader) == recorder.instructions == len(expected)
+        assert reader.chunks == -(-len(expected) // CHUNK)
+        steps = [step for chunk in range(reader.chunks) for step in reader.steps(chunk)]
+        assert [(step.pc, step.cycle, step.w) for step in steps] == expected
+        assert [step.index for step in steps] == list(range(len(expected)))
+
+        writes = reader.writes('PR2')
+        assert [write.value for write in writes] == [n & 0xFF for n in range(1, len(writes) + 1)]
+        assert all(write.pc == MOVWF_PR2 and write.address == register_address('PR2') for write in writes)
+        assert reader.writes('PR2', start=writes[10].cycle, end=writes[12].cycle) == writes[10:13]
+        assert reader.executions(MOVWF_PR2) == [write.cycle for write in writes]
+        assert reader.executions(MOVWF_PR2, limit=3) == [write.cycle for write in writes[:3]]
+
+        # Around the first instruction of the third chunk: the window spans two chunks
+        boundary = expected[2 * CHUNK][1]
+        window = reader.around(boundary, 5, 5)
+        assert [step.index for step in window] == list(range(2 * CHUNK - 5, 2 * CHUNK + 6))
+        assert [(step.pc, step.cycle) for step in window] == [(pc, cycle) for pc, cycle, _ in
+                                                              expected[2 * CHUNK - 5:2 * CHUNK + 6]]
+    finally:
+        reader.close()
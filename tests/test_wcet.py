@@ -0,0 +1,132 @@
+import pytest
+
+from conftest import HEX_FILES, V71_HEX
+from burst_mode_injector import IntelHex
+from pic_asm import assemble
+from pic_cfg import build_cfg
+from pic_disasm import disassemble
+from pic_periph import load_system
+from pic_sim import PICSimulator
+from pic_wcet import FOSC_HZ, Cost, CycleEstimator, default_targets, image_fosc, oscillator_hz
+
+# Loops of the 32-bit division routines the V71 Timer4 ISR calls: at most
+# 31 normalizing shifts, then one subtract-and-shift pass per shift plus one
+V71_DIVISION_BOUNDS = {0x0C01: 32, 0x0C0F: 32, 0x0CDB: 32, 0x0CE9: 32}
+
+
+@pytest.mark.parametrize('hex_file', HEX_FILES, ids=lambda path: path.name)
+def test_images_run_the_16mhz_hfintosc(hex_file):
+    assert image_fosc(IntelHex(str(hex_file))) == 16000000
+
+
+def _image(source: str, config2: int) -> IntelHex:
+    image = IntelHex()
+    image.set_words(0, assemble(source).words)
+    image.set_words(0x8007, [0x39D4, config2])
+    return image
+
+
+@pytest.mark.parametrize('osccon, config2, fosc', [
+    (0x78, 0x1FFF, 16000000),   # IRCF 1111: the PLL does not apply
+    (0x70, 0x1FFF, 32000000),   # IRCF 1110 with CONFIG2 PLLEN
+    (0x70, 0x1EFF, 8000000),
+    (0xF0, 0x1EFF, 32000000),   # SPLLEN
+    (0x72, 0x1FFF, 8000000),    # SCS 1x: internal block, no PLL
+])
+def test_oscillator_from_osccon_and_config(osccon, config2, fosc):
+    image = _image(f'movlw {osccon:#x}\n banksel OSCCON\n movwf OSCCON\n goto $', config2)
+    assert oscillator_hz(disassemble(image)) == fosc
+
+
+def test_undetermined_clock_falls_back():
+    image = _image('movf PORTA, W\n banksel OSCCON\n movwf OSCCON\n goto $', 0x1FFF)
+    assert oscillator_hz(disassemble(image)) is None
+    assert image_fosc(image) == FOSC_HZ
+
+
+def _estimator(source: str, loop_bounds=None) -> CycleEstimator:
+    image = IntelHex()
+    image.set_words(0, assemble(source).words)
+    return CycleEstimator(disassemble(image), loop_bounds=loop_bounds)
+
+
+def _simulated(source: str, stop: int) -> int:
+    image = IntelHex()
+    image.set_words(0, assemble(source).words)
+    sim = PICSimulator(image)
+    assert sim.run_until(stop, 100000)
+    return sim.cycle
+
+
+def test_taken_skips_cost_two_cycles():
+    # Bit clear: btfss + return; bit set: skipped return, two nops, return
+    timing = _estimator('btfss 0x70, 0\n return\n nop\n nop\n return').region(0)
+    assert (timing.wcet, timing.bcet) == (6, 3)
+    assert timing.worst == Cost(2, 2, 1) and timing.best == Cost(1, 1, 0)
+    assert timing.path_count == 2 and not timing.loops
+
+
+def test_counter_loop_is_bounded_by_its_initial_value():
+    source = 'movlw 5\n movwf 0x70\nLOOP:\n nop\n decfsz 0x70, F\n goto LOOP\n goto $'
+    timing = _estimator(source).region(0, exits=[5])
+    # 2 + 4 passes of nop, decfsz, goto + nop and the taken skip
+    assert timing.wcet == timing.bcet == 21 == _simulated(source, 5)
+    assert [(loop.header, loop.bound, loop.exact) for loop in timing.loops] == [(2, 5, True)]
+
+
+def test_loop_without_a_bound_has_no_wcet():
+    source = 'LOOP:\n btfss 0x70, 0\n goto LOOP\n return'
+    timing = _estimator(source).region(0)
+    assert timing.wcet is None and timing.worst_blocks == [] and timing.paths == []
+    assert timing.bcet == 4
+    assert [loop.header for loop in timing.unbounded_loops] == [0]
+
+    # Two passes around the loop, then the taken skip and return
+    timing = _estimator(source, {0: 3}).region(0)
+    assert timing.wcet == 2 * 3 + 4 and not timing.unbounded_loops
+
+
+def test_counter_written_in_the_loop_is_unbounded():
+    source = 'movlw 3\n movwf 0x70\nLOOP:\n btfsc 0x71, 0\n incf 0x70, F\n' \
+             ' decfsz 0x70, F\n goto LOOP\n return'
+    timing = _estimator(source).region(0)
+    assert timing.wcet is None and len(timing.unbounded_loops) == 1
+
+
+def test_nested_delay_reenters_its_inner_counter_at_zero():
+    # The delay idiom: both counters jump back to one header, so only the
+    # first inner pass starts from the movlw value; later ones run 256 times
+    source = 'movlw 2\n movwf 0x71\n movlw 3\n movwf 0x70\nLOOP:\n decfsz 0x70, F\n goto LOOP\n' \
+             ' decfsz 0x71, F\n goto LOOP\n goto $'
+    timing = _estimator(source).region(0, exits=[8])
+    assert sorted((loop.bound, loop.exact) for loop in timing.loops) == [(2, True), (256, False)]
+    assert timing.wcet >= _simulated(source, 8) == 4 + 8 + 3 + 767 + 2
+
+
+@pytest.fixture(scope='module')
+def v71_timer4():
+    store = disassemble(IntelHex(str(V71_HEX)))
+    cfg = build_cfg(store)
+    return store, cfg, default_targets(store, cfg)['timer4_isr']
+
+
+def test_v71_timer4_needs_division_loop_bounds(v71_timer4):
+    store, cfg, (entry, exits) = v71_timer4
+    timing = CycleEstimator(store, cfg).region(entry, exits)
+    assert timing.wcet is None and timing.bcet is not None
+    assert {loop.header for loop in timing.unbounded_loops} == set(V71_DIVISION_BOUNDS)
+
+
+def test_v71_timer4_wcet_covers_simulated_services(v71_timer4):
+    store, cfg, (entry, exits) = v71_timer4
+    timing = CycleEstimator(store, cfg, V71_DIVISION_BOUNDS).region(entry, exits)
+
+    system = load_system(str(V71_HEX))
+    sim = system.sim
+    spans, started = [], []
+    sim.add_probe(entry, lambda: started.append(sim.cycle))
+    sim.add_probe(exits[0], lambda: started and spans.append(sim.cycle - started.pop()))
+    sim.run(6000000)
+    # Includes a service with a full ~4000-cycle delay and both divisions
+    assert len(spans) > 10 and max(spans) > 6000
+    assert timing.bcet <= min(spans) and timing.wcet >= max(spans)
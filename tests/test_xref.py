@@ -0,0 +1,23 @@
+import re
+
+from conftest import BINS
+from pic_xref import SFR_MAP, XrefIndex
+
+
+def test_sfr_map_matches_ida_equates():
+    """Every named SFR sits where the IDA listing's BANKn_NAME equates put it"""
+    equates = {}
+    with open(BINS / 'PIC16F1704_APW12_1.2_V71.hex.asm', errors='replace') as f:
+        for line in f:
+            match = re.match(r'BANK\d+_(\w+) equ ([0-9A-F]+)\s*$', line.strip())
+            if match:
+                equates[match.group(1)] = int(match.group(2), 16)
+    wrong = {name: (hex(address), hex(equates[name]))
+             for address, name in SFR_MAP.items() if name in equates and equates[name] != address}
+    assert not wrong
+
+
+def test_v71_pwm3_accesses_resolve(v71_store):
+    xref = XrefIndex(v71_store)
+    assert len(xref.accesses('PWM3CON'))
+    assert len(xref.writes('PWM3DCH'))